@@ -1,44 +1,276 @@
 import os
 import time
-from flask import Flask, render_template, jsonify, request, send_file, abort, send_from_directory, redirect, url_for
-from flask_mail import Mail, Message
-from decimal import Decimal
-from models import db, Bill, Diagnosis, Procedure, InsuranceClaim
-from datetime import datetime, timedelta
+import base64
 import logging
-import requests
-from requests.exceptions import RequestException
-from pdf_generator import generate_bill_pdf
-import json
+from flask import Blueprint, Flask, current_app, render_template, jsonify, request, send_file, abort, send_from_directory, redirect, Response, stream_with_context
+from flask_mail import Mail
+from models import db, Bill, bill_query, filter_bills
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pdf_generator import render_bill_pdf, load_bill_for_pdf
+from pdf_batch import SharedRenderPool, stream_statements_zip, write_statements_zip, write_merged_statements
+from pdf_cache import PdfCache, register_invalidation
+from pdf_templates import load_template, use_template
+from catalog import CodeCatalog, CODE_SYSTEMS, CODE_LABELS, AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT
+from totals import register_total_maintenance, recompute_bill_totals, RECOMPUTE_CHUNK_SIZE
+from rollups import register_rollup_maintenance, rebuild_rollups, dashboard_summary, ROLLUP_REBUILD_CHUNK_DAYS
+from ingest import BillValidationError, parse_bill_payload, parse_claim_payload, parse_payment_payload, create_bill, ingest_bills, iter_ndjson_bills, iter_csv_bills
+from currency import (
+    BASE_CURRENCY, CONVERSION_BATCH_SIZE, REVALUATION_FORMATS,
+    rate_history_recorder, record_rates, revaluation_totals, write_revaluation
+)
+from archive import (
+    ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, archive_bills, archive_horizon, backfill_transaction_hashes, load_archived_bill
+)
+from search import NameIndex, SEARCH_LIMIT, MAX_SEARCH_LIMIT, search_bills, create_search_indexes
+from exports import EXPORT_ENTITIES, EXPORT_BATCH_SIZE, stream_csv, write_csv, write_columnar, run_incremental_export
+from clearinghouse import build_clearinghouse
+from migrations import upgrade_schema
+from mailer import MAIL_BATCH_SIZE, MAIL_POLL_INTERVAL, MailSender, queue_payment_confirmation
+from events import EventHub, EVENT_TOPICS, sse_supported
+from db_routing import init_routing, replica_reads, reading_from_replicas, refresh_sqlite_replicas
+from metrics import init_metrics, registry as metrics_registry, rate_limited, current_route, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from payment_state import (
+    IdempotencyKeyReused, InvalidTransition, VersionConflict,
+    register_status_guard, transition, validate_idempotency_key
+)
+from payment_verifier import build_chain_provider, transaction_used_by, verify_pending_payments, run_payment_verifier, VERIFY_BATCH_SIZE, VERIFY_INTERVAL
+from claim_queue import enqueue_claim, process_claims, run_claim_worker, queue_metrics, claim_queue_stats, CLAIM_BATCH_SIZE, CLAIM_POLL_INTERVAL
+from rates import (
+    STATIC_EXCHANGE_RATES, STATIC_CRYPTO_PRICES, RateRefresher,
+    get_live_exchange_rates, get_live_crypto_prices, get_upstream_status
+)
 from flask_caching import Cache
-from functools import wraps
-import threading
+from shared_backends import SlidingWindowLimiter, build_store
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.local import LocalProxy
+from functools import partial, wraps
+import click
 from flask_cors import CORS
 
-app = Flask(__name__)
-
-# Configure CORS
-CORS(app, resources={
-    r"/*": {
-        "origins": [
-            "https://www.billingdog.net",
-            "https://billingdog.net",
-            "http://localhost:5000"
-        ],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+logger = logging.getLogger(__name__)
+
+# Routes and CLI commands; registered on each application by create_app()
+bp = Blueprint('main', __name__, cli_group=None)
+
+# Extensions are bound to an application in create_app()
+mail = Mail()
+cache = Cache()
+
+def _service(name):
+    """Proxy to the current application's instance of a service built in create_app()"""
+    return LocalProxy(lambda: current_app.extensions['billing'][name])
+
+pdf_cache = _service('pdf_cache')
+code_catalog = _service('code_catalog')
+rate_limiter = _service('rate_limiter')
+exchange_rate_refresher = _service('exchange_rate_refresher')
+crypto_price_refresher = _service('crypto_price_refresher')
+mail_sender = _service('mail_sender')
+event_hub = _service('event_hub')
+statement_pool = _service('statement_pool')
+name_index = _service('name_index')
+
+# Rate limiting configuration
+RATE_LIMIT_WINDOW = 60  # seconds
+
+# Bulk ingestion settings
+INGEST_BATCH_SIZE = 500
+INGEST_MAX_BATCH_SIZE = 5000
+
+# Dashboard pagination settings
+PAYMENTS_PAGE_SIZE = 50
+PAYMENTS_MAX_PAGE_SIZE = 200
+PAYMENT_CHANGES_LIMIT = 500
+# Changes this recent are held back from /api/payments/changes: a transaction can
+# commit after a newer one, and a cursor already past its updated_at would skip it
+STATUS_FEED_LAG = timedelta(seconds=2)
+
+# Batch statement rendering settings
+STATEMENT_WORKERS = int(os.environ.get('STATEMENT_WORKERS', os.cpu_count() or 1))
+STATEMENT_CHUNK_SIZE = 50
+# /api/statements.zip shares one small pool per web worker; big runs belong in render-statements
+STATEMENT_DOWNLOAD_WORKERS = int(os.environ.get('STATEMENT_DOWNLOAD_WORKERS', min(2, os.cpu_count() or 1)))
+STATEMENT_DOWNLOAD_STREAMS = 1
+STATEMENT_DOWNLOAD_RETRY_AFTER = 30  # seconds
+
+# Precision of Bill.bank_exchange_rate
+EXCHANGE_RATE_PLACES = Decimal('0.0001')
+
+def load_config(app):
+    """Read settings from the environment into app.config"""
+    # Request metrics (/metrics and Server-Timing); gunicorn workers share
+    # snapshots through METRICS_DIR
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR', os.path.join(app.instance_path, 'metrics'))
+
+    # Database configuration: writes go to DATABASE_URL; @replica_reads routes and
+    # batch jobs read from DATABASE_REPLICA_URLS (comma-separated) when set
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config['DATABASE_REPLICA_URLS'] = [
+        url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+    ]
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_REPLICA_POOL_SIZE'] = int(os.environ.get('DB_REPLICA_POOL_SIZE', 5))
+    app.config['DB_REPLICA_MAX_OVERFLOW'] = int(os.environ.get('DB_REPLICA_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds
+    # Off by default: pool_recycle retires idle connections, and a dropped one
+    # fails a single request instead of every checkout paying a round trip
+    app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', 'false').lower() == 'true'
+    # How long a client that wrote keeps reading from the primary
+    app.config['REPLICA_STICKY_SECONDS'] = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Email configuration
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
+    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
+    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
+    app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', os.environ.get('MAIL_USERNAME'))
+
+    # Shared cache/rate-limit backend ('sqlite' on local disk, or 'redis')
+    app.config['SHARED_BACKEND'] = os.environ.get('SHARED_BACKEND', 'sqlite')
+    app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    app.config['SHARED_SQLITE_PATH'] = os.environ.get('SHARED_SQLITE_PATH', os.path.join(app.instance_path, 'shared.db'))
+
+    # Per-client request limit for @rate_limit routes
+    app.config['RATE_LIMIT'] = int(os.environ.get('RATE_LIMIT', 60))  # requests per minute
+
+    # Claim clearinghouse; the in-process 'fake' must be chosen explicitly
+    app.config['CLEARINGHOUSE'] = os.environ.get('CLEARINGHOUSE', 'http')
+    app.config['CLEARINGHOUSE_URL'] = os.environ.get('CLEARINGHOUSE_URL')
+    app.config['CLEARINGHOUSE_API_KEY'] = os.environ.get('CLEARINGHOUSE_API_KEY')
+
+    # Chain RPC endpoint for payment verification; 'mock' must be chosen explicitly
+    app.config['PAYMENT_PROVIDER'] = os.environ.get('PAYMENT_PROVIDER', 'rpc')
+    app.config['PAYMENT_RPC_URL'] = os.environ.get('PAYMENT_RPC_URL')
+    # Our wallet: only transfers to it settle a bill
+    app.config['PAYMENT_RECEIVING_ADDRESS'] = os.environ.get('PAYMENT_RECEIVING_ADDRESS')
+    # Token contracts per currency ("USDC=0x...:6,USDT=0x...:6"); defaults in payment_verifier.CHAIN_TOKENS
+    app.config['PAYMENT_TOKEN_CONTRACTS'] = os.environ.get('PAYMENT_TOKEN_CONTRACTS')
+
+    # Settled bills older than this move to cold storage (flask archive-bills)
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS))
+
+    # Server-Sent Events: 'auto' enables the stream only under gevent workers
+    app.config['SSE_ENABLED'] = os.environ.get('SSE_ENABLED', 'auto')
+
+    # Cache configuration
+    app.config['CACHE_TYPE'] = 'shared_backends.SharedStoreCache'
+
+    # PDF cache configuration
+    app.config['PDF_CACHE_DIR'] = os.environ.get('PDF_CACHE_DIR', os.path.join(app.instance_path, 'pdf_cache'))
+    app.config['PDF_CACHE_MAX_BYTES'] = int(os.environ.get('PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    # Statement branding: a JSON file overriding pdf_templates.DEFAULT_STATEMENT_TEMPLATE
+    app.config['PDF_TEMPLATE_PATH'] = os.environ.get('PDF_TEMPLATE_PATH')
+
+    # Code catalog: CMS ICD-10-CM code file and the practice's CPT fee schedule (CSV)
+    app.config['ICD10_CODES_PATH'] = os.environ.get('ICD10_CODES_PATH')
+    app.config['FEE_SCHEDULE_PATH'] = os.environ.get('FEE_SCHEDULE_PATH')
+    app.config['CODE_CATALOG_DIR'] = os.environ.get('CODE_CATALOG_DIR', os.path.join(app.instance_path, 'catalog'))
+
+def create_app(config=None):
+    """Build the application: settings from the environment, overridden by `config`.
+
+    Nothing here touches the database or the network, so workers, CLI
+    commands and scripts start quickly; create the schema with
+    `flask --app app init-db`. Background threads (rate refreshers, the mail
+    sender, the event hub) start in each process on first use.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    app = Flask(__name__)
+    load_config(app)
+    if config:
+        app.config.update(config)
+
+    # Configure CORS
+    CORS(app, resources={
+        r"/*": {
+            "origins": [
+                "https://www.billingdog.net",
+                "https://billingdog.net",
+                "http://localhost:5000"
+            ],
+            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+            "allow_headers": ["Content-Type", "Authorization"]
+        }
+    })
+
+    # Registered before the other hooks so redirected requests are timed too
+    init_metrics(app)
+    app.after_request(add_security_headers)
+    app.before_request(redirect_to_preferred_domain)
+
+    # Initialize extensions
+    init_routing(app)
+    db.init_app(app)
+    mail.init_app(app)
+    cache.init_app(app)
+    dispose_engine_after_fork(app)
+
+    # Keep denormalized bill totals in step with line-item changes
+    register_total_maintenance()
+    # ... and the dashboard's daily rollups in step with bills and claims
+    register_rollup_maintenance()
+    # Payment and claim statuses only change through the state machine (payment_state.py)
+    register_status_guard()
+
+    # Statements are rendered with one template per process; forked batch workers inherit it
+    if app.config['PDF_TEMPLATE_PATH']:
+        use_template(load_template(app.config['PDF_TEMPLATE_PATH']))
+    pdf = PdfCache(app.config['PDF_CACHE_DIR'], app.config['PDF_CACHE_MAX_BYTES'])
+    register_invalidation(pdf)
+    # Upstream rate sources, refreshed in the background of each worker process
+    # Live exchange rates are also appended to the rate history (currency.py) when they change
+    exchange_rates = RateRefresher('exchange-rates', get_live_exchange_rates, STATIC_EXCHANGE_RATES,
+                                   on_refresh=rate_history_recorder(app, 'exchangerate-api'))
+    crypto_prices = RateRefresher('crypto-prices', get_live_crypto_prices, STATIC_CRYPTO_PRICES)
+    app.extensions['billing'] = {
+        'pdf_cache': pdf,
+        'code_catalog': CodeCatalog(
+            {'icd10': app.config['ICD10_CODES_PATH'], 'cpt': app.config['FEE_SCHEDULE_PATH']},
+            app.config['CODE_CATALOG_DIR']
+        ),
+        'rate_limiter': SlidingWindowLimiter(build_store(app.config), app.config['RATE_LIMIT'], RATE_LIMIT_WINDOW),
+        'exchange_rate_refresher': exchange_rates,
+        'crypto_price_refresher': crypto_prices,
+        # Outbound email is queued in the database and sent from a background thread
+        'mail_sender': MailSender(app, pdf),
+        # Pushes rate and status changes to /api/events subscribers in this process
+        'event_hub': EventHub(app, {
+            'rates': (exchange_rates, 'rates'),
+            'prices': (crypto_prices, 'prices'),
+        }, partial(query_status_changes, lag=None)),
+        # Patient name search off PostgreSQL; built as each worker boots (gunicorn.conf.py)
+        'name_index': NameIndex(),
+        # Render processes for /api/statements.zip, started on the first download
+        'statement_pool': SharedRenderPool(STATEMENT_DOWNLOAD_WORKERS, STATEMENT_DOWNLOAD_STREAMS),
     }
-})
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = app.logger
+    app.register_blueprint(bp)
+    return app
+
+def dispose_engine_after_fork(app):
+    """Give each forked process (gunicorn --preload workers, multiprocessing) fresh pools.
+
+    close=False drops the inherited pooled connections without closing them,
+    so the parent's sockets are left alone. Covers the primary and every replica.
+    """
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def dispose():
+        for engine in engines:
+            engine.dispose(close=False)
+    os.register_at_fork(after_in_child=dispose)
 
 # Security headers middleware
-@app.after_request
 def add_security_headers(response):
     response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
     response.headers['X-Content-Type-Options'] = 'nosniff'
@@ -47,9 +279,8 @@ def add_security_headers(response):
     return response
 
 # Domain redirect middleware
-@app.before_request
 def redirect_to_preferred_domain():
-    if not request.is_secure and not app.debug:
+    if not request.is_secure and not current_app.debug:
         url = request.url.replace('http://', 'https://', 1)
         return redirect(url, code=301)
 
@@ -59,198 +290,147 @@ def redirect_to_preferred_domain():
 
     return None
 
-# Database configuration
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Email configuration
-app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-app.config['MAIL_PORT'] = 587
-app.config['MAIL_USE_TLS'] = True
-app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME')
-app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
-
-# Cache configuration
-app.config['CACHE_TYPE'] = 'simple'
-cache = Cache(app)
+def rate_limit(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        allowed, retry_after = rate_limiter.hit(request.remote_addr)
+        if not allowed:
+            rate_limited.inc(current_route())
+            return jsonify({
+                'success': False,
+                'error': 'Rate limit exceeded. Please try again later.',
+                'retry_after': retry_after
+            }), 429
 
-# Rate limiting configuration
-RATE_LIMIT = 60  # requests per minute
-RATE_LIMIT_WINDOW = 60  # seconds
-request_counts = {}
-request_times = {}
-request_lock = threading.Lock()
+        return f(*args, **kwargs)
+    return decorated_function
 
-# Initialize extensions
-mail = Mail(app)
-db.init_app(app)
+def encode_keyset_cursor(timestamp, row_id):
+    """Encode a (timestamp, id) keyset position as an opaque cursor"""
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
 
-# Initialize database tables
-with app.app_context():
+def encode_payment_cursor(bill):
+    """Encode the (created_at, id) keyset position of a bill as an opaque cursor"""
+    return encode_keyset_cursor(bill.created_at, bill.id)
+
+def decode_payment_cursor(cursor):
+    """Decode a cursor produced by encode_keyset_cursor, raising ValueError if malformed"""
     try:
-        db.create_all()
-        logger.info("Database tables created successfully")
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, row_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(row_id)
     except Exception as e:
-        logger.error(f"Database error: {str(e)}")
-
-# Static exchange rates for fallback
-STATIC_EXCHANGE_RATES = {
-    'USD': 1.0,
-    'EUR': 0.85,
-    'GBP': 0.73,
-    'JPY': 110.0,
-    'CAD': 1.25,
-    'AUD': 1.35,
-    'CNY': 6.45
-}
-
-# Static crypto prices for fallback
-STATIC_CRYPTO_PRICES = {
-    'BTC': 35000.00,
-    'ETH': 2000.00,
-    'USDT': 1.00,
-    'USDC': 1.00
-}
-
-# Cache durations and retry settings
-CACHE_DURATION = 30  # seconds
-MAX_RETRIES = 3
-RETRY_DELAY = 1  # seconds
-REQUEST_TIMEOUT = 5  # seconds
+        raise ValueError(f"Invalid cursor: {cursor}") from e
 
-def rate_limit(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        ip = request.remote_addr
-        
-        with request_lock:
-            current_time = time.time()
-            
-            # Clean up old entries
-            for stored_ip in list(request_times.keys()):
-                if current_time - request_times[stored_ip] > RATE_LIMIT_WINDOW:
-                    del request_times[stored_ip]
-                    del request_counts[stored_ip]
-            
-            # Check rate limit
-            if ip in request_counts:
-                if request_counts[ip] >= RATE_LIMIT:
-                    return jsonify({
-                        'success': False,
-                        'error': 'Rate limit exceeded. Please try again later.',
-                        'retry_after': int(request_times[ip] + RATE_LIMIT_WINDOW - current_time)
-                    }), 429
-                request_counts[ip] += 1
-            else:
-                request_counts[ip] = 1
-                request_times[ip] = current_time
-        
-        return f(*args, **kwargs)
-    return decorated_function
+def statement_bill_ids(date_filter='all', status='all', method='all'):
+    """Query selecting the ids of bills to include in a statement batch"""
+    query = filter_bills(db.session.query(Bill.id), date_filter, status, method)
+    return query.order_by(Bill.id)
 
-def get_live_exchange_rates():
-    """Fetch live exchange rates from an API with retry mechanism"""
-    for attempt in range(MAX_RETRIES):
-        try:
-            response = requests.get(
-                'https://api.exchangerate-api.com/v4/latest/USD',
-                timeout=REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            rates = {
-                'USD': 1.0,
-                'EUR': data['rates'].get('EUR', STATIC_EXCHANGE_RATES['EUR']),
-                'GBP': data['rates'].get('GBP', STATIC_EXCHANGE_RATES['GBP']),
-                'JPY': data['rates'].get('JPY', STATIC_EXCHANGE_RATES['JPY']),
-                'CAD': data['rates'].get('CAD', STATIC_EXCHANGE_RATES['CAD']),
-                'AUD': data['rates'].get('AUD', STATIC_EXCHANGE_RATES['AUD']),
-                'CNY': data['rates'].get('CNY', STATIC_EXCHANGE_RATES['CNY'])
-            }
-            
-            logger.info("Successfully fetched live exchange rates")
-            return rates
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Attempt {attempt + 1}/{MAX_RETRIES} failed: {str(e)}")
-            if attempt < MAX_RETRIES - 1:
-                time.sleep(RETRY_DELAY * (2 ** attempt))  # Exponential backoff
-            continue
-        except Exception as e:
-            logger.error(f"Unexpected error fetching exchange rates: {str(e)}")
-            break
-            
-    logger.warning("All attempts to fetch exchange rates failed, using static rates")
-    return None
+def query_payments_page(date_filter='all', status='all', method='all', cursor=None, limit=PAYMENTS_PAGE_SIZE):
+    """Return one keyset page of bills and the cursor for the next page.
 
-def get_live_crypto_prices():
-    """Fetch live cryptocurrency prices from Coinbase API with retry mechanism"""
-    coinbase_key = os.environ.get('COINBASE_COMMERCE_API_KEY')
-    if not coinbase_key:
-        logger.error("Coinbase API key not found in environment variables")
-        return None
+    Filtering and ordering run in SQL against the composite (filter, created_at, id)
+    indexes on Bill, so the cost of a page does not grow with the table size.
+    """
+    query = filter_bills(bill_query('list'), date_filter, status, method)
+    if cursor:
+        created_at, bill_id = decode_payment_cursor(cursor)
+        query = query.filter(tuple_(Bill.created_at, Bill.id) < tuple_(created_at, bill_id))
+
+    # Fetch one extra row to learn whether another page exists
+    rows = query.order_by(Bill.created_at.desc(), Bill.id.desc()).limit(limit + 1).all()
+    payments = rows[:limit]
+    next_cursor = encode_payment_cursor(payments[-1]) if len(rows) > limit else None
+    return payments, next_cursor
+
+def query_status_changes(cursor=None, limit=PAYMENT_CHANGES_LIMIT, lag=STATUS_FEED_LAG, rewind=None):
+    """Bills updated after a (updated_at, id) cursor, oldest first, and the cursor to resume from.
 
-    headers = {
-        'X-CC-Api-Key': coinbase_key,
-        'X-CC-Version': '2018-03-22'
+    Without a cursor nothing is returned, only the current position, so a
+    client can start following changes from now. Rows updated within `lag` of
+    now are left for a later call, so a transaction that commits late is still
+    ahead of the cursor. `rewind` re-reads that much before the cursor for
+    callers that de-duplicate by (id, version) themselves (events.EventHub).
+    """
+    columns = (Bill.id, Bill.updated_at, Bill.payment_status, Bill.claim_status, Bill.claim_number, Bill.version)
+    horizon = datetime.utcnow() - lag if lag else None
+    if cursor is None:
+        query = select(Bill.updated_at, Bill.id).order_by(Bill.updated_at.desc(), Bill.id.desc()).limit(1)
+        if horizon is not None:
+            query = query.where(Bill.updated_at <= horizon)
+        latest = db.session.execute(query).first()
+        position = latest or (horizon or datetime.utcnow(), 0)
+        return [], encode_keyset_cursor(*position)
+
+    position = decode_payment_cursor(cursor)
+    start = (position[0] - rewind, 0) if rewind else position
+    query = (
+        select(*columns)
+        .where(tuple_(Bill.updated_at, Bill.id) > tuple_(*start))
+        .order_by(Bill.updated_at, Bill.id)
+        .limit(limit)
+    )
+    if horizon is not None:
+        query = query.where(Bill.updated_at <= horizon)
+    rows = db.session.execute(query).all()
+    # A re-read window can end before the cursor (its row was archived); only a
+    # full page, which the caller continues from, moves it back
+    if rows and (len(rows) == limit or (rows[-1].updated_at, rows[-1].id) > position):
+        cursor = encode_keyset_cursor(rows[-1].updated_at, rows[-1].id)
+    return rows, cursor
+
+def serialize_payment_row(bill):
+    """Slim JSON representation of a bill for the dashboard table"""
+    return {
+        'id': bill.id,
+        'created_at': bill.created_at.isoformat() if bill.created_at else None,
+        'patient_name': bill.patient_name,
+        'total_amount': str(bill.total_amount),
+        'payment_method': bill.payment_method,
+        'payment_currency': bill.payment_currency,
+        'bank_currency': bill.bank_currency,
+        'payment_status': bill.payment_status,
+        'insurance_provider': bill.insurance_provider,
+        'claim_status': bill.claim_status,
+        'claim_number': bill.claim_number
     }
-    
-    crypto_symbols = ['BTC', 'ETH', 'USDT', 'USDC']
-    prices = {}
-    
-    for symbol in crypto_symbols:
-        for attempt in range(MAX_RETRIES):
-            try:
-                response = requests.get(
-                    f'https://api.commerce.coinbase.com/v2/exchange-rates?currency={symbol}',
-                    headers=headers,
-                    timeout=REQUEST_TIMEOUT
-                )
-                
-                if response.status_code == 502:
-                    logger.error(f"Bad Gateway (502) error for {symbol}")
-                    if attempt < MAX_RETRIES - 1:
-                        delay = RETRY_DELAY * (2 ** attempt)  # Exponential backoff
-                        logger.info(f"Retrying after {delay} seconds...")
-                        time.sleep(delay)
-                        continue
-                    break
-                
-                response.raise_for_status()
-                data = response.json()
-                
-                if 'data' in data and 'rates' in data['data'] and 'USD' in data['data']['rates']:
-                    prices[symbol] = float(data['data']['rates']['USD'])
-                    logger.info(f"Successfully fetched {symbol} price")
-                    break
-                else:
-                    raise ValueError(f"Invalid response format for {symbol}")
-                    
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Attempt {attempt + 1}/{MAX_RETRIES} failed for {symbol}: {str(e)}")
-                if attempt < MAX_RETRIES - 1:
-                    delay = RETRY_DELAY * (2 ** attempt)  # Exponential backoff
-                    time.sleep(delay)
-                continue
-            except ValueError as e:
-                logger.error(f"Invalid response for {symbol}: {str(e)}")
-                break
-            except Exception as e:
-                logger.error(f"Unexpected error fetching {symbol} price: {str(e)}")
-                break
-                
-        if symbol not in prices:
-            logger.warning(f"Using fallback price for {symbol}")
-            prices[symbol] = STATIC_CRYPTO_PRICES[symbol]
-    
-    return prices if len(prices) == len(crypto_symbols) else None
-
-@app.route('/')
+
+def serialize_bill_detail(bill):
+    """Full JSON representation of a bill loaded with the 'detail' profile"""
+    return {
+        **serialize_payment_row(bill),
+        'patient_dob': bill.patient_dob.isoformat() if bill.patient_dob else None,
+        'policy_number': bill.policy_number,
+        'email': bill.email,
+        'transaction_hash': bill.transaction_hash,
+        'crypto_amount': str(bill.crypto_amount) if bill.crypto_amount is not None else None,
+        'bank_name': bill.bank_name,
+        'bank_exchange_rate': str(bill.bank_exchange_rate) if bill.bank_exchange_rate is not None else None,
+        'claim_submission_date': bill.claim_submission_date.isoformat() if bill.claim_submission_date else None,
+        'version': bill.version,
+        'diagnoses': [{
+            'icd10_code': d.icd10_code,
+            'description': d.description,
+            'amount': str(d.amount)
+        } for d in bill.diagnoses],
+        'procedures': [{
+            'cpt_code': p.cpt_code,
+            'description': p.description,
+            'amount': str(p.amount)
+        } for p in bill.procedures],
+        'claims': [{
+            'id': c.id,
+            'payer_id': c.payer_id,
+            'payer_name': c.payer_name,
+            'status': c.status,
+            'claim_number': c.claim_number,
+            'submitted_at': c.submitted_at.isoformat() if c.submitted_at else None
+        } for c in bill.claims]
+    }
+
+@bp.route('/')
 def index():
     try:
         logger.info("Rendering index page")
@@ -259,78 +439,576 @@ def index():
         logger.error(f"Error rendering template: {str(e)}")
         return f"Error loading page: {str(e)}", 500
 
-@app.route('/static/<path:filename>')
+@bp.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory('static', filename)
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
+@replica_reads
 def dashboard():
     try:
-        payments = Bill.query.order_by(Bill.created_at.desc()).all()
-        return render_template('dashboard.html', payments=payments)
+        payments, next_cursor = query_payments_page()
+        _, changes_cursor = query_status_changes()
+        return render_template('dashboard.html', payments=payments, next_cursor=next_cursor,
+                               changes_cursor=changes_cursor)
     except Exception as e:
         logger.error(f"Error loading dashboard: {str(e)}")
         return f"Error loading dashboard: {str(e)}", 500
 
-@app.route('/get_exchange_rates')
-@rate_limit
-@cache.cached(timeout=CACHE_DURATION)
-def get_exchange_rates():
+@bp.route('/api/payments')
+@replica_reads
+def api_payments():
     try:
-        rates = get_live_exchange_rates()
-        if rates:
-            return jsonify({
-                'success': True,
-                'rates': rates,
-                'is_live': True,
-                'timestamp': time.time()
-            })
-        
+        limit = min(request.args.get('limit', PAYMENTS_PAGE_SIZE, type=int), PAYMENTS_MAX_PAGE_SIZE)
+        payments, next_cursor = query_payments_page(
+            date_filter=request.args.get('date', 'all'),
+            status=request.args.get('status', 'all'),
+            method=request.args.get('method', 'all'),
+            cursor=request.args.get('cursor'),
+            limit=max(limit, 1)
+        )
         return jsonify({
             'success': True,
-            'rates': STATIC_EXCHANGE_RATES,
-            'is_live': False,
-            'timestamp': time.time()
+            'payments': [serialize_payment_row(bill) for bill in payments],
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error in exchange rates endpoint: {str(e)}")
+        logger.error(f"Error listing payments: {str(e)}")
+        return jsonify({'success': False, 'error': "Failed to fetch payments"}), 500
+
+@bp.route('/api/dashboard/summary')
+@replica_reads
+def api_dashboard_summary():
+    """Summary cards, daily revenue and claim outcomes for a date filter, served from the rollups"""
+    try:
+        return jsonify({'success': True, **dashboard_summary(request.args.get('date', 'all'))})
+    except Exception as e:
+        logger.error(f"Error building dashboard summary: {str(e)}")
+        return jsonify({'success': False, 'error': "Failed to build dashboard summary"}), 500
+
+@bp.route('/api/payments/changes')
+@replica_reads
+def api_payment_changes():
+    """Payment and claim status deltas since the `since` cursor"""
+    try:
+        rows, cursor = query_status_changes(request.args.get('since') or None)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'changes': [{
+            'id': row.id,
+            'payment_status': row.payment_status,
+            'claim_status': row.claim_status,
+            'claim_number': row.claim_number,
+            'version': row.version
+        } for row in rows],
+        'cursor': cursor
+    })
+
+@bp.route('/api/search')
+@replica_reads
+def api_search():
+    """Find bills by patient name, date of birth, policy/claim number or transaction hash"""
+    try:
+        limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), MAX_SEARCH_LIMIT)
+        results = search_bills(request.args.get('q', ''), name_index, limit)
         return jsonify({
-            'success': False,
-            'error': "Failed to fetch exchange rates",
-            'rates': STATIC_EXCHANGE_RATES,
-            'is_live': False
+            'success': True,
+            'results': [{
+                **serialize_payment_row(result.bill),
+                'patient_dob': result.bill.patient_dob.isoformat() if result.bill.patient_dob else None,
+                'policy_number': result.bill.policy_number,
+                'transaction_hash': result.bill.transaction_hash,
+                'matched': result.matched
+            } for result in results]
         })
+    except Exception as e:
+        logger.error(f"Error searching bills: {str(e)}")
+        return jsonify({'success': False, 'error': "Search failed"}), 500
 
-@app.route('/get_crypto_prices')
+@bp.route('/submit_bill', methods=['POST'])
+@rate_limit
+def submit_bill():
+    try:
+        bill = create_bill(parse_bill_payload(request.get_json(silent=True), code_catalog))
+        logger.info(f"Created bill {bill.id}")
+        return jsonify({'success': True, 'bill_id': bill.id, 'total_amount': str(bill.total_amount)})
+    except BillValidationError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error submitting bill: {str(e)}")
+        return jsonify({'success': False, 'error': "Failed to submit bill"}), 500
+
+@bp.route('/api/bills/batch', methods=['POST'])
+@rate_limit
+def submit_bill_batch():
+    """Bulk upload of bills as NDJSON (one bill per line) or CSV (one line item per row)"""
+    content_type = request.mimetype
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json'):
+        rows = iter_ndjson_bills(request.stream)
+    elif content_type in ('text/csv', 'application/csv'):
+        rows = iter_csv_bills(request.stream)
+    else:
+        return jsonify({'success': False, 'error': f"Unsupported content type: {content_type}"}), 415
+
+    try:
+        batch_size = min(request.args.get('batch_size', INGEST_BATCH_SIZE, type=int), INGEST_MAX_BATCH_SIZE)
+        result = ingest_bills(rows, batch_size=max(batch_size, 1), catalog=code_catalog)
+        return jsonify({'success': result.error_count == 0, **result.to_dict()})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error ingesting bill batch: {str(e)}")
+        return jsonify({'success': False, 'error': "Failed to ingest bills"}), 500
+
+@bp.route('/api/codes')
+def code_catalog_status():
+    return jsonify({'success': True, 'catalogs': code_catalog.status()})
+
+@bp.route('/api/codes/<system>')
+def search_codes(system):
+    """Autocomplete for ICD-10 (system 'icd10') or CPT ('cpt') codes by code prefix or description words"""
+    if system not in CODE_SYSTEMS:
+        return jsonify({'success': False, 'error': f"Unknown code system: {system}"}), 404
+    index = code_catalog.index(system)
+    if index is None:
+        return jsonify({'success': False, 'error': f"{CODE_LABELS[system]} catalog is not loaded"}), 503
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), 1), MAX_AUTOCOMPLETE_LIMIT)
+    return jsonify({'success': True, 'results': [entry._asdict() for entry in index.autocomplete(query, limit)]})
+
+@bp.route('/api/codes/validate', methods=['POST'])
+def validate_codes():
+    """Report which of the posted {"icd10": [...], "cpt": [...]} codes are not in the catalog"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Body must be a JSON object of code lists'}), 400
+    unknown = {}
+    for system in CODE_SYSTEMS:
+        codes = data.get(system) or []
+        if not isinstance(codes, list) or not all(isinstance(code, str) for code in codes):
+            return jsonify({'success': False, 'error': f"{system} must be a list of codes"}), 400
+        unknown[system] = code_catalog.unknown_codes(system, codes)
+    return jsonify({
+        'success': True,
+        'valid': not any(unknown.values()),
+        'unknown': unknown,
+        'catalogs': code_catalog.status()
+    })
+
+def parse_expected_version(header):
+    """Bill version from an If-Match header ("3", W/"3" or 3), or None when absent"""
+    if not header:
+        return None
+    try:
+        return int(header.strip().removeprefix('W/').strip('"'))
+    except ValueError:
+        raise BillValidationError("If-Match must be the bill version")
+
+def transition_error_response(e):
+    """409 for a change the bill's current state rejects, 422 for a reused idempotency key"""
+    status = 422 if isinstance(e, IdempotencyKeyReused) else 409
+    return jsonify({'success': False, 'error': str(e)}), status
+
+def mark_replayed(response, change):
+    """Tell the client its idempotency key was seen before and nothing changed"""
+    if change.replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@bp.route('/verify_payment', methods=['POST'])
+@rate_limit
+def verify_payment():
+    """Record the payment details for a bill and queue the confirmation email.
+
+    A repeated Idempotency-Key answers with the recorded outcome and queues no
+    second email; If-Match (the bill version) turns a concurrent change into a 409.
+    """
+    try:
+        payment = parse_payment_payload(request.get_json(silent=True))
+        idempotency_key = validate_idempotency_key(request.headers.get('Idempotency-Key'))
+        expected_version = parse_expected_version(request.headers.get('If-Match'))
+        bill_id = payment.pop('bill_id')
+        if payment.get('transaction_hash') and transaction_used_by(payment['transaction_hash'], bill_id):
+            return jsonify({'success': False, 'error': 'This transaction already pays another bill'}), 409
+        if payment['payment_method'] == 'bank' and payment['bank_currency']:
+            # Record the rate the patient was quoted; revaluations start from it
+            rate = exchange_rate_refresher.current().values.get(payment['bank_currency'])
+            payment['bank_exchange_rate'] = Decimal(str(rate)).quantize(EXCHANGE_RATE_PLACES) if rate else None
+        change = transition(bill_id, 'payment', 'pending', payment, expected_version, idempotency_key)
+        if not change.replayed:
+            queue_payment_confirmation(db.session.get(Bill, bill_id))
+            db.session.commit()
+            mail_sender.wake()
+        return mark_replayed(jsonify({
+            'success': True, 'bill_id': bill_id, 'payment_status': change.to_status, 'version': change.version
+        }), change)
+    except (InvalidTransition, VersionConflict, IdempotencyKeyReused) as e:
+        db.session.rollback()
+        return transition_error_response(e)
+    except IntegrityError:
+        # uq_bill_transaction_hash_open: another bill took the hash since the check above
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'This transaction already pays another bill'}), 409
+    except LookupError:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': 'Bill not found'}), 404
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error recording payment: {str(e)}")
+        return jsonify({'success': False, 'error': "Failed to process payment"}), 500
+
+@bp.route('/api/submit_claim', methods=['POST'])
+@rate_limit
+def submit_claim():
+    """Queue an insurance claim; a claims worker batches and submits it.
+
+    A repeated Idempotency-Key returns the claim the first submission queued.
+    """
+    try:
+        idempotency_key = validate_idempotency_key(request.headers.get('Idempotency-Key'))
+        claim, change = enqueue_claim(parse_claim_payload(request.get_json(silent=True)), idempotency_key)
+        if not change.replayed:
+            logger.info(f"Queued claim {claim.id} for bill {claim.bill_id}")
+        return mark_replayed(jsonify({'success': True, 'claim_id': claim.id, 'status': claim.status}), change), 202
+    except (InvalidTransition, VersionConflict, IdempotencyKeyReused) as e:
+        db.session.rollback()
+        return transition_error_response(e)
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error queueing claim: {str(e)}")
+        return jsonify({'success': False, 'error': "Failed to submit claim"}), 500
+
+@bp.route('/api/claims/queue')
+@replica_reads
+def claim_queue_status():
+    return jsonify({'success': True, **queue_metrics()})
+
+@bp.route('/api/payments/<int:bill_id>')
+@replica_reads
+def api_payment_detail(bill_id):
+    bill = bill_query('detail').filter(Bill.id == bill_id).first() or load_archived_bill(bill_id)
+    if bill is None:
+        return jsonify({'success': False, 'error': 'Bill not found'}), 404
+    return jsonify(serialize_bill_detail(bill))
+
+@bp.route('/api/bills/<int:bill_id>')
+@replica_reads
+def api_bill_detail(bill_id):
+    bill = bill_query('detail').filter(Bill.id == bill_id).first() or load_archived_bill(bill_id)
+    if bill is None:
+        return jsonify({'success': False, 'error': 'Bill not found'}), 404
+    return jsonify({'success': True, 'bill': serialize_bill_detail(bill)})
+
+@bp.route('/claim_form')
+def claim_form():
+    return render_template('claim_form.html')
+
+@bp.route('/download_bill_pdf/<int:bill_id>')
+@replica_reads
+def download_bill_pdf(bill_id):
+    bill = load_bill_for_pdf(bill_id)
+    if bill is None:
+        abort(404)
+    try:
+        path, key = pdf_cache.get_or_render(bill, render_bill_pdf)
+
+        # conditional=True answers If-None-Match with 304 and honours Range
+        return send_file(
+            path,
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f'bill_{bill_id}.pdf',
+            etag=key,
+            conditional=True,
+            max_age=0
+        )
+    except Exception as e:
+        logger.error(f"Error generating PDF for bill {bill_id}: {str(e)}")
+        return f"Error generating PDF: {str(e)}", 500
+
+@bp.route('/api/statements.zip')
+@rate_limit
+@replica_reads
+def download_statements_zip():
+    """Stream matching statements as a ZIP, rendered on this worker's shared pool.
+
+    Only STATEMENT_DOWNLOAD_STREAMS archives render at once per worker; a
+    busy worker answers 503. Month-end runs use `flask render-statements`.
+    """
+    if not statement_pool.try_acquire():
+        response = jsonify({'success': False, 'error': 'Statement downloads are busy. Please try again later.',
+                            'retry_after': STATEMENT_DOWNLOAD_RETRY_AFTER})
+        response.headers['Retry-After'] = str(STATEMENT_DOWNLOAD_RETRY_AFTER)
+        return response, 503
+    bill_ids = statement_bill_ids(
+        date_filter=request.args.get('date', 'all'),
+        status=request.args.get('status', 'all'),
+        method=request.args.get('method', 'all')
+    )
+    response = Response(
+        stream_with_context(stream_statements_zip(bill_ids, chunk_size=STATEMENT_CHUNK_SIZE, pool=statement_pool)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=statements.zip'}
+    )
+    # Released when the stream finishes or the client goes away, started or not
+    response.call_on_close(statement_pool.release)
+    return response
+
+def rates_response(snapshot, key):
+    """JSON body for a rate snapshot, including how old it is (null timestamp and age for the fallback)"""
+    age = snapshot.age
+    return jsonify({
+        'success': True,
+        key: snapshot.to_dict(),
+        'is_live': snapshot.is_live,
+        'live': snapshot.liveness(),
+        'timestamp': snapshot.fetched_at,
+        'age': round(age, 3) if age is not None else None
+    })
+
+@bp.route('/get_exchange_rates')
+@rate_limit
+def get_exchange_rates():
+    return rates_response(exchange_rate_refresher.current(), 'rates')
+
+@bp.route('/get_crypto_prices')
 @rate_limit
-@cache.cached(timeout=CACHE_DURATION)
 def get_crypto_prices():
+    return rates_response(crypto_price_refresher.current(), 'prices')
+
+def sse_enabled():
+    setting = current_app.config['SSE_ENABLED'].lower()
+    return sse_supported() if setting == 'auto' else setting == 'true'
+
+@bp.route('/api/events')
+@rate_limit
+def event_stream():
+    """SSE stream of rate snapshots and bill status deltas; clients poll when it answers 503"""
+    if not sse_enabled():
+        return jsonify({'success': False, 'error': 'Event stream unavailable'}), 503
+    topics = [t for t in request.args.get('topics', ','.join(EVENT_TOPICS)).split(',') if t in EVENT_TOPICS]
+    if not topics:
+        return jsonify({'success': False, 'error': 'No valid topics requested'}), 400
     try:
-        prices = get_live_crypto_prices()
-        if prices:
-            return jsonify({
-                'success': True,
-                'prices': prices,
-                'is_live': True,
-                'timestamp': time.time()
-            })
-        
-        return jsonify({
-            'success': True,
-            'prices': STATIC_CRYPTO_PRICES,
-            'is_live': False,
-            'timestamp': time.time()
-        })
+        bills = request.args.get('bills')
+        bill_ids = {int(b) for b in bills.split(',')} if bills else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'bills must be a comma-separated list of ids'}), 400
+
+    subscription = event_hub.subscribe(topics, bill_ids)
+    return Response(
+        event_hub.stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/upstreams')
+def upstream_status():
+    return jsonify({'success': True, **get_upstream_status(), 'event_subscribers': event_hub.subscriber_count})
+
+@bp.route('/metrics')
+def metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@bp.route('/api/exports/<entity>.csv')
+@replica_reads
+def export_csv(entity):
+    if entity not in EXPORT_ENTITIES:
+        return jsonify({'success': False, 'error': f"Unknown export: {entity}"}), 404
+    rows = stream_csv(
+        entity,
+        date_filter=request.args.get('date', 'all'),
+        status=request.args.get('status', 'all'),
+        method=request.args.get('method', 'all')
+    )
+    return Response(
+        stream_with_context(rows),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f"attachment; filename={entity}.csv"}
+    )
+
+@bp.route('/api/reports/revaluation')
+@replica_reads
+def revaluation_report():
+    """Bank payments per currency valued in a reporting currency, optionally revalued at a date"""
+    revalue_at = request.args.get('at')
+    try:
+        revalue_at = datetime.fromisoformat(revalue_at) if revalue_at else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'at must be an ISO date or datetime'}), 400
+    target = request.args.get('currency', BASE_CURRENCY).upper()
+    try:
+        totals = revaluation_totals(
+            target, revalue_at,
+            date_filter=request.args.get('date', 'all'),
+            status=request.args.get('status', 'paid')
+        )
+        return jsonify({'success': True, 'currency': target,
+                        'revalued_at': revalue_at.isoformat() if revalue_at else None, 'by_currency': totals})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Error in crypto prices endpoint: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': "Failed to fetch cryptocurrency prices",
-            'prices': STATIC_CRYPTO_PRICES,
-            'is_live': False
-        })
+        logger.error(f"Error building revaluation report: {str(e)}")
+        return jsonify({'success': False, 'error': 'Failed to build revaluation report'}), 500
+
+@bp.cli.command('render-statements')
+@click.argument('output')
+@click.option('--format', 'output_format', type=click.Choice(['zip', 'pdf']), default='zip',
+              help='A ZIP of per-bill PDFs or a single merged PDF.')
+@click.option('--date', 'date_filter', default='all', help='today, week, month or all.')
+@click.option('--status', default='all', help='Payment status filter.')
+@click.option('--method', default='all', help='Payment method filter.')
+@click.option('--workers', default=STATEMENT_WORKERS, show_default=True, help='Render processes.')
+@click.option('--chunk-size', default=STATEMENT_CHUNK_SIZE, show_default=True, help='Bills per worker task.')
+def render_statements(output, output_format, date_filter, status, method, workers, chunk_size):
+    """Render billing statements for all matching bills into OUTPUT"""
+    started = time.perf_counter()
+    with reading_from_replicas():
+        bill_ids = statement_bill_ids(date_filter, status, method)
+        if output_format == 'pdf':
+            try:
+                write_merged_statements(bill_ids, output, workers, chunk_size)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        else:
+            write_statements_zip(bill_ids, output, workers, chunk_size)
+    click.echo(f"Rendered statements to {output} in {time.perf_counter() - started:.1f}s")
+
+@bp.cli.command('export')
+@click.argument('entity', type=click.Choice(list(EXPORT_ENTITIES)))
+@click.argument('output')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'parquet', 'arrow']), default='csv')
+@click.option('--date', 'date_filter', default='all', help='today, week, month or all.')
+@click.option('--status', default='all', help='Payment status filter.')
+@click.option('--method', default='all', help='Payment method filter.')
+@click.option('--incremental', is_flag=True, help='Only rows changed since the last incremental export.')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help='Rows fetched per round trip.')
+def export_entity(entity, output, output_format, date_filter, status, method, incremental, batch_size):
+    """Export bills, diagnoses, procedures or claims to OUTPUT for reconciliation"""
+    filters = {'date_filter': date_filter, 'status': status, 'method': method}
+    started = time.perf_counter()
+    if incremental:
+        # Stays on the primary, where the watermark it reads and advances lives
+        written = run_incremental_export(entity, output, output_format, batch_size, **filters)
+    else:
+        with reading_from_replicas():
+            if output_format == 'csv':
+                written = write_csv(entity, output, batch_size, **filters)
+            else:
+                written = write_columnar(entity, output, output_format, batch_size, **filters)
+    click.echo(f"Exported {written} {entity} rows to {output} in {time.perf_counter() - started:.1f}s")
+
+@bp.cli.command('claims-worker')
+@click.option('--batch-size', default=CLAIM_BATCH_SIZE, show_default=True, help='Claims leased per pass.')
+@click.option('--poll-interval', default=CLAIM_POLL_INTERVAL, show_default=True, help='Seconds to wait when the queue is empty.')
+@click.option('--once', is_flag=True, help='Process due claims once and exit.')
+def claims_worker(batch_size, poll_interval, once):
+    """Submit queued insurance claims to the clearinghouse in per-payer 837P batches"""
+    try:
+        clearinghouse = build_clearinghouse(current_app.config)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if once:
+        handled = process_claims(clearinghouse, batch_size)
+        click.echo(f"Processed {handled} claims: {claim_queue_stats.to_dict()}")
+        return
+    click.echo(f"Claims worker started (pid {os.getpid()})")
+    run_claim_worker(clearinghouse, batch_size, poll_interval)
+
+@bp.cli.command('send-mail')
+@click.option('--batch-size', default=MAIL_BATCH_SIZE, show_default=True, help='Messages leased per pass.')
+@click.option('--poll-interval', default=MAIL_POLL_INTERVAL, show_default=True, help='Seconds to wait when nothing is due.')
+@click.option('--once', is_flag=True, help='Send every due message once and exit.')
+def send_mail(batch_size, poll_interval, once):
+    """Send queued email, including retries that come due while no web request wakes a sender"""
+    mail_sender.batch_size = batch_size
+    mail_sender.poll_interval = poll_interval
+    if once:
+        click.echo(f"Sent mail: {mail_sender.send_backlog()} messages leased")
+        return
+    click.echo(f"Mail sender started (pid {os.getpid()})")
+    mail_sender.run()
+
+@bp.cli.command('verify-payments')
+@click.option('--batch-size', default=VERIFY_BATCH_SIZE, show_default=True, help='Transactions per provider call.')
+@click.option('--interval', default=VERIFY_INTERVAL, show_default=True, help='Seconds between passes.')
+@click.option('--once', is_flag=True, help='Run a single pass and exit.')
+def verify_payments(batch_size, interval, once):
+    """Confirm pending crypto payments against the chain provider"""
+    try:
+        chain_provider = build_chain_provider(current_app.config)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if once:
+        click.echo(f"Verified payments: {verify_pending_payments(chain_provider, batch_size)}")
+        return
+    click.echo(f"Payment verifier started (pid {os.getpid()})")
+    run_payment_verifier(chain_provider, batch_size, interval)
+
+@bp.cli.command('build-catalog')
+def build_catalog():
+    """Compile the configured ICD-10 and CPT sources into memory-mapped indexes"""
+    for system in CODE_SYSTEMS:
+        if not code_catalog.sources[system]:
+            click.echo(f"{CODE_LABELS[system]}: no source configured")
+            continue
+        started = time.perf_counter()
+        path = code_catalog.build(system)
+        click.echo(f"{CODE_LABELS[system]}: {path} ({time.perf_counter() - started:.2f}s)")
 
-@app.template_filter('status_badge')
+@bp.cli.command('rebuild-rollups')
+@click.option('--start', 'start_day', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First day (default: oldest row).')
+@click.option('--end', 'end_day', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day (default: newest row).')
+@click.option('--chunk-days', default=ROLLUP_REBUILD_CHUNK_DAYS, show_default=True, help='Days per transaction.')
+def rebuild_dashboard_rollups(start_day, end_day, chunk_days):
+    """Rebuild the daily bill and claim rollups from the source tables"""
+    written = 0
+    for chunk_start, chunk_end, rows in rebuild_rollups(
+        start_day.date() if start_day else None, end_day.date() if end_day else None, chunk_days
+    ):
+        written += rows
+        click.echo(f"{chunk_start} .. {chunk_end}: {rows} rollup rows")
+    click.echo(f"Rebuilt {written} rollup rows")
+
+@bp.cli.command('archive-bills')
+@click.option('--older-than-days', type=int, default=None, help='Horizon (default: ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True, help='Bills per transaction.')
+def archive_settled_bills(older_than_days, batch_size):
+    """Move settled bills older than the horizon to the archive tables"""
+    days = older_than_days if older_than_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    before = archive_horizon(days)
+    archived = 0
+    for last_created_at, last_id, rows in archive_bills(before, batch_size):
+        archived += rows
+        click.echo(f"Archived bills up to {last_created_at:%Y-%m-%d} (id {last_id}, {archived} so far)")
+    click.echo(f"Archived {archived} bills created before {before:%Y-%m-%d}")
+
+@bp.cli.command('recompute-totals')
+@click.option('--chunk-size', default=RECOMPUTE_CHUNK_SIZE, show_default=True, help='Bills per transaction.')
+@click.option('--start-id', type=int, default=None, help='Resume from this bill id.')
+def recompute_totals(chunk_size, start_id):
+    """Recompute stored bill subtotals and totals from their line items"""
+    updated = 0
+    for last_id, rows in recompute_bill_totals(chunk_size, start_id):
+        updated += rows
+        click.echo(f"Recomputed bills up to id {last_id} ({updated} updated)")
+
+@bp.app_template_filter('status_badge')
 def status_badge(status):
     badges = {
         'pending': 'warning',
@@ -339,5 +1017,64 @@ def status_badge(status):
     }
     return badges.get(status, 'secondary')
 
+@bp.cli.command('record-rates')
+@click.option('--static', 'use_static', is_flag=True, help='Record the built-in fallback table instead of live rates.')
+@click.option('--at', type=click.DateTime(), default=None, help='Effective time (default: now); e.g. to seed history.')
+def record_exchange_rates(use_static, at):
+    """Append the current exchange rates to the rate history where they changed"""
+    rates = STATIC_EXCHANGE_RATES if use_static else get_live_exchange_rates()
+    if rates is None:
+        raise click.ClickException("Live exchange rates are unavailable")
+    added = record_rates(rates, 'static' if use_static else 'exchangerate-api', at)
+    click.echo(f"Recorded {added} changed rate(s) of {len(rates)}")
+
+@bp.cli.command('revalue-payments')
+@click.argument('output')
+@click.option('--currency', 'target', default=BASE_CURRENCY, show_default=True, help='Reporting currency.')
+@click.option('--at', 'revalue_at', type=click.DateTime(), default=None,
+              help='Also revalue at this date and report the FX difference.')
+@click.option('--format', 'output_format', type=click.Choice(REVALUATION_FORMATS), default='parquet')
+@click.option('--date', 'date_filter', default='all', help='today, week, month or all.')
+@click.option('--status', default='paid', show_default=True, help='Payment status filter.')
+@click.option('--batch-size', default=CONVERSION_BATCH_SIZE, show_default=True, help='Payments per batch.')
+def revalue_payments_command(output, target, revalue_at, output_format, date_filter, status, batch_size):
+    """Value every bank payment in a reporting currency at its bill date into OUTPUT"""
+    started = time.perf_counter()
+    try:
+        with reading_from_replicas():
+            written = write_revaluation(output, output_format, target, revalue_at, batch_size,
+                                        date_filter=date_filter, status=status)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Revalued {written} payments into {target.upper()} in {output} in {time.perf_counter() - started:.1f}s")
+
+@bp.cli.command('refresh-replicas')
+def refresh_replicas():
+    """Copy the SQLite primary into the SQLite replicas (local testing of replica routing)"""
+    try:
+        refreshed = refresh_sqlite_replicas(db)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Refreshed {len(refreshed)} replica(s): {', '.join(refreshed) or '-'}")
+
+@bp.cli.command('init-db')
+def init_db():
+    """Create any missing tables and upgrade existing ones (run once per deploy, before starting workers)"""
+    db.create_all()
+    for step in upgrade_schema():
+        click.echo(step)
+    # Name search indexes on PostgreSQL (and any index added to an existing table)
+    create_search_indexes()
+    filled = backfill_transaction_hashes()
+    if filled:
+        click.echo(f"Filled transaction hashes of {filled} archived bills")
+    click.echo("Database tables created")
+
+@bp.cli.command('create-search-indexes')
+def create_search_indexes_command():
+    """Create the search indexes missing from an existing database"""
+    created = create_search_indexes()
+    click.echo(f"Created {', '.join(created)}" if created else "Search indexes already exist")
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
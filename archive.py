@@ -0,0 +1,234 @@
+"""Cold storage for settled bills.
+
+Paid bills older than a horizon (ARCHIVE_AFTER_DAYS) with no claim or email
+still in flight are moved, in chunks of one transaction each, from the hot
+bill/diagnosis/procedure/insurance_claim tables into bill_archive: one row
+per bill keeping the columns rollups.py groups by, plus the bill, its line
+items and claims as zlib-compressed JSON. The hot tables and their indexes
+then only hold recent and open work.
+
+On PostgreSQL bill_archive and insurance_claim_archive are range-partitioned
+by the bill's created_at month; the monthly partitions are created before a
+run. SQLite keeps each as one table. Reads by id fall back to the archive
+through load_archived_bill(), which returns a detached copy of the bill that
+the detail serializers and the PDF renderer accept like a loaded Bill.
+"""
+import json
+import logging
+import zlib
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from sqlalchemy import select, insert, update, delete, exists, func, text, tuple_
+from models import db, Bill, Diagnosis, Procedure, InsuranceClaim, OutboundEmail, BillArchive, ClaimArchive
+
+logger = logging.getLogger(__name__)
+
+# Archive settings
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 1000  # bills per transaction
+ARCHIVE_COMPRESSION_LEVEL = 6
+
+# Only settled bills leave the hot tables
+ARCHIVE_PAYMENT_STATUSES = ('paid',)
+OPEN_CLAIM_STATUSES = ('queued', 'submitting')
+OPEN_EMAIL_STATUSES = ('queued', 'sending')
+
+# Archived children, in payload order
+ARCHIVE_CHILDREN = (('diagnoses', Diagnosis), ('procedures', Procedure), ('claims', InsuranceClaim))
+PARTITIONED_TABLES = (BillArchive.__tablename__, ClaimArchive.__tablename__)
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def _decode(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is Decimal:
+        return Decimal(value)
+    return value
+
+def _pack(row, skip=()):
+    return {name: _encode(value) for name, value in row.items() if value is not None and name not in skip}
+
+def _unpack(model, values, **extra):
+    fields = {column.name: _decode(column, values.get(column.name)) for column in model.__table__.columns}
+    return SimpleNamespace(**{**fields, **extra})
+
+def compress_bill(bill, children):
+    """Archive payload for a bill row and its {name: [child rows]}"""
+    document = {'bill': _pack(bill)}
+    for name, _ in ARCHIVE_CHILDREN:
+        document[name] = [_pack(row, skip=('bill_id',)) for row in children.get(name, ())]
+    encoded = json.dumps(document, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return zlib.compress(encoded, ARCHIVE_COMPRESSION_LEVEL)
+
+def restore_bill(payload):
+    """Detached copy of an archived bill with diagnoses, procedures and claims"""
+    document = json.loads(zlib.decompress(payload))
+    bill = _unpack(Bill, document['bill'])
+    for name, model in ARCHIVE_CHILDREN:
+        setattr(bill, name, [_unpack(model, values, bill_id=bill.id) for values in document[name]])
+    return bill
+
+def load_archived_bill(bill_id):
+    """An archived bill by id (see restore_bill), or None"""
+    payload = db.session.scalar(select(BillArchive.payload).where(BillArchive.id == bill_id))
+    return restore_bill(payload) if payload is not None else None
+
+def backfill_transaction_hashes(batch_size=ARCHIVE_BATCH_SIZE):
+    """Copy transaction hashes out of the payloads of crypto bills archived before the column existed"""
+    filled, last_id = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(BillArchive.id, BillArchive.created_at, BillArchive.payload)
+            .where(BillArchive.payment_method == 'crypto', BillArchive.transaction_hash.is_(None),
+                   BillArchive.id > last_id)
+            .order_by(BillArchive.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            db.session.rollback()
+            return filled
+        for row in rows:
+            tx_hash = restore_bill(row.payload).transaction_hash
+            if tx_hash:
+                db.session.execute(
+                    update(BillArchive)
+                    .where(BillArchive.id == row.id, BillArchive.created_at == row.created_at)
+                    .values(transaction_hash=tx_hash)
+                )
+                filled += 1
+        db.session.commit()
+        last_id = rows[-1].id
+
+def _months(start, end):
+    month, end = date(start.year, start.month, 1), date(end.year, end.month, end.day)
+    while month <= end:
+        following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        yield month, following
+        month = following
+
+def ensure_partitions(connection, start, end):
+    """Create the monthly archive partitions covering start..end (PostgreSQL only); returns their names"""
+    if connection.dialect.name != 'postgresql':
+        return []
+    created = []
+    for month, following in _months(start, end):
+        for table in PARTITIONED_TABLES:
+            name = f"{table}_{month:%Y_%m}"
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+            ))
+            created.append(name)
+    return created
+
+def archivable(before):
+    """WHERE clause for bills that may be archived"""
+    open_claims = exists().where(InsuranceClaim.bill_id == Bill.id, InsuranceClaim.status.in_(OPEN_CLAIM_STATUSES))
+    open_emails = exists().where(OutboundEmail.bill_id == Bill.id, OutboundEmail.status.in_(OPEN_EMAIL_STATUSES))
+    return (
+        Bill.payment_status.in_(ARCHIVE_PAYMENT_STATUSES),
+        Bill.created_at < before,
+        ~open_claims,
+        ~open_emails,
+    )
+
+def _archive_row(bill, payload):
+    currency = bill['bank_currency'] if bill['payment_method'] == 'bank' else bill['payment_currency']
+    return {
+        'id': bill['id'],
+        'created_at': bill['created_at'],
+        'payment_status': bill['payment_status'],
+        'payment_method': bill['payment_method'],
+        'currency': currency,
+        'insurance_provider': bill['insurance_provider'],
+        'total_amount': bill['total_amount'],
+        'transaction_hash': bill['transaction_hash'],
+        'archived_at': datetime.utcnow(),
+        'payload': payload,
+    }
+
+def archive_chunk(connection, ids):
+    """Move the given bills and their children to the archive; returns the number of bills moved.
+
+    Deletes are Core statements, so the rollup hooks leave the daily rollups
+    as they are: archived bills still count in the dashboard history.
+    """
+    bills = connection.execute(select(Bill.__table__).where(Bill.id.in_(ids))).mappings().all()
+    if not bills:
+        return 0
+    children = defaultdict(lambda: defaultdict(list))
+    for name, model in ARCHIVE_CHILDREN:
+        for row in connection.execute(
+                select(model.__table__).where(model.bill_id.in_(ids)).order_by(model.id)).mappings():
+            children[row['bill_id']][name].append(row)
+
+    connection.execute(insert(BillArchive), [
+        _archive_row(bill, compress_bill(bill, children[bill['id']])) for bill in bills
+    ])
+    created = {bill['id']: bill['created_at'] for bill in bills}
+    claims = [
+        {'id': claim['id'], 'bill_created_at': created[bill_id], 'bill_id': bill_id,
+         'payer_id': claim['payer_id'], 'payer_name': claim['payer_name'], 'status': claim['status'],
+         'queued_at': claim['queued_at'], 'submitted_at': claim['submitted_at']}
+        for bill_id, rows in children.items() for claim in rows['claims']
+    ]
+    if claims:
+        connection.execute(insert(ClaimArchive), claims)
+
+    # Sent mail keeps its history, without the link to the hot row
+    connection.execute(update(OutboundEmail).where(OutboundEmail.bill_id.in_(ids)).values(bill_id=None))
+    for _, model in ARCHIVE_CHILDREN:
+        connection.execute(delete(model).where(model.bill_id.in_(ids)))
+    connection.execute(delete(Bill).where(Bill.id.in_(ids)))
+    return len(bills)
+
+def archive_bills(before, batch_size=ARCHIVE_BATCH_SIZE):
+    """Archive job: move bills matching archivable(before) to the archive, a chunk per transaction.
+
+    Chunks follow (created_at, id) on ix_bill_status_created_at_id and each
+    is committed on its own, so the job can be stopped and simply run again.
+    Candidates are read FOR UPDATE SKIP LOCKED, leaving rows other workers
+    hold alone on PostgreSQL. Yields (last_created_at, last_id, archived)
+    after each chunk.
+    """
+    conditions = archivable(before)
+    oldest = db.session.scalar(select(func.min(Bill.created_at)).where(*conditions))
+    if oldest is None:
+        db.session.rollback()
+        return
+    with db.engine.begin() as connection:
+        ensure_partitions(connection, oldest, before)
+
+    cursor = None
+    while True:
+        stmt = select(Bill.id, Bill.created_at).where(*conditions)
+        if cursor is not None:
+            stmt = stmt.where(tuple_(Bill.created_at, Bill.id) > cursor)
+        rows = db.session.execute(
+            stmt.order_by(Bill.created_at, Bill.id).limit(batch_size).with_for_update(skip_locked=True)
+        ).all()
+        if not rows:
+            db.session.rollback()
+            return
+        archived = archive_chunk(db.session.connection(), [row.id for row in rows])
+        db.session.commit()
+        cursor = (rows[-1].created_at, rows[-1].id)
+        logger.info(f"Archived {archived} bills up to {cursor[0]} (id {cursor[1]})")
+        yield cursor[0], cursor[1], archived
+
+def archive_horizon(days=ARCHIVE_AFTER_DAYS, now=None):
+    """Cut-off for bills archived after `days`"""
+    return (now or datetime.utcnow()) - timedelta(days=days)
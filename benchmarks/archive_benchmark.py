@@ -0,0 +1,134 @@
+"""Archive benchmark: hot table size, archive throughput and reads by id.
+
+Seeds its own database (archiving removes bills, so the shared benchmark
+database is left alone), then:
+
+- measures the hot tables and their indexes (dbstat on SQLite,
+  pg_total_relation_size on PostgreSQL) before and after archiving
+- archives bills older than --older-than-days with archive.archive_bills()
+  and reports bills per second and the payload compression ratio
+- times reading a bill by id as the detail view and PDF download do, for
+  bills still in the hot tables and for archived ones
+
+    python benchmarks/archive_benchmark.py --bills 1000000 --older-than-days 90 --output results/archive.json
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from results import summarize, write_results
+from seed_dataset import ensure_dataset, use_database
+
+DEFAULT_DATABASE = os.path.join(tempfile.gettempdir(), 'healthbillpay-archive-bench.db')
+HOT_TABLES = ('bill', 'diagnosis', 'procedure', 'insurance_claim')
+
+def hot_table_bytes():
+    """{table: bytes of the table and its indexes}, or None when the database cannot tell"""
+    from sqlalchemy import inspect, text
+    from models import db
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return {table: db.session.execute(text('SELECT pg_total_relation_size(:t)'), {'t': table}).scalar()
+                for table in HOT_TABLES}
+    if dialect != 'sqlite':
+        return None
+    inspector = inspect(db.engine)
+    sizes = dict(db.session.execute(text('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')).all())
+    return {
+        table: sizes.get(table, 0) + sum(sizes.get(index['name'], 0) for index in inspector.get_indexes(table))
+        for table in HOT_TABLES
+    }
+
+def time_reads(ids, load):
+    from models import db
+    samples = []
+    for bill_id in ids:
+        started = time.perf_counter()
+        if load(bill_id) is None:
+            raise SystemExit(f"bill {bill_id} not found")
+        samples.append(time.perf_counter() - started)
+        db.session.rollback()
+    return summarize(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bills', type=int, default=100000, help='Bills to seed when the database is empty.')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite file when DATABASE_URL is unset.')
+    parser.add_argument('--older-than-days', type=int, default=90, help='Archive horizon.')
+    parser.add_argument('--batch-size', type=int, default=None, help='Bills per archive transaction.')
+    parser.add_argument('--reads', type=int, default=1000, help='Reads by id per kind.')
+    parser.add_argument('--output', help="Write results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+
+    use_database(args.database)
+    from sqlalchemy import func, select
+    from app import create_app
+    from archive import ARCHIVE_BATCH_SIZE, archive_bills, archive_horizon, load_archived_bill
+    from models import db, Bill, BillArchive, bill_query
+    from pdf_generator import load_bill_for_pdf
+
+    app = create_app()
+    rng = random.Random(23)
+    results = {}
+    with app.app_context():
+        bills = ensure_dataset(args.bills)
+        dialect = db.engine.dialect.name
+        results['hot_bytes_before'] = hot_table_bytes()
+
+        started = time.perf_counter()
+        archived = sum(rows for *_, rows in archive_bills(archive_horizon(args.older_than_days),
+                                                          args.batch_size or ARCHIVE_BATCH_SIZE))
+        seconds = time.perf_counter() - started
+        results['archive'] = {'bills': archived, 'seconds': round(seconds, 3),
+                              'per_second': round(archived / seconds, 1) if seconds else None}
+        if dialect == 'sqlite':
+            db.session.execute(db.text('VACUUM'))
+        results['hot_bytes_after'] = hot_table_bytes()
+
+        archive_ids = db.session.scalars(select(BillArchive.id)).all()
+        hot_ids = db.session.scalars(select(Bill.id)).all()
+        compressed = db.session.scalar(select(func.sum(func.length(BillArchive.payload)))) or 0
+        sample = rng.sample(archive_ids, min(len(archive_ids), args.reads))
+        raw = sum(len(zlib.decompress(payload)) for payload in db.session.scalars(
+            select(BillArchive.payload).where(BillArchive.id.in_(sample))))
+        sampled = sum(len(payload) for payload in db.session.scalars(
+            select(BillArchive.payload).where(BillArchive.id.in_(sample))))
+        results['payload'] = {
+            'bytes_per_bill': round(compressed / len(archive_ids), 1) if archive_ids else None,
+            'compression_ratio': round(raw / sampled, 2) if sampled else None,
+        }
+        db.session.rollback()
+
+        hot_sample = rng.sample(hot_ids, min(len(hot_ids), args.reads))
+        if hot_sample:
+            results['detail_hot'] = time_reads(hot_sample, lambda i: bill_query('detail').filter(Bill.id == i).first())
+            results['pdf_hot'] = time_reads(hot_sample, load_bill_for_pdf)
+        if sample:
+            results['detail_archived'] = time_reads(sample, load_archived_bill)
+            results['pdf_archived'] = time_reads(sample, load_bill_for_pdf)
+
+    print(f"{bills} bills on {dialect}; archived {archived} in {results['archive']['seconds']:.2f}s "
+          f"({results['archive']['per_second'] or 0:.0f}/s)")
+    before, after = results['hot_bytes_before'], results['hot_bytes_after']
+    if before and after:
+        for table in HOT_TABLES:
+            print(f"{table:<18} {before[table] / 1e6:>9.1f} MB -> {after[table] / 1e6:>9.1f} MB")
+    print(f"payload {results['payload']['bytes_per_bill']} bytes/bill, "
+          f"compression {results['payload']['compression_ratio']}x")
+    print(f"{'read':<18} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name in ('detail_hot', 'detail_archived', 'pdf_hot', 'pdf_archived'):
+        if name in results:
+            result = results[name]
+            print(f"{name:<18} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['max_ms']:>8.2f}")
+    if args.output:
+        write_results(args.output, 'archive', {**vars(args), 'bills': bills, 'dialect': dialect}, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Code catalog benchmark.
+
+Builds the ICD-10 and CPT indexes (from the real source files, or a
+synthetic ICD-10-CM sized set when none are given), then reports build and
+per-process open time, lookup/prefix/keyword latency, bulk validation
+throughput and the memory each worker process adds (RSS includes the
+shared page cache; private is what the worker alone holds), next to a plain
+dict-loaded catalog for comparison. Memory figures come from /proc, so they
+are Linux only:
+
+    python benchmarks/catalog_benchmark.py --codes 72000 --workers 4
+    python benchmarks/catalog_benchmark.py --icd10 icd10cm-codes-2025.txt --fee-schedule fees.csv
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from catalog import CodeCatalog, CodeIndex, SOURCE_READERS, tokenize
+
+def write_synthetic_sources(workdir, codes, procedures):
+    rng = random.Random(15)
+    syllables = ['ab', 'ac', 'al', 'an', 'ar', 'card', 'derm', 'en', 'gas', 'hep', 'is', 'my', 'neph',
+                 'neur', 'or', 'os', 'path', 'pulm', 'ren', 'sis', 'tis', 'tro', 'ul', 'vas']
+    vocabulary = sorted({''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(6000)})
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    def description(words):
+        return ' '.join(rng.choices(vocabulary, weights, k=words)).capitalize()
+
+    icd10_path = os.path.join(workdir, 'icd10cm-codes.txt')
+    seen = set()
+    with open(icd10_path, 'w') as f:
+        while len(seen) < codes:
+            code = f"{rng.choice('ABCDEFGHIJKLMNOPQRSTVWXYZ')}{rng.randint(0, 99):02d}{rng.randint(0, 9999):0{rng.randint(0, 4)}d}"[:7]
+            if code not in seen:
+                seen.add(code)
+                f.write(f"{code:<8}{description(rng.randint(4, 14))}\n")
+
+    fee_path = os.path.join(workdir, 'fee-schedule.csv')
+    with open(fee_path, 'w') as f:
+        f.write('cpt_code,description,amount\n')
+        for code in rng.sample(range(10000, 100000), procedures):
+            f.write(f"{code},{description(rng.randint(3, 8))},{rng.randint(1000, 90000) / 100:.2f}\n")
+    return icd10_path, fee_path
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+def time_queries(fn, queries):
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        fn(query)
+        samples.append((time.perf_counter() - started) * 1e6)
+    return percentiles(samples)
+
+def memory_kb():
+    """(RSS, private) memory of this process in kB"""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                fields[name] = int(value.split()[0])
+    return fields['Rss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+def load_dict_catalog(icd10_path):
+    """The naive alternative: every record and posting list as Python objects"""
+    records, postings = {}, {}
+    for code, description, price in SOURCE_READERS['icd10'](icd10_path):
+        records[code] = (description, price)
+        for token in set(tokenize(description)):
+            postings.setdefault(token, []).append(code)
+    return records, postings
+
+def worker(mode, index_path, icd10_path, results, ready, release):
+    before = memory_kb()
+    started = time.perf_counter()
+    if mode == 'mmap':
+        index = CodeIndex(index_path, 'icd10')
+        for number in range(len(index)):  # touch every record page
+            index.entry(number)
+    else:
+        catalog = load_dict_catalog(icd10_path)
+    opened = time.perf_counter() - started
+    ready.put(None)
+    release.wait()  # hold the mapping while siblings measure, as live workers would
+    after = memory_kb()
+    results.put((mode, opened, [a - b for a, b in zip(after, before)]))
+
+def measure_workers(mode, count, index_path, icd10_path):
+    context = multiprocessing.get_context('fork')
+    results, ready, release = context.Queue(), context.Queue(), context.Event()
+    processes = [context.Process(target=worker, args=(mode, index_path, icd10_path, results, ready, release))
+                 for _ in range(count)]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get()
+    release.set()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--icd10', help='CMS icd10cm-codes file (synthetic when omitted).')
+    parser.add_argument('--fee-schedule', help='CPT fee schedule CSV (synthetic when omitted).')
+    parser.add_argument('--codes', type=int, default=72000, help='Synthetic ICD-10 codes.')
+    parser.add_argument('--procedures', type=int, default=10000, help='Synthetic CPT codes.')
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4, help='Processes for the memory comparison.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='catalog-bench-')
+    icd10_path, fee_path = args.icd10, args.fee_schedule
+    if not (icd10_path and fee_path):
+        synthetic = write_synthetic_sources(workdir, args.codes, args.procedures)
+        icd10_path, fee_path = icd10_path or synthetic[0], fee_path or synthetic[1]
+
+    catalog = CodeCatalog({'icd10': icd10_path, 'cpt': fee_path}, os.path.join(workdir, 'cache'))
+    for system in ('icd10', 'cpt'):
+        started = time.perf_counter()
+        path = catalog.build(system)
+        print(f"build {system:<6} {time.perf_counter() - started:8.2f} s  {os.path.getsize(path) / 1e6:6.1f} MB")
+
+    index_path = catalog.build('icd10')
+    started = time.perf_counter()
+    index = CodeIndex(index_path, 'icd10')
+    print(f"open icd10      {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+    rng = random.Random(1)
+    entries = [index.entry(rng.randrange(len(index))) for _ in range(args.queries)]
+    codes = [entry.code for entry in entries]
+    prefixes = [code[:rng.randint(1, 4)] for code in codes]
+    keywords = []
+    for entry in entries:
+        words = tokenize(entry.description)
+        picked = rng.sample(words, min(len(words), rng.randint(1, 3)))
+        picked[-1] = picked[-1][:rng.randint(2, len(picked[-1]))] if len(picked[-1]) > 2 else picked[-1]
+        keywords.append(' '.join(picked))
+
+    print(f"\n{'query':<16} {'p50 us':>10} {'p99 us':>10}")
+    for name, fn, queries in (('lookup', index.lookup, codes),
+                              ('code prefix', index.prefix, prefixes),
+                              ('keyword', index.search, keywords),
+                              ('autocomplete', index.autocomplete, keywords)):
+        p50, p99 = time_queries(fn, queries)
+        print(f"{name:<16} {p50:>10.1f} {p99:>10.1f}")
+
+    batch = codes + [f"Z{n:05d}X" for n in range(len(codes) // 10)]
+    started = time.perf_counter()
+    unknown = catalog.unknown_codes('icd10', batch)
+    elapsed = time.perf_counter() - started
+    print(f"\nbulk validation  {len(batch) / elapsed:10.0f} codes/s ({len(unknown)} unknown of {len(batch)})")
+
+    # load s includes decoding every record, so each worker faults in the whole index
+    print(f"\n{args.workers} workers  {'load s':>8} {'RSS MB':>8} {'private MB':>11}")
+    for mode in ('mmap', 'dict'):
+        rows = measure_workers(mode, args.workers, index_path, icd10_path)
+        opened = statistics.mean(row[1] for row in rows)
+        rss, private = (statistics.mean(row[2][i] for row in rows) / 1024 for i in range(2))
+        print(f"{mode:<10} {opened:>8.3f} {rss:>8.1f} {private:>11.1f}")
+
+if __name__ == '__main__':
+    main()
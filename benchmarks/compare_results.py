@@ -0,0 +1,73 @@
+"""Compare two benchmark result files and flag regressions.
+
+Matches every latency (``*_ms``, lower is better) and throughput
+(``per_second``, higher is better) figure in two JSON documents written by
+the suite, prints the change and exits 1 when any figure got worse by more
+than --threshold percent:
+
+    git checkout main && python benchmarks/micro_benchmark.py --output base.json
+    git checkout my-branch && python benchmarks/micro_benchmark.py --output head.json
+    python benchmarks/compare_results.py base.json head.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+def metrics(results, prefix=''):
+    """Flatten nested results into {'path.to.metric': value} for comparable figures"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(metrics(value, f"{path}."))
+        elif isinstance(value, (int, float)) and (key.endswith('_ms') or key == 'per_second'):
+            flat[path] = value
+    return flat
+
+def change(name, base, head):
+    """Relative change in percent, positive when head is worse"""
+    if not base:
+        return 0.0
+    delta = (head - base) / base * 100
+    return -delta if name.endswith('per_second') else delta
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent worse that counts as a regression.')
+    parser.add_argument('--metric', action='append',
+                        help='Only compare figures ending in this name (e.g. p95_ms); repeatable.')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    if base['benchmark'] != head['benchmark']:
+        parser.error(f"cannot compare a {base['benchmark']} run with a {head['benchmark']} run")
+    print(f"{base['benchmark']}: {(base['commit'] or '?')[:10]} -> {(head['commit'] or '?')[:10]}"
+          f"{' (dirty)' if head.get('dirty') else ''}")
+
+    def selected(figures):
+        return {name: value for name, value in figures.items()
+                if not args.metric or any(name.endswith(metric) for metric in args.metric)}
+
+    base_metrics, head_metrics = selected(metrics(base['results'])), selected(metrics(head['results']))
+    regressions = 0
+    print(f"{'metric':<44} {'base':>10} {'head':>10} {'worse %':>8}")
+    for name in sorted(base_metrics.keys() & head_metrics.keys()):
+        worse = change(name, base_metrics[name], head_metrics[name])
+        flag = ''
+        if worse > args.threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print(f"{name:<44} {base_metrics[name]:>10.3f} {head_metrics[name]:>10.3f} {worse:>+8.1f}{flag}")
+    for name in sorted(base_metrics.keys() ^ head_metrics.keys()):
+        print(f"{name:<44} only in {'base' if name in base_metrics else 'head'}")
+
+    print(f"{regressions} regression(s) beyond {args.threshold:g}%")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""Status contention benchmark: many concurrent writers on the same bills.
+
+Seeds --bills pending bills in a throwaway SQLite database (or DATABASE_URL
+when set; use PostgreSQL to see row-level concurrency) and runs
+--writers-per-bill threads against each bill for --duration seconds, each
+thread with its own session, mixing:
+
+- submit: the payment submission /verify_payment makes (new payment details,
+  status pending) with an idempotency key; --duplicate-rate of submissions
+  resend a key the bill has already seen, as a double-click or a client
+  retry does, often while the first request is still in flight
+- conditional: read the bill's version, then submit with it as If-Match
+- verifier: the payment verifier's set-based pending -> failed
+
+Reports operations and applied transitions per second, idempotent replays,
+If-Match conflicts, writers that gave up after TRANSITION_RETRIES lost
+races, and database errors: lock timeouts (SQLite's busy timeout running
+out while writers queue for its single write lock) and deadlocks. Afterwards
+every bill's version must equal 1 + its transition log rows, its status the
+last logged one, and the dashboard rollups what a rebuild computes.
+
+    python benchmarks/contention_benchmark.py --bills 8 --writers-per-bill 16 --duration 10 --output results/contention.json
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from results import summarize, write_results
+
+OPERATIONS = (('submit', 70), ('conditional', 15), ('verifier', 15))
+
+def seed_bills(count):
+    from sqlalchemy import insert
+    from models import db, Bill
+    from rollups import BILL_ROLLUP, apply_rollup_changes
+    now = datetime.utcnow()
+    rows = [{
+        'patient_name': f"Patient {i}",
+        'patient_dob': date(1980, 1, 1),
+        'email': f"patient{i}@example.com",
+        'created_at': now,
+        'updated_at': now,
+        'payment_status': 'pending',
+        'payment_method': 'bank',
+        'bank_currency': 'USD',
+        'diagnoses_subtotal': 0,
+        'procedures_subtotal': 0,
+        'total_amount': 100,
+    } for i in range(count)]
+    ids = db.session.scalars(insert(Bill).returning(Bill.id, sort_by_parameter_order=True), rows).all()
+    apply_rollup_changes(db.session.connection(), BILL_ROLLUP, {}, ids)
+    db.session.commit()
+    return ids
+
+def run_operation(name, bill_id, rng, keys, duplicate_rate):
+    """Run one operation in the current session and commit; returns its outcome"""
+    from sqlalchemy import select
+    from models import db, Bill
+    from payment_state import transition, transition_many
+    if name == 'verifier':
+        moved = transition_many([bill_id], 'payment', 'pending', 'failed', source='benchmark')
+        db.session.commit()
+        return 'applied' if moved else 'unchanged'
+
+    details = {'bank_name': f"Bank {rng.randint(1, 1000)}", 'account_number': str(rng.getrandbits(32)),
+               'routing_number': '021000021'}
+    if name == 'conditional':
+        version = db.session.scalar(select(Bill.version).where(Bill.id == bill_id))
+        change = transition(bill_id, 'payment', 'pending', details, expected_version=version, source='benchmark')
+    else:
+        seen = keys[bill_id]
+        if seen and rng.random() < duplicate_rate:
+            key = rng.choice(seen)
+        else:
+            key = uuid.uuid4().hex
+            seen.append(key)
+        change = transition(bill_id, 'payment', 'pending', details, idempotency_key=key, source='benchmark')
+    db.session.commit()
+    return 'replayed' if change.replayed else 'applied'
+
+def writer(app, bill_id, seed, deadline, keys, duplicate_rate, records):
+    from sqlalchemy.exc import DBAPIError
+    from models import db
+    from payment_state import InvalidTransition, VersionConflict
+    rng = random.Random(seed)
+    names, weights = zip(*OPERATIONS)
+    samples, counts = [], Counter()
+    with app.app_context():
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                outcome = run_operation(name, bill_id, rng, keys, duplicate_rate)
+            except VersionConflict:
+                outcome = 'conflict' if name == 'conditional' else 'gave_up'
+            except InvalidTransition:
+                outcome = 'invalid'
+            except DBAPIError as e:
+                message = str(e).lower()
+                if 'deadlock' in message:
+                    outcome = 'deadlock'
+                elif 'locked' in message or 'lock timeout' in message:
+                    outcome = 'lock_timeout'  # SQLite's busy timeout: one writer at a time
+                else:
+                    outcome = 'db_error'
+            if outcome not in ('applied', 'replayed', 'unchanged'):
+                db.session.rollback()
+            samples.append(time.perf_counter() - started)
+            counts[f"{name}_{outcome}"] += 1
+            counts[outcome] += 1
+        db.session.remove()
+    records.append((samples, counts))
+
+def check_consistency(bill_ids):
+    """{check: passed} for versions, final statuses, idempotency keys and rollups against the log"""
+    from sqlalchemy import func, select
+    from models import db, Bill, DailyBillRollup, StatusTransition
+    from rollups import rebuild_rollups
+    bills = {row.id: row for row in db.session.execute(
+        select(Bill.id, Bill.version, Bill.payment_status).where(Bill.id.in_(bill_ids)))}
+    logged = dict(db.session.execute(
+        select(StatusTransition.bill_id, func.count()).group_by(StatusTransition.bill_id)).all())
+    last = {}
+    for bill_id, to_status in db.session.execute(
+            select(StatusTransition.bill_id, StatusTransition.to_status).order_by(StatusTransition.id)):
+        last[bill_id] = to_status
+    duplicate_keys = db.session.scalar(select(func.count()).select_from(
+        select(StatusTransition.idempotency_key)
+        .where(StatusTransition.idempotency_key.isnot(None))
+        .group_by(StatusTransition.idempotency_key)
+        .having(func.count() > 1)
+        .subquery()))
+
+    rollup = select(DailyBillRollup).where(DailyBillRollup.bill_count != 0)
+    def rollup_rows():
+        return {(r.day, r.payment_status, r.payment_method, r.currency, r.insurer, r.bill_count, r.total_amount)
+                for r in db.session.scalars(rollup)}
+    maintained = rollup_rows()
+    db.session.rollback()
+    for _ in rebuild_rollups():
+        pass
+    return {
+        'versions_match_log': all(bill.version == 1 + logged.get(bill.id, 0) for bill in bills.values()),
+        'statuses_match_log': all(bill.payment_status == last.get(bill.id, 'pending') for bill in bills.values()),
+        'unique_idempotency_keys': duplicate_keys == 0,
+        'rollups_match_rebuild': maintained == rollup_rows(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bills', type=int, default=8, help='Bills written concurrently.')
+    parser.add_argument('--writers-per-bill', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds of load.')
+    parser.add_argument('--duplicate-rate', type=float, default=0.3, help='Share of submissions resending a key.')
+    parser.add_argument('--output', help="Write results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+
+    threads = args.bills * args.writers_per_bill
+    if 'DATABASE_URL' not in os.environ:
+        workdir = tempfile.mkdtemp(prefix='contention-bench-')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    # One connection per writer, so the pool is not what they queue on
+    os.environ.setdefault('DB_POOL_SIZE', str(threads))
+
+    from app import create_app
+    from models import db
+    from payment_state import TRANSITION_RETRIES
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        bill_ids = seed_bills(args.bills)
+        dialect = db.engine.dialect.name
+
+    keys = {bill_id: [] for bill_id in bill_ids}
+    records = []
+    deadline = time.perf_counter() + args.duration
+    workers = [
+        threading.Thread(target=writer, args=(app, bill_id, index * 1000 + n, deadline, keys,
+                                              args.duplicate_rate, records))
+        for index, bill_id in enumerate(bill_ids) for n in range(args.writers_per_bill)
+    ]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = [sample for thread_samples, _ in records for sample in thread_samples]
+    counts = sum((thread_counts for _, thread_counts in records), Counter())
+    with app.app_context():
+        checks = check_consistency(bill_ids)
+    results = {
+        'operations': summarize(samples, elapsed),
+        'transitions_per_second': round(counts['applied'] / elapsed, 1),
+        'counts': dict(sorted(counts.items())),
+        'checks': checks,
+    }
+
+    print(f"{args.bills} bills x {args.writers_per_bill} writers on {dialect}, {elapsed:.1f}s, "
+          f"compare-and-set retries per transition: {TRANSITION_RETRIES}")
+    operations = results['operations']
+    print(f"{operations['count']} operations ({operations.get('per_second', 0):.0f}/s), "
+          f"{counts['applied']} transitions ({results['transitions_per_second']:.0f}/s); "
+          f"p50 {operations.get('p50_ms', 0):.2f} ms, p99 {operations.get('p99_ms', 0):.2f} ms")
+    for outcome in ('replayed', 'conflict', 'unchanged', 'gave_up', 'invalid', 'lock_timeout', 'deadlock', 'db_error'):
+        print(f"{outcome:<12} {counts[outcome]:>8}")
+    for check, passed in checks.items():
+        print(f"{check:<24} {'ok' if passed else 'FAILED'}")
+    if args.output:
+        write_results(args.output, 'contention', {**vars(args), 'dialect': dialect}, results)
+    if counts['deadlock'] or not all(checks.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Currency revaluation benchmark: per-row conversion against the set-based engine.
+
+Values the seeded dataset's bank payments in a reporting currency at each
+bill's created_at, three ways:
+
+- per_row_queries: one rate query per payment and currency, Decimal math in
+  Python (what ad hoc conversion code does); run on --per-row-limit payments
+- per_row_python: the whole rate history loaded into memory, a bisect and
+  Decimal math per payment
+- set_based: currency.revalue_payments(), rates joined in SQL and the math
+  done on Arrow decimal columns (and set_based_revalue, which also revalues
+  at today's rates)
+
+and checks that all of them produce the same cents:
+
+    python benchmarks/currency_benchmark.py --currency GBP --output results/currency.json
+"""
+import argparse
+import bisect
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from results import write_results
+from seed_dataset import DEFAULT_DATABASE, ensure_dataset, seed_rates, use_database
+
+CENTS = Decimal('0.01')
+
+def throughput(rows, seconds):
+    return {'rows': rows, 'seconds': round(seconds, 3), 'per_second': round(rows / seconds, 1) if seconds else None}
+
+def bank_payments(limit=None):
+    from sqlalchemy import select
+    from models import db, Bill, filter_bills
+    stmt = filter_bills(select(Bill.id, Bill.created_at, Bill.bank_currency, Bill.total_amount, Bill.bank_exchange_rate)
+                        .where(Bill.bank_currency.isnot(None)), status='paid', method='bank').order_by(Bill.id)
+    return db.session.execute(stmt.limit(limit) if limit else stmt).all()
+
+def per_row_queries(target, limit):
+    """Two rate lookups per payment, as a loop over ORM rows would do them"""
+    from sqlalchemy import select
+    from models import db, ExchangeRate
+
+    def rate(currency, at):
+        if currency == 'USD':
+            return Decimal(1)
+        value = db.session.execute(
+            select(ExchangeRate.rate).where(ExchangeRate.currency == currency, ExchangeRate.effective_at <= at)
+            .order_by(ExchangeRate.effective_at.desc()).limit(1)
+        ).scalar()
+        if value is None:
+            value = db.session.execute(
+                select(ExchangeRate.rate).where(ExchangeRate.currency == currency)
+                .order_by(ExchangeRate.effective_at).limit(1)
+            ).scalar()
+        return value
+
+    values = {}
+    for bill_id, created_at, currency, amount, _stored in bank_payments(limit):
+        target_rate = rate(target, created_at)
+        rate(currency, created_at)
+        values[bill_id] = (amount * target_rate).quantize(CENTS)
+    return values
+
+def per_row_python(target):
+    """The rate history in memory, one bisect and Decimal multiply per payment"""
+    from models import db, ExchangeRate
+    history = defaultdict(lambda: ([], []))
+    for currency, effective_at, rate in db.session.query(
+            ExchangeRate.currency, ExchangeRate.effective_at, ExchangeRate.rate).order_by(ExchangeRate.effective_at):
+        history[currency][0].append(effective_at)
+        history[currency][1].append(rate)
+
+    def rate(currency, at):
+        if currency == 'USD':
+            return Decimal(1)
+        times, rates = history[currency]
+        return rates[max(bisect.bisect_right(times, at) - 1, 0)]
+
+    values = {}
+    for bill_id, created_at, currency, amount, _stored in bank_payments():
+        rate(currency, created_at)
+        values[bill_id] = (amount * rate(target, created_at)).quantize(CENTS)
+    return values
+
+def set_based(target, revalue_at=None, batch_size=None):
+    from currency import CONVERSION_BATCH_SIZE, revalue_payments
+    values = {}
+    for batch in revalue_payments(target, revalue_at, batch_size or CONVERSION_BATCH_SIZE, status='paid'):
+        values.update(zip(batch.column('bill_id').to_pylist(), batch.column('target_amount').to_pylist()))
+    return values
+
+def set_based_count(target, revalue_at=None, batch_size=None):
+    """Rows revalued, keeping the results columnar (as reports and file writers do)"""
+    from currency import CONVERSION_BATCH_SIZE, revalue_payments
+    return sum(batch.num_rows for batch in
+               revalue_payments(target, revalue_at, batch_size or CONVERSION_BATCH_SIZE, status='paid'))
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    value = fn(*args)
+    return value, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--currency', default='EUR', help='Reporting currency.')
+    parser.add_argument('--bills', type=int, default=100000, help='Bills to seed when the database is empty.')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite file when DATABASE_URL is unset.')
+    parser.add_argument('--per-row-limit', type=int, default=5000, help='Payments for per_row_queries.')
+    parser.add_argument('--batch-size', type=int, default=None, help='Rows per Arrow batch.')
+    parser.add_argument('--output', help="Write results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+    target = args.currency.upper()
+
+    use_database(args.database)
+    from app import create_app
+    from models import db, ExchangeRate
+
+    app = create_app()
+    with app.app_context():
+        bills = ensure_dataset(args.bills)
+        if not db.session.query(ExchangeRate.id).first():
+            print(f"seeded {seed_rates()} exchange rates")
+        dialect = db.engine.dialect.name
+
+        results = {}
+        sample, seconds = timed(per_row_queries, target, args.per_row_limit)
+        results['per_row_queries'] = throughput(len(sample), seconds)
+        db.session.rollback()
+        in_memory, seconds = timed(per_row_python, target)
+        results['per_row_python'] = throughput(len(in_memory), seconds)
+        db.session.rollback()
+        rows, seconds = timed(set_based_count, target, None, args.batch_size)
+        results['set_based'] = throughput(rows, seconds)
+        db.session.rollback()
+        rows, seconds = timed(set_based_count, target, datetime.utcnow(), args.batch_size)
+        results['set_based_revalue'] = throughput(rows, seconds)
+        db.session.rollback()
+
+        engine_values = set_based(target, None, args.batch_size)
+        mismatches = sum(1 for bill_id, value in in_memory.items() if engine_values.get(bill_id) != value)
+        mismatches += sum(1 for bill_id, value in sample.items() if engine_values.get(bill_id) != value)
+        results['mismatches'] = mismatches
+
+    print(f"{bills} bills on {dialect}; paid bank payments valued in {target}")
+    print(f"{'approach':<20} {'rows':>9} {'seconds':>9} {'rows/s':>11}")
+    for name in ('per_row_queries', 'per_row_python', 'set_based', 'set_based_revalue'):
+        result = results[name]
+        print(f"{name:<20} {result['rows']:>9} {result['seconds']:>9.3f} {result['per_second'] or 0:>11.0f}")
+    print(f"{mismatches} mismatched amounts")
+    if args.output:
+        write_results(args.output, 'currency', {**vars(args), 'bills': bills, 'dialect': dialect}, results)
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Bulk ingestion benchmark.
+
+Compares rows/s of the batched bulk-insert path used by /api/bills/batch with
+the one-ORM-object-per-bill path used by /submit_bill:
+
+    python benchmarks/ingest_benchmark.py --bills 5000 --batch-size 500
+    DATABASE_URL=postgresql://... python benchmarks/ingest_benchmark.py
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def synthetic_bills(count, max_items, seed=7):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield i + 1, {
+            'patient_name': f"Patient {i}",
+            'patient_dob': f"19{rng.randint(40, 99)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}",
+            'email': f"patient{i}@example.com",
+            'insurance_provider': rng.choice(['Aetna', 'Cigna', None]),
+            'policy_number': f"POL{i:08d}",
+            'diagnoses': [
+                {'icd10_code': f"E11.{j}", 'description': 'Type 2 diabetes mellitus', 'amount': rng.randint(10, 200)}
+                for j in range(rng.randint(1, max_items))
+            ],
+            'procedures': [
+                {'cpt_code': f"992{j:02d}", 'description': 'Office visit', 'amount': rng.randint(50, 500)}
+                for j in range(rng.randint(1, max_items))
+            ],
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bills', type=int, default=2000)
+    parser.add_argument('--max-items', type=int, default=6)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        workdir = tempfile.mkdtemp(prefix='ingest-bench-')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from app import create_app
+    from models import db
+    from ingest import ingest_bills, parse_bill_payload, create_bill
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        rows = list(synthetic_bills(args.bills, args.max_items))
+        line_items = sum(len(b['diagnoses']) + len(b['procedures']) for _, b in rows)
+        total_rows = args.bills + line_items
+
+        started = time.perf_counter()
+        for _, raw in rows:
+            create_bill(parse_bill_payload(raw))
+        orm_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        result = ingest_bills(iter(rows), batch_size=args.batch_size)
+        bulk_elapsed = time.perf_counter() - started
+        assert result.inserted == args.bills, result.to_dict()
+        dialect = db.engine.dialect.name
+
+    print(f"{args.bills} bills, {line_items} line items on {dialect}")
+    print(f"{'path':>12} {'seconds':>10} {'rows/s':>12}")
+    print(f"{'orm-per-row':>12} {orm_elapsed:>10.2f} {total_rows / orm_elapsed:>12.0f}")
+    print(f"{'bulk':>12} {bulk_elapsed:>10.2f} {total_rows / bulk_elapsed:>12.0f}")
+    print(f"speedup: {orm_elapsed / bulk_elapsed:.1f}x")
+
+if __name__ == '__main__':
+    main()
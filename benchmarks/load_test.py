@@ -0,0 +1,236 @@
+"""End-to-end HTTP load test.
+
+Starts the app in a child process (werkzeug's threaded server, or gevent's
+WSGI server with --server gevent) on the seeded benchmark database, with the
+rate APIs served by fake_upstream.py and the per-client rate limit lifted,
+then drives a weighted mix of requests from --concurrency closed-loop
+clients for --duration seconds. Use --url to load an already running
+deployment instead (nothing is seeded or started then).
+
+    python benchmarks/load_test.py --concurrency 16 --duration 30 --output results/load.json
+    python benchmarks/load_test.py --scenarios dashboard_summary,exchange_rates --server gevent
+    python benchmarks/load_test.py --url https://staging.example.com --scenarios dashboard,bill_pdf
+
+The clients are Python threads, so on a small machine the generator competes
+with the server for CPU; compare runs made on the same host and settings.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from results import summarize, write_results
+from seed_dataset import DEFAULT_DATABASE, use_database
+
+# Relative weight of each scenario in the mix; requests are built by request_for()
+SCENARIOS = {
+    'dashboard': 10,
+    'dashboard_summary': 20,
+    'payments_page': 20,
+    'bill_pdf': 10,
+    'exchange_rates': 15,
+    'crypto_prices': 15,
+    'submit_bill': 10,
+}
+READY_TIMEOUT = 120  # seconds; includes seeding an empty database
+
+def request_for(name, rng, max_bill_id):
+    """(method, path, json body) for one request of a scenario"""
+    if name == 'dashboard':
+        return 'GET', '/dashboard', None
+    if name == 'dashboard_summary':
+        return 'GET', f"/api/dashboard/summary?date={rng.choice(['today', 'week', 'month', 'all'])}", None
+    if name == 'payments_page':
+        return 'GET', f"/api/payments?status={rng.choice(['all', 'paid', 'pending'])}&limit=50", None
+    if name == 'bill_pdf':
+        # A small hot set (cache hits) and a long tail (renders)
+        bill_id = max_bill_id - rng.randrange(20) if rng.random() < 0.8 else rng.randint(1, max_bill_id)
+        return 'GET', f"/download_bill_pdf/{bill_id}", None
+    if name == 'exchange_rates':
+        return 'GET', '/get_exchange_rates', None
+    if name == 'crypto_prices':
+        return 'GET', '/get_crypto_prices', None
+    return 'POST', '/submit_bill', {
+        'patientName': 'Load Test', 'patientDOB': '1980-01-01', 'email': 'load@example.com',
+        'insurance': 'Aetna', 'policyNumber': 'POL-LOAD',
+        'diagnoses': [{'code': 'I10', 'description': 'Essential hypertension', 'amount': 40}],
+        'services': {'procedures': [{'code': '99213', 'description': 'Office visit', 'price': 120}]},
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def serve(port, server, environment, bills):
+    """Child process: seed if needed and serve the app over plain HTTP"""
+    if server == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+    os.environ.update(environment)
+    from app import create_app
+    from seed_dataset import ensure_dataset
+    app = create_app()
+    with app.app_context():
+        ensure_dataset(bills)
+
+    def https_app(environ, start_response):
+        # The app redirects plain HTTP; this server stands in for the TLS proxy
+        environ['wsgi.url_scheme'] = 'https'
+        environ['HTTP_X_FORWARDED_PROTO'] = 'https'
+        return app(environ, start_response)
+
+    if server == 'gevent':
+        from gevent.pywsgi import WSGIServer
+        WSGIServer(('127.0.0.1', port), https_app, log=None).serve_forever()
+    else:
+        import logging
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        make_server('127.0.0.1', port, https_app, threaded=True).serve_forever()
+
+# requests is imported inside the client-side functions: the spawned server
+# re-imports this module, and gevent has to patch ssl before anything loads it
+
+def wait_until_ready(url, process=None):
+    import requests
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process is not None and not process.is_alive():
+            raise SystemExit(f"server exited with code {process.exitcode}")
+        try:
+            if requests.get(f"{url}/api/upstreams", timeout=2).ok:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"server at {url} did not become ready")
+
+def newest_bill_id(url):
+    import requests
+    response = requests.get(f"{url}/api/payments?limit=1", headers={'X-Forwarded-Proto': 'https'}, timeout=30)
+    response.raise_for_status()
+    payments = response.json()['payments']
+    return payments[0]['id'] if payments else 1
+
+def client(url, scenarios, weights, max_bill_id, seed, warmup_until, deadline, records):
+    import requests
+    rng = random.Random(seed)
+    session = requests.Session()
+    session.headers['X-Forwarded-Proto'] = 'https'
+    while True:
+        name = rng.choices(scenarios, weights)[0]
+        method, path, body = request_for(name, rng, max_bill_id)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url + path, json=body, timeout=60, allow_redirects=False)
+            response.content
+            status = response.status_code
+        except requests.exceptions.RequestException:
+            status = 'error'
+        finished = time.perf_counter()
+        if finished >= deadline:
+            return
+        if finished >= warmup_until:
+            records.append((name, finished - started, status))
+
+def run_load(url, scenarios, concurrency, duration, warmup, max_bill_id):
+    weights = [SCENARIOS[name] for name in scenarios]
+    records = []
+    warmup_until = time.perf_counter() + warmup
+    deadline = warmup_until + duration
+    threads = [threading.Thread(target=client, daemon=True,
+                                args=(url, scenarios, weights, max_bill_id, n, warmup_until, deadline, records))
+               for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    by_scenario = defaultdict(list)
+    statuses = defaultdict(Counter)
+    for name, latency, status in records:
+        by_scenario[name].append(latency)
+        statuses[name][str(status)] += 1
+    results = {'scenarios': {}}
+    for name in scenarios:
+        failures = sum(count for status, count in statuses[name].items()
+                       if status == 'error' or int(status) >= 400)
+        results['scenarios'][name] = {**summarize(by_scenario[name], duration),
+                                      'statuses': dict(statuses[name]), 'failures': failures}
+    results['total'] = {**summarize([latency for _, latency, _ in records], duration),
+                        'failures': sum(s['failures'] for s in results['scenarios'].values())}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Load an existing deployment instead of starting the app.')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated subset of the mix.')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds.')
+    parser.add_argument('--warmup', type=float, default=3, help='Seconds of load before measuring.')
+    parser.add_argument('--server', choices=('threaded', 'gevent'), default='threaded')
+    parser.add_argument('--bills', type=int, default=100000, help='Bills to seed when the database is empty.')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite file when DATABASE_URL is unset.')
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help='Seconds the fake rate APIs add.')
+    parser.add_argument('--keep-rate-limit', action='store_true', help='Leave the per-client limit at its default.')
+    parser.add_argument('--output', help="Write results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    process = upstream = None
+    url = args.url.rstrip('/') if args.url else None
+    if url is None:
+        from fake_upstream import FakeUpstream
+        upstream = FakeUpstream(latency=args.upstream_latency).start()
+        environment = {
+            'DATABASE_URL': use_database(args.database),
+            'EXCHANGE_RATE_API_URL': upstream.exchange_rate_url,
+            'COINBASE_API_URL': upstream.coinbase_url,
+            'COINBASE_COMMERCE_API_KEY': 'benchmark',
+        }
+        if not args.keep_rate_limit:
+            environment['RATE_LIMIT'] = os.environ.get('RATE_LIMIT', str(10 ** 9))
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        # spawn, so gevent can patch a fresh interpreter before anything is imported
+        process = multiprocessing.get_context('spawn').Process(
+            target=serve, args=(port, args.server, environment, args.bills), daemon=True)
+        process.start()
+    try:
+        wait_until_ready(url, process)
+        max_bill_id = newest_bill_id(url)
+        print(f"{url}: {len(scenarios)} scenarios, {args.concurrency} clients, {args.duration:g}s "
+              f"(newest bill {max_bill_id})")
+        results = run_load(url, scenarios, args.concurrency, args.duration, args.warmup, max_bill_id)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+        if upstream is not None:
+            upstream.stop()
+
+    print(f"{'scenario':<20} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'failures':>9}")
+    for name, summary in list(results['scenarios'].items()) + [('total', results['total'])]:
+        if not summary['count']:
+            print(f"{name:<20} {'-':>8}")
+            continue
+        print(f"{name:<20} {summary['per_second']:>8.1f} {summary['p50_ms']:>9.1f} {summary['p95_ms']:>9.1f} "
+              f"{summary['p99_ms']:>9.1f} {summary['failures']:>9}")
+    if args.output:
+        params = {**vars(args), 'scenarios': scenarios, 'url': args.url, 'newest_bill_id': max_bill_id}
+        write_results(args.output, 'load', params, results)
+
+if __name__ == '__main__':
+    main()
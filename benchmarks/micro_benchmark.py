@@ -0,0 +1,134 @@
+"""Micro-benchmarks of the app's hot paths.
+
+Times single calls, in-process, against the seeded benchmark database (it is
+seeded on first use, see seed_dataset.py) with the rate APIs served by
+fake_upstream.py:
+
+- pdf_render / pdf_load_render: statement rendering, without and with loading the bill
+- pdf_statements: one merged document of 50 statements, reported per bill
+- rate_limit: the @rate_limit decorator around a no-op view, for rotating clients
+- payments_page / json_payments_page: the dashboard's keyset query and its JSON body
+- dashboard_summary / json_dashboard_summary: the rollup-backed summary and its JSON body
+- exchange_rates / crypto_prices: one refresh of each rate source
+
+    python benchmarks/micro_benchmark.py --output results/micro.json
+    python benchmarks/micro_benchmark.py --cases pdf_render,rate_limit --iterations 2000
+    python benchmarks/micro_benchmark.py --cases pdf_render,pdf_statements --allocations
+
+--allocations also reports each case's peak memory allocated per call
+(tracemalloc, measured after the timed run so it does not skew the timings).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_upstream import FakeUpstream
+from results import measure_allocations, time_calls, write_results
+from seed_dataset import DEFAULT_DATABASE, ensure_dataset, use_database
+
+CASES = ('pdf_render', 'pdf_load_render', 'pdf_statements', 'rate_limit', 'payments_page', 'json_payments_page',
+         'dashboard_summary', 'json_dashboard_summary', 'exchange_rates', 'crypto_prices')
+
+# Bills in the pdf_statements document; its timings are divided by this
+STATEMENTS_PER_DOCUMENT = 50
+PER_BILL_CASES = {'pdf_statements': STATEMENTS_PER_DOCUMENT}
+
+def build_cases(app_module, rng, clients):
+    from models import Bill, db
+    from pdf_generator import generate_statements_pdf, load_bill_for_pdf, render_bill_pdf, snapshot_bill
+    from rates import get_live_crypto_prices, get_live_exchange_rates
+    from rollups import dashboard_summary
+
+    max_id = db.session.query(db.func.max(Bill.id)).scalar()
+    bill = load_bill_for_pdf(max_id)
+    statements = [snapshot_bill(load_bill_for_pdf(rng.randint(1, max_id))) for _ in range(STATEMENTS_PER_DOCUMENT)]
+    page, _ = app_module.query_payments_page(limit=app_module.PAYMENTS_PAGE_SIZE)
+    summary = dashboard_summary('month')
+    limited_view = app_module.rate_limit(lambda: None)
+    addresses = [f"10.{n // 65536}.{n // 256 % 256}.{n % 256}" for n in range(clients)]
+
+    def rate_limit():
+        app_module.request.remote_addr = rng.choice(addresses)
+        limited_view()
+
+    return {
+        'pdf_render': lambda: render_bill_pdf(bill),
+        'pdf_load_render': lambda: render_bill_pdf(load_bill_for_pdf(rng.randint(1, max_id))),
+        'pdf_statements': lambda: generate_statements_pdf(statements, io.BytesIO()),
+        'rate_limit': rate_limit,
+        'payments_page': lambda: app_module.query_payments_page(status='paid', limit=app_module.PAYMENTS_PAGE_SIZE),
+        'json_payments_page': lambda: app_module.jsonify({
+            'success': True, 'payments': [app_module.serialize_payment_row(row) for row in page]
+        }).get_data(),
+        'dashboard_summary': lambda: dashboard_summary('month'),
+        'json_dashboard_summary': lambda: json.dumps({'success': True, **summary}, default=str),
+        'exchange_rates': get_live_exchange_rates,
+        'crypto_prices': get_live_crypto_prices,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=','.join(CASES), help='Comma-separated subset of the cases.')
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--bills', type=int, default=100000, help='Bills to seed when the database is empty.')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite file when DATABASE_URL is unset.')
+    parser.add_argument('--clients', type=int, default=1000, help='Distinct client addresses for rate_limit.')
+    parser.add_argument('--allocations', action='store_true', help='Also measure peak memory allocated per call.')
+    parser.add_argument('--output', help="Write results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+    cases = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    upstream = FakeUpstream().start()
+    use_database(args.database)
+    os.environ.update({
+        'EXCHANGE_RATE_API_URL': upstream.exchange_rate_url,
+        'COINBASE_API_URL': upstream.coinbase_url,
+        'COINBASE_COMMERCE_API_KEY': 'benchmark',
+        # Measure the limiter's bookkeeping, not its rejections
+        'RATE_LIMIT': os.environ.get('RATE_LIMIT', str(10 ** 9)),
+    })
+    import app as app_module
+    app = app_module.create_app()
+    from models import db
+
+    results = {}
+    with app.test_request_context('/benchmark'):
+        bills = ensure_dataset(args.bills)
+        dialect = db.engine.dialect.name
+        functions = build_cases(app_module, random.Random(18), args.clients)
+        print(f"{bills} bills on {dialect}, {args.iterations} iterations")
+        print(f"{'case':<24} {'mean ms':>9} {'p50 ms':>9} {'p99 ms':>9} {'per s':>10}"
+              + (f" {'peak KB':>9}" if args.allocations else ''))
+        for name in cases:
+            summary = time_calls(functions[name], args.iterations)
+            if args.allocations:
+                summary['alloc_peak_kb'] = measure_allocations(functions[name], min(args.iterations, 50))
+            per_call = PER_BILL_CASES.get(name)
+            if per_call:
+                # Reported per bill, comparable with pdf_render
+                summary = {key: round(value / per_call, 3) if key.endswith(('_ms', '_kb')) else
+                           round(value * per_call, 1) if key == 'per_second' else value
+                           for key, value in summary.items()}
+            results[name] = summary
+            print(f"{name:<24} {summary['mean_ms']:>9.3f} {summary['p50_ms']:>9.3f} "
+                  f"{summary['p99_ms']:>9.3f} {summary['per_second']:>10.0f}"
+                  + (f" {summary['alloc_peak_kb']:>9.1f}" if args.allocations else ''))
+            db.session.rollback()  # release read transactions and identity map between cases
+    upstream.stop()
+
+    if args.output:
+        params = {**vars(args), 'cases': cases, 'bills': bills, 'dialect': dialect,
+                  'shared_backend': app.config['SHARED_BACKEND']}
+        write_results(args.output, 'micro', params, results)
+
+if __name__ == '__main__':
+    main()
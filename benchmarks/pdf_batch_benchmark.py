@@ -0,0 +1,75 @@
+"""Throughput benchmark for batch statement rendering.
+
+Seeds a throwaway SQLite database with synthetic bills and reports bills per
+second for ZIP rendering at several process-pool sizes:
+
+    python benchmarks/pdf_batch_benchmark.py --bills 2000 --workers 1 2 4 8
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def seed_bills(db, Bill, Diagnosis, Procedure, count, max_items):
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        bill = Bill(
+            patient_name=f"Patient {i}",
+            patient_dob=date(1950, 1, 1) + timedelta(days=rng.randint(0, 20000)),
+            insurance_provider=rng.choice([None, 'Aetna', 'Cigna', 'UnitedHealthcare']),
+            policy_number=f"POL{i:08d}",
+            email=f"patient{i}@example.com",
+            created_at=start + timedelta(minutes=i),
+            payment_status=rng.choice(['pending', 'paid', 'failed']),
+            payment_method=rng.choice(['bank', 'crypto'])
+        )
+        bill.diagnoses = [
+            Diagnosis(icd10_code=f"E11.{j}", description="Type 2 diabetes mellitus", amount=rng.randint(10, 200))
+            for j in range(rng.randint(1, max_items))
+        ]
+        bill.procedures = [
+            Procedure(cpt_code=f"992{j:02d}", description="Office visit, established patient", amount=rng.randint(50, 500))
+            for j in range(rng.randint(1, max_items))
+        ]
+        db.session.add(bill)
+        if i % 1000 == 999:
+            db.session.commit()
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bills', type=int, default=500)
+    parser.add_argument('--max-items', type=int, default=12, help='Max diagnoses/procedures per bill.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chunk-size', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='pdf-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from app import create_app, statement_bill_ids
+    from models import db, Bill, Diagnosis, Procedure
+    from pdf_batch import write_statements_zip
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed_bills(db, Bill, Diagnosis, Procedure, args.bills, args.max_items)
+
+        print(f"{'workers':>8} {'seconds':>10} {'bills/s':>10} {'MB':>8}")
+        for workers in args.workers:
+            output = os.path.join(workdir, f"statements_{workers}.zip")
+            started = time.perf_counter()
+            written = write_statements_zip(statement_bill_ids(), output, workers, args.chunk_size)
+            elapsed = time.perf_counter() - started
+            print(f"{workers:>8} {elapsed:>10.2f} {args.bills / elapsed:>10.1f} {written / 1e6:>8.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Shared helpers for the benchmark suite: latency summaries and JSON results.
+
+Every suite script writes one JSON document (--output) so runs on two
+commits can be diffed with compare_results.py.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FORMAT_VERSION = 1
+
+def git_revision():
+    """(commit, dirty) of the working tree, or (None, None) outside git"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+def summarize(samples, elapsed=None):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+    count = len(samples)
+
+    def pick(fraction):
+        return round(samples[min(count - 1, int(count * fraction))] * 1000, 3)
+
+    summary = {
+        'count': count,
+        'mean_ms': round(sum(samples) / count * 1000, 3),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(samples[-1] * 1000, 3),
+    }
+    if elapsed:
+        summary['per_second'] = round(count / elapsed, 1)
+    return summary
+
+def measure_allocations(fn, iterations=50):
+    """Mean peak of memory allocated during one call of fn(), in KB, traced with tracemalloc"""
+    import tracemalloc
+    fn()
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn()
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return round(sum(peaks) / len(peaks) / 1024, 1)
+
+def time_calls(fn, iterations, warmup=10):
+    """Call fn() repeatedly and summarize each call's duration"""
+    for _ in range(min(warmup, iterations)):
+        fn()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - call_started)
+    return summarize(samples, time.perf_counter() - started)
+
+def write_results(path, benchmark, params, results):
+    """Write a results document (or print it when path is '-')"""
+    commit, dirty = git_revision()
+    document = {
+        'format': RESULTS_FORMAT_VERSION,
+        'benchmark': benchmark,
+        'commit': commit,
+        'dirty': dirty,
+        'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+    if path == '-':
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+        f.write('\n')
+    print(f"results written to {path}")
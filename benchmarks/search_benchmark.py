@@ -0,0 +1,149 @@
+"""Search benchmark: latency of the front-desk search box by kind of query.
+
+Queries are drawn from the seeded bills (see seed_dataset.py): last names,
+full names, partial names as typed, names with a typo, dates of birth alone
+and with a name, and exact policy, claim and transaction-hash lookups. Each
+kind is timed through search.search_bills() on the benchmark database; off
+PostgreSQL the first search builds the in-process name index, reported on
+its own, and a final pass writes bills between searches to time catching up
+on changes:
+
+    python benchmarks/search_benchmark.py --bills 3000000 --queries 2000 --output results/search.json
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from results import summarize, write_results
+from seed_dataset import DEFAULT_DATABASE, ensure_dataset, use_database
+
+KINDS = ('last_name', 'full_name', 'typing', 'typo', 'dob', 'dob_name', 'policy_number', 'claim_number',
+         'transaction_hash')
+
+def typo(word, rng):
+    """word with two neighbouring letters swapped (or one letter dropped)"""
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    if rng.random() < 0.5:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + word[i + 1:]
+
+def build_queries(rng, count):
+    from sqlalchemy import func, select
+    from models import db, Bill, InsuranceClaim
+    max_id = db.session.query(func.max(Bill.id)).scalar()
+    ids = [rng.randint(1, max_id) for _ in range(count)]
+    bills = {row.id: row for row in db.session.execute(
+        select(Bill.id, Bill.patient_name, Bill.patient_dob, Bill.policy_number, Bill.transaction_hash)
+        .where(Bill.id.in_(ids)))}
+    policies = [b.policy_number for b in bills.values() if b.policy_number]
+    hashes = db.session.scalars(select(Bill.transaction_hash).where(Bill.transaction_hash.isnot(None))
+                                .order_by(func.random()).limit(count)).all()
+    claims = db.session.scalars(select(InsuranceClaim.claim_number).where(InsuranceClaim.claim_number.isnot(None))
+                                .order_by(func.random()).limit(count)).all()
+
+    queries = {kind: [] for kind in KINDS}
+    for bill in bills.values():
+        first, last = bill.patient_name.split(' ', 1)
+        dob = bill.patient_dob.isoformat()
+        queries['last_name'].append(last)
+        queries['full_name'].append(bill.patient_name)
+        queries['typing'].append(f"{first} {last[:rng.randint(2, max(2, len(last) - 1))]}")
+        queries['typo'].append(f"{first} {typo(last, rng)}")
+        queries['dob'].append(dob)
+        queries['dob_name'].append(f"{dob} {last}")
+    queries['policy_number'] = policies
+    queries['claim_number'] = claims
+    queries['transaction_hash'] = hashes
+    return queries
+
+def time_queries(queries, search):
+    samples, hits = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        hits += bool(search(query))
+        samples.append(time.perf_counter() - started)
+    summary = summarize(samples)
+    summary['hit_rate'] = round(hits / len(queries), 3) if queries else None
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bills', type=int, default=100000, help='Bills to seed when the database is empty.')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite file when DATABASE_URL is unset.')
+    parser.add_argument('--queries', type=int, default=1000, help='Queries per kind.')
+    parser.add_argument('--writes', type=int, default=200, help='Bill renames interleaved with searches at the end.')
+    parser.add_argument('--output', help="Write results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+
+    use_database(args.database)
+    from app import create_app
+    from models import db, Bill
+    from search import NameIndex, create_search_indexes, search_bills
+
+    app = create_app()
+    rng = random.Random(22)
+    results = {}
+    with app.app_context():
+        bills = ensure_dataset(args.bills)
+        created = create_search_indexes()
+        if created:
+            print(f"created {', '.join(created)}")
+        dialect = db.engine.dialect.name
+        index = NameIndex()
+
+        def search(query):
+            result = search_bills(query, index)
+            db.session.rollback()
+            return result
+
+        queries = build_queries(rng, args.queries)
+        started = time.perf_counter()
+        search(queries['last_name'][0])
+        results['first_search_s'] = round(time.perf_counter() - started, 3)
+        if dialect != 'postgresql':
+            postings = sum(len(p) for p in index._postings.values())
+            results['index_words'] = len(index)
+            results['index_postings_mb'] = round(postings * 4 / 1e6, 1)
+
+        for kind in KINDS:
+            results[kind] = time_queries(queries[kind], search)
+
+        # Rename bills between searches: each search first catches up on the change
+        max_id = db.session.query(db.func.max(Bill.id)).scalar()
+        samples = []
+        for n in range(args.writes):
+            bill = db.session.get(Bill, rng.randint(1, max_id))
+            # Letters only: a word with digits would be looked up as an identifier
+            marker = 'qx' + ''.join(chr(ord('a') + int(d)) for d in str(n))
+            bill.patient_name = f"Renamed {marker}"
+            bill.updated_at = datetime.utcnow()
+            db.session.commit()
+            started = time.perf_counter()
+            found = search(marker)
+            samples.append(time.perf_counter() - started)
+            if not any(result.bill.id == bill.id for result in found):
+                raise SystemExit(f"renamed bill {bill.id} not found")
+            # Past the sync interval, so the next search syncs again
+            time.sleep(0.3)
+        results['after_write'] = summarize(samples)
+        db.session.rollback()
+
+    print(f"{bills} bills on {dialect}; first search (index build) {results['first_search_s']:.2f}s")
+    print(f"{'query':<18} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'hits':>6}")
+    for kind in KINDS + ('after_write',):
+        result = results[kind]
+        print(f"{kind:<18} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['max_ms']:>8.2f} "
+              f"{result.get('hit_rate') or '':>6}")
+    if args.output:
+        write_results(args.output, 'search', {**vars(args), 'bills': bills, 'dialect': dialect}, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""Synthetic dataset for the benchmark suite.
+
+Seeds bills with diagnoses, procedures and insurance claims spread over the
+last --days days (ids increase with created_at, as in production), written in
+batches of plain INSERTs, then rebuilds the dashboard rollups. The same seed
+always produces the same data, so results from different commits compare.
+SQLite is used unless DATABASE_URL points elsewhere:
+
+    python benchmarks/seed_dataset.py --bills 1000000
+    DATABASE_URL=postgresql://localhost/bench python benchmarks/seed_dataset.py --bills 1000000 --reset
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_DATABASE = os.path.join(tempfile.gettempdir(), 'healthbillpay-bench.db')
+
+PAYERS = [('60054', 'Aetna'), ('62308', 'Cigna'), ('87726', 'UnitedHealthcare'),
+          ('00590', 'Blue Cross Blue Shield'), ('61101', 'Humana'), ('77027', 'Kaiser Permanente')]
+DIAGNOSES = [('E11.9', 'Type 2 diabetes mellitus without complications'), ('I10', 'Essential hypertension'),
+             ('J06.9', 'Acute upper respiratory infection'), ('M54.5', 'Low back pain'),
+             ('R51.9', 'Headache, unspecified'), ('Z00.00', 'General adult medical examination')]
+PROCEDURES = [('99213', 'Office visit, established patient'), ('99203', 'Office visit, new patient'),
+              ('80053', 'Comprehensive metabolic panel'), ('85025', 'Complete blood count'),
+              ('71046', 'Chest X-ray, 2 views'), ('93000', 'Electrocardiogram')]
+PAYMENT_STATUSES = (('paid', 60), ('pending', 30), ('failed', 10))
+CLAIM_STATUSES = (('submitted', 70), ('queued', 12), ('rejected', 10), ('failed', 8))
+BANK_CURRENCIES = ('USD', 'USD', 'USD', 'EUR', 'GBP', 'CAD')
+CRYPTO_CURRENCIES = ('BTC', 'ETH', 'USDC')
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William',
+               'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah',
+               'Carlos', 'Karen', 'Daniel', 'Nancy', 'Matthew', 'Lisa', 'Anthony', 'Betty', 'Mark', 'Sandra',
+               'Wei', 'Ashley', 'Paul', 'Emily', 'Andrew', 'Donna', 'Joshua', 'Michelle', 'Kenji', 'Amelia',
+               'Omar', 'Sofia', 'Ivan', 'Priya', 'Diego', 'Zoe', 'Noah', 'Olivia', 'Liam', 'Renee')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore',
+              'Jackson', 'Martin', 'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Nguyen',
+              "O'Brien", 'Kowalski', 'Chen', 'Patel', 'Kim', 'Muller', 'Rossi', 'Novak', 'Okafor', 'Yamamoto')
+# Rarer surnames are built from these, so most names are not among the common ones above
+SURNAME_STEMS = ('Ash', 'Bel', 'Cal', 'Dun', 'Ell', 'Fair', 'Gar', 'Hal', 'Iver', 'Kel', 'Lind', 'Mor',
+                 'Nor', 'Pem', 'Quin', 'Ros', 'Stan', 'Thorn', 'Vance', 'Wald', 'Brock', 'Carr', 'Dal', 'Went')
+SURNAME_ENDINGS = ('by', 'ford', 'ham', 'ley', 'ton', 'wood', 'field', 'stein', 'berg', 'ov', 'ski', 'son',
+                   'man', 'well', 'worth', 'more', 'ridge', 'dale', 'land', 'croft')
+# Starting points of the daily exchange-rate random walks (units per USD)
+RATE_CURRENCIES = {'EUR': 0.92, 'GBP': 0.79, 'CAD': 1.36}
+
+def use_database(path=None):
+    """Point DATABASE_URL at the benchmark SQLite file unless it is already set"""
+    if 'DATABASE_URL' not in os.environ:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(path or DEFAULT_DATABASE)}"
+    return os.environ['DATABASE_URL']
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights)[0]
+
+def _money(rng, low, high):
+    return Decimal(rng.randint(low * 100, high * 100)) / 100
+
+def patient_name(bill_id):
+    """Name of a bill's patient; a hash of the id, so the rng (and every other column) is unaffected"""
+    h = (bill_id * 2654435761) % 2 ** 32
+    first = FIRST_NAMES[h % len(FIRST_NAMES)]
+    h //= len(FIRST_NAMES)
+    if h % 3 == 0:
+        return f"{first} {LAST_NAMES[(h // 3) % len(LAST_NAMES)]}"
+    h //= 3
+    return f"{first} {SURNAME_STEMS[h % len(SURNAME_STEMS)]}{SURNAME_ENDINGS[(h // len(SURNAME_STEMS)) % len(SURNAME_ENDINGS)]}"
+
+def generate_batch(rng, first_id, count, started_at, spacing, max_items, claim_ratio, ids):
+    """Rows for bills first_id.. and their children; ids holds the next diagnosis/procedure/claim ids"""
+    bills, diagnoses, procedures, claims = [], [], [], []
+    for bill_id in range(first_id, first_id + count):
+        created_at = started_at + spacing * (bill_id - 1) + timedelta(seconds=rng.random() * spacing.total_seconds())
+        bill_diagnoses = []
+        for _ in range(rng.randint(1, max_items)):
+            code, description = rng.choice(DIAGNOSES)
+            bill_diagnoses.append({'id': ids['diagnosis'], 'bill_id': bill_id, 'icd10_code': code,
+                                   'description': description, 'amount': _money(rng, 10, 250),
+                                   'updated_at': created_at})
+            ids['diagnosis'] += 1
+        bill_procedures = []
+        for _ in range(rng.randint(1, max_items)):
+            code, description = rng.choice(PROCEDURES)
+            bill_procedures.append({'id': ids['procedure'], 'bill_id': bill_id, 'cpt_code': code,
+                                    'description': description, 'amount': _money(rng, 40, 900),
+                                    'updated_at': created_at})
+            ids['procedure'] += 1
+        diagnoses.extend(bill_diagnoses)
+        procedures.extend(bill_procedures)
+
+        status = _weighted(rng, PAYMENT_STATUSES)
+        method = rng.choice(('bank', 'bank', 'crypto')) if status != 'pending' or rng.random() < 0.5 else None
+        payer = rng.choice(PAYERS) if rng.random() < 0.75 else None
+        diagnoses_subtotal = sum(item['amount'] for item in bill_diagnoses)
+        procedures_subtotal = sum(item['amount'] for item in bill_procedures)
+        bill = {
+            'id': bill_id,
+            'patient_name': patient_name(bill_id),
+            'patient_dob': date(1940, 1, 1) + timedelta(days=rng.randrange(28000)),
+            'email': f"patient{bill_id}@example.com",
+            'insurance_provider': payer[1] if payer else None,
+            'policy_number': f"POL{bill_id:09d}" if payer else None,
+            'diagnoses_subtotal': diagnoses_subtotal,
+            'procedures_subtotal': procedures_subtotal,
+            'total_amount': diagnoses_subtotal + procedures_subtotal,
+            'created_at': created_at,
+            'updated_at': created_at,
+            'payment_status': status,
+            'payment_method': method,
+            'bank_name': 'First Benchmark Bank' if method == 'bank' else None,
+            'bank_currency': rng.choice(BANK_CURRENCIES) if method == 'bank' else None,
+            'payment_currency': rng.choice(CRYPTO_CURRENCIES) if method == 'crypto' else None,
+            'transaction_hash': f"0x{rng.getrandbits(256):064x}" if method == 'crypto' else None,
+            'claim_status': 'pending',
+        }
+        bills.append(bill)
+
+        if payer and rng.random() < claim_ratio:
+            claim_status = _weighted(rng, CLAIM_STATUSES)
+            queued_at = created_at + timedelta(minutes=rng.randint(5, 600))
+            submitted = claim_status in ('submitted', 'rejected')
+            claims.append({
+                'id': ids['claim'], 'bill_id': bill_id, 'payer_id': payer[0], 'payer_name': payer[1],
+                'subscriber_id': bill['policy_number'], 'subscriber_name': bill['patient_name'],
+                'subscriber_dob': bill['patient_dob'], 'relationship_to_subscriber': 'self',
+                'date_of_service': created_at.date(), 'place_of_service': '11', 'status': claim_status,
+                'submitted_at': queued_at + timedelta(minutes=rng.randint(1, 120)) if submitted else None,
+                'claim_number': f"CLM{ids['claim']:010d}" if submitted else None,
+                'queued_at': queued_at, 'available_at': queued_at, 'attempts': 1 if submitted else 0,
+                'updated_at': queued_at,
+            })
+            bill['claim_status'] = claim_status
+            ids['claim'] += 1
+    return bills, diagnoses, procedures, claims
+
+def seed_rates(days=365, seed=18):
+    """Insert a daily exchange-rate history (a random walk per currency) over the last `days` days"""
+    from sqlalchemy import insert
+    from models import db, ExchangeRate
+
+    rng = random.Random(seed)
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    rows = []
+    for currency, rate in RATE_CURRENCIES.items():
+        for day in range(days + 1):
+            rows.append({'currency': currency, 'rate': Decimal(str(round(rate, 8))),
+                         'effective_at': start + timedelta(days=day), 'source': 'benchmark'})
+            rate *= 1 + rng.gauss(0, 0.004)
+    db.session.execute(insert(ExchangeRate), rows)
+    db.session.commit()
+    return len(rows)
+
+def seed(bills, days=365, max_items=4, claim_ratio=0.5, batch_size=5000, seed=18, progress=None):
+    """Insert a synthetic dataset (inside an app context) and rebuild the rollups.
+
+    Appends to whatever is already there; the exchange-rate history is only
+    seeded when empty. Returns a dict of row counts and timings.
+    """
+    from sqlalchemy import func, insert, select, text
+    from models import db, Bill, Diagnosis, Procedure, InsuranceClaim, ExchangeRate
+    from rollups import rebuild_rollups
+
+    rng = random.Random(seed)
+    models = {'bill': Bill, 'diagnosis': Diagnosis, 'procedure': Procedure, 'claim': InsuranceClaim}
+    ids = {name: (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+           for name, model in models.items()}
+    first_bill = ids.pop('bill')
+    # New bills are spread evenly over the last `days` days
+    spacing = timedelta(days=days) / bills
+    started_at = datetime.utcnow() - timedelta(days=days) - spacing * (first_bill - 1)
+
+    counts = dict.fromkeys(models, 0)
+    started = time.perf_counter()
+    for offset in range(0, bills, batch_size):
+        count = min(batch_size, bills - offset)
+        rows = generate_batch(rng, first_bill + offset, count, started_at, spacing, max_items, claim_ratio, ids)
+        for name, batch in zip(models, rows):
+            if batch:
+                db.session.execute(insert(models[name].__table__), batch)
+                counts[name] += len(batch)
+        db.session.commit()
+        if progress:
+            progress(offset + count, bills)
+    insert_seconds = time.perf_counter() - started
+
+    if db.engine.dialect.name == 'postgresql':
+        # Rows were inserted with explicit ids; move the sequences past them
+        for model in models.values():
+            table = model.__tablename__
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+            ))
+        db.session.commit()
+
+    if not db.session.query(ExchangeRate.id).first():
+        counts['rate'] = seed_rates(days, seed)
+
+    started = time.perf_counter()
+    for _ in rebuild_rollups():
+        pass
+    return {**{f"{name}_rows": value for name, value in counts.items()},
+            'insert_seconds': round(insert_seconds, 2),
+            'rollup_seconds': round(time.perf_counter() - started, 2)}
+
+def ensure_dataset(bills, **options):
+    """Create the schema if needed and seed it when it has no bills; returns the bill count"""
+    from models import db, Bill
+    db.create_all()
+    existing = db.session.query(Bill.id).count()
+    if existing == 0:
+        print(f"seeding {bills} bills into {db.engine.url.render_as_string(hide_password=True)} ...")
+        seed(bills, **options)
+        existing = db.session.query(Bill.id).count()
+    return existing
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bills', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=365, help='Spread created_at over this many days.')
+    parser.add_argument('--max-items', type=int, default=4, help='Diagnoses and procedures per bill (1..N each).')
+    parser.add_argument('--claim-ratio', type=float, default=0.5, help='Share of insured bills with a claim.')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=18)
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite file when DATABASE_URL is unset.')
+    parser.add_argument('--reset', action='store_true', help='Drop and recreate all tables first.')
+    parser.add_argument('--output', help='Write seeding timings as JSON.')
+    args = parser.parse_args()
+
+    use_database(args.database)
+    from app import create_app
+    from models import db
+    from results import write_results
+
+    def progress(done, total):
+        print(f"\r{done}/{total} bills", end='', flush=True)
+
+    app = create_app()
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+        stats = seed(args.bills, args.days, args.max_items, args.claim_ratio, args.batch_size, args.seed, progress)
+        dialect = db.engine.dialect.name
+    print()
+    for name, value in stats.items():
+        print(f"{name:<16} {value}")
+    if args.output:
+        write_results(args.output, 'seed', {**vars(args), 'dialect': dialect}, stats)
+
+if __name__ == '__main__':
+    main()
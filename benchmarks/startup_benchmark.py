@@ -0,0 +1,122 @@
+"""Cold-start benchmark: import time and time to first request.
+
+Each run starts a fresh interpreter that imports app.py, builds the app with
+create_app() and serves its first requests in-process: a rollup-backed JSON
+page, then a statement PDF rendered into an empty cache (which is where
+ReportLab gets loaded). Every phase is summarized over --runs processes,
+next to the wall time of the whole process. The benchmark database is
+seeded first if empty (see seed_dataset.py):
+
+    python benchmarks/startup_benchmark.py --runs 10 --output results/startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from results import summarize, write_results
+from seed_dataset import DEFAULT_DATABASE, use_database
+
+# Phases timed inside each child, in order
+PHASES = ('import_app', 'create_app', 'first_request', 'first_pdf')
+FIRST_REQUEST = '/api/dashboard/summary?date=month'
+
+def measure():
+    """Child process: time each start-up phase and print them as JSON"""
+    timings = {}
+    started = time.perf_counter()
+    import app as app_module
+    timings['import_app'] = time.perf_counter() - started
+    heavy_modules = {name: name in sys.modules for name in ('reportlab', 'requests')}
+
+    started = time.perf_counter()
+    app = app_module.create_app()
+    timings['create_app'] = time.perf_counter() - started
+
+    client = app.test_client()
+    headers = {'X-Forwarded-Proto': 'https'}
+    started = time.perf_counter()
+    response = client.get(FIRST_REQUEST, headers=headers, base_url='https://localhost')
+    timings['first_request'] = time.perf_counter() - started
+    statuses = [response.status_code]
+
+    started = time.perf_counter()
+    response = client.get(f"/download_bill_pdf/{os.environ['STARTUP_BILL_ID']}", headers=headers,
+                          base_url='https://localhost')
+    timings['first_pdf'] = time.perf_counter() - started
+    statuses.append(response.status_code)
+    print(json.dumps({'timings': timings, 'statuses': statuses, 'loaded_at_import': heavy_modules}))
+
+def run_child(environment):
+    # An empty PDF cache per run, so the first PDF is always rendered
+    with tempfile.TemporaryDirectory(prefix='startup-pdf-') as pdf_cache_dir:
+        started = time.perf_counter()
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'],
+                                   env={**environment, 'PDF_CACHE_DIR': pdf_cache_dir},
+                                   capture_output=True, text=True, cwd=ROOT)
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise SystemExit(f"child failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['timings']['process'] = wall
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--bills', type=int, default=10000, help='Bills to seed when the database is empty.')
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help='SQLite file when DATABASE_URL is unset.')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help="Write results as JSON ('-' for stdout).")
+    args = parser.parse_args()
+    if args.child:
+        measure()
+        return
+
+    use_database(args.database)
+    environment = dict(os.environ)
+    # Nothing in the timed phases should wait on the network
+    environment.setdefault('EXCHANGE_RATE_API_URL', 'http://127.0.0.1:9/')
+    environment.setdefault('COINBASE_API_URL', 'http://127.0.0.1:9/')
+    # Seed (and create the schema) in a process of its own, so the measured
+    # children all start against a ready database
+    seeder = subprocess.run([sys.executable, '-c', (
+        "import sys; sys.path.insert(0, 'benchmarks')\n"
+        "from app import create_app\n"
+        "from models import db, Bill\n"
+        "from seed_dataset import ensure_dataset\n"
+        "with create_app().app_context():\n"
+        f"    ensure_dataset({args.bills}); print(db.session.query(db.func.max(Bill.id)).scalar())\n"
+    )], env=environment, capture_output=True, text=True, cwd=ROOT)
+    if seeder.returncode != 0:
+        raise SystemExit(f"seeding failed:\n{seeder.stderr}")
+    environment['STARTUP_BILL_ID'] = seeder.stdout.strip().splitlines()[-1]
+
+    samples = {phase: [] for phase in PHASES + ('process',)}
+    loaded_at_import = None
+    for _ in range(args.runs):
+        result = run_child(environment)
+        if any(status != 200 for status in result['statuses']):
+            raise SystemExit(f"first requests answered {result['statuses']}")
+        loaded_at_import = result['loaded_at_import']
+        for phase, seconds in result['timings'].items():
+            samples[phase].append(seconds)
+
+    results = {phase: summarize(values) for phase, values in samples.items()}
+    results['loaded_at_import'] = loaded_at_import
+    print(f"{args.runs} cold starts")
+    print(f"{'phase':<16} {'p50 ms':>9} {'max ms':>9}")
+    for phase in PHASES + ('process',):
+        print(f"{phase:<16} {results[phase]['p50_ms']:>9.1f} {results[phase]['max_ms']:>9.1f}")
+    print("loaded by `import app`: " + ', '.join(f"{name}={loaded}" for name, loaded in loaded_at_import.items()))
+    if args.output:
+        write_results(args.output, 'startup', vars(args), results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Payment verification load benchmark.
+
+Seeds a throwaway SQLite database with outstanding crypto payments and times
+one verification pass against the mock chain provider at several batch
+sizes. `--latency` is the simulated RPC round trip per provider call:
+
+    python benchmarks/verification_benchmark.py --payments 10000 --batch-sizes 50 200 1000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def seed_payments(db, Bill, count):
+    rng = random.Random(11)
+    start = datetime.utcnow() - timedelta(hours=1)
+    rows = [{
+        'patient_name': f"Patient {i}",
+        'patient_dob': date(1950, 1, 1) + timedelta(days=rng.randint(0, 20000)),
+        'email': f"patient{i}@example.com",
+        'created_at': start + timedelta(milliseconds=i),
+        'updated_at': start + timedelta(milliseconds=i),
+        'payment_status': 'pending',
+        'payment_method': 'crypto',
+        'payment_currency': rng.choice(['ETH', 'USDC', 'USDT']),
+        'transaction_hash': f"0x{rng.getrandbits(256):064x}",
+        'diagnoses_subtotal': 0,
+        'procedures_subtotal': 0,
+        'total_amount': 0,
+    } for i in range(count)]
+    db.session.execute(db.insert(Bill), rows)
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--payments', type=int, default=10000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[50, 200, 1000])
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per provider call.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='verify-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    from app import create_app
+    from models import db, Bill
+    from payment_verifier import MockChainProvider, verify_pending_payments
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed_payments(db, Bill, args.payments)
+
+        print(f"{args.payments} pending payments, {args.latency * 1000:.0f} ms per provider call")
+        print(f"{'batch':>8} {'calls':>8} {'seconds':>10} {'payments/s':>12} {'paid':>8} {'failed':>8}")
+        for batch_size in args.batch_sizes:
+            db.session.execute(db.update(Bill).values(payment_status='pending'))
+            db.session.commit()
+            provider = MockChainProvider(latency=args.latency)
+            started = time.perf_counter()
+            counts = verify_pending_payments(provider, batch_size)
+            elapsed = time.perf_counter() - started
+            print(f"{batch_size:>8} {provider.calls:>8} {elapsed:>10.2f} {counts['checked'] / elapsed:>12.0f} "
+                  f"{counts['paid']:>8} {counts['failed']:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import os
+import re
+import csv
+import glob
+import mmap
+import fcntl
+import heapq
+import struct
+import bisect
+import hashlib
+import logging
+import tempfile
+import threading
+from array import array
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+
+logger = logging.getLogger(__name__)
+
+# Code catalog settings
+AUTOCOMPLETE_LIMIT = 20
+MAX_AUTOCOMPLETE_LIMIT = 100
+MAX_COMPLETION_LISTS = 16  # completions of a partial word checked through their posting lists
+# Bump when the index file layout changes so stale files are rebuilt.
+INDEX_FORMAT_VERSION = 1
+
+CODE_SYSTEMS = ('icd10', 'cpt')
+CODE_LABELS = {'icd10': 'ICD-10', 'cpt': 'CPT'}
+STOP_WORDS = frozenset(('a', 'an', 'and', 'as', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to'))
+
+_MAGIC = b'HBCODES\x00'
+# magic, version, record count, token count, then the offsets of the record
+# offsets, token offsets, posting offsets, postings, record blob and token blob
+_HEADER = struct.Struct('=8sIII6Q')
+_SEP = b'\x1f'
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+CodeEntry = namedtuple('CodeEntry', 'code description price')
+
+class CatalogError(Exception):
+    """Raised when a catalog source or index file cannot be read"""
+
+def normalize_code(code):
+    """Canonical lookup form of a code: upper case, without the ICD-10 dot"""
+    return str(code).replace('.', '').strip().upper()
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+def read_icd10_codes(path):
+    """Yield (code, description, None) from a CMS icd10cm-codes-YYYY.txt file"""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            code, _, description = line.strip().partition(' ')
+            if code:
+                yield code, description.strip(), None
+
+def read_fee_schedule(path):
+    """Yield (code, description, price) from a CSV with code/cpt_code, description and amount/price columns"""
+    with open(path, encoding='utf-8', newline='') as f:
+        for line_number, row in enumerate(csv.DictReader(f), start=2):
+            code = row.get('cpt_code') or row.get('code')
+            if not code:
+                continue
+            price = row.get('amount') or row.get('price')
+            try:
+                price = str(Decimal(price).quantize(Decimal('0.01'))) if price else None
+            except InvalidOperation:
+                raise CatalogError(f"{path}:{line_number}: invalid price {price!r}")
+            yield code, (row.get('description') or '').strip(), price
+
+SOURCE_READERS = {'icd10': read_icd10_codes, 'cpt': read_fee_schedule}
+
+def build_index(entries, path):
+    """Write (code, description, price) entries to a CodeIndex file at path.
+
+    Records are sorted by normalized code; every description word gets a
+    posting list of record numbers, so both lookups are binary searches over
+    the mapped file and nothing is unpacked into Python objects up front.
+    """
+    records = {}
+    for code, description, price in entries:
+        records[normalize_code(code)] = (description, price)
+
+    record_blob = bytearray()
+    record_offsets = array('I')
+    postings = {}
+    for number, code in enumerate(sorted(records)):
+        description, price = records[code]
+        record_offsets.append(len(record_blob))
+        record_blob += _SEP.join((code.encode(), description.encode(), (price or '').encode()))
+        for token in set(tokenize(description)) - STOP_WORDS:
+            postings.setdefault(token, array('I')).append(number)
+    record_offsets.append(len(record_blob))
+
+    token_blob = bytearray()
+    token_offsets = array('I')
+    posting_offsets = array('I', [0])
+    posting_data = array('I')
+    for token in sorted(postings):
+        token_offsets.append(len(token_blob))
+        token_blob += token.encode()
+        posting_data.extend(postings[token])
+        posting_offsets.append(len(posting_data))
+    token_offsets.append(len(token_blob))
+
+    sections = [record_offsets.tobytes(), token_offsets.tobytes(), posting_offsets.tobytes(),
+                posting_data.tobytes(), bytes(record_blob), bytes(token_blob)]
+    offsets, position = [], _HEADER.size
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, INDEX_FORMAT_VERSION, len(records), len(postings), *offsets))
+            for section in sections:
+                f.write(section)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return len(records)
+
+class _Strings:
+    """Sequence view of the byte strings packed in one blob of a mapped index"""
+    __slots__ = ('data', 'base', 'offsets', 'field_end')
+
+    def __init__(self, data, base, offsets, field_end=False):
+        self.data = data
+        self.base = base
+        self.offsets = offsets
+        self.field_end = field_end  # stop at the first separator (record code)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.base + self.offsets[i], self.base + self.offsets[i + 1]
+        if self.field_end:
+            end = self.data.find(_SEP, start, end)
+        return self.data[start:end]
+
+class CodeIndex:
+    """Read-only, memory-mapped index of one code system.
+
+    The file is mapped rather than read, so every gunicorn worker on the host
+    shares the same page-cache copy instead of holding its own dictionaries.
+    """
+
+    def __init__(self, path, system):
+        self.path = path
+        self.system = system
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = _HEADER.unpack_from(self._data, 0)
+        except struct.error:
+            raise CatalogError(f"{path} is not a code index")
+        magic, version, record_count, token_count, *offsets = header
+        if magic != _MAGIC or version != INDEX_FORMAT_VERSION:
+            raise CatalogError(f"{path} is not a version {INDEX_FORMAT_VERSION} code index")
+        record_offs, token_offs, posting_offs, postings, record_blob, token_blob = offsets
+
+        view = memoryview(self._data)
+        self._posting_offsets = view[posting_offs:postings].cast('I')
+        self._postings = view[postings:record_blob].cast('I')
+        self._records = _Strings(self._data, record_blob, view[record_offs:token_offs].cast('I'))
+        self._codes = _Strings(self._data, record_blob, self._records.offsets, field_end=True)
+        self._tokens = _Strings(self._data, token_blob, view[token_offs:posting_offs].cast('I'))
+        self.record_count = record_count
+        self.token_count = token_count
+
+    def __len__(self):
+        return self.record_count
+
+    def _range(self, keys, prefix):
+        """Index range of the sorted keys starting with prefix"""
+        lo = bisect.bisect_left(keys, prefix)
+        return lo, bisect.bisect_left(keys, prefix + b'\xff', lo)
+
+    def _posting_list(self, token_number):
+        return self._postings[self._posting_offsets[token_number]:self._posting_offsets[token_number + 1]]
+
+    def entry(self, number):
+        code, description, price = self._records[number].split(_SEP)
+        code = code.decode()
+        if self.system == 'icd10' and len(code) > 3:
+            code = f"{code[:3]}.{code[3:]}"
+        return CodeEntry(code, description.decode(), price.decode() or None)
+
+    def lookup(self, code):
+        """The entry for an exact code, or None"""
+        key = normalize_code(code).encode()
+        number = bisect.bisect_left(self._codes, key)
+        if number < self.record_count and self._codes[number] == key:
+            return self.entry(number)
+        return None
+
+    def lookup_many(self, codes):
+        """Map each distinct code to its entry (None when unknown)"""
+        return {code: self.lookup(code) for code in set(codes)}
+
+    def prefix(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """Entries whose code starts with query, in code order"""
+        key = normalize_code(query).encode()
+        if not key:
+            return []
+        lo, hi = self._range(self._codes, key)
+        return [self.entry(n) for n in range(lo, min(hi, lo + limit))]
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """Entries whose description contains every query word.
+
+        The last word is treated as a prefix while the user is still typing
+        it. The smallest posting list (or, for the partial word, the merged
+        lists of its completions) drives the scan; the others are checked by
+        binary search with cursors that only move forward.
+        """
+        words = [w for w in tokenize(query) if w not in STOP_WORDS]
+        if not words:
+            return []
+        partial = None if query[-1:].isspace() else words.pop()
+
+        required = []
+        for word in words:
+            lo, hi = self._range(self._tokens, word.encode())
+            if lo == hi or self._tokens[lo] != word.encode():
+                return []
+            required.append(self._posting_list(lo))
+        completions = []
+        if partial:
+            lo, hi = self._range(self._tokens, partial.encode())
+            if lo == hi:
+                return []
+            completions = [self._posting_list(n) for n in range(lo, hi)]
+
+        required.sort(key=len)
+        if completions and (not required or sum(map(len, completions)) < len(required[0])):
+            candidates, filters, completions = heapq.merge(*completions), required, []
+        else:
+            candidates, filters = iter(required[0]), required[1:]
+        filters = [_Cursor(postings) for postings in filters]
+        # Past a handful of completions, reading the description is cheaper
+        check_text = len(completions) > MAX_COMPLETION_LISTS
+        completions = [] if check_text else [_Cursor(postings) for postings in completions]
+
+        results, previous = [], None
+        for number in candidates:
+            if number == previous:
+                continue
+            previous = number
+            if not all(number in f for f in filters):
+                continue
+            if completions and not any(number in c for c in completions):
+                continue
+            entry = self.entry(number)
+            if check_text and not any(t.startswith(partial) for t in tokenize(entry.description)):
+                continue
+            results.append(entry)
+            if len(results) >= limit:
+                break
+        return results
+
+    def autocomplete(self, query, limit=AUTOCOMPLETE_LIMIT):
+        """Code-prefix matches first, then description matches"""
+        results = [] if ' ' in query.strip() else self.prefix(query, limit)
+        if len(results) < limit:
+            seen = {entry.code for entry in results}
+            results += [e for e in self.search(query, limit) if e.code not in seen][:limit - len(results)]
+        return results
+
+class _Cursor:
+    """Membership test of ascending record numbers against one posting list"""
+    __slots__ = ('postings', 'position')
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.position = 0
+
+    def __contains__(self, number):
+        self.position = bisect.bisect_left(self.postings, number, self.position)
+        return self.position < len(self.postings) and self.postings[self.position] == number
+
+class CodeCatalog:
+    """ICD-10-CM diagnosis codes and the CPT fee schedule.
+
+    Each source file is compiled once into a binary index under cache_dir,
+    named after the source's size and mtime, and memory-mapped on first use.
+    A system whose source is not configured stays unloaded, and bills are
+    accepted without checking its codes.
+    """
+
+    def __init__(self, sources, cache_dir):
+        self.sources = {system: sources.get(system) for system in CODE_SYSTEMS}
+        self.cache_dir = cache_dir
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def index_path(self, system):
+        source = self.sources[system]
+        stat = os.stat(source)
+        fingerprint = f"{os.path.abspath(source)}|{stat.st_size}|{stat.st_mtime_ns}|{INDEX_FORMAT_VERSION}"
+        return os.path.join(self.cache_dir, f"{system}-{hashlib.sha1(fingerprint.encode()).hexdigest()[:16]}.idx")
+
+    def build(self, system):
+        """Compile the source for system unless an up-to-date index exists; return its path"""
+        path = self.index_path(system)
+        if os.path.exists(path):
+            return path
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Workers starting together wait for one build instead of each compiling
+        with open(os.path.join(self.cache_dir, f"{system}.lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(path):
+                count = build_index(SOURCE_READERS[system](self.sources[system]), path)
+                logger.info(f"Built {CODE_LABELS[system]} index with {count} codes at {path}")
+                for stale in glob.glob(os.path.join(self.cache_dir, f"{system}-*.idx")):
+                    if stale != path:
+                        os.unlink(stale)
+        return path
+
+    def index(self, system):
+        """The loaded CodeIndex for system, or None when it has no source"""
+        if system in self._indexes:
+            return self._indexes[system]
+        with self._lock:
+            if system not in self._indexes:
+                index = None
+                source = self.sources[system]
+                if not source or not os.path.exists(source):
+                    logger.warning(f"{CODE_LABELS[system]} catalog source {source!r} not found; codes are not validated")
+                else:
+                    try:
+                        index = CodeIndex(self.build(system), system)
+                    except (OSError, CatalogError) as e:
+                        logger.error(f"Failed to load {CODE_LABELS[system]} catalog: {str(e)}")
+                self._indexes[system] = index
+        return self._indexes[system]
+
+    def unknown_codes(self, system, codes):
+        """Codes (in input order, deduplicated) missing from a loaded catalog"""
+        index = self.index(system)
+        if index is None:
+            return []
+        entries = index.lookup_many(codes)
+        return [code for code in dict.fromkeys(codes) if entries[code] is None]
+
+    def status(self):
+        return {
+            system: {'loaded': index is not None, 'codes': len(index) if index else 0}
+            for system, index in ((s, self.index(s)) for s in CODE_SYSTEMS)
+        }
@@ -0,0 +1,245 @@
+import time
+import logging
+import threading
+from itertools import groupby
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from sqlalchemy.orm import selectinload
+from models import db, Bill, InsuranceClaim, ClaimBatch, lease_due_rows
+from payment_state import TransitionError, find_replay, transition
+from clearinghouse import ClearinghouseError
+from x12 import build_837p
+
+logger = logging.getLogger(__name__)
+
+# Claim queue settings
+CLAIM_BATCH_SIZE = 200  # claims leased per worker pass
+CLAIM_LEASE_SECONDS = 300  # a crashed worker's claims become visible again after this
+CLAIM_MAX_ATTEMPTS = 5
+CLAIM_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+CLAIM_POLL_INTERVAL = 2.0
+
+LEASABLE_STATUSES = ('queued', 'submitting')
+# Batches that may have reached the clearinghouse without an answer; their claims are resent in them
+UNCONFIRMED_BATCH_STATUSES = ('sending', 'failed')
+OPEN_STATUSES = ('queued', 'submitting', 'submitted')
+
+class ClaimQueueStats:
+    """Thread-safe throughput counters for the workers in this process"""
+
+    def __init__(self):
+        self.batches = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.retried = 0
+        self.failed = 0
+        self.total_submit_time = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'retried': self.retried,
+                'failed': self.failed,
+                'avg_batch_seconds': self.total_submit_time / self.batches if self.batches else None
+            }
+
+claim_queue_stats = ClaimQueueStats()
+
+def enqueue_claim(payload, idempotency_key=None):
+    """Store a validated claim as queued; returns (claim, Transition). Submission happens in a worker.
+
+    Raises LookupError if the bill does not exist and ValueError if it cannot
+    be claimed (no procedures, a claim is already open for it, or its claim
+    status does not allow another). An idempotency key seen before returns
+    the claim its first submission queued instead of queueing another.
+    """
+    bill_id = payload['bill_id']
+    replay = find_replay(idempotency_key, bill_id, 'claim')
+    if replay is not None:
+        return db.session.get(InsuranceClaim, replay.claim_id), replay
+    bill = db.session.get(Bill, bill_id)
+    if bill is None:
+        raise LookupError(f"Bill {bill_id} not found")
+    if not bill.procedures:
+        raise ValueError("Bill has no procedures to claim")
+    open_claim = db.session.scalar(
+        select(InsuranceClaim.id)
+        .where(InsuranceClaim.bill_id == bill.id, InsuranceClaim.status.in_(OPEN_STATUSES))
+        .limit(1)
+    )
+    if open_claim is not None:
+        # The open claim may be this very submission, committed by a concurrent retry
+        replay = find_replay(idempotency_key, bill_id, 'claim')
+        if replay is not None:
+            return db.session.get(InsuranceClaim, replay.claim_id), replay
+        raise ValueError(f"Claim {open_claim} is already open for this bill")
+
+    claim = InsuranceClaim(**payload, status='queued')
+    db.session.add(claim)
+    db.session.flush()
+    change = transition(bill.id, 'claim', 'queued', idempotency_key=idempotency_key, claim_id=claim.id)
+    if change.replayed:
+        return db.session.get(InsuranceClaim, change.claim_id), change
+    db.session.commit()
+    return claim, change
+
+def lease_claims(limit=CLAIM_BATCH_SIZE, lease_seconds=CLAIM_LEASE_SECONDS):
+    """Take up to `limit` due claims for this worker and return their ids"""
+    return lease_due_rows(InsuranceClaim, LEASABLE_STATUSES, 'submitting', limit, lease_seconds)
+
+def _move_bill(claim, status, values=None):
+    # The claim's outcome is recorded either way; a bill that moved on elsewhere keeps its status
+    try:
+        transition(claim.bill_id, 'claim', status, values, source='claims worker', claim_id=claim.id)
+    except TransitionError as e:
+        logger.warning(f"Claim {claim.id}: {str(e)}")
+
+def _retry_or_fail(claim, reason, now):
+    claim.response_message = reason
+    if claim.attempts >= CLAIM_MAX_ATTEMPTS:
+        claim.status = 'failed'
+        _move_bill(claim, 'failed')
+        return 'failed'
+    claim.status = 'queued'
+    claim.available_at = now + timedelta(seconds=CLAIM_RETRY_DELAY * 2 ** (claim.attempts - 1))
+    return 'retried'
+
+def _build_batch(payer_id, claims):
+    batch = ClaimBatch(payer_id=payer_id, claim_count=len(claims))
+    db.session.add(batch)
+    db.session.flush()
+    batch.payload = build_837p(batch.id, claims)
+    for claim in claims:
+        claim.batch_id = batch.id
+    return batch
+
+def _undelivered_batch(claim):
+    """The batch a claim was last sent in, when nobody knows whether it arrived"""
+    batch = claim.batch
+    return batch if batch is not None and batch.status in UNCONFIRMED_BATCH_STATUSES else None
+
+def _batch_key(claim):
+    batch = _undelivered_batch(claim)
+    return claim.payer_id, batch.id if batch is not None else 0
+
+def submit_batch(adapter, payer_id, claims, batch=None):
+    """Submit a payer's leased claims in one 837P and record the outcome.
+
+    Without `batch` a new interchange is built. A batch whose delivery is
+    unknown (the call failed or the worker died mid-call) is passed back in and
+    sent again unchanged: the same payload and control number (ISA13 and
+    X-Batch-Id), which the clearinghouse answers as a repeat of the first
+    delivery instead of a second set of claims.
+    """
+    if batch is None:
+        batch = _build_batch(payer_id, claims)
+    # From here until the clearinghouse answers, the batch may or may not have arrived
+    batch.status = 'sending'
+    db.session.commit()
+
+    started = time.perf_counter()
+    try:
+        result = adapter.submit(batch.id, payer_id, batch.payload)
+    except ClearinghouseError as e:
+        logger.warning(f"Claim batch {batch.id} for payer {payer_id} failed: {str(e)}")
+        now = datetime.utcnow()
+        batch.status = 'failed'
+        batch.response_message = str(e)
+        outcomes = [_retry_or_fail(claim, str(e), now) for claim in claims]
+        db.session.commit()
+        claim_queue_stats.record(retried=outcomes.count('retried'), failed=outcomes.count('failed'))
+        return batch
+    elapsed = time.perf_counter() - started
+
+    now = datetime.utcnow()
+    batch.status = 'submitted'
+    batch.submitted_at = now
+    batch.response_message = result.message
+    submitted = rejected = 0
+    for claim in claims:
+        if claim.id in result.accepted:
+            claim.status = 'submitted'
+            claim.claim_number = result.accepted[claim.id]
+            claim.submitted_at = now
+            claim.response_message = result.message
+            _move_bill(claim, 'submitted', {'claim_number': claim.claim_number, 'claim_submission_date': now})
+            submitted += 1
+        else:
+            claim.status = 'rejected'
+            claim.response_message = result.rejected.get(claim.id, 'Not acknowledged by clearinghouse')
+            _move_bill(claim, 'rejected')
+            rejected += 1
+    db.session.commit()
+    claim_queue_stats.record(batches=1, submitted=submitted, rejected=rejected, total_submit_time=elapsed)
+    logger.info(f"Claim batch {batch.id} for payer {payer_id}: {submitted} submitted, {rejected} rejected")
+    return batch
+
+def process_claims(adapter, limit=CLAIM_BATCH_SIZE):
+    """Lease due claims, send one interchange per payer and return the number of claims handled"""
+    claim_ids = lease_claims(limit)
+    if not claim_ids:
+        return 0
+    claims = db.session.scalars(
+        select(InsuranceClaim)
+        .where(InsuranceClaim.id.in_(claim_ids))
+        .order_by(InsuranceClaim.payer_id, InsuranceClaim.id)
+        .options(selectinload(InsuranceClaim.bill).selectinload(Bill.diagnoses),
+                 selectinload(InsuranceClaim.bill).selectinload(Bill.procedures),
+                 selectinload(InsuranceClaim.batch))
+    ).all()
+    # Claims of a batch that may already have arrived go out again in that batch
+    for (payer_id, _), group in groupby(sorted(claims, key=_batch_key), key=_batch_key):
+        group = list(group)
+        try:
+            submit_batch(adapter, payer_id, group, _undelivered_batch(group[0]))
+        except Exception as e:
+            # Leave the claims leased; they are retried once the lease expires
+            db.session.rollback()
+            logger.error(f"Error submitting claims for payer {payer_id}: {str(e)}")
+    return len(claims)
+
+def run_claim_worker(adapter, limit=CLAIM_BATCH_SIZE, poll_interval=CLAIM_POLL_INTERVAL, stop=None):
+    """Process claims until `stop` (a threading.Event) is set, sleeping while the queue is empty"""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            handled = process_claims(adapter, limit)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Claim worker error: {str(e)}")
+            handled = 0
+        if handled < limit:
+            stop.wait(poll_interval)
+
+def queue_metrics():
+    """Queue depth by status, age of the oldest due claim and recent throughput"""
+    now = datetime.utcnow()
+    depth = dict(db.session.execute(
+        select(InsuranceClaim.status, func.count()).group_by(InsuranceClaim.status)
+    ).all())
+    oldest = db.session.scalar(
+        select(func.min(InsuranceClaim.queued_at)).where(InsuranceClaim.status.in_(LEASABLE_STATUSES))
+    )
+
+    def submitted_since(seconds):
+        return db.session.scalar(
+            select(func.count()).select_from(InsuranceClaim)
+            .where(InsuranceClaim.submitted_at >= now - timedelta(seconds=seconds))
+        )
+
+    return {
+        'depth': depth,
+        'oldest_queued_age': (now - oldest).total_seconds() if oldest else None,
+        'submitted_last_minute': submitted_since(60),
+        'submitted_last_hour': submitted_since(3600),
+        'worker': claim_queue_stats.to_dict()
+    }
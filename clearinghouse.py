@@ -0,0 +1,117 @@
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from rates import get_http_session
+from x12 import claim_ids
+
+logger = logging.getLogger(__name__)
+
+CLEARINGHOUSE_TIMEOUT = 30  # seconds
+
+class ClearinghouseError(Exception):
+    """A submission could not be delivered; the claims should be retried"""
+
+@dataclass
+class SubmissionResult:
+    """Per-claim outcome of one interchange: accepted claim numbers and rejection reasons"""
+    accepted: dict = field(default_factory=dict)
+    rejected: dict = field(default_factory=dict)
+    message: str = ''
+
+class HttpClearinghouse:
+    """Posts 837 interchanges to a clearinghouse HTTP endpoint.
+
+    The endpoint answers with JSON ``{"accepted": {claim_id: claim_number},
+    "rejected": {claim_id: reason}, "message": ...}``. Transport failures and
+    5xx responses raise ClearinghouseError; other errors reject the batch.
+    A batch is resent with the same X-Batch-Id and ISA13 control number after
+    such a failure, and the endpoint answers a repeat with its first outcome.
+    """
+
+    def __init__(self, url, api_key=None, timeout=CLEARINGHOUSE_TIMEOUT):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def submit(self, batch_id, payer_id, payload):
+        headers = {'Content-Type': 'application/edi-x12', 'X-Batch-Id': str(batch_id)}
+        if self.api_key:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        from requests.exceptions import RequestException
+        try:
+            response = get_http_session().post(self.url, data=payload.encode('utf-8'), headers=headers, timeout=self.timeout)
+        except RequestException as e:
+            raise ClearinghouseError(f"Clearinghouse unreachable: {str(e)}") from e
+        if response.status_code >= 500:
+            raise ClearinghouseError(f"Clearinghouse returned {response.status_code}")
+        if response.status_code >= 400:
+            reason = f"Clearinghouse rejected batch ({response.status_code}): {response.text[:500]}"
+            return SubmissionResult(rejected={claim_id: reason for claim_id in claim_ids(payload)}, message=reason)
+
+        data = response.json()
+        return SubmissionResult(
+            accepted={int(k): v for k, v in (data.get('accepted') or {}).items()},
+            rejected={int(k): v for k, v in (data.get('rejected') or {}).items()},
+            message=data.get('message', '')
+        )
+
+class FakeClearinghouse:
+    """In-process clearinghouse for local runs and tests.
+
+    Accepts every claim in the interchange unless its id is in
+    ``reject_claims``; ``fail_next`` simulates that many transport failures
+    and ``lose_next`` that many answers lost after the batch arrived. A
+    repeated batch id gets the first answer again. Payloads received are kept
+    in ``submissions``, repeats excluded.
+    """
+
+    def __init__(self, latency=0.0, reject_claims=(), fail_next=0, lose_next=0):
+        self.latency = latency
+        self.reject_claims = set(reject_claims)
+        self.fail_next = fail_next
+        self.lose_next = lose_next
+        self.submissions = []
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def submit(self, batch_id, payer_id, payload):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise ClearinghouseError("Simulated clearinghouse outage")
+            if batch_id in self._results:
+                return self._results[batch_id]
+            self.submissions.append((batch_id, payer_id, payload))
+
+        result = SubmissionResult(message=f"Batch {batch_id} received")
+        for claim_id in claim_ids(payload):
+            if claim_id in self.reject_claims:
+                result.rejected[claim_id] = 'Rejected by fake clearinghouse'
+            else:
+                result.accepted[claim_id] = f"FCH{batch_id:06d}{claim_id:08d}"
+        with self._lock:
+            self._results[batch_id] = result
+            if self.lose_next > 0:
+                self.lose_next -= 1
+                raise ClearinghouseError("Simulated timeout after the batch arrived")
+        return result
+
+def build_clearinghouse(config):
+    """Return the adapter for CLEARINGHOUSE_URL; the fake only when asked for.
+
+    The fake accepts every claim, so it is used only with CLEARINGHOUSE=fake
+    or, without a URL, in testing. Raises ValueError otherwise.
+    """
+    url = config.get('CLEARINGHOUSE_URL')
+    choice = config.get('CLEARINGHOUSE') or 'http'
+    if choice not in ('http', 'fake'):
+        raise ValueError(f"CLEARINGHOUSE must be 'http' or 'fake', not {choice!r}")
+    if choice == 'fake' or (config.get('TESTING') and not url):
+        logger.warning("Claims go to the fake clearinghouse")
+        return FakeClearinghouse()
+    if not url:
+        raise ValueError("CLEARINGHOUSE_URL is not set (CLEARINGHOUSE=fake submits to the in-process fake)")
+    return HttpClearinghouse(url, config.get('CLEARINGHOUSE_API_KEY'))
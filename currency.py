@@ -0,0 +1,236 @@
+"""Exchange-rate history and bulk currency conversion.
+
+Bill amounts are kept in BASE_CURRENCY (USD). ExchangeRate rows store units
+of a currency per one USD, each valid from its effective_at until the next
+row for that currency; the exchange-rate refresher appends a row whenever a
+live rate changes. Bulk conversion is set-based: one SELECT pairs every bill
+with the rates valid at its created_at (an index probe per bill and
+currency), and the arithmetic runs on whole Arrow decimal columns, rounded
+half-even to the cent exactly as Decimal.quantize would.
+"""
+import logging
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import Float, case, cast, func, insert, literal, select
+from models import db, Bill, ExchangeRate, filter_bills
+from exports import iter_export_batches
+
+logger = logging.getLogger(__name__)
+
+BASE_CURRENCY = 'USD'
+RATE_PLACES = 8
+CONVERSION_BATCH_SIZE = 50000
+REVALUATION_FORMATS = ('parquet', 'arrow', 'csv')
+
+def _arrow_types():
+    import pyarrow as pa
+    return pa.decimal128(18, 2), pa.decimal128(15, RATE_PLACES)
+
+def _quantize_rate(rate):
+    return Decimal(str(rate)).quantize(Decimal(1).scaleb(-RATE_PLACES))
+
+def latest_rates():
+    """{currency: Decimal rate} of the newest recorded row per currency"""
+    newest = (select(ExchangeRate.currency, func.max(ExchangeRate.effective_at).label('effective_at'))
+              .group_by(ExchangeRate.currency).subquery())
+    rows = db.session.execute(
+        select(ExchangeRate.currency, ExchangeRate.rate)
+        .join(newest, (ExchangeRate.currency == newest.c.currency)
+              & (ExchangeRate.effective_at == newest.c.effective_at))
+    )
+    return {currency: rate for currency, rate in rows}
+
+def rates_at(at):
+    """{currency: Decimal rate} valid at `at`, for every currency with history"""
+    currencies = select(ExchangeRate.currency).distinct().subquery()
+    rate = rate_at(currencies.c.currency, literal(at))
+    return {currency: value for currency, value in db.session.execute(select(currencies.c.currency, rate))
+            if value is not None}
+
+def record_rates(rates, source, at=None):
+    """Append the rates that differ from the latest recorded ones; returns the rows added"""
+    at = at or datetime.utcnow()
+    latest = latest_rates()
+    rows = []
+    for currency, rate in rates.items():
+        if currency == BASE_CURRENCY or not rate:
+            continue
+        rate = _quantize_rate(rate)
+        if latest.get(currency) != rate:
+            rows.append({'currency': currency, 'rate': rate, 'effective_at': at, 'source': source})
+    if rows:
+        db.session.execute(insert(ExchangeRate), rows)
+        db.session.commit()
+    return len(rows)
+
+def rate_history_recorder(app, source):
+    """RateRefresher on_refresh callback that records changed rates in `app`'s database"""
+    last_recorded = {}
+
+    def record(rates):
+        if rates == last_recorded:
+            return
+        with app.app_context():
+            added = record_rates(rates, source)
+        last_recorded.clear()
+        last_recorded.update(rates)
+        if added:
+            logger.info(f"Recorded {added} changed exchange rates from {source}")
+    return record
+
+def rate_at(currency, at):
+    """SQL expression for the rate of `currency` valid at `at` (both SQL expressions or values).
+
+    A correlated probe of ix_exchange_rate_currency_effective_at per row.
+    Times before a currency's first recorded rate use that first rate; a
+    currency with no history at all gives NULL.
+    """
+    if isinstance(currency, str):
+        if currency == BASE_CURRENCY:
+            return literal(Decimal(1), ExchangeRate.rate.type)
+        currency = literal(currency)
+    valid = (select(ExchangeRate.rate)
+             .where(ExchangeRate.currency == currency, ExchangeRate.effective_at <= at)
+             .order_by(ExchangeRate.effective_at.desc()).limit(1).scalar_subquery())
+    earliest = (select(ExchangeRate.rate).where(ExchangeRate.currency == currency)
+                .order_by(ExchangeRate.effective_at).limit(1).scalar_subquery())
+    return case((currency == BASE_CURRENCY, literal(Decimal(1), ExchangeRate.rate.type)),
+                else_=func.coalesce(valid, earliest))
+
+def convert_column(amounts, multiply_by, divide_by=None):
+    """amounts * multiply_by [/ divide_by] on Arrow decimal columns, rounded half-even to cents.
+
+    Products are exact; quotients are carried to 21 decimal places before
+    rounding. Nulls propagate.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    amount_type, _ = _arrow_types()
+    result = pc.multiply(amounts, multiply_by)
+    if divide_by is not None:
+        result = pc.divide(result.cast(pa.decimal256(40, 10)), divide_by.cast(pa.decimal256(18, RATE_PLACES)))
+    return pc.round(result, ndigits=2, round_mode='half_to_even').cast(amount_type)
+
+def build_revaluation_query(target, date_filter='all', status='all'):
+    """Bank payments with their USD amount, stored rate and the rates valid at created_at.
+
+    Decimals are read as floats, which is lossless for these column sizes
+    (at most 15 significant digits) and much cheaper to fetch; they become
+    exact Arrow decimals again in revaluation_batch().
+    """
+    stmt = select(
+        Bill.id, Bill.created_at, Bill.bank_currency,
+        cast(Bill.total_amount, Float),
+        cast(Bill.bank_exchange_rate, Float),
+        cast(rate_at(Bill.bank_currency, Bill.created_at), Float),
+        cast(rate_at(target, Bill.created_at), Float),
+    ).where(Bill.bank_currency.isnot(None))
+    return filter_bills(stmt, date_filter, status, 'bank').order_by(Bill.id)
+
+def revaluation_batch(rows, target, revalue_rates=None):
+    """Arrow RecordBatch for rows of build_revaluation_query().
+
+    local_amount is what the patient paid in their bank currency (the stored
+    bank_exchange_rate, else the historical one); target_amount is the USD
+    amount in `target` at created_at. With revalue_rates ({currency: rate}
+    at a revaluation date), revalued_amount is local_amount converted into
+    `target` at that date and fx_difference the change against target_amount.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    amount_type, rate_type = _arrow_types()
+    ids, created, currencies, amounts, stored, historical, target_rates = list(zip(*rows)) or [()] * 7
+    currency = pa.array(currencies, pa.string())
+    amount = pa.array(amounts, pa.float64()).cast(amount_type)
+    local_rate = pc.coalesce(pa.array(stored, pa.float64()), pa.array(historical, pa.float64())).cast(rate_type)
+    target_rate = pa.array(target_rates, pa.float64()).cast(rate_type)
+    local_amount = convert_column(amount, local_rate)
+    columns = {
+        'bill_id': pa.array(ids, pa.int64()),
+        'created_at': pa.array(created, pa.timestamp('us')),
+        'currency': currency,
+        'amount_usd': amount,
+        'local_rate': local_rate,
+        'local_amount': local_amount,
+        'target_rate': target_rate,
+        'target_amount': convert_column(amount, target_rate),
+    }
+    if revalue_rates is not None:
+        # Look the revaluation rates up by currency with a vectorized index/take
+        known = sorted(revalue_rates)
+        values = pa.array([revalue_rates[c] for c in known] + [None], pa.float64()).cast(rate_type)
+        positions = pc.fill_null(pc.index_in(currency, value_set=pa.array(known, pa.string())), len(known))
+        target_at = pa.scalar(_quantize_rate(revalue_rates[target]), rate_type)
+        revalued = convert_column(local_amount, target_at, pc.take(values, positions))
+        columns['revalued_amount'] = revalued
+        columns['fx_difference'] = pc.subtract(revalued, columns['target_amount']).cast(amount_type)
+    return pa.RecordBatch.from_pydict(columns)
+
+def revalue_payments(target, revalue_at=None, batch_size=CONVERSION_BATCH_SIZE, date_filter='all', status='all'):
+    """Yield Arrow RecordBatches of bank payments valued in `target` (see revaluation_batch)"""
+    target = target.upper()
+    revalue_rates = None
+    if revalue_at is not None:
+        revalue_rates = {currency: float(rate) for currency, rate in rates_at(revalue_at).items()}
+        revalue_rates[BASE_CURRENCY] = 1.0
+        if target not in revalue_rates:
+            raise ValueError(f"No {target} rate recorded at or before {revalue_at}")
+    stmt = build_revaluation_query(target, date_filter, status)
+    for rows in iter_export_batches(stmt, batch_size):
+        yield revaluation_batch(rows, target, revalue_rates)
+
+def revaluation_totals(target, revalue_at=None, batch_size=CONVERSION_BATCH_SIZE, **filters):
+    """Per payment currency: count, local amount and value in `target`, aggregated in Arrow"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    totals = defaultdict(lambda: defaultdict(Decimal))
+    measures = ['local_amount', 'target_amount'] + (['revalued_amount', 'fx_difference'] if revalue_at else [])
+    for batch in revalue_payments(target, revalue_at, batch_size, **filters):
+        table = pa.Table.from_batches([batch])
+        # Rows without any rate for their currency (or for target) are left unconverted
+        converted = pc.and_(pc.is_valid(table['local_amount']), pc.is_valid(table['target_amount']))
+        table = table.append_column('unconverted', pc.invert(converted).cast(pa.int64()))
+        grouped = table.group_by('currency').aggregate(
+            [('bill_id', 'count'), ('unconverted', 'sum')] + [(name, 'sum') for name in measures])
+        for row in grouped.to_pylist():
+            bucket = totals[row['currency']]
+            bucket['payments'] += row['bill_id_count']
+            bucket['unconverted'] += row['unconverted_sum']
+            for name in measures:
+                bucket[name] += row[f"{name}_sum"] or 0
+    return {currency: {name: (int(value) if name in ('payments', 'unconverted') else str(value))
+                       for name, value in values.items()}
+            for currency, values in sorted(totals.items())}
+
+def write_revaluation(path, file_format, target, revalue_at=None, batch_size=CONVERSION_BATCH_SIZE, **filters):
+    """Write revalued payments to a Parquet, Arrow IPC or CSV file; returns the row count"""
+    import pyarrow as pa
+    if file_format not in REVALUATION_FORMATS:
+        raise ValueError(f"Unknown format: {file_format}")
+    writer = None
+    written = 0
+
+    def open_writer(schema):
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+            return pq.ParquetWriter(path, schema, compression='zstd')
+        if file_format == 'arrow':
+            return pa.ipc.new_file(path, schema)
+        import pyarrow.csv as pa_csv
+        return pa_csv.CSVWriter(path, schema)
+
+    try:
+        for batch in revalue_payments(target, revalue_at, batch_size, **filters):
+            if writer is None:
+                writer = open_writer(batch.schema)
+            writer.write_batch(batch)
+            written += batch.num_rows
+        if writer is None:
+            # No matching payments: still leave a file with the header/schema
+            empty = revaluation_batch([], target.upper(), {target.upper(): 1.0} if revalue_at else None)
+            writer = open_writer(empty.schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
@@ -0,0 +1,173 @@
+"""Primary/replica routing for the SQLAlchemy session, and per-role pools.
+
+Writes, and every read in a session that has already written, go to the
+primary (DATABASE_URL). Plain SELECTs made in @replica_reads views or inside
+a reading_from_replicas() block (batch jobs) go to one of the replicas in
+DATABASE_REPLICA_URLS, picked once per session. A client whose request wrote
+gets a short-lived cookie that keeps its next requests on the primary, so it
+reads its own writes despite replication lag. With no replicas configured
+every statement goes to the primary, as before.
+"""
+import time
+import random
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from metrics import db_pool_wait, db_pool_timeouts, db_routed
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+REPLICA_BIND_PREFIX = 'replica_'  # SQLALCHEMY_BINDS keys: replica_0, replica_1, ...
+STICKY_COOKIE = 'db_primary_until'
+
+# session.info keys
+ROLE_KEY = 'db_role'        # REPLICA when this session's reads may use a replica
+REPLICA_KEY = 'db_replica'  # the replica engine picked for this session
+WROTE_KEY = 'db_wrote'      # set once the session flushes or runs DML
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records checkout waits and timeouts, labelled by pool name"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts.inc(self.logging_name)
+            raise
+        finally:
+            db_pool_wait.observe(time.perf_counter() - started, self.logging_name)
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends eligible reads to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if self._flushing or getattr(clause, 'is_dml', False):
+            self.info[WROTE_KEY] = True
+        elif (bind is None and self.info.get(ROLE_KEY) == REPLICA and not self.info.get(WROTE_KEY)
+              and _is_plain_select(clause) and engine is self._db.engine):
+            replica = self._replica()
+            if replica is not None:
+                db_routed.inc(REPLICA)
+                return replica
+        db_routed.inc(PRIMARY)
+        return engine
+
+    def _replica(self):
+        engine = self.info.get(REPLICA_KEY)
+        if engine is None:
+            replicas = [engine for key, engine in self._db.engines.items()
+                        if key is not None and key.startswith(REPLICA_BIND_PREFIX)]
+            if not replicas:
+                return None
+            engine = self.info[REPLICA_KEY] = random.choice(replicas)
+        return engine
+
+def _is_plain_select(clause):
+    # SELECT ... FOR UPDATE takes locks, so it belongs on the primary
+    return getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+def _pool_options(url, name, size, overflow, config):
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}  # Flask-SQLAlchemy uses a StaticPool (one shared connection) here
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_logging_name': name,
+        'pool_size': size,
+        'max_overflow': overflow,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+
+def configure_engines(config):
+    """Derive SQLALCHEMY_ENGINE_OPTIONS and the replica SQLALCHEMY_BINDS from the DB_* settings"""
+    options = {'pool_recycle': 300, 'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    if config.get('SQLALCHEMY_DATABASE_URI'):
+        options.update(_pool_options(config['SQLALCHEMY_DATABASE_URI'], PRIMARY,
+                                     config['DB_POOL_SIZE'], config['DB_MAX_OVERFLOW'], config))
+    # Explicit SQLALCHEMY_ENGINE_OPTIONS (e.g. create_app overrides) win
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    for n, url in enumerate(config['DATABASE_REPLICA_URLS']):
+        name = f"{REPLICA_BIND_PREFIX}{n}"
+        binds[name] = {'url': url, **_pool_options(url, name, config['DB_REPLICA_POOL_SIZE'],
+                                                   config['DB_REPLICA_MAX_OVERFLOW'], config)}
+    config['SQLALCHEMY_BINDS'] = binds
+
+def init_routing(app):
+    """Configure the engines (before db.init_app) and the read-your-writes cookie"""
+    configure_engines(app.config)
+    if app.config['DATABASE_REPLICA_URLS']:
+        app.after_request(_pin_writer_to_primary)
+
+def _session():
+    return current_app.extensions['sqlalchemy'].session
+
+def _pinned_to_primary():
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def _pin_writer_to_primary(response):
+    session = _session()
+    if session.registry.has() and session.info.get(WROTE_KEY):
+        seconds = current_app.config['REPLICA_STICKY_SECONDS']
+        response.set_cookie(STICKY_COOKIE, f"{time.time() + seconds:.3f}", max_age=seconds,
+                            secure=True, httponly=True, samesite='Lax')
+    return response
+
+def replica_reads(view):
+    """Route decorator: the view's reads may be served by a replica.
+
+    Skipped for clients that wrote within REPLICA_STICKY_SECONDS."""
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        if not _pinned_to_primary():
+            _session().info[ROLE_KEY] = REPLICA
+        return view(*args, **kwargs)
+    return decorated
+
+@contextmanager
+def reading_from_replicas():
+    """Send reads made in this block to a replica (batch jobs that tolerate lag)"""
+    session = _session()
+    previous = session.info.get(ROLE_KEY)
+    session.info[ROLE_KEY] = REPLICA
+    try:
+        yield
+    finally:
+        if previous is None:
+            session.info.pop(ROLE_KEY, None)
+        else:
+            session.info[ROLE_KEY] = previous
+
+def refresh_sqlite_replicas(db):
+    """Copy the primary SQLite database into each SQLite replica; returns their bind keys.
+
+    For trying replica routing locally: there is no replication between
+    SQLite files, so replicas only see what existed at the last refresh.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        raise ValueError("the primary is not SQLite")
+    refreshed = []
+    source = db.engine.raw_connection()
+    try:
+        for key, engine in db.engines.items():
+            if key is None or not key.startswith(REPLICA_BIND_PREFIX) or engine.dialect.name != 'sqlite':
+                continue
+            target = engine.raw_connection()
+            try:
+                source.driver_connection.backup(target.driver_connection)
+            finally:
+                target.close()
+            refreshed.append(key)
+    finally:
+        source.close()
+    return refreshed
@@ -0,0 +1,200 @@
+import os
+import json
+import queue
+import logging
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Server-Sent Events settings
+EVENT_POLL_INTERVAL = 1.0  # seconds between checks of the rate snapshots and status feed
+SSE_HEARTBEAT = 20  # comment line sent on idle connections so proxies keep them open
+SSE_RETRY_MS = 5000
+SUBSCRIBER_QUEUE_SIZE = 100  # a client this far behind is dropped and reconnects
+# Each poll re-reads this much of the status feed behind its cursor, so a
+# transaction that commits after a newer one is still seen; re-read rows are
+# de-duplicated by (id, version)
+STATUS_FEED_OVERLAP = timedelta(seconds=5)
+STATUS_FEED_BATCH = 500
+
+EVENT_TOPICS = ('rates', 'prices', 'status')
+
+Event = namedtuple('Event', 'topic data bill_id')
+
+def sse_supported():
+    """True when running under a gevent worker, where an idle stream costs a greenlet, not a thread"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+def format_sse(event):
+    return f"event: {event.topic}\ndata: {json.dumps(event.data, separators=(',', ':'))}\n\n"
+
+class Subscription:
+    """One connected client: the topics and bills it follows and its pending events"""
+
+    def __init__(self, topics, bill_ids=None):
+        self.topics = set(topics)
+        self.bill_ids = bill_ids
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+    def wants(self, event):
+        if event.topic not in self.topics:
+            return False
+        return event.bill_id is None or self.bill_ids is None or event.bill_id in self.bill_ids
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.closed = True
+
+class EventHub:
+    """Pushes rate snapshots and bill status deltas to every subscriber in this process.
+
+    A single poller per process, however many clients are connected, compares
+    the rate refreshers' snapshots with what was last sent and reads the
+    (updated_at, id) status feed with an overlap; only changes are fanned out. New
+    subscribers get the current rates straight away.
+    """
+
+    def __init__(self, app, rate_sources, status_changes, interval=EVENT_POLL_INTERVAL):
+        self.app = app
+        self.rate_sources = rate_sources  # {topic: (RateRefresher, payload key)}
+        self.status_changes = status_changes  # callable(cursor, limit=, rewind=) -> (rows, next cursor)
+        self.interval = interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_rates = {}
+        self._status_cursor = None
+        self._published = {}  # bill id -> (version, updated_at) sent within the overlap
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the poller once per process (safe to call repeatedly)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._subscribers = set()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self, topics, bill_ids=None):
+        self.start()
+        subscription = Subscription(topics, bill_ids)
+        for topic in subscription.topics & set(self.rate_sources):
+            subscription.offer(self._rate_event(topic))
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.wants(event):
+                subscription.offer(event)
+
+    def _rate_event(self, topic):
+        refresher, key = self.rate_sources[topic]
+        snapshot = refresher.current()
+        return Event(topic, {key: dict(snapshot.values), 'is_live': snapshot.is_live, 'live': snapshot.liveness(),
+                             'timestamp': snapshot.fetched_at}, None)
+
+    def _poll_rates(self):
+        for topic, (_, key) in self.rate_sources.items():
+            event = self._rate_event(topic)
+            signature = (event.data[key], event.data['live'])
+            if self._last_rates.get(topic) != signature:
+                self._last_rates[topic] = signature
+                self.publish(event)
+
+    def _read_status_changes(self):
+        rows, cursor = self.status_changes(self._status_cursor, limit=STATUS_FEED_BATCH, rewind=STATUS_FEED_OVERLAP)
+        changes = list(rows)
+        while len(rows) == STATUS_FEED_BATCH:
+            rows, cursor = self.status_changes(cursor, limit=STATUS_FEED_BATCH)
+            changes.extend(rows)
+        self._status_cursor = cursor
+        return changes
+
+    def _poll_status(self):
+        if not any('status' in s.topics for s in list(self._subscribers)):
+            # Nobody is listening; pick the feed up from "now" when someone does
+            self._status_cursor = None
+            self._published = {}
+            return
+        with self.app.app_context():
+            try:
+                starting = self._status_cursor is None
+                if starting:
+                    _, self._status_cursor = self.status_changes(None)
+                rows = self._read_status_changes()
+            finally:
+                db.session.remove()
+        for row in rows:
+            sent = self._published.get(row.id)
+            if sent is not None and sent[0] >= row.version:
+                continue
+            self._published[row.id] = (row.version, row.updated_at)
+            if starting:
+                # Changes behind the starting position predate every subscriber
+                continue
+            self.publish(Event('status', {
+                'id': row.id,
+                'payment_status': row.payment_status,
+                'claim_status': row.claim_status,
+                'claim_number': row.claim_number,
+                'version': row.version
+            }, row.id))
+        if rows:
+            # Older entries are behind every future re-read window
+            keep_after = max(row.updated_at for row in rows) - STATUS_FEED_OVERLAP
+            self._published = {bill_id: sent for bill_id, sent in self._published.items() if sent[1] >= keep_after}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._poll_rates()
+                self._poll_status()
+            except Exception as e:
+                logger.error(f"Event hub poll failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def stream(self, subscription):
+        """Yield the SSE body for one subscription until the client goes away"""
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while not subscription.closed:
+                try:
+                    event = subscription.queue.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,181 @@
+import io
+import csv
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, tuple_, types
+from models import db, Bill, Diagnosis, Procedure, InsuranceClaim, ExportWatermark, filter_bills
+
+logger = logging.getLogger(__name__)
+
+# Export settings
+EXPORT_BATCH_SIZE = 5000
+# Rows changed within this window are left for the next incremental run, so
+# transactions still in flight when the export starts are not skipped.
+EXPORT_WATERMARK_LAG = timedelta(minutes=1)
+
+# Exported columns per entity. Bank account and routing numbers are never exported.
+EXPORT_ENTITIES = {
+    'bills': (Bill, (
+        Bill.id, Bill.created_at, Bill.updated_at, Bill.patient_name, Bill.email,
+        Bill.insurance_provider, Bill.policy_number, Bill.diagnoses_subtotal,
+        Bill.procedures_subtotal, Bill.total_amount, Bill.payment_status,
+        Bill.payment_method, Bill.transaction_hash, Bill.payment_currency,
+        Bill.crypto_amount, Bill.bank_name, Bill.bank_currency, Bill.bank_exchange_rate,
+        Bill.claim_status, Bill.claim_submission_date, Bill.claim_number,
+    )),
+    'diagnoses': (Diagnosis, (
+        Diagnosis.id, Diagnosis.bill_id, Diagnosis.updated_at, Diagnosis.icd10_code,
+        Diagnosis.description, Diagnosis.amount,
+    )),
+    'procedures': (Procedure, (
+        Procedure.id, Procedure.bill_id, Procedure.updated_at, Procedure.cpt_code,
+        Procedure.description, Procedure.amount,
+    )),
+    'claims': (InsuranceClaim, (
+        InsuranceClaim.id, InsuranceClaim.bill_id, InsuranceClaim.updated_at,
+        InsuranceClaim.payer_id, InsuranceClaim.payer_name, InsuranceClaim.date_of_service,
+        InsuranceClaim.place_of_service, InsuranceClaim.status, InsuranceClaim.submitted_at,
+        InsuranceClaim.claim_number, InsuranceClaim.response_message,
+    )),
+}
+
+def export_columns(entity):
+    return [column.key for column in EXPORT_ENTITIES[entity][1]]
+
+def build_export_query(entity, date_filter='all', status='all', method='all', since=None, until=None):
+    """SELECT for one entity with the dashboard filters applied to the owning bill.
+
+    With `since` (an (updated_at, id) pair) only rows changed after that
+    position are selected, ordered by (updated_at, id) so the last row read
+    becomes the next watermark.
+    """
+    if entity not in EXPORT_ENTITIES:
+        raise ValueError(f"Unknown export entity: {entity}")
+    model, columns = EXPORT_ENTITIES[entity]
+    stmt = select(*columns)
+    if model is not Bill:
+        stmt = stmt.join(Bill, model.bill_id == Bill.id)
+    stmt = filter_bills(stmt, date_filter, status, method)
+
+    if since is not None:
+        stmt = stmt.where(tuple_(model.updated_at, model.id) > tuple_(*since))
+    if until is not None:
+        stmt = stmt.where(model.updated_at <= until)
+    if since is not None or until is not None:
+        return stmt.order_by(model.updated_at, model.id)
+    return stmt.order_by(model.id)
+
+def iter_export_batches(stmt, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of rows using a server-side cursor, so memory stays flat"""
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield partition
+
+def stream_csv(entity, batch_size=EXPORT_BATCH_SIZE, **filters):
+    """Yield an entity export as CSV text, one chunk per fetched batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(entity))
+    yield buffer.getvalue()
+    for rows in iter_export_batches(build_export_query(entity, **filters), batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+def _arrow_schema(entity):
+    import pyarrow as pa
+
+    fields = []
+    for column in EXPORT_ENTITIES[entity][1]:
+        sql_type = column.type
+        if isinstance(sql_type, types.Integer):
+            arrow_type = pa.int64()
+        elif isinstance(sql_type, types.Numeric):
+            arrow_type = pa.decimal128(sql_type.precision, sql_type.scale)
+        elif isinstance(sql_type, types.DateTime):
+            arrow_type = pa.timestamp('us')
+        elif isinstance(sql_type, types.Date):
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.key, arrow_type))
+    return pa.schema(fields)
+
+def write_columnar(entity, path, file_format='parquet', batch_size=EXPORT_BATCH_SIZE, on_batch=None, **filters):
+    """Write an entity export to a Parquet or Arrow IPC file, one record batch per fetch.
+
+    Returns the number of rows written. `on_batch` is called with each list
+    of rows after it has been written.
+    """
+    import pyarrow as pa
+
+    schema = _arrow_schema(entity)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(path, schema, compression='zstd')
+        write = writer.write_batch
+    elif file_format == 'arrow':
+        writer = pa.ipc.new_file(path, schema)
+        write = writer.write_batch
+    else:
+        raise ValueError(f"Unknown columnar format: {file_format}")
+
+    written = 0
+    try:
+        for rows in iter_export_batches(build_export_query(entity, **filters), batch_size):
+            arrays = [
+                pa.array([row[i] for row in rows], type=field.type)
+                for i, field in enumerate(schema)
+            ]
+            write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+            written += len(rows)
+            if on_batch:
+                on_batch(rows)
+    finally:
+        writer.close()
+    return written
+
+def write_csv(entity, path, batch_size=EXPORT_BATCH_SIZE, on_batch=None, **filters):
+    """Write an entity export to a CSV file and return the number of rows written"""
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(export_columns(entity))
+        for rows in iter_export_batches(build_export_query(entity, **filters), batch_size):
+            writer.writerows(rows)
+            written += len(rows)
+            if on_batch:
+                on_batch(rows)
+    return written
+
+def run_incremental_export(entity, path, file_format='csv', batch_size=EXPORT_BATCH_SIZE, **filters):
+    """Export rows changed since the entity's stored watermark, then advance it.
+
+    The watermark only moves after the file has been written completely, so a
+    failed run is simply repeated from the same position next time.
+    """
+    watermark = db.session.get(ExportWatermark, entity)
+    since = (watermark.updated_at, watermark.last_id) if watermark else None
+    until = datetime.utcnow() - EXPORT_WATERMARK_LAG
+
+    columns = export_columns(entity)
+    updated_at_index, id_index = columns.index('updated_at'), columns.index('id')
+    last_seen = {}
+
+    def remember_last(rows):
+        last_seen['position'] = (rows[-1][updated_at_index], rows[-1][id_index])
+
+    if file_format == 'csv':
+        written = write_csv(entity, path, batch_size, remember_last, since=since, until=until, **filters)
+    else:
+        written = write_columnar(entity, path, file_format, batch_size, remember_last, since=since, until=until, **filters)
+
+    if 'position' in last_seen:
+        if watermark is None:
+            watermark = ExportWatermark(name=entity)
+            db.session.add(watermark)
+        watermark.updated_at, watermark.last_id = last_seen['position']
+        db.session.commit()
+    logger.info(f"Incremental export of {entity}: {written} rows to {path}")
+    return written
@@ -0,0 +1,132 @@
+"""Local stand-in for the exchange-rate and Coinbase APIs.
+
+Lets the rate refreshers be exercised offline, including slow and failing
+upstreams. Point the app at it with:
+
+    python fake_upstream.py --port 8765 --latency 0.5
+    EXCHANGE_RATE_API_URL=http://127.0.0.1:8765/v4/latest/USD \\
+    COINBASE_API_URL=http://127.0.0.1:8765/v2/exchange-rates \\
+    COINBASE_COMMERCE_API_KEY=test python main.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DEFAULT_FIAT_RATES = {
+    'USD': 1.0, 'EUR': 0.92, 'GBP': 0.79, 'JPY': 149.5,
+    'CAD': 1.36, 'AUD': 1.52, 'CNY': 7.24
+}
+
+DEFAULT_CRYPTO_PRICES = {
+    'BTC': 67000.00, 'ETH': 3400.00, 'USDT': 1.00, 'USDC': 1.00
+}
+
+class FakeUpstream:
+    """Threaded HTTP server with mutable rates and failure injection.
+
+    ``failures`` maps a currency symbol (or ``'fiat'`` for the exchange-rate
+    API) to the HTTP status to return instead of data; ``latency`` delays
+    every response. Both can be changed while the server is running.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.fiat_rates = dict(DEFAULT_FIAT_RATES)
+        self.crypto_prices = dict(DEFAULT_CRYPTO_PRICES)
+        self.failures = {}
+        self.latency = latency
+        self.request_count = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def exchange_rate_url(self):
+        return f"{self.base_url}/v4/latest/USD"
+
+    @property
+    def coinbase_url(self):
+        return f"{self.base_url}/v2/exchange-rates"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler_class(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                upstream.request_count += 1
+                if upstream.latency:
+                    time.sleep(upstream.latency)
+
+                url = urlparse(self.path)
+                if url.path == '/v4/latest/USD':
+                    key = 'fiat'
+                    body = {'base': 'USD', 'rates': upstream.fiat_rates}
+                elif url.path == '/v2/exchange-rates':
+                    key = parse_qs(url.query).get('currency', [''])[0].upper()
+                    if key not in upstream.crypto_prices:
+                        return self._send(404, {'error': f'Unknown currency {key}'})
+                    body = {'data': {'currency': key, 'rates': {'USD': str(upstream.crypto_prices[key])}}}
+                else:
+                    return self._send(404, {'error': 'Not found'})
+
+                status = upstream.failures.get(key)
+                if status:
+                    return self._send(status, {'error': 'Injected failure'})
+                self._send(200, body)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to delay each response.')
+    parser.add_argument('--fail', action='append', default=[], metavar='KEY=STATUS',
+                        help="Inject a failure, e.g. BTC=502 or fiat=500. Repeatable.")
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.host, args.port, args.latency)
+    for spec in args.fail:
+        key, status = spec.split('=')
+        upstream.failures[key.upper() if key != 'fiat' else key] = int(status)
+
+    print(f"Fake upstream listening on {upstream.base_url}")
+    try:
+        upstream._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
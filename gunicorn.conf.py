@@ -0,0 +1,29 @@
+import os
+
+# gevent workers hold each idle /api/events stream as a greenlet, so one
+# process can keep tens of thousands of connections open.
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 10000))
+keepalive = 75
+timeout = 30
+
+def post_fork(server, worker):
+    # Make psycopg2 cooperative so a slow query does not block every greenlet
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return
+    patch_psycopg()
+
+def post_worker_init(worker):
+    # Build the in-memory patient name index (search.py) now, not on the first search
+    app = worker.wsgi
+    app.extensions['billing']['name_index'].warm(app)
+
+def on_starting(server):
+    # Worker metric snapshots from a previous run would otherwise be summed in
+    from metrics import clear_snapshots
+    directory = os.environ.get('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics'))
+    clear_snapshots(directory)
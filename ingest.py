@@ -0,0 +1,432 @@
+import io
+import csv
+import json
+import logging
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import insert, text
+from models import db, Bill, Diagnosis, Procedure
+from catalog import CODE_LABELS
+from rollups import BILL_ROLLUP, apply_rollup_changes
+
+logger = logging.getLogger(__name__)
+
+# Bulk ingestion settings
+INGEST_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+CENTS = Decimal('0.01')
+
+class BillValidationError(ValueError):
+    """Raised when a submitted bill fails validation"""
+
+def _field(data, *names, max_length=None, required=False):
+    """Return the first non-empty value among `names`, stripped, or None"""
+    for name in names:
+        value = data.get(name)
+        if value not in (None, ''):
+            value = str(value).strip()
+            if max_length and len(value) > max_length:
+                raise BillValidationError(f"{names[0]} must be at most {max_length} characters")
+            return value
+    if required:
+        raise BillValidationError(f"{names[0]} is required")
+    return None
+
+def _parse_amount(value, field):
+    try:
+        amount = Decimal(str(value)).quantize(CENTS)
+    except (InvalidOperation, TypeError, ValueError):
+        raise BillValidationError(f"{field} must be a number")
+    if amount < 0 or not amount.is_finite():
+        raise BillValidationError(f"{field} must be a non-negative amount")
+    return amount
+
+def _parse_date(value, field):
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value).strip())
+    except ValueError:
+        raise BillValidationError(f"{field} must be a date in YYYY-MM-DD format")
+
+def _parse_line_item(item, code_names, code_field):
+    if not isinstance(item, dict):
+        raise BillValidationError(f"{code_field} line items must be objects")
+    # amount stays None when the item has none, so a catalog price can fill it
+    amount = item.get('amount', item.get('price'))
+    return {
+        code_field: _field(item, *code_names, max_length=10, required=True),
+        'description': _field(item, 'description', max_length=200),
+        'amount': None if amount is None else _parse_amount(amount, 'amount'),
+    }
+
+def _list_field(data, name):
+    value = data.get(name) or []
+    if not isinstance(value, list):
+        raise BillValidationError(f"{name} must be a list")
+    return list(value)
+
+LINE_ITEM_CODES = (('diagnoses', 'icd10_code', 'icd10'), ('procedures', 'cpt_code', 'cpt'))
+
+def _apply_catalog(bill, catalog):
+    """Reject codes missing from the catalog and fill blanks from its entries.
+
+    Codes are stored in catalog form (E11.9 rather than e119); a missing
+    description, or a missing procedure amount, is taken from the entry.
+    """
+    for key, code_field, system in LINE_ITEM_CODES:
+        index = catalog.index(system)
+        if index is None or not bill[key]:
+            continue
+        entries = index.lookup_many(item[code_field] for item in bill[key])
+        unknown = [code for code, entry in entries.items() if entry is None]
+        if unknown:
+            raise BillValidationError(f"Unknown {CODE_LABELS[system]} codes: {', '.join(sorted(unknown))}")
+        for item in bill[key]:
+            entry = entries[item[code_field]]
+            item[code_field] = entry.code
+            if not item['description']:
+                item['description'] = entry.description[:200]
+            if item['amount'] is None and entry.price is not None:
+                item['amount'] = Decimal(entry.price)
+
+def parse_bill_payload(data, catalog=None):
+    """Validate a bill submission and return normalized column values.
+
+    Accepts both the camelCase form posted by billing.js (with ``services``
+    grouped by tab) and the snake_case form used by batch uploads. With a
+    CodeCatalog, diagnosis and procedure codes are checked against it.
+    """
+    if not isinstance(data, dict):
+        raise BillValidationError("Bill must be a JSON object")
+
+    email = _field(data, 'email', max_length=120, required=True)
+    if '@' not in email:
+        raise BillValidationError("email must be a valid email address")
+
+    insurance = _field(data, 'insurance_provider', 'insurance', max_length=100)
+    if insurance and insurance.lower() == 'none':
+        insurance = None
+
+    diagnoses_in = _list_field(data, 'diagnoses')
+    procedures_in = _list_field(data, 'procedures')
+    services = data.get('services') or {}
+    if not isinstance(services, dict):
+        raise BillValidationError("services must be an object of procedure lists")
+    for tab, service_list in services.items():
+        if not isinstance(service_list, (list, type(None))):
+            raise BillValidationError(f"services.{tab} must be a list")
+        procedures_in.extend(service_list or [])
+
+    bill = {
+        'patient_name': _field(data, 'patient_name', 'patientName', max_length=100, required=True),
+        'patient_dob': _parse_date(_field(data, 'patient_dob', 'patientDOB', required=True), 'patient_dob'),
+        'email': email,
+        'insurance_provider': insurance,
+        'policy_number': _field(data, 'policy_number', 'policyNumber', max_length=50),
+        'payment_method': _field(data, 'payment_method', 'paymentMethod', max_length=20),
+        'diagnoses': [_parse_line_item(d, ('icd10_code', 'code'), 'icd10_code') for d in diagnoses_in],
+        'procedures': [_parse_line_item(p, ('cpt_code', 'code'), 'cpt_code') for p in procedures_in],
+    }
+    if catalog is not None:
+        _apply_catalog(bill, catalog)
+    for item in bill['diagnoses'] + bill['procedures']:
+        if item['amount'] is None:
+            item['amount'] = Decimal('0.00')
+    bill['diagnoses_subtotal'] = sum((d['amount'] for d in bill['diagnoses']), Decimal('0.00'))
+    bill['procedures_subtotal'] = sum((p['amount'] for p in bill['procedures']), Decimal('0.00'))
+    bill['total_amount'] = bill['diagnoses_subtotal'] + bill['procedures_subtotal']
+    return bill
+
+RELATIONSHIPS = ('self', 'spouse', 'child', 'other')
+PLACES_OF_SERVICE = ('11', '21', '22', '23')
+
+def parse_claim_payload(data):
+    """Validate an insurance claim submission from claim.js and return column values"""
+    if not isinstance(data, dict):
+        raise BillValidationError("Claim must be a JSON object")
+
+    try:
+        bill_id = int(_field(data, 'bill_id', 'billId', required=True))
+    except ValueError:
+        raise BillValidationError("bill_id must be an integer")
+
+    relationship = (_field(data, 'relationship_to_subscriber', 'relationshipToSubscriber') or 'self').lower()
+    if relationship not in RELATIONSHIPS:
+        raise BillValidationError(f"relationship_to_subscriber must be one of {', '.join(RELATIONSHIPS)}")
+    place_of_service = _field(data, 'place_of_service', 'placeOfService') or '11'
+    if place_of_service not in PLACES_OF_SERVICE:
+        raise BillValidationError(f"place_of_service must be one of {', '.join(PLACES_OF_SERVICE)}")
+
+    return {
+        'bill_id': bill_id,
+        'payer_id': _field(data, 'payer_id', 'payerId', max_length=50, required=True),
+        'payer_name': _field(data, 'payer_name', 'payerName', max_length=100, required=True),
+        'subscriber_id': _field(data, 'subscriber_id', 'subscriberId', max_length=50, required=True),
+        'subscriber_name': _field(data, 'subscriber_name', 'subscriberName', max_length=100, required=True),
+        'subscriber_dob': _parse_date(_field(data, 'subscriber_dob', 'subscriberDOB', required=True), 'subscriber_dob'),
+        'relationship_to_subscriber': relationship,
+        'date_of_service': _parse_date(_field(data, 'date_of_service', 'dateOfService', required=True), 'date_of_service'),
+        'place_of_service': place_of_service,
+    }
+
+PAYMENT_METHODS = ('bank', 'crypto')
+# Stored lower-case, so the unique index on open bills' hashes sees every spelling as one
+TRANSACTION_HASH_RE = re.compile(r'0x[0-9a-f]{64}')
+
+def parse_payment_payload(data):
+    """Validate a payment submission from payment.js and return the Bill fields to set"""
+    if not isinstance(data, dict):
+        raise BillValidationError("Payment must be a JSON object")
+    try:
+        bill_id = int(_field(data, 'bill_id', 'billId', required=True))
+    except ValueError:
+        raise BillValidationError("bill_id must be an integer")
+    method = _field(data, 'payment_method', 'paymentMethod', required=True).lower()
+    if method not in PAYMENT_METHODS:
+        raise BillValidationError(f"payment_method must be one of {', '.join(PAYMENT_METHODS)}")
+    currency = _field(data, 'currency', max_length=10, required=True).upper()
+
+    payment = {'bill_id': bill_id, 'payment_method': method}
+    if method == 'bank':
+        payment.update({
+            'bank_name': _field(data, 'bank_name', 'bankName', max_length=100, required=True),
+            'account_number': _field(data, 'account_number', 'accountNumber', max_length=50, required=True),
+            'routing_number': _field(data, 'routing_number', 'routingNumber', max_length=50, required=True),
+            'bank_currency': currency[:3],
+        })
+    else:
+        transaction_hash = _field(data, 'transaction_hash', 'transactionHash', max_length=66)
+        if transaction_hash is not None:
+            transaction_hash = transaction_hash.lower()
+            if not TRANSACTION_HASH_RE.fullmatch(transaction_hash):
+                raise BillValidationError("transaction_hash must be 0x followed by 64 hex digits")
+        payment.update({
+            'payment_currency': currency,
+            'transaction_hash': transaction_hash,
+        })
+        crypto_amount = _field(data, 'crypto_amount', 'cryptoAmount')
+        if crypto_amount is not None:
+            try:
+                payment['crypto_amount'] = Decimal(crypto_amount)
+            except InvalidOperation:
+                raise BillValidationError("crypto_amount must be a number")
+    return payment
+
+DERIVED_KEYS = ('diagnoses', 'procedures', 'diagnoses_subtotal', 'procedures_subtotal', 'total_amount')
+
+def create_bill(payload):
+    """Insert one validated bill through the ORM and return it.
+
+    Subtotals and total_amount are left to the totals maintenance events,
+    which derive them from the line items as they are flushed.
+    """
+    bill = Bill(**{k: v for k, v in payload.items() if k not in DERIVED_KEYS})
+    bill.diagnoses = [Diagnosis(**d) for d in payload['diagnoses']]
+    bill.procedures = [Procedure(**p) for p in payload['procedures']]
+    db.session.add(bill)
+    db.session.commit()
+    return bill
+
+def iter_ndjson_bills(stream):
+    """Yield (line_number, raw_bill_or_exception) from an NDJSON byte stream"""
+    for line_number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, BillValidationError(f"Invalid JSON: {e.msg}")
+
+CSV_BILL_COLUMNS = ('patient_name', 'patient_dob', 'email', 'insurance_provider', 'policy_number', 'payment_method')
+
+def iter_csv_bills(stream):
+    """Yield (line_number, raw_bill) from a CSV byte stream.
+
+    Each CSV row is one line item. Consecutive rows sharing a ``bill_ref``
+    belong to the same bill; the bill columns are taken from its first row and
+    ``item_type`` ('diagnosis' or 'procedure'), ``code``, ``description`` and
+    ``amount`` describe the line item. Rows with an empty item_type only carry
+    the bill itself.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+    current_ref, current, start_line = None, None, None
+    for row in reader:
+        line_number = reader.line_num
+        ref = row.get('bill_ref') or f"line-{line_number}"
+        if ref != current_ref:
+            if current is not None:
+                yield start_line, current
+            current_ref, start_line = ref, line_number
+            current = {name: row.get(name) for name in CSV_BILL_COLUMNS}
+            current['diagnoses'], current['procedures'] = [], []
+
+        item_type = (row.get('item_type') or '').strip().lower()
+        item = {'code': row.get('code'), 'description': row.get('description'), 'amount': row.get('amount')}
+        if item_type == 'diagnosis':
+            current['diagnoses'].append(item)
+        elif item_type == 'procedure':
+            current['procedures'].append(item)
+        elif item_type:
+            current.setdefault('_errors', []).append(f"Unknown item_type '{item_type}' on line {line_number}")
+    if current is not None:
+        yield start_line, current
+
+class IngestResult:
+    """Running totals and per-row errors for one batch upload"""
+
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.errors = []
+        self.error_count = 0
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'failed': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors)
+        }
+
+def _is_postgresql(connection):
+    return connection.dialect.name == 'postgresql'
+
+def _copy_rows(connection, table, columns, rows):
+    """Load rows with PostgreSQL COPY FROM STDIN"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+    buffer.seek(0)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '')",
+            buffer
+        )
+
+BILL_INSERT_COLUMNS = (
+    'patient_name', 'patient_dob', 'email', 'insurance_provider', 'policy_number',
+    'payment_method', 'diagnoses_subtotal', 'procedures_subtotal', 'total_amount',
+    'created_at', 'updated_at', 'payment_status', 'claim_status'
+)
+ITEM_COLUMNS = {
+    'diagnosis': ('bill_id', 'icd10_code', 'description', 'amount', 'updated_at'),
+    'procedure': ('bill_id', 'cpt_code', 'description', 'amount', 'updated_at'),
+}
+
+def _bill_row(bill, now):
+    return {
+        **{name: bill.get(name) for name in BILL_INSERT_COLUMNS},
+        'created_at': now,
+        'updated_at': now,
+        'payment_status': 'pending',
+        'claim_status': 'pending'
+    }
+
+def _item_rows(bills, bill_ids, key, columns, now):
+    return [
+        {'bill_id': bill_id, 'updated_at': now, **{c: item[c] for c in columns if c in item}}
+        for bill, bill_id in zip(bills, bill_ids)
+        for item in bill[key]
+    ]
+
+def insert_bills_bulk(bills):
+    """Insert validated bills and their line items in one transaction.
+
+    Uses multi-row INSERT ... RETURNING for bills and executemany for line
+    items; on PostgreSQL, bill ids are reserved from the sequence and all three
+    tables are loaded with COPY. Returns the new bill ids in input order.
+    """
+    now = datetime.utcnow()
+    connection = db.session.connection()
+    if _is_postgresql(connection):
+        bill_ids = [row[0] for row in connection.execute(
+            text("SELECT nextval(pg_get_serial_sequence('bill', 'id')) FROM generate_series(1, :n)"),
+            {'n': len(bills)}
+        )]
+        bill_rows = [_bill_row(bill, now) for bill in bills]
+        _copy_rows(connection, 'bill', ('id',) + BILL_INSERT_COLUMNS, [
+            [bill_id] + [row[c] for c in BILL_INSERT_COLUMNS]
+            for row, bill_id in zip(bill_rows, bill_ids)
+        ])
+        for table, key in (('diagnosis', 'diagnoses'), ('procedure', 'procedures')):
+            columns = ITEM_COLUMNS[table]
+            _copy_rows(connection, table, columns, [
+                [row[c] for c in columns] for row in _item_rows(bills, bill_ids, key, columns, now)
+            ])
+        apply_rollup_changes(connection, BILL_ROLLUP, {}, bill_ids)
+        return bill_ids
+
+    result = db.session.execute(
+        insert(Bill).returning(Bill.id, sort_by_parameter_order=True),
+        [_bill_row(bill, now) for bill in bills]
+    )
+    bill_ids = [row[0] for row in result]
+    for model, table, key in ((Diagnosis, 'diagnosis', 'diagnoses'), (Procedure, 'procedure', 'procedures')):
+        rows = _item_rows(bills, bill_ids, key, ITEM_COLUMNS[table], now)
+        if rows:
+            db.session.execute(insert(model), rows)
+    apply_rollup_changes(connection, BILL_ROLLUP, {}, bill_ids)
+    return bill_ids
+
+def _flush_batch(batch, result):
+    """Commit one bounded batch; on failure, retry its bills one at a time"""
+    bills = [bill for _, bill in batch]
+    try:
+        insert_bills_bulk(bills)
+        db.session.commit()
+        result.inserted += len(bills)
+        return
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Bulk insert of {len(bills)} bills failed, isolating bad rows: {str(e)}")
+
+    for line, bill in batch:
+        try:
+            insert_bills_bulk([bill])
+            db.session.commit()
+            result.inserted += 1
+        except Exception as e:
+            db.session.rollback()
+            result.add_error(line, f"Database error: {str(e.__cause__ or e)}")
+
+def ingest_bills(rows, batch_size=INGEST_BATCH_SIZE, catalog=None):
+    """Validate and insert a stream of (line_number, raw_bill) pairs.
+
+    Rows are validated as they arrive; valid bills are written in batches of
+    batch_size, each in its own transaction, so a bad row never aborts the
+    rest of the upload and memory stays bounded by the batch size.
+    """
+    result = IngestResult()
+    batch = []
+    for line, raw in rows:
+        result.received += 1
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            if isinstance(raw, dict) and raw.get('_errors'):
+                raise BillValidationError('; '.join(raw['_errors']))
+            batch.append((line, parse_bill_payload(raw, catalog)))
+        except BillValidationError as e:
+            result.add_error(line, str(e))
+            continue
+        except Exception as e:
+            # A row the parser did not anticipate is that row's error, not the batch's
+            logger.warning(f"Unexpected error validating bill on line {line}: {str(e)}")
+            result.add_error(line, f"Invalid bill: {str(e)}")
+            continue
+        if len(batch) >= batch_size:
+            _flush_batch(batch, result)
+            batch = []
+    if batch:
+        _flush_batch(batch, result)
+    logger.info(f"Ingested {result.inserted}/{result.received} bills ({result.error_count} errors)")
+    return result
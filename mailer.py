@@ -0,0 +1,232 @@
+import os
+import time
+import smtplib
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask_mail import Message
+from sqlalchemy import select, update
+from models import db, OutboundEmail, lease_due_rows
+from pdf_generator import load_bill_for_pdf, render_bill_pdf
+
+logger = logging.getLogger(__name__)
+
+# Outbound mail settings
+MAIL_BATCH_SIZE = 50  # messages leased per pass, all sent over one connection
+MAIL_LEASE_SECONDS = 120
+MAIL_MAX_ATTEMPTS = 6
+MAIL_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+MAIL_POLL_INTERVAL = 15  # how often to look for retries that have come due
+MAIL_IDLE_TIMEOUT = 60  # close the pooled SMTP connection after this long unused
+SMTP_TIMEOUT = 30
+
+class SMTPConnection:
+    """One persistent SMTP session, reconnected on demand and closed when idle.
+
+    Reusing the session means the TCP/TLS handshake and AUTH happen once per
+    burst of messages instead of once per message.
+    """
+
+    def __init__(self, config):
+        self.host = config.get('MAIL_SERVER', 'localhost')
+        self.port = config.get('MAIL_PORT', 25)
+        self.use_tls = config.get('MAIL_USE_TLS', False)
+        self.use_ssl = config.get('MAIL_USE_SSL', False)
+        self.username = config.get('MAIL_USERNAME')
+        self.password = config.get('MAIL_PASSWORD')
+        self._smtp = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if self.use_tls:
+            smtp.starttls()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return smtp
+
+    def send(self, sender, recipients, message_bytes):
+        """Send one message, reconnecting once if the server dropped the session"""
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.sendmail(sender, recipients, message_bytes)
+        except smtplib.SMTPServerDisconnected:
+            self._smtp = self._connect()
+            self._smtp.sendmail(sender, recipients, message_bytes)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self, idle_timeout=MAIL_IDLE_TIMEOUT):
+        if self._smtp is not None and time.monotonic() - self._last_used > idle_timeout:
+            self.close()
+
+    def close(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except smtplib.SMTPException:
+            pass
+        except OSError:
+            pass
+        self._smtp = None
+
+def queue_email(recipient, subject, body, bill_id=None, attach_statement=False):
+    """Add a message to the outbound queue in the caller's transaction.
+
+    Nothing is sent until the caller commits, so a rolled-back request never
+    produces an email. Call MailSender.wake() after the commit.
+    """
+    email = OutboundEmail(
+        recipient=recipient, subject=subject, body=body,
+        bill_id=bill_id, attach_statement=attach_statement
+    )
+    db.session.add(email)
+    return email
+
+def queue_payment_confirmation(bill):
+    """Queue the payment confirmation for a bill, with its statement attached"""
+    method = 'bank transfer' if bill.payment_method == 'bank' else 'cryptocurrency'
+    body = (
+        f"Dear {bill.patient_name},\n\n"
+        f"We have received your {method} payment details for bill #{bill.id} "
+        f"(total ${bill.total_amount}). Current status: {bill.payment_status}.\n\n"
+        f"Your billing statement is attached.\n\n"
+        f"Thank you,\nBillingDog"
+    )
+    return queue_email(bill.email, f"Payment confirmation for bill #{bill.id}", body, bill.id, True)
+
+class MailSender:
+    """Sends queued OutboundEmail rows from a daemon thread or a `flask send-mail` worker.
+
+    Web workers start the thread on the first wake(), so a confirmation goes
+    out right after its request; the send-mail worker runs the same loop in
+    the foreground and picks up retries and any backlog left by restarts
+    while no request has woken a sender. Each pass leases a batch of due messages and sends them over one pooled
+    SMTP connection. Failed messages are retried with exponential backoff
+    until MAIL_MAX_ATTEMPTS. Statements are read from the PDF cache, so
+    mailing the same bill again does not re-render it.
+    """
+
+    def __init__(self, app, pdf_cache, batch_size=MAIL_BATCH_SIZE, poll_interval=MAIL_POLL_INTERVAL):
+        self.app = app
+        self.pdf_cache = pdf_cache
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.connection = SMTPConnection(app.config)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the sender thread once per process (safe to call repeatedly)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            # A forked worker inherits the attribute but not the thread or socket
+            self._pid = os.getpid()
+            self.connection = SMTPConnection(self.app.config)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='mail-sender', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Ask the sender to look at the queue now"""
+        self.start()
+        self._wake.set()
+
+    def _statement(self, bill_id, attachments):
+        if bill_id not in attachments:
+            bill = load_bill_for_pdf(bill_id)
+            if bill is None:
+                attachments[bill_id] = None
+            else:
+                path, _ = self.pdf_cache.get_or_render(bill, render_bill_pdf)
+                with open(path, 'rb') as f:
+                    attachments[bill_id] = f.read()
+        return attachments[bill_id]
+
+    def _build_message(self, email, attachments):
+        message = Message(subject=email.subject, recipients=[email.recipient], body=email.body)
+        if email.attach_statement and email.bill_id:
+            pdf = self._statement(email.bill_id, attachments)
+            if pdf is not None:
+                message.attach(f"bill_{email.bill_id}.pdf", 'application/pdf', pdf)
+        return message
+
+    def send_due(self):
+        """Send one batch of due messages and return how many were leased"""
+        ids = lease_due_rows(OutboundEmail, ('queued', 'sending'), 'sending', self.batch_size, MAIL_LEASE_SECONDS)
+        if not ids:
+            return 0
+        emails = db.session.scalars(select(OutboundEmail).where(OutboundEmail.id.in_(ids))).all()
+        attachments = {}
+        sent, failures = [], []
+        for email in emails:
+            try:
+                message = self._build_message(email, attachments)
+                self.connection.send(message.sender, message.send_to, message.as_bytes())
+                sent.append(email.id)
+            except Exception as e:
+                failures.append((email, str(e)))
+                # The session may be half-way through a transaction; start afresh
+                self.connection.close()
+
+        now = datetime.utcnow()
+        if sent:
+            db.session.execute(
+                update(OutboundEmail)
+                .where(OutboundEmail.id.in_(sent))
+                .values(status='sent', sent_at=now, last_error=None)
+                .execution_options(synchronize_session=False)
+            )
+        for email, error in failures:
+            email.last_error = error
+            if email.attempts >= MAIL_MAX_ATTEMPTS:
+                email.status = 'failed'
+                logger.error(f"Giving up on email {email.id} to {email.recipient}: {error}")
+            else:
+                email.status = 'queued'
+                email.available_at = now + timedelta(seconds=MAIL_RETRY_DELAY * 2 ** (email.attempts - 1))
+                logger.warning(f"Email {email.id} failed (attempt {email.attempts}), will retry: {error}")
+        db.session.commit()
+        logger.info(f"Mail batch: {len(sent)} sent, {len(failures)} failed")
+        return len(ids)
+
+    def send_backlog(self):
+        """Send batches until no message is due and return how many were leased"""
+        leased = total = self.send_due()
+        while leased == self.batch_size:
+            leased = self.send_due()
+            total += leased
+        return total
+
+    def run(self):
+        """Send due messages until stop() is called, waiting between passes when idle"""
+        while not self._stop.is_set():
+            leased = 0
+            with self.app.app_context():
+                try:
+                    leased = self.send_due()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Mail sender error: {str(e)}")
+                finally:
+                    db.session.remove()
+            if leased < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+            self.connection.close_if_idle()
+        self.connection.close()
@@ -1,4 +1,7 @@
-from app import app
+from app import create_app
+from models import db
+
+app = create_app()
 
 if __name__ == '__main__':
     # Force HTTPS in production
@@ -7,7 +10,13 @@ if __name__ == '__main__':
     app.config['SESSION_COOKIE_SECURE'] = True
     app.config['REMEMBER_COOKIE_SECURE'] = True
     app.config['SESSION_COOKIE_HTTPONLY'] = True
-    
+
+    # The development server creates missing tables itself; deployments run
+    # `flask --app app init-db` once instead
+    with app.app_context():
+        db.create_all()
+    app.extensions['billing']['name_index'].warm(app)
+
     # Run the application
     app.run(
         host='0.0.0.0',  # Listen on all available interfaces
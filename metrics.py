@@ -0,0 +1,303 @@
+import os
+import json
+import glob
+import time
+import atexit
+import logging
+import tempfile
+import threading
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+POOL_WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+METRICS_FLUSH_INTERVAL = 5  # seconds between a worker's snapshot writes
+UNMATCHED_ROUTE = '<unmatched>'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Metric:
+    """A labelled counter or histogram; values are keyed by the label tuple"""
+
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        registry.metrics.append(self)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        if not self.registry.enabled:
+            return
+        with self.registry.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Histogram(Metric):
+    """Fixed buckets; each value is [count per bucket..., +Inf count, sum]"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        slot = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                slot = i
+                break
+        with self.registry.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[slot] += 1
+            counts[-1] += value
+
+class MetricsRegistry:
+    """Process-local metrics. Each worker periodically writes a snapshot to a
+    shared directory so any worker can answer a scrape for all of them."""
+
+    def __init__(self):
+        self.metrics = []
+        self.enabled = False
+        self.directory = None
+        self._reset()
+        # A forked worker (gunicorn --preload) starts its own series
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.lock = threading.Lock()
+        for metric in self.metrics:
+            metric.values.clear()
+        self._token = f"{os.getpid()}-{time.time_ns()}"
+        self._last_flush = 0.0
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(self, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, documentation, labelnames, buckets)
+
+    def snapshot(self):
+        with self.lock:
+            return {metric.name: [[list(labels), value if metric.kind == 'counter' else list(value)]
+                                  for labels, value in metric.values.items()]
+                    for metric in self.metrics}
+
+    def _snapshot_path(self):
+        return os.path.join(self.directory, f"{self._token}.json")
+
+    def flush(self, force=False):
+        """Write this process's snapshot, at most every METRICS_FLUSH_INTERVAL seconds"""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        path = self._snapshot_path()
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot: {str(e)}")
+
+    def collect(self):
+        """Merged snapshots of every process, this one read live"""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own = self._snapshot_path()
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # a worker exiting mid-scrape
+        merged = {}
+        for snapshot in snapshots:
+            for name, rows in snapshot.items():
+                series = merged.setdefault(name, {})
+                for labels, value in rows:
+                    key = tuple(labels)
+                    if key not in series:
+                        series[key] = value
+                    elif isinstance(value, list):
+                        series[key] = [a + b for a, b in zip(series[key], value)]
+                    else:
+                        series[key] += value
+        return merged
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        merged = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for labels, value in sorted(merged.get(metric.name, {}).items()):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == 'counter':
+                    lines.append(f"{metric.name}{_format_labels(pairs)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _format_value(bound)
+                    lines.append(f"{metric.name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{metric.name}_sum{_format_labels(pairs)} {_format_value(value[-1])}")
+                lines.append(f"{metric.name}_count{_format_labels(pairs)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    'http_requests_total', 'Requests handled, by route, method and status.', ('route', 'method', 'status'))
+http_latency = registry.histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route.', ('route', 'method'))
+request_db_queries = registry.histogram(
+    'http_request_db_queries', 'SQL statements executed per request, by route.', ('route',), QUERY_COUNT_BUCKETS)
+request_db_time = registry.histogram(
+    'http_request_db_seconds', 'Time spent in SQL per request, by route.', ('route',))
+db_queries = registry.counter('db_queries_total', 'SQL statements executed, including background work.')
+db_time = registry.counter('db_query_seconds_total', 'Time spent in SQL, including background work.')
+upstream_latency = registry.histogram(
+    'upstream_request_duration_seconds', 'Outbound HTTP latency, by upstream and outcome.', ('upstream', 'outcome'))
+upstream_retries = registry.counter('upstream_retries_total', 'Outbound HTTP retries, by upstream.', ('upstream',))
+cache_requests = registry.counter('cache_requests_total', 'Cache lookups, by cache and result.', ('cache', 'result'))
+rate_limited = registry.counter('rate_limit_rejections_total', 'Requests rejected with 429, by route.', ('route',))
+db_pool_wait = registry.histogram(
+    'db_pool_checkout_wait_seconds', 'Time to get a pooled connection (waiting or connecting), by pool.',
+    ('pool',), POOL_WAIT_BUCKETS)
+db_pool_timeouts = registry.counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up after the pool timeout, by pool.', ('pool',))
+db_routed = registry.counter('db_routed_statements_total', 'Statements sent by the session, by database role.', ('role',))
+
+class RequestTimings:
+    """Per-request accumulators fed by the engine and upstream hooks"""
+
+    __slots__ = ('started', 'db_count', 'db_time', 'upstream_count', 'upstream_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.upstream_count = 0
+        self.upstream_time = 0.0
+
+_current = ContextVar('request_timings', default=None)
+
+def current_route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else UNMATCHED_ROUTE
+
+def record_upstream(upstream, latency, error):
+    """Called by rates.timed_request for every outbound call"""
+    if not registry.enabled:
+        return
+    upstream_latency.observe(latency, upstream, 'error' if error else 'ok')
+    timings = _current.get()
+    if timings is not None:
+        timings.upstream_count += 1
+        timings.upstream_time += latency
+
+def record_cache(cache, hit):
+    cache_requests.inc(cache, 'hit' if hit else 'miss')
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_query_started'] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('metrics_query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    db_queries.inc()
+    db_time.inc(amount=elapsed)
+    timings = _current.get()
+    if timings is not None:
+        timings.db_count += 1
+        timings.db_time += elapsed
+
+def _start_timing():
+    request.environ['metrics.token'] = _current.set(RequestTimings())
+
+def _finish_timing(response):
+    timings = _current.get()
+    if timings is None:
+        return response
+    elapsed = time.perf_counter() - timings.started
+    route = current_route()
+    http_requests.inc(route, request.method, str(response.status_code))
+    http_latency.observe(elapsed, route, request.method)
+    request_db_queries.observe(timings.db_count, route)
+    request_db_time.observe(timings.db_time, route)
+
+    entries = [f'db;dur={timings.db_time * 1000:.1f};desc="{timings.db_count} queries"']
+    if timings.upstream_count:
+        entries.append(f'upstream;dur={timings.upstream_time * 1000:.1f};desc="{timings.upstream_count} calls"')
+    entries.append(f'app;dur={elapsed * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(entries)
+    registry.flush()
+    return response
+
+def _reset_timing(exc):
+    token = request.environ.pop('metrics.token', None)
+    if token is not None:
+        _current.reset(token)
+
+def init_metrics(app):
+    """Register the request hooks and engine listeners when METRICS_ENABLED is set.
+
+    Must run before any other before_request hook so requests they answer
+    early (redirects) are still timed. When disabled nothing is registered
+    and every recording call returns immediately."""
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    registry.enabled = True
+    directory = app.config.get('METRICS_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        if registry.directory is None:
+            atexit.register(registry.flush, True)
+        registry.directory = directory
+    # Engine listeners are process-wide; a second app must not count queries twice
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_timing)
+    app.after_request(_finish_timing)
+    app.teardown_request(_reset_timing)
+
+def clear_snapshots(directory):
+    """Remove snapshots left by a previous server run (gunicorn on_starting)"""
+    for path in glob.glob(os.path.join(directory, '*.json')) + glob.glob(os.path.join(directory, '*.tmp')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,119 @@
+"""Schema upgrades for databases created by an earlier release.
+
+db.create_all() creates missing tables but never changes existing ones, so
+upgrade_schema() adds the columns and indexes introduced since, then fills
+them in. Every step checks before it acts, so `flask init-db` runs it on each
+deploy; it only does work the first time.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import inspect, select, text, update, func
+from models import db, Bill, BillArchive, Diagnosis, InsuranceClaim, Procedure
+from totals import recompute_bill_totals
+
+logger = logging.getLogger(__name__)
+
+# Columns added to tables that existing databases already have, as portable DDL.
+# NOT NULL columns carry a default so existing rows get a value.
+ADDED_COLUMNS = {
+    Bill: (
+        ('diagnoses_subtotal', 'NUMERIC(10, 2) NOT NULL DEFAULT 0'),
+        ('procedures_subtotal', 'NUMERIC(10, 2) NOT NULL DEFAULT 0'),
+        ('updated_at', 'TIMESTAMP'),
+        ('version', 'INTEGER NOT NULL DEFAULT 1'),
+    ),
+    Diagnosis: (('updated_at', 'TIMESTAMP'),),
+    Procedure: (('updated_at', 'TIMESTAMP'),),
+    InsuranceClaim: (
+        ('queued_at', 'TIMESTAMP'),
+        ('available_at', 'TIMESTAMP'),
+        ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+        ('batch_id', 'INTEGER REFERENCES claim_batch (id)'),
+        ('updated_at', 'TIMESTAMP'),
+    ),
+    BillArchive: (('transaction_hash', 'VARCHAR(66)'),),
+}
+
+# Claims used to start as 'pending'; the submission queue starts them as 'queued'
+LEGACY_CLAIM_STATUSES = {'pending': 'queued'}
+
+def _add_missing_columns(connection):
+    inspector = inspect(connection)
+    quote = connection.dialect.identifier_preparer.quote
+    added = []
+    for model, columns in ADDED_COLUMNS.items():
+        table = model.__table__.name
+        if not inspector.has_table(table):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for name, definition in columns:
+            if name not in existing:
+                connection.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(name)} {definition}"))
+                added.append((table, name))
+    return added
+
+def _create_missing_indexes(connection):
+    inspector = inspect(connection)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(connection)
+                created.append(index.name)
+    return created
+
+def _backfill(connection):
+    """Fill the added columns of existing rows; returns {step: rows changed}"""
+    now = datetime.utcnow()
+    claims = InsuranceClaim.__table__.c
+    steps = {}
+    for legacy, status in LEGACY_CLAIM_STATUSES.items():
+        # Such claims were never sent: their submitted_at is when they were created
+        steps[f"insurance_claim.status {legacy} -> {status}"] = connection.execute(
+            update(InsuranceClaim.__table__).where(claims.status == legacy)
+            .values(status=status, queued_at=func.coalesce(claims.queued_at, claims.submitted_at),
+                    submitted_at=None, available_at=now, updated_at=now)
+        ).rowcount
+    steps['insurance_claim.queued_at'] = connection.execute(
+        update(InsuranceClaim.__table__).where(claims.queued_at.is_(None))
+        .values(queued_at=func.coalesce(claims.submitted_at, now))
+    ).rowcount
+    steps['insurance_claim.available_at'] = connection.execute(
+        update(InsuranceClaim.__table__).where(claims.available_at.is_(None)).values(available_at=claims.queued_at)
+    ).rowcount
+    steps['insurance_claim.updated_at'] = connection.execute(
+        update(InsuranceClaim.__table__).where(claims.updated_at.is_(None))
+        .values(updated_at=func.coalesce(claims.submitted_at, claims.queued_at))
+    ).rowcount
+
+    bills = Bill.__table__.c
+    steps['bill.updated_at'] = connection.execute(
+        update(Bill.__table__).where(bills.updated_at.is_(None)).values(updated_at=bills.created_at)
+    ).rowcount
+    for model in (Diagnosis, Procedure):
+        items = model.__table__.c
+        created_at = select(bills.created_at).where(bills.id == items.bill_id).scalar_subquery()
+        steps[f"{model.__table__.name}.updated_at"] = connection.execute(
+            update(model.__table__).where(items.updated_at.is_(None)).values(updated_at=func.coalesce(created_at, now))
+        ).rowcount
+    return {step: rows for step, rows in steps.items() if rows}
+
+def upgrade_schema():
+    """Add missing columns and indexes and backfill them; returns a line per step taken"""
+    with db.engine.begin() as connection:
+        added = _add_missing_columns(connection)
+        indexes = _create_missing_indexes(connection)
+        backfilled = _backfill(connection)
+    steps = [f"Added column {table}.{name}" for table, name in added]
+    steps += [f"Created index {name}" for name in indexes]
+    steps += [f"Backfilled {step} on {rows} rows" for step, rows in backfilled.items()]
+    if (Bill.__table__.name, 'diagnoses_subtotal') in added:
+        # Subtotals were new: derive them (and the total) from the line items
+        recomputed = sum(rows for _, rows in recompute_bill_totals())
+        steps.append(f"Recomputed subtotals of {recomputed} bills")
+    for step in steps:
+        logger.info(f"Schema upgrade: {step}")
+    return steps
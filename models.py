@@ -1,17 +1,45 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from db_routing import RoutingSession
+from sqlalchemy import DDL, event, select, update, and_
+from sqlalchemy.orm import selectinload, load_only, raiseload
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
-db = SQLAlchemy()
+# Reads can be routed to replicas, see db_routing.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class Bill(db.Model):
+    # Composite indexes backing the dashboard filters and keyset pagination
+    # on (created_at, id); every listing query is an index range scan.
+    __table_args__ = (
+        db.Index('ix_bill_created_at_id', 'created_at', 'id'),
+        db.Index('ix_bill_status_created_at_id', 'payment_status', 'created_at', 'id'),
+        db.Index('ix_bill_method_created_at_id', 'payment_method', 'created_at', 'id'),
+        db.Index('ix_bill_status_method_created_at_id', 'payment_status', 'payment_method', 'created_at', 'id'),
+        db.Index('ix_bill_updated_at_id', 'updated_at', 'id'),
+        # Exact lookups from the search box (search.py)
+        db.Index('ix_bill_policy_number', 'policy_number'),
+        db.Index('ix_bill_claim_number', 'claim_number'),
+        db.Index('ix_bill_transaction_hash', 'transaction_hash'),
+        # One transaction settles one bill: a hash is only free again once its bill failed
+        db.Index('uq_bill_transaction_hash_open', 'transaction_hash', unique=True,
+                 postgresql_where=db.text("payment_status <> 'failed'"),
+                 sqlite_where=db.text("payment_status <> 'failed'")),
+        db.Index('ix_bill_patient_dob_id', 'patient_dob', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     patient_name = db.Column(db.String(100), nullable=False)
     patient_dob = db.Column(db.Date, nullable=False)
     insurance_provider = db.Column(db.String(100))
     policy_number = db.Column(db.String(50))
-    total_amount = db.Column(db.Numeric(10, 2), nullable=False)
+    # Denormalized from the line items; kept in sync by totals.py
+    diagnoses_subtotal = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    procedures_subtotal = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    total_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
     email = db.Column(db.String(120), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     payment_status = db.Column(db.String(20), default='pending')
     payment_method = db.Column(db.String(20))  # 'crypto' or 'bank'
     
@@ -28,9 +56,12 @@ class Bill(db.Model):
     bank_exchange_rate = db.Column(db.Numeric(10, 4))
     
     # Insurance claim fields
-    claim_status = db.Column(db.String(20), default='pending')  # pending, submitted, approved, denied
+    claim_status = db.Column(db.String(20), default='pending')  # see payment_state.CLAIM_TRANSITIONS
     claim_submission_date = db.Column(db.DateTime)
     claim_number = db.Column(db.String(50))
+
+    # Bumped by every status transition (payment_state.py); compare-and-set guard
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     
     # Relationships
     diagnoses = db.relationship('Diagnosis', backref='bill', lazy=True, cascade="all, delete-orphan")
@@ -39,21 +70,42 @@ class Bill(db.Model):
 
 class Diagnosis(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id', ondelete='CASCADE'), nullable=False)
+    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id', ondelete='CASCADE'), nullable=False, index=True)
     icd10_code = db.Column(db.String(10), nullable=False)
     description = db.Column(db.String(200))
     amount = db.Column(db.Numeric(10, 2), nullable=False, default=0.00)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
 class Procedure(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id', ondelete='CASCADE'), nullable=False)
+    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id', ondelete='CASCADE'), nullable=False, index=True)
     cpt_code = db.Column(db.String(10), nullable=False)
     description = db.Column(db.String(200))
     amount = db.Column(db.Numeric(10, 2), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+class ClaimBatch(db.Model):
+    """One 837P interchange sent to the clearinghouse for a single payer"""
+    id = db.Column(db.Integer, primary_key=True)
+    payer_id = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='building')  # building, sending, submitted, failed
+    claim_count = db.Column(db.Integer, nullable=False, default=0)
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    submitted_at = db.Column(db.DateTime, index=True)
+    response_message = db.Column(db.Text)
+
+    claims = db.relationship('InsuranceClaim', backref='batch', lazy=True)
 
 class InsuranceClaim(db.Model):
+    # Backs the worker's "next due claims" scan
+    __table_args__ = (
+        db.Index('ix_insurance_claim_status_available_at', 'status', 'available_at'),
+        db.Index('ix_insurance_claim_claim_number', 'claim_number'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id'), nullable=False)
+    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id'), nullable=False, index=True)
     payer_id = db.Column(db.String(50), nullable=False)
     payer_name = db.Column(db.String(100), nullable=False)
     subscriber_id = db.Column(db.String(50), nullable=False)
@@ -62,7 +114,286 @@ class InsuranceClaim(db.Model):
     relationship_to_subscriber = db.Column(db.String(20), nullable=False)
     date_of_service = db.Column(db.Date, nullable=False)
     place_of_service = db.Column(db.String(2), nullable=False)
-    status = db.Column(db.String(20), default='pending')
-    submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='queued')  # queued, submitting, submitted, rejected, failed
+    submitted_at = db.Column(db.DateTime, index=True)
     claim_number = db.Column(db.String(50))
     response_message = db.Column(db.Text)
+
+    # Submission queue bookkeeping
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    batch_id = db.Column(db.Integer, db.ForeignKey('claim_batch.id'), index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+class OutboundEmail(db.Model):
+    """A message in the outbound mail queue, sent by mailer.MailSender"""
+    __table_args__ = (
+        db.Index('ix_outbound_email_status_available_at', 'status', 'available_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    bill_id = db.Column(db.Integer, db.ForeignKey('bill.id'), index=True)
+    attach_statement = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+class BillArchive(db.Model):
+    """A settled bill moved out of the hot tables by archive.py.
+
+    Range-partitioned by created_at month on PostgreSQL (one table on
+    SQLite). The rollup dimensions stay in columns so rollups can still be
+    rebuilt; the bill, its line items and claims are a compressed payload.
+    """
+    __tablename__ = 'bill_archive'
+    __table_args__ = (
+        db.Index('ix_bill_archive_id', 'id'),
+        db.Index('ix_bill_archive_created_at', 'created_at'),
+        # An archived bill's transaction stays spent (payment_verifier.transaction_used_by)
+        db.Index('ix_bill_archive_transaction_hash', 'transaction_hash'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    # The partition key has to be part of the primary key
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    payment_status = db.Column(db.String(20))
+    payment_method = db.Column(db.String(20))
+    currency = db.Column(db.String(10))  # bank_currency or payment_currency, as rolled up
+    insurance_provider = db.Column(db.String(100))
+    total_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
+    transaction_hash = db.Column(db.String(66))
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+class ClaimArchive(db.Model):
+    """Rollup dimensions of an archived bill's insurance claim, partitioned like bill_archive"""
+    __tablename__ = 'insurance_claim_archive'
+    __table_args__ = (
+        db.Index('ix_insurance_claim_archive_queued_at', 'queued_at'),
+        {'postgresql_partition_by': 'RANGE (bill_created_at)'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    bill_created_at = db.Column(db.DateTime, primary_key=True)
+    bill_id = db.Column(db.Integer, nullable=False)
+    payer_id = db.Column(db.String(50), nullable=False)
+    payer_name = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20))
+    queued_at = db.Column(db.DateTime)
+    submitted_at = db.Column(db.DateTime)
+
+class DailyBillRollup(db.Model):
+    """Bill count and billed amount per day and dashboard dimension, maintained by rollups.py"""
+    day = db.Column(db.Date, primary_key=True)
+    payment_status = db.Column(db.String(20), primary_key=True)
+    payment_method = db.Column(db.String(20), primary_key=True)  # '' when not chosen yet
+    currency = db.Column(db.String(10), primary_key=True)
+    insurer = db.Column(db.String(100), primary_key=True)
+    bill_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+class DailyClaimRollup(db.Model):
+    """Insurance claim count per day queued, payer and outcome, maintained by rollups.py"""
+    day = db.Column(db.Date, primary_key=True)
+    payer_id = db.Column(db.String(50), primary_key=True)
+    payer_name = db.Column(db.String(100), primary_key=True)
+    outcome = db.Column(db.String(20), primary_key=True)  # open, accepted, rejected, failed
+    claim_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ExportWatermark(db.Model):
+    """High-water mark of the last incremental export of one entity"""
+    name = db.Column(db.String(50), primary_key=True)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    last_id = db.Column(db.Integer, nullable=False)
+    exported_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ExchangeRate(db.Model):
+    """Units of `currency` per one USD, valid from effective_at until the currency's next row (see currency.py)"""
+    __table_args__ = (
+        db.Index('ix_exchange_rate_currency_effective_at', 'currency', 'effective_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    currency = db.Column(db.String(3), nullable=False)
+    # At most 15 significant digits, so the value survives a float round trip
+    rate = db.Column(db.Numeric(15, 8), nullable=False)
+    effective_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    source = db.Column(db.String(30), nullable=False)
+
+class StatusTransition(db.Model):
+    """Append-only log of bill payment and claim status changes, written by payment_state.py.
+
+    bill_id has no foreign key so the history outlives archived bills. A
+    client's idempotency key is unique: a repeated submission finds the row
+    its first attempt wrote instead of changing the bill again.
+    """
+    __table_args__ = (
+        db.Index('ix_status_transition_bill_id_id', 'bill_id', 'id'),
+        db.Index('ix_status_transition_idempotency_key', 'idempotency_key', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    bill_id = db.Column(db.Integer, nullable=False)
+    field = db.Column(db.String(10), nullable=False)  # payment, claim
+    from_status = db.Column(db.String(20))
+    to_status = db.Column(db.String(20), nullable=False)
+    version = db.Column(db.Integer, nullable=False)  # bill version after the change
+    claim_id = db.Column(db.Integer)
+    source = db.Column(db.String(30), nullable=False)
+    idempotency_key = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# The log is append-only in the database too, not just by convention
+event.listen(StatusTransition.__table__, 'after_create', DDL(
+    "CREATE TRIGGER status_transition_append_only BEFORE UPDATE ON status_transition "
+    "BEGIN SELECT RAISE(ABORT, 'status_transition is append-only'); END; "
+).execute_if(dialect='sqlite'))
+event.listen(StatusTransition.__table__, 'after_create', DDL(
+    "CREATE TRIGGER status_transition_no_delete BEFORE DELETE ON status_transition "
+    "BEGIN SELECT RAISE(ABORT, 'status_transition is append-only'); END; "
+).execute_if(dialect='sqlite'))
+event.listen(StatusTransition.__table__, 'after_create', DDL(
+    "CREATE FUNCTION status_transition_append_only() RETURNS trigger AS $$ "
+    "BEGIN RAISE EXCEPTION 'status_transition is append-only'; END; $$ LANGUAGE plpgsql; "
+    "CREATE TRIGGER status_transition_append_only BEFORE UPDATE OR DELETE ON status_transition "
+    "FOR EACH ROW EXECUTE FUNCTION status_transition_append_only()"
+).execute_if(dialect='postgresql'))
+
+# Columns needed to render a dashboard row; everything else stays deferred.
+BILL_LIST_COLUMNS = (
+    Bill.id, Bill.created_at, Bill.patient_name, Bill.total_amount,
+    Bill.payment_method, Bill.payment_currency, Bill.bank_currency,
+    Bill.payment_status, Bill.insurance_provider, Bill.claim_status,
+    Bill.claim_number
+)
+
+# Columns drawn on the PDF statement.
+BILL_PDF_COLUMNS = (
+    Bill.id, Bill.patient_name, Bill.patient_dob, Bill.insurance_provider,
+    Bill.policy_number, Bill.diagnoses_subtotal, Bill.procedures_subtotal,
+    Bill.total_amount
+)
+
+# Named loading profiles. Each one loads a bill's children in a fixed number
+# of batched SELECTs, independent of how many bills the query returns.
+BILL_LOADING_PROFILES = {
+    'list': lambda: [
+        load_only(*BILL_LIST_COLUMNS),
+        raiseload('*'),
+    ],
+    'detail': lambda: [
+        selectinload(Bill.diagnoses),
+        selectinload(Bill.procedures),
+        selectinload(Bill.claims),
+    ],
+    'pdf': lambda: [
+        load_only(*BILL_PDF_COLUMNS),
+        selectinload(Bill.diagnoses).load_only(
+            Diagnosis.bill_id, Diagnosis.icd10_code, Diagnosis.description, Diagnosis.amount
+        ),
+        selectinload(Bill.procedures).load_only(
+            Procedure.bill_id, Procedure.cpt_code, Procedure.description, Procedure.amount
+        ),
+        raiseload(Bill.claims),
+    ],
+}
+
+# Dashboard date filter windows
+PAYMENT_DATE_FILTERS = {
+    'today': timedelta(days=1),
+    'week': timedelta(days=7),
+    'month': timedelta(days=30)
+}
+
+def filter_bills(query, date_filter='all', status='all', method='all'):
+    """Apply the dashboard date/status/method filters to a query involving Bill"""
+    if date_filter in PAYMENT_DATE_FILTERS:
+        query = query.filter(Bill.created_at >= datetime.utcnow() - PAYMENT_DATE_FILTERS[date_filter])
+    if status and status != 'all':
+        query = query.filter(Bill.payment_status == status)
+    if method and method != 'all':
+        query = query.filter(Bill.payment_method == method)
+    return query
+
+def bill_query(profile):
+    """Return a Bill query using one of the named BILL_LOADING_PROFILES"""
+    if profile not in BILL_LOADING_PROFILES:
+        raise ValueError(f"Unknown loading profile: {profile}")
+    return Bill.query.options(*BILL_LOADING_PROFILES[profile]())
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine while active"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+@contextmanager
+def count_queries(engine=None):
+    """Yield a QueryCounter recording every statement run inside the block"""
+    engine = engine or db.engine
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+
+@contextmanager
+def assert_max_queries(limit, engine=None):
+    """Fail if the block issues more than `limit` SQL statements"""
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > limit:
+        raise AssertionError(
+            f"Expected at most {limit} queries, got {counter.count}:\n" + "\n".join(counter.statements)
+        )
+
+def lease_due_rows(model, due_statuses, leased_status, limit, lease_seconds):
+    """Atomically take up to `limit` due rows of a queue table and return their ids.
+
+    `model` needs status, available_at and attempts columns. Candidates are
+    read with FOR UPDATE SKIP LOCKED, so concurrent workers on PostgreSQL pick
+    disjoint rows without waiting on each other. The guarded UPDATE ...
+    RETURNING re-checks eligibility, which keeps the lease safe on databases
+    that ignore SKIP LOCKED (SQLite serializes the writers instead). Leased
+    rows become due again after `lease_seconds` if the worker dies.
+    """
+    now = datetime.utcnow()
+    due = and_(model.status.in_(due_statuses), model.available_at <= now)
+    candidates = db.session.scalars(
+        select(model.id)
+        .where(due)
+        .order_by(model.available_at, model.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not candidates:
+        db.session.rollback()
+        return []
+
+    leased = db.session.scalars(
+        update(model)
+        .where(model.id.in_(candidates), due)
+        .values(
+            status=leased_status,
+            available_at=now + timedelta(seconds=lease_seconds),
+            attempts=model.attempts + 1
+        )
+        .returning(model.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return leased
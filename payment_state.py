@@ -0,0 +1,218 @@
+"""Payment and claim status state machine with optimistic concurrency.
+
+Bill.payment_status and Bill.claim_status only move along
+PAYMENT_TRANSITIONS and CLAIM_TRANSITIONS, and only through transition()
+or transition_many(). Each change is a compare-and-set UPDATE on
+Bill.version (no row lock is held between reading and writing the bill),
+bumps the version and appends a StatusTransition row in the same
+transaction. A writer that loses the race re-reads and re-validates; a
+client that names an expected version (If-Match) gets VersionConflict.
+
+Clients send an idempotency key with each submission. A key already in the
+log replays the recorded outcome without touching the bill; two requests
+racing with the same key are settled by the log's unique index, and the
+loser rolls back and replays the winner.
+"""
+import logging
+from collections import namedtuple
+from types import SimpleNamespace
+from sqlalchemy import event, inspect, select, update, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import db, Bill, StatusTransition
+from rollups import BILL_ROLLUP, apply_rollup_delta
+
+logger = logging.getLogger(__name__)
+
+# {status: statuses it may move to}; a status missing on the left is terminal
+PAYMENT_TRANSITIONS = {
+    'pending': ('pending', 'paid', 'failed'),  # pending -> pending records new payment details
+    'failed': ('pending',),                    # the patient tries again
+    'paid': (),
+}
+CLAIM_TRANSITIONS = {
+    'pending': ('queued',),
+    'queued': ('submitted', 'rejected', 'failed'),
+    'rejected': ('queued',),
+    'failed': ('queued',),
+    'submitted': ('approved', 'denied'),
+}
+STATUS_FIELDS = {
+    'payment': ('payment_status', PAYMENT_TRANSITIONS),
+    'claim': ('claim_status', CLAIM_TRANSITIONS),
+}
+INITIAL_STATUS = 'pending'
+
+# Compare-and-set attempts before a busy bill is reported as a conflict
+TRANSITION_RETRIES = 5
+MAX_IDEMPOTENCY_KEY_LENGTH = 100
+
+class TransitionError(Exception):
+    """A status change that was not applied"""
+
+class InvalidTransition(TransitionError, ValueError):
+    """The state machine does not allow the change from the bill's current status"""
+
+class VersionConflict(TransitionError):
+    """The bill changed since the version the caller expected (or kept changing)"""
+
+class IdempotencyKeyReused(TransitionError, ValueError):
+    """An idempotency key already recorded for a different bill or status field"""
+
+Transition = namedtuple('Transition', 'bill_id field from_status to_status version claim_id replayed')
+
+def allowed(field, from_status, to_status):
+    """Whether the state machine lets `field` move from `from_status` to `to_status`"""
+    _, transitions = STATUS_FIELDS[field]
+    return to_status in transitions.get(from_status or INITIAL_STATUS, ())
+
+def validate_idempotency_key(key):
+    """The key stripped, or None when absent; ValueError when too long"""
+    key = (key or '').strip()
+    if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f"Idempotency key must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters")
+    return key or None
+
+def recorded_transition(idempotency_key):
+    """The StatusTransition logged under `idempotency_key`, or None"""
+    if not idempotency_key:
+        return None
+    return db.session.scalar(select(StatusTransition).where(StatusTransition.idempotency_key == idempotency_key))
+
+def find_replay(idempotency_key, bill_id, field):
+    """The Transition recorded under `idempotency_key` (replayed=True), or None if the key is new.
+
+    Raises IdempotencyKeyReused when the key belongs to another bill or field.
+    """
+    entry = recorded_transition(idempotency_key)
+    if entry is None:
+        return None
+    if entry.bill_id != bill_id or entry.field != field:
+        raise IdempotencyKeyReused(f"Idempotency key was already used for another {entry.field} change")
+    return Transition(entry.bill_id, entry.field, entry.from_status, entry.to_status,
+                      entry.version, entry.claim_id, True)
+
+def transition(bill_id, field, to_status, values=None, expected_version=None,
+               idempotency_key=None, source='api', claim_id=None):
+    """Move a bill's `field` ('payment' or 'claim') status to `to_status`; returns a Transition.
+
+    `values` are other Bill columns written in the same UPDATE. Raises
+    LookupError for an unknown bill, InvalidTransition, VersionConflict and
+    IdempotencyKeyReused. The caller commits, unless the result is a replay
+    of a concurrent request with the same key: then the session has been
+    rolled back, discarding anything else the caller had pending.
+    """
+    column_name, _ = STATUS_FIELDS[field]
+    column = getattr(Bill, column_name)
+    # Payment changes move the bill between dashboard rollup buckets: the row the
+    # compare-and-set matched and the UPDATE's RETURNING are the before and after
+    tracked = BILL_ROLLUP.columns if field == 'payment' else (Bill.id, column)
+    for attempt in range(TRANSITION_RETRIES):
+        # Checked again after a lost race: the winner may be our own retry
+        replay = find_replay(idempotency_key, bill_id, field)
+        if replay is not None:
+            return replay
+
+        row = db.session.execute(select(Bill.version, *tracked).where(Bill.id == bill_id)).one_or_none()
+        if row is None:
+            raise LookupError(f"Bill {bill_id} not found")
+        version, current = row.version, getattr(row, column_name)
+        if expected_version is not None and version != expected_version:
+            raise VersionConflict(f"Bill {bill_id} is at version {version}, not {expected_version}")
+        if not allowed(field, current, to_status):
+            raise InvalidTransition(f"Cannot move {field} status of bill {bill_id} from {current} to {to_status}")
+
+        changed = db.session.execute(
+            update(Bill)
+            .where(Bill.id == bill_id, Bill.version == version)
+            .values(**(values or {}), **{column_name: to_status}, version=version + 1)
+            .returning(*tracked)
+        ).one_or_none()
+        if changed is None:
+            logger.debug(f"Bill {bill_id} changed under {field} transition (attempt {attempt + 1})")
+            continue
+        if field == 'payment':
+            apply_rollup_delta(db.session.connection(), BILL_ROLLUP, {bill_id: row}, {bill_id: changed})
+
+        db.session.add(StatusTransition(
+            bill_id=bill_id, field=field, from_status=current, to_status=to_status, version=version + 1,
+            claim_id=claim_id, source=source, idempotency_key=idempotency_key
+        ))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # A concurrent request with the same key committed first; undo ours and answer like it
+            db.session.rollback()
+            replay = find_replay(idempotency_key, bill_id, field)
+            if replay is None:
+                raise
+            return replay
+        return Transition(bill_id, field, current, to_status, version + 1, claim_id, False)
+    raise VersionConflict(f"Bill {bill_id} kept changing; gave up after {TRANSITION_RETRIES} attempts")
+
+def transition_many(bill_ids, field, from_status, to_status, source):
+    """Move every bill in `bill_ids` still at `from_status` to `to_status` with one UPDATE.
+
+    For background jobs settling many bills: the status predicate is the
+    compare-and-set, every moved bill's version is bumped and logged. Returns
+    the ids that moved; the caller commits.
+    """
+    if not bill_ids:
+        return []
+    if not allowed(field, from_status, to_status):
+        raise InvalidTransition(f"Cannot move {field} status from {from_status} to {to_status}")
+    column_name, _ = STATUS_FIELDS[field]
+    column = getattr(Bill, column_name)
+    tracked = BILL_ROLLUP.columns if field == 'payment' else (Bill.id,)
+    moved = db.session.execute(
+        update(Bill)
+        .where(Bill.id.in_(bill_ids), column == from_status)
+        .values(**{column_name: to_status}, version=Bill.version + 1)
+        .returning(Bill.version, *tracked)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not moved:
+        return []
+    if field == 'payment':
+        # Only the status changed, so each row's state before is what it RETURNed at from_status
+        after = {row.id: row for row in moved}
+        before = {row.id: SimpleNamespace(**{**row._asdict(), column_name: from_status}) for row in moved}
+        apply_rollup_delta(db.session.connection(), BILL_ROLLUP, before, after)
+    db.session.execute(insert(StatusTransition), [
+        {'bill_id': row.id, 'field': field, 'from_status': from_status, 'to_status': to_status,
+         'version': row.version, 'source': source}
+        for row in moved
+    ])
+    return [row.id for row in moved]
+
+def bill_history(bill_id):
+    """A bill's logged status transitions, oldest first"""
+    return db.session.scalars(
+        select(StatusTransition).where(StatusTransition.bill_id == bill_id).order_by(StatusTransition.id)
+    ).all()
+
+_guard_registered = False
+
+def register_status_guard():
+    """Refuse ORM flushes that change the status of an existing bill directly.
+
+    Such a write would skip the version check and the transition log; use
+    transition() instead. New bills may start at any status. Attached once
+    per process, however many apps call this.
+    """
+    global _guard_registered
+    if _guard_registered:
+        return
+    _guard_registered = True
+
+    @event.listens_for(Session, 'before_flush')
+    def guard_status_columns(session, flush_context, instances):
+        for obj in session.dirty:
+            if not isinstance(obj, Bill):
+                continue
+            state = inspect(obj)
+            for column_name, _ in STATUS_FIELDS.values():
+                if state.attrs[column_name].history.has_changes():
+                    raise InvalidTransition(
+                        f"Bill {obj.id} {column_name} must change through payment_state.transition()"
+                    )
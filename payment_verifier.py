@@ -0,0 +1,279 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy import select, tuple_
+from models import db, Bill, BillArchive
+from payment_state import transition_many
+from rates import timed_request
+
+logger = logging.getLogger(__name__)
+
+# Payment verification settings
+REQUIRED_CONFIRMATIONS = int(os.environ.get('PAYMENT_REQUIRED_CONFIRMATIONS', 12))
+VERIFY_BATCH_SIZE = 200  # transaction hashes looked up per provider call
+VERIFY_INTERVAL = 15  # seconds between passes over the pending payments
+PAYMENT_TIMEOUT = timedelta(hours=24)  # unconfirmed payments fail after this long
+RPC_TIMEOUT = 10
+
+CONFIRMED = 'confirmed'
+PENDING = 'pending'
+FAILED = 'failed'
+
+# What a bill expects to have been paid by its transaction
+ExpectedPayment = namedtuple('ExpectedPayment', 'tx_hash currency amount')
+
+# Currencies payable on the chain: the ERC-20 contract (None for the native
+# coin) and its decimals. PAYMENT_TOKEN_CONTRACTS overrides the contracts.
+Token = namedtuple('Token', 'contract decimals')
+CHAIN_TOKENS = {
+    'ETH': Token(None, 18),
+    'USDC': Token('0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48', 6),
+    'USDT': Token('0xdac17f958d2ee523a2206206994597c13d831ec7', 6),
+}
+# transfer(address,uint256)
+ERC20_TRANSFER_SELECTOR = '0xa9059cbb'
+
+class ChainProviderError(Exception):
+    """The chain provider could not be queried; the batch is retried next pass"""
+
+def parse_token_contracts(value):
+    """CHAIN_TOKENS updated from "USDC=0x...:6,USDT=0x...:6" (PAYMENT_TOKEN_CONTRACTS)"""
+    tokens = dict(CHAIN_TOKENS)
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        try:
+            currency, spec = item.split('=')
+            contract, decimals = spec.split(':')
+            tokens[currency.strip().upper()] = Token(contract.strip().lower(), int(decimals))
+        except ValueError:
+            raise ValueError(f"PAYMENT_TOKEN_CONTRACTS entries look like USDC=0x...:6, not {item!r}")
+    return tokens
+
+def base_units(amount, decimals):
+    """A token amount in the chain's smallest unit (wei for ETH)"""
+    return int((Decimal(amount) * 10 ** decimals).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+class JsonRpcChainProvider:
+    """Looks up transactions and their receipts on an EVM node, one JSON-RPC batch per call.
+
+    A payment is confirmed only when its transaction succeeded, is
+    `required_confirmations` blocks deep and pays the bill: the native coin
+    or the currency's token contract, transferred to `receiving_address`,
+    at least the bill's crypto amount. A receipt with status 0x0, or a
+    transaction that pays anything else, is a failed payment.
+    """
+
+    def __init__(self, url, receiving_address, tokens=CHAIN_TOKENS,
+                 required_confirmations=REQUIRED_CONFIRMATIONS):
+        self.url = url
+        self.receiving_address = receiving_address.lower()
+        self.tokens = tokens
+        self.required_confirmations = required_confirmations
+
+    def mismatch(self, payment, tx):
+        """None when `tx` pays `payment` to us, else the reason it does not"""
+        token = self.tokens.get((payment.currency or '').upper())
+        if token is None:
+            return f"{payment.currency} payments cannot be verified on this chain"
+        if payment.amount is None:
+            return "the bill has no crypto amount to compare with"
+        to = (tx.get('to') or '').lower()
+        if token.contract is None:
+            recipient, value = to, int(tx.get('value') or '0x0', 16)
+        else:
+            data = (tx.get('input') or '').lower()
+            if to != token.contract or not data.startswith(ERC20_TRANSFER_SELECTOR) or len(data) < 138:
+                return f"not a transfer of the {payment.currency} token"
+            recipient, value = '0x' + data[34:74], int(data[74:138], 16)
+        if recipient != self.receiving_address:
+            return f"paid to {recipient or 'no address'}, not the receiving address"
+        expected = base_units(payment.amount, token.decimals)
+        if value < expected:
+            return f"paid {value} base units, {expected} expected"
+        return None
+
+    def check(self, payments):
+        """Return {tx_hash: CONFIRMED | PENDING | FAILED} for a batch of ExpectedPayments"""
+        calls = [{'jsonrpc': '2.0', 'id': 0, 'method': 'eth_blockNumber', 'params': []}]
+        for i, payment in enumerate(payments, start=1):
+            calls.append({'jsonrpc': '2.0', 'id': 2 * i - 1, 'method': 'eth_getTransactionReceipt',
+                          'params': [payment.tx_hash]})
+            calls.append({'jsonrpc': '2.0', 'id': 2 * i, 'method': 'eth_getTransactionByHash',
+                          'params': [payment.tx_hash]})
+        from requests.exceptions import RequestException
+        try:
+            response = timed_request('chain-rpc', 'POST', self.url, json=calls, timeout=RPC_TIMEOUT)
+            response.raise_for_status()
+            replies = {reply['id']: reply for reply in response.json()}
+            head = int(replies[0]['result'], 16)
+        except (RequestException, ValueError, KeyError, TypeError) as e:
+            raise ChainProviderError(f"Chain RPC failed: {str(e)}") from e
+
+        statuses = {}
+        for i, payment in enumerate(payments, start=1):
+            receipt = (replies.get(2 * i - 1) or {}).get('result')
+            tx = (replies.get(2 * i) or {}).get('result')
+            if not receipt or not tx:
+                statuses[payment.tx_hash] = PENDING
+            elif receipt.get('status') == '0x0':
+                statuses[payment.tx_hash] = FAILED
+            elif (reason := self.mismatch(payment, tx)) is not None:
+                logger.warning(f"Transaction {payment.tx_hash} does not pay its bill: {reason}")
+                statuses[payment.tx_hash] = FAILED
+            elif head - int(receipt['blockNumber'], 16) + 1 >= self.required_confirmations:
+                statuses[payment.tx_hash] = CONFIRMED
+            else:
+                statuses[payment.tx_hash] = PENDING
+        return statuses
+
+class MockChainProvider:
+    """Deterministic provider for local runs, tests and benchmarks.
+
+    Hashes ending in '0' are failed transactions; every other hash confirms
+    on its `confirm_after`-th lookup. `latency` is slept once per call to
+    stand in for the RPC round trip.
+    """
+
+    def __init__(self, confirm_after=1, latency=0.0):
+        self.confirm_after = confirm_after
+        self.latency = latency
+        self.calls = 0
+        self._lookups = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def check(self, payments):
+        if self.latency:
+            time.sleep(self.latency)
+        statuses = {}
+        with self._lock:
+            self.calls += 1
+            for tx_hash in (payment.tx_hash for payment in payments):
+                self._lookups[tx_hash] += 1
+                if tx_hash.lower().endswith('0'):
+                    statuses[tx_hash] = FAILED
+                elif self._lookups[tx_hash] >= self.confirm_after:
+                    statuses[tx_hash] = CONFIRMED
+                else:
+                    statuses[tx_hash] = PENDING
+        return statuses
+
+def build_chain_provider(config):
+    """Return the provider for PAYMENT_RPC_URL; the mock only when asked for.
+
+    The mock confirms hashes by their last digit, so it is used only with
+    PAYMENT_PROVIDER=mock or, without an RPC URL, in testing. Raises
+    ValueError for any other incomplete configuration.
+    """
+    url = config.get('PAYMENT_RPC_URL')
+    choice = config.get('PAYMENT_PROVIDER') or 'rpc'
+    if choice not in ('rpc', 'mock'):
+        raise ValueError(f"PAYMENT_PROVIDER must be 'rpc' or 'mock', not {choice!r}")
+    if choice == 'mock' or (config.get('TESTING') and not url):
+        logger.warning("Payments are verified against the mock chain provider")
+        return MockChainProvider()
+    if not url:
+        raise ValueError("PAYMENT_RPC_URL is not set (PAYMENT_PROVIDER=mock verifies against the mock chain)")
+    address = config.get('PAYMENT_RECEIVING_ADDRESS')
+    if not address:
+        raise ValueError("PAYMENT_RECEIVING_ADDRESS must be set with PAYMENT_RPC_URL")
+    return JsonRpcChainProvider(url, address, parse_token_contracts(config.get('PAYMENT_TOKEN_CONTRACTS')))
+
+def transaction_used_by(tx_hash, bill_id):
+    """Id of another bill, not failed, already paid with `tx_hash`, or None.
+
+    Archived bills count too: the archiver moves paid bills out of the bill
+    table, and their transactions must not pay a new bill.
+    """
+    hot = (
+        select(Bill.id)
+        .where(Bill.transaction_hash == tx_hash, Bill.id != bill_id, Bill.payment_status != 'failed')
+    )
+    archived = (
+        select(BillArchive.id)
+        .where(BillArchive.transaction_hash == tx_hash, BillArchive.payment_status != 'failed')
+    )
+    return db.session.scalar(hot.union_all(archived).limit(1))
+
+def _set_payment_status(bill_ids, status):
+    """Move still-pending bills to `status` with one UPDATE and return how many changed"""
+    return len(transition_many(bill_ids, 'payment', 'pending', status, source='payment verifier'))
+
+def verify_pending_payments(provider, batch_size=VERIFY_BATCH_SIZE):
+    """Check every pending crypto payment once and settle the ones the chain has decided.
+
+    Pending bills are walked in (created_at, id) order on the status/method
+    index, `batch_size` at a time. Each batch costs one provider call and at
+    most two UPDATE statements, each with one transition log INSERT. Returns
+    counts of checked, paid and failed bills.
+    """
+    expire_before = datetime.utcnow() - PAYMENT_TIMEOUT
+    counts = {'checked': 0, 'paid': 0, 'failed': 0}
+    position = None
+    while True:
+        stmt = select(Bill.id, Bill.created_at, Bill.updated_at, Bill.transaction_hash,
+                      Bill.payment_currency, Bill.crypto_amount).where(
+            Bill.payment_status == 'pending',
+            Bill.payment_method == 'crypto',
+            Bill.transaction_hash.isnot(None)
+        )
+        if position is not None:
+            stmt = stmt.where(tuple_(Bill.created_at, Bill.id) > tuple_(*position))
+        rows = db.session.execute(stmt.order_by(Bill.created_at, Bill.id).limit(batch_size)).all()
+        if not rows:
+            break
+        position = (rows[-1].created_at, rows[-1].id)
+
+        # The unique index on open bills' hashes means one bill per transaction
+        statuses = provider.check([
+            ExpectedPayment(row.transaction_hash, row.payment_currency, row.crypto_amount) for row in rows
+        ])
+        paid, failed = [], []
+        for row in rows:
+            status = statuses.get(row.transaction_hash, PENDING)
+            if status == CONFIRMED:
+                paid.append(row.id)
+            elif status == FAILED or (row.updated_at and row.updated_at < expire_before):
+                failed.append(row.id)
+
+        counts['checked'] += len(rows)
+        counts['paid'] += _set_payment_status(paid, 'paid')
+        counts['failed'] += _set_payment_status(failed, 'failed')
+        db.session.commit()
+
+    # Payments that never reported a transaction hash cannot be confirmed
+    while True:
+        abandoned = db.session.execute(
+            select(Bill.id)
+            .where(
+                Bill.payment_status == 'pending',
+                Bill.payment_method == 'crypto',
+                Bill.transaction_hash.is_(None),
+                Bill.updated_at < expire_before
+            )
+            .limit(batch_size)
+        ).scalars().all()
+        if not abandoned:
+            break
+        counts['failed'] += _set_payment_status(abandoned, 'failed')
+        db.session.commit()
+    return counts
+
+def run_payment_verifier(provider, batch_size=VERIFY_BATCH_SIZE, interval=VERIFY_INTERVAL, stop=None):
+    """Verify pending payments every `interval` seconds until `stop` is set"""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            counts = verify_pending_payments(provider, batch_size)
+            if counts['paid'] or counts['failed']:
+                logger.info(f"Payment verification: {counts} in {time.perf_counter() - started:.2f}s")
+        except ChainProviderError as e:
+            db.session.rollback()
+            logger.warning(str(e))
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Payment verifier error: {str(e)}")
+        stop.wait(interval)
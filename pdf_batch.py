@@ -0,0 +1,214 @@
+import io
+import os
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from models import db, Bill, bill_query
+from pdf_generator import generate_bill_pdf, generate_statements_pdf, snapshot_bill
+from pdf_templates import active_template, use_template
+
+logger = logging.getLogger(__name__)
+
+# Batch rendering settings
+DEFAULT_CHUNK_SIZE = 50
+DEFAULT_WORKERS = os.cpu_count() or 1
+MAX_CHUNKS_IN_FLIGHT_PER_WORKER = 2
+# pypdf keeps every appended page in memory until the merged file is written
+MAX_MERGED_BILLS = 20000
+
+class _StreamSink(io.RawIOBase):
+    """Unseekable write target that lets a ZipFile be drained incrementally"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _init_worker(template=None):
+    """Process-pool initializer: build shared ReportLab state once per worker"""
+    if template is not None:
+        # Spawned workers start without the parent's statement template
+        use_template(template)
+    # Rendering an empty story imports ReportLab, builds the shared TableStyles
+    # and ParagraphStyles (pdf_layout) and warms the font metric caches.
+    generate_statements_pdf([], io.BytesIO())
+
+def _gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+class SharedRenderPool:
+    """One process pool per web worker for on-demand statement archives.
+
+    Requests share its `workers` processes instead of each starting a pool,
+    and at most `max_streams` archives render at once: try_acquire() is
+    False when they are all taken. The processes start on first use.
+
+    Under gevent workers (gunicorn.conf.py) the processes are spawned, not
+    forked: a forked child would inherit the parent's gevent hub and patched
+    threading. Waiting on a result still only blocks the requesting greenlet,
+    since concurrent.futures waits on the patched threading primitives.
+    """
+
+    def __init__(self, workers, max_streams):
+        self.workers = max(1, workers)
+        self._streams = threading.BoundedSemaphore(max_streams)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context('spawn' if _gevent_patched() else None)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                     initializer=_init_worker, initargs=(active_template()[0],))
+            return self._executor
+
+    def try_acquire(self):
+        return self._streams.acquire(blocking=False)
+
+    def release(self):
+        self._streams.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+def _render_chunk(snapshots):
+    return [(s.id, generate_bill_pdf(s, s.diagnoses, s.procedures).getvalue()) for s in snapshots]
+
+def _render_chunk_to_file(snapshots, path):
+    generate_statements_pdf(snapshots, path)
+    return path
+
+def iter_bill_id_chunks(bill_ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Group an iterable of bill ids (or a query selecting Bill.id) into lists"""
+    if hasattr(bill_ids, 'yield_per'):
+        bill_ids = bill_ids.yield_per(chunk_size)
+    chunk = []
+    for row in bill_ids:
+        chunk.append(row[0] if isinstance(row, tuple) or hasattr(row, '_mapping') else row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _load_snapshots(ids):
+    """Load one chunk with the 'pdf' profile and detach it from the session"""
+    bills = bill_query('pdf').filter(Bill.id.in_(ids)).order_by(Bill.id).all()
+    snapshots = [snapshot_bill(bill) for bill in bills]
+    for bill in bills:
+        db.session.expunge(bill)
+    return snapshots
+
+def _iter_chunk_results(bill_ids, task, workers, chunk_size, task_args=lambda index: (), pool=None):
+    """Submit one task per chunk, keeping a bounded number of chunks in flight.
+
+    Results are yielded in submission order. With workers <= 1 the task runs
+    inline, which avoids process start-up cost for small batches. A
+    SharedRenderPool replaces the pool of `workers` processes started per call.
+    """
+    chunks = iter_bill_id_chunks(bill_ids, chunk_size)
+    if pool is not None:
+        yield from _iter_submitted(pool.executor(), pool.workers, chunks, task, task_args)
+        return
+    if workers <= 1:
+        for index, ids in enumerate(chunks):
+            yield task(_load_snapshots(ids), *task_args(index))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        yield from _iter_submitted(executor, workers, chunks, task, task_args)
+
+def _iter_submitted(executor, workers, chunks, task, task_args):
+    max_in_flight = workers * MAX_CHUNKS_IN_FLIGHT_PER_WORKER
+    pending = deque()
+    try:
+        for index, ids in enumerate(chunks):
+            pending.append(executor.submit(task, _load_snapshots(ids), *task_args(index)))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # A download that stopped early must not leave work queued on a shared pool
+        for future in pending:
+            future.cancel()
+
+def iter_rendered_bills(bill_ids, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, pool=None):
+    """Yield (bill_id, pdf_bytes) for every bill, rendered across a process pool"""
+    for results in _iter_chunk_results(bill_ids, _render_chunk, workers, chunk_size, pool=pool):
+        yield from results
+
+def stream_statements_zip(bill_ids, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE, pool=None):
+    """Yield a ZIP archive of bill PDFs as byte chunks.
+
+    Only the chunks currently being rendered are held in memory, so the
+    generator can back a streamed HTTP response or be written to disk.
+    """
+    sink = _StreamSink()
+    # PDFs are already compressed, so entries are stored rather than deflated
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for bill_id, pdf_bytes in iter_rendered_bills(bill_ids, workers, chunk_size, pool):
+            archive.writestr(f"bill_{bill_id}.pdf", pdf_bytes)
+            yield sink.drain()
+    yield sink.drain()
+
+def write_statements_zip(bill_ids, path, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write a ZIP archive of bill PDFs to `path` and return the number of bytes written"""
+    written = 0
+    with open(path, 'wb') as f:
+        for data in stream_statements_zip(bill_ids, workers, chunk_size):
+            f.write(data)
+            written += len(data)
+    logger.info(f"Wrote statements archive {path} ({written} bytes)")
+    return written
+
+def write_merged_statements(bill_ids, path, workers=DEFAULT_WORKERS, chunk_size=DEFAULT_CHUNK_SIZE,
+                            max_bills=MAX_MERGED_BILLS):
+    """Render all bills into a single PDF at `path`.
+
+    Each worker renders its chunk into one multi-bill PDF in a temporary
+    directory; the chunk files are then concatenated. The merge holds every
+    page in memory until the file is written, so more than `max_bills` bills
+    raise ValueError; larger runs belong in a ZIP (write_statements_zip).
+    """
+    from pypdf import PdfWriter
+
+    count = bill_ids.count() if hasattr(bill_ids, 'yield_per') else len(bill_ids)
+    if count > max_bills:
+        raise ValueError(f"{count} bills is too many for one merged PDF (limit {max_bills}); use the zip format")
+
+    tmpdir = tempfile.mkdtemp(prefix='statements-')
+    try:
+        writer = PdfWriter()
+        chunk_path = lambda index: (os.path.join(tmpdir, f"chunk_{index:06d}.pdf"),)
+        for rendered in _iter_chunk_results(bill_ids, _render_chunk_to_file, workers, chunk_size, chunk_path):
+            writer.append(rendered)
+        with open(path, 'wb') as f:
+            writer.write(f)
+        writer.close()
+        logger.info(f"Wrote merged statements {path}")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
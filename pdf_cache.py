@@ -0,0 +1,187 @@
+import os
+import glob
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from models import Bill, Diagnosis, Procedure
+from metrics import record_cache
+from pdf_templates import active_template
+
+logger = logging.getLogger(__name__)
+
+# Bump when the statement layout changes so old renders are not served.
+PDF_LAYOUT_VERSION = 4
+# Fraction of max_bytes to shrink to once the cache overflows.
+EVICTION_TARGET_RATIO = 0.9
+# Bill attributes drawn on the statement; changes to any other column
+# (payment or claim status, for example) keep the cached file.
+STATEMENT_BILL_FIELDS = (
+    'patient_name', 'patient_dob', 'insurance_provider', 'policy_number',
+    'diagnoses_subtotal', 'procedures_subtotal', 'total_amount'
+)
+
+def bill_content_key(bill):
+    """Hash of everything drawn on a bill's statement.
+
+    Covers the bill fields, diagnoses, procedures and the statement template
+    but not the generation timestamp in the footer, so identical content
+    always maps to one file.
+    """
+    content = {
+        'layout': PDF_LAYOUT_VERSION,
+        'template': active_template()[1],
+        'bill': [bill.id] + [str(getattr(bill, name)) for name in STATEMENT_BILL_FIELDS],
+        'diagnoses': [[d.icd10_code, d.description, str(d.amount)] for d in bill.diagnoses],
+        'procedures': [[p.cpt_code, p.description, str(p.amount)] for p in bill.procedures],
+    }
+    encoded = json.dumps(content, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+class PdfCache:
+    """Size-bounded, on-disk LRU cache of rendered bill PDFs.
+
+    Files are named ``<bill_id>-<content_key>.pdf`` so every version of a bill
+    can be found (and dropped) by id. Recency is tracked through file mtimes,
+    which keeps the cache consistent across gunicorn worker processes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, bill_id, key):
+        return os.path.join(self.directory, f"{bill_id}-{key}.pdf")
+
+    def get(self, bill_id, key):
+        """Return the cached file path for this content, or None on a miss"""
+        path = self._path(bill_id, key)
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, bill_id, key, pdf_bytes):
+        """Store a rendered PDF atomically and return its path"""
+        path = self._path(bill_id, key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Older versions of this bill can never be requested again
+        self.invalidate(bill_id, keep=path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(pdf_bytes)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def get_or_render(self, bill, render):
+        """Return (path, content_key) for a bill's statement, calling render(bill) only on a miss"""
+        key = bill_content_key(bill)
+        path = self.get(bill.id, key)
+        record_cache('pdf', path is not None)
+        if path is None:
+            path = self.put(bill.id, key, render(bill))
+        return path, key
+
+    def invalidate(self, bill_id, keep=None):
+        """Remove every cached version of a bill"""
+        for path in glob.glob(os.path.join(self.directory, f"{bill_id}-*.pdf")):
+            if path == keep:
+                continue
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                if self._size is not None:
+                    self._size -= size
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.pdf'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Delete least recently used files until under the eviction target"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET_RATIO
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+        logger.info(f"PDF cache evicted down to {total} bytes")
+
+def _owning_bill_id(target):
+    return target.id if isinstance(target, Bill) else target.bill_id
+
+def register_invalidation(cache):
+    """Drop cached PDFs whenever a bill's statement content changes.
+
+    Affected bill ids are collected by mapper events during flush and the
+    files are removed only once the transaction commits. Bulk
+    ``Query.update()``/``delete()`` calls bypass these events; callers using
+    them must call ``cache.invalidate()`` themselves.
+    """
+    # Each registered cache (one per app) tracks its own pending ids
+    dirty_key = f"pdf_cache_dirty:{id(cache)}"
+
+    def mark_dirty(mapper, connection, target):
+        session = object_session(target)
+        bill_id = _owning_bill_id(target)
+        if session is not None and bill_id is not None:
+            session.info.setdefault(dirty_key, set()).add(bill_id)
+
+    def mark_bill_dirty(mapper, connection, target):
+        state = inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in STATEMENT_BILL_FIELDS):
+            mark_dirty(mapper, connection, target)
+
+    for model in (Diagnosis, Procedure):
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, mark_dirty)
+    event.listen(Bill, 'after_update', mark_bill_dirty)
+    event.listen(Bill, 'after_delete', mark_dirty)
+
+    @event.listens_for(Session, 'after_commit')
+    def invalidate_committed(session):
+        for bill_id in session.info.pop(dirty_key, ()):
+            cache.invalidate(bill_id)
+
+    @event.listens_for(Session, 'after_soft_rollback')
+    def discard_rolled_back(session, previous_transaction):
+        session.info.pop(dirty_key, None)
@@ -1,129 +1,309 @@
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import Paragraph
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from types import SimpleNamespace
+from xml.sax.saxutils import escape
+from models import Bill, bill_query
+from archive import load_archived_bill
+from pdf_templates import active_template
 import os
 import io
 
+# Names of the form XObjects holding the template's static page furniture
+HEADER_FORM = 'StatementHeader'
+FOOTER_FORM = 'StatementFooter'
+
+CENTS = Decimal('0.01')
+
+# Line-item cell padding (ReportLab's default) on each side of the description
+CELL_PADDING = 6
+
+def pdf_layout():
+    """The active statement template compiled into ReportLab objects, built once per template and process.
+
+    ReportLab is the slowest import in the app, so keeping it out of module
+    scope keeps it off worker boot and CLI start. The compiled layout is
+    immutable, so each process (including every batch-render worker) builds
+    it exactly once per template (see pdf_templates.use_template).
+    """
+    return _compile_layout(active_template()[1])
+
+@lru_cache(maxsize=4)
+def _compile_layout(fingerprint):
+    from reportlab import rl_config
+    from reportlab.lib.pagesizes import letter, A4
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.utils import ImageReader, simpleSplit
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Flowable
+
+    # Page streams are zlib-compressed either way; the ASCII85 pass on top
+    # only makes them larger and is pure Python without ReportLab's C extension
+    rl_config.useA85 = 0
+
+    template = active_template()[0]
+    page_size = {'letter': letter, 'A4': A4}[template['page']['size']]
+    margin = template['page']['margin']
+    regular, bold = template['fonts']['regular'], template['fonts']['bold']
+    color = {name: colors.HexColor(value) for name, value in template['colors'].items()}
+    brand, footer = template['brand'], template['footer']
+    frame_width = page_size[0] - 2 * margin
+    logo = ImageReader(brand['logo']) if brand['logo'] else None
+
+    class FormFlowable(Flowable):
+        """Static content drawn once per document into a form XObject, then reused wherever it appears"""
+
+        def __init__(self, name, height, draw):
+            super().__init__()
+            self.name, self.height, self._draw = name, height, draw
+            self.width = frame_width
+
+        def wrap(self, available_width, available_height):
+            return self.width, self.height
+
+        def draw(self):
+            canv = self.canv
+            if not canv.hasForm(self.name):
+                canv.beginForm(self.name, 0, 0, self.width, self.height)
+                self._draw(canv)
+                canv.endForm()
+            canv.doForm(self.name)
+
+    class TextLines(Flowable):
+        """Single-font lines of plain text, wrapped to the frame without Paragraph markup parsing"""
+
+        def __init__(self, texts, font, size, leading, space_before=0, space_after=0):
+            super().__init__()
+            self.texts, self.font, self.size, self.leading = texts, font, size, leading
+            self.spaceBefore, self.spaceAfter = space_before, space_after
+
+        def wrap(self, available_width, available_height):
+            self.width = available_width
+            self.lines = [line for text in self.texts
+                          for line in simpleSplit(text, self.font, self.size, available_width) or ['']]
+            self.height = self.leading * len(self.lines)
+            return self.width, self.height
+
+        def draw(self):
+            canv = self.canv
+            canv.setFont(self.font, self.size)
+            canv.setFillColor(color['text'])
+            baseline = self.height - self.size
+            for line in self.lines:
+                canv.drawString(0, baseline, line)
+                baseline -= self.leading
+
+    def draw_header(canv):
+        x = 0
+        if logo is not None:
+            canv.drawImage(logo, 0, header_height - brand['logo_height'], brand['logo_width'], brand['logo_height'],
+                           mask='auto', preserveAspectRatio=True)
+            x = brand['logo_width'] + 12
+        canv.setFillColor(color['brand'])
+        canv.setFont(bold, 24)
+        canv.drawString(x, header_height - 30, brand['name'])
+        canv.setFillColor(color['text'])
+        canv.setFont(regular, 12)
+        canv.drawString(x, header_height - 46, brand['subtitle'])
+
+    def section(key):
+        return lambda: TextLines([template['sections'][key]], bold, 14, 18, space_before=12, space_after=8)
+
+    def draw_footer(canv):
+        canv.setFillColor(color['text'])
+        canv.setFont(regular, 10)
+        canv.drawString(margin, 50, footer['notice'])
+        canv.drawString(page_size[0] - 250, 30, footer['system'])
+
+    # Title (24/28) and subtitle (12/16) lines followed by 24pt of space
+    header_height = max(68, brand['logo_height'] if logo is not None else 0)
+    return SimpleNamespace(
+        SimpleDocTemplate=SimpleDocTemplate, Table=Table, Paragraph=Paragraph, Spacer=Spacer, PageBreak=PageBreak,
+        TextLines=TextLines,
+        template=template,
+        page_size=page_size,
+        margin=margin,
+        footer_height=template['page']['footer_height'],
+        regular_font=regular,
+        string_width=stringWidth,
+        header=lambda: FormFlowable(HEADER_FORM, header_height, draw_header),
+        sections={key: section(key) for key in template['sections']},
+        draw_footer=draw_footer,
+        column_headers={key: list(template['columns'][key]) for key in ('diagnoses', 'procedures')},
+        line_item_col_widths=template['columns']['widths'],
+        description_width=template['columns']['widths'][1] - 2 * CELL_PADDING,
+        line_item_table_style=TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), color['table_header_background']),
+            ('TEXTCOLOR', (0, 0), (-1, 0), color['table_header_text']),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), bold),
+            ('FONTSIZE', (0, 0), (-1, 0), 12),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), color['table_background']),
+            ('TEXTCOLOR', (0, 1), (-1, -1), color['text']),
+            ('FONTNAME', (0, 1), (-1, -1), regular),
+            ('FONTSIZE', (0, 1), (-1, -1), 10),
+            ('GRID', (0, 0), (-1, -1), 1, color['grid']),
+            ('ALIGN', (-1, 0), (-1, -1), 'RIGHT'),
+        ]),
+        totals_table_style=TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+            ('TEXTCOLOR', (0, 0), (-1, -1), color['text']),
+            ('FONTNAME', (0, 0), (-1, -2), regular),
+            ('FONTSIZE', (0, 0), (-1, -2), 12),
+            ('FONTNAME', (0, -1), (-1, -1), bold),
+            ('FONTSIZE', (0, -1), (-1, -1), 14),
+        ]),
+        cell_style=ParagraphStyle('BillCell', fontName=regular, fontSize=10, leading=12, textColor=color['text']),
+    )
+
+def load_bill_for_pdf(bill_id):
+    """Load a bill and its line items with the 'pdf' loading profile, or its archived copy"""
+    return bill_query('pdf').filter(Bill.id == bill_id).first() or load_archived_bill(bill_id)
+
+def snapshot_bill(bill):
+    """Copy the fields drawn on a statement into a picklable, detached object"""
+    return SimpleNamespace(
+        id=bill.id,
+        patient_name=bill.patient_name,
+        patient_dob=bill.patient_dob,
+        insurance_provider=bill.insurance_provider,
+        policy_number=bill.policy_number,
+        diagnoses_subtotal=bill.diagnoses_subtotal,
+        procedures_subtotal=bill.procedures_subtotal,
+        total_amount=bill.total_amount,
+        diagnoses=[
+            SimpleNamespace(icd10_code=d.icd10_code, description=d.description, amount=d.amount)
+            for d in bill.diagnoses
+        ],
+        procedures=[
+            SimpleNamespace(cpt_code=p.cpt_code, description=p.description, amount=p.amount)
+            for p in bill.procedures
+        ]
+    )
+
+def format_money(amount):
+    """Dollar amount rounded half-up to cents, without going through float"""
+    return f"${Decimal(str(amount or 0)).quantize(CENTS, rounding=ROUND_HALF_UP)}"
+
+def _line_item_table(layout, header, rows):
+    """Build a line-item table that repeats its header row across page breaks"""
+    def description_cell(description):
+        description = description or ''
+        # Only descriptions too wide for the column need a (much slower) wrapping Paragraph
+        if layout.string_width(description, layout.regular_font, 10) <= layout.description_width:
+            return description
+        return layout.Paragraph(escape(description), layout.cell_style)
+
+    data = [list(header)] + [
+        [code, description_cell(description), format_money(amount)]
+        for code, description, amount in rows
+    ]
+    table = layout.Table(data, colWidths=layout.line_item_col_widths, repeatRows=1, hAlign='LEFT')
+    table.setStyle(layout.line_item_table_style)
+    return table
+
+def _draw_footer(c, doc):
+    layout = pdf_layout()
+    c.saveState()
+    if not c.hasForm(FOOTER_FORM):
+        c.beginForm(FOOTER_FORM)
+        layout.draw_footer(c)
+        c.endForm()
+    c.doForm(FOOTER_FORM)
+    c.setFont(layout.regular_font, 10)
+    c.drawString(layout.margin, 30, f"{layout.template['footer']['generated_label']}: {doc.generated_on}")
+    c.restoreState()
+
+def _patient_lines(template, bill):
+    lines = []
+    for item in template['patient_fields']:
+        value = getattr(bill, item['field'])
+        if value is None or value == '':
+            value = item.get('default')
+            if value is None:
+                continue
+        elif hasattr(value, 'strftime'):
+            value = value.strftime(template['date_format'])
+        lines.append(f"{item['label']}: {value}")
+    return lines
+
+def build_bill_story(bill, diagnoses, procedures):
+    """Return the list of flowables making up one bill statement.
+
+    The header is the template's form XObject; section titles and patient
+    fields are plain text lines, and only descriptions too long for their
+    column go through Paragraph.
+    """
+    layout = pdf_layout()
+    template = layout.template
+    story = [
+        layout.header(),
+        layout.sections['patient'](),
+        layout.TextLines(_patient_lines(template, bill), layout.regular_font, 12, 20),
+        layout.sections['diagnoses'](),
+        _line_item_table(
+            layout,
+            layout.column_headers['diagnoses'],
+            [(d.icd10_code, d.description, d.amount) for d in diagnoses]
+        ),
+        layout.sections['procedures'](),
+        _line_item_table(
+            layout,
+            layout.column_headers['procedures'],
+            [(p.cpt_code, p.description, p.amount) for p in procedures]
+        ),
+    ]
+
+    # Subtotals are stored on the bill, so nothing is aggregated at render time
+    labels = template['totals']
+    totals = layout.Table([
+        [f"{labels['diagnoses']}: {format_money(bill.diagnoses_subtotal)}"],
+        [f"{labels['procedures']}: {format_money(bill.procedures_subtotal)}"],
+        [f"{labels['total']}: {format_money(bill.total_amount)}"],
+    ], hAlign='RIGHT')
+    totals.setStyle(layout.totals_table_style)
+    story.append(layout.Spacer(1, 20))
+    story.append(totals)
+    return story
+
+def _build_document(output, story, title):
+    layout = pdf_layout()
+    doc = layout.SimpleDocTemplate(
+        output,
+        pagesize=layout.page_size,
+        leftMargin=layout.margin,
+        rightMargin=layout.margin,
+        topMargin=layout.margin,
+        bottomMargin=layout.footer_height,
+        title=title
+    )
+    doc.generated_on = datetime.now().strftime('%m/%d/%Y %H:%M:%S')
+
+    # Flowables break across pages; the footer is redrawn on every page
+    doc.build(story, onFirstPage=_draw_footer, onLaterPages=_draw_footer)
+
 def generate_bill_pdf(bill, diagnoses, procedures):
     # Create a buffer to store PDF
     buffer = io.BytesIO()
-    
-    # Create the PDF object using the buffer
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Add header with logo and title
-    c.setFont("Helvetica-Bold", 24)
-    c.drawString(50, height - 50, "BillingDog")
-    c.setFont("Helvetica", 12)
-    c.drawString(50, height - 70, "Healthcare Billing Report")
-    
-    # Add patient information
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, height - 120, "Patient Information")
-    c.setFont("Helvetica", 12)
-    c.drawString(50, height - 140, f"Name: {bill.patient_name}")
-    c.drawString(50, height - 160, f"DOB: {bill.patient_dob.strftime('%m/%d/%Y')}")
-    c.drawString(50, height - 180, f"Insurance: {bill.insurance_provider or 'Self Pay'}")
-    if bill.policy_number:
-        c.drawString(50, height - 200, f"Policy Number: {bill.policy_number}")
-    
-    # Add diagnoses with charges
-    y_position = height - 250
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y_position, "Diagnoses")
-    y_position -= 30
-    
-    # Create diagnoses table
-    diagnoses_data = [["ICD-10 Code", "Description", "Amount"]]
-    for diagnosis in diagnoses:
-        diagnoses_data.append([
-            diagnosis.icd10_code,
-            diagnosis.description,
-            f"${float(diagnosis.amount):.2f}"
-        ])
-    
-    diagnoses_table = Table(diagnoses_data, colWidths=[1.2*inch, 4*inch, 1*inch])
-    diagnoses_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.whitesmoke),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('ALIGN', (-1, 0), (-1, -1), 'RIGHT'),
-    ]))
-    
-    # Draw diagnoses table
-    diagnoses_table.wrapOn(c, width - 100, height)
-    diagnoses_table.drawOn(c, 50, y_position - len(diagnoses_data)*20)
-    
-    # Add procedures and charges
-    y_position = y_position - len(diagnoses_data)*20 - 50
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(50, y_position, "Procedures and Charges")
-    y_position -= 30
-    
-    # Create procedures table
-    procedures_data = [["CPT Code", "Description", "Amount"]]
-    for procedure in procedures:
-        procedures_data.append([
-            procedure.cpt_code,
-            procedure.description,
-            f"${float(procedure.amount):.2f}"
-        ])
-    
-    procedures_table = Table(procedures_data, colWidths=[1.2*inch, 4*inch, 1*inch])
-    procedures_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.whitesmoke),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('ALIGN', (-1, 0), (-1, -1), 'RIGHT'),
-    ]))
-    
-    # Draw procedures table
-    procedures_table.wrapOn(c, width - 100, height)
-    procedures_table.drawOn(c, 50, y_position - len(procedures_data)*20)
-    
-    # Calculate subtotals
-    diagnoses_total = sum(float(d.amount) for d in diagnoses)
-    procedures_total = sum(float(p.amount) for p in procedures)
-    
-    # Add subtotals and total
-    y_position = y_position - len(procedures_data)*20 - 40
-    c.setFont("Helvetica", 12)
-    c.drawString(width - 200, y_position, f"Diagnoses Subtotal: ${diagnoses_total:.2f}")
-    y_position -= 20
-    c.drawString(width - 200, y_position, f"Procedures Subtotal: ${procedures_total:.2f}")
-    y_position -= 20
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(width - 200, y_position, f"Total Amount: ${float(bill.total_amount):.2f}")
-    
-    # Add footer
-    c.setFont("Helvetica", 10)
-    c.drawString(50, 30, f"Generated on: {datetime.now().strftime('%m/%d/%Y %H:%M:%S')}")
-    c.drawString(width - 250, 30, "BillingDog Healthcare Billing System")
-    c.drawString(50, 50, "This is a computer-generated document and does not require a signature.")
-    
-    # Save PDF
-    c.save()
+    title = f"Bill {bill.id}" if getattr(bill, 'id', None) else "Bill"
+    _build_document(buffer, build_bill_story(bill, diagnoses, procedures), title)
     buffer.seek(0)
     return buffer
+
+def render_bill_pdf(bill):
+    """Render a loaded bill's statement and return the PDF bytes"""
+    return generate_bill_pdf(bill, bill.diagnoses, bill.procedures).getvalue()
+
+def generate_statements_pdf(bills, output):
+    """Render several bills into one document, each starting on a new page.
+
+    `output` may be a file path or a writable binary file object.
+    """
+    story = []
+    for bill in bills:
+        if story:
+            story.append(pdf_layout().PageBreak())
+        story.extend(build_bill_story(bill, bill.diagnoses, bill.procedures))
+    _build_document(output, story, "Billing Statements")
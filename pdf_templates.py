@@ -0,0 +1,120 @@
+"""Statement templates: the data that drives the bill PDF layout.
+
+A template is a JSON document overriding any part of
+DEFAULT_STATEMENT_TEMPLATE (brand name, subtitle and logo, fonts, colours,
+section and column titles, patient fields, footer text), so a clinic can
+brand its statements with PDF_TEMPLATE_PATH instead of code changes.
+pdf_generator compiles the active template once per process into the
+ReportLab styles and the static page furniture it draws per document.
+"""
+import copy
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZES = ('letter', 'A4')
+# Bill fields a template may print in the patient block; pdf_cache keys renders on these
+PATIENT_FIELDS = ('patient_name', 'patient_dob', 'insurance_provider', 'policy_number')
+
+DEFAULT_STATEMENT_TEMPLATE = {
+    'page': {'size': 'letter', 'margin': 50, 'footer_height': 80},
+    'brand': {
+        'name': 'BillingDog',
+        'subtitle': 'Healthcare Billing Report',
+        'logo': None,  # path to a PNG or JPEG drawn left of the name
+        'logo_width': 72,
+        'logo_height': 36,
+    },
+    'fonts': {'regular': 'Helvetica', 'bold': 'Helvetica-Bold'},
+    'colors': {
+        'text': '#000000',
+        'brand': '#000000',
+        'table_header_background': '#808080',
+        'table_header_text': '#f5f5f5',
+        'table_background': '#f5f5f5',
+        'grid': '#000000',
+    },
+    'sections': {
+        'patient': 'Patient Information',
+        'diagnoses': 'Diagnoses',
+        'procedures': 'Procedures and Charges',
+    },
+    # Printed in order; a field without a value is left out unless it has a default
+    'patient_fields': [
+        {'label': 'Name', 'field': 'patient_name'},
+        {'label': 'DOB', 'field': 'patient_dob'},
+        {'label': 'Insurance', 'field': 'insurance_provider', 'default': 'Self Pay'},
+        {'label': 'Policy Number', 'field': 'policy_number'},
+    ],
+    'date_format': '%m/%d/%Y',
+    'columns': {
+        'diagnoses': ['ICD-10 Code', 'Description', 'Amount'],
+        'procedures': ['CPT Code', 'Description', 'Amount'],
+        'widths': [86.4, 288, 72],  # points
+    },
+    'totals': {
+        'diagnoses': 'Diagnoses Subtotal',
+        'procedures': 'Procedures Subtotal',
+        'total': 'Total Amount',
+    },
+    'footer': {
+        'notice': 'This is a computer-generated document and does not require a signature.',
+        'generated_label': 'Generated on',
+        'system': 'BillingDog Healthcare Billing System',
+    },
+}
+
+def _merge(base, overrides, path=''):
+    merged = copy.deepcopy(base)
+    for key, value in overrides.items():
+        if key not in base:
+            raise ValueError(f"Unknown statement template setting: {path}{key}")
+        if isinstance(base[key], dict) and isinstance(value, dict):
+            merged[key] = _merge(base[key], value, f"{path}{key}.")
+        else:
+            merged[key] = value
+    return merged
+
+def validate_template(template):
+    """Raise ValueError for a template the layout cannot draw"""
+    if template['page']['size'] not in PAGE_SIZES:
+        raise ValueError(f"page.size must be one of {', '.join(PAGE_SIZES)}")
+    for item in template['patient_fields']:
+        if item.get('field') not in PATIENT_FIELDS or not isinstance(item.get('label'), str):
+            raise ValueError(f"patient_fields entries need a label and one of {', '.join(PATIENT_FIELDS)}")
+    columns = template['columns']
+    if any(len(columns[name]) != 3 for name in ('diagnoses', 'procedures', 'widths')):
+        raise ValueError("columns need three titles (code, description, amount) and three widths")
+    return template
+
+def build_template(overrides=None):
+    """DEFAULT_STATEMENT_TEMPLATE with `overrides` applied, validated"""
+    return validate_template(_merge(DEFAULT_STATEMENT_TEMPLATE, overrides or {}))
+
+def load_template(path):
+    """Read a template file (JSON overrides of DEFAULT_STATEMENT_TEMPLATE)"""
+    with open(path, encoding='utf-8') as f:
+        return build_template(json.load(f))
+
+def template_fingerprint(template):
+    """Stable hash of a template and its logo file, part of every cached statement's key"""
+    digest = hashlib.sha256(json.dumps(template, sort_keys=True, separators=(',', ':')).encode('utf-8'))
+    if template['brand']['logo']:
+        with open(template['brand']['logo'], 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+_default = build_template()
+_active = {'template': _default, 'fingerprint': template_fingerprint(_default)}
+
+def use_template(template):
+    """Make `template` the one statements are rendered with in this process (and forked workers)"""
+    _active['template'] = template
+    _active['fingerprint'] = template_fingerprint(template)
+    logger.info(f"Statement template {_active['fingerprint']} ({template['brand']['name']})")
+
+def active_template():
+    """(template, fingerprint) currently used for rendering"""
+    return _active['template'], _active['fingerprint']
@@ -0,0 +1,407 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from metrics import record_upstream, upstream_retries
+
+logger = logging.getLogger(__name__)
+
+# Static exchange rates for fallback
+STATIC_EXCHANGE_RATES = {
+    'USD': 1.0,
+    'EUR': 0.85,
+    'GBP': 0.73,
+    'JPY': 110.0,
+    'CAD': 1.25,
+    'AUD': 1.35,
+    'CNY': 6.45
+}
+
+# Static crypto prices for fallback
+STATIC_CRYPTO_PRICES = {
+    'BTC': 35000.00,
+    'ETH': 2000.00,
+    'USDT': 1.00,
+    'USDC': 1.00
+}
+
+# Retry settings
+MAX_RETRIES = 3
+RETRY_DELAY = 1  # seconds
+REQUEST_TIMEOUT = 5  # seconds
+
+# Upstream endpoints; overridable so a local fake upstream can stand in
+EXCHANGE_RATE_API_URL = os.environ.get('EXCHANGE_RATE_API_URL', 'https://api.exchangerate-api.com/v4/latest/USD')
+COINBASE_API_URL = os.environ.get('COINBASE_API_URL', 'https://api.commerce.coinbase.com/v2/exchange-rates')
+
+# Background refresh settings (seconds)
+RATES_REFRESH_INTERVAL = float(os.environ.get('RATES_REFRESH_INTERVAL', 30))
+RATES_STALE_AFTER = float(os.environ.get('RATES_STALE_AFTER', 60))
+RATES_EXPIRE_AFTER = float(os.environ.get('RATES_EXPIRE_AFTER', 600))
+
+CRYPTO_SYMBOLS = ['BTC', 'ETH', 'USDT', 'USDC']
+
+# Circuit breaker settings
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 60  # seconds
+
+class CircuitBreaker:
+    """Stops calling an upstream after repeated failures.
+
+    After failure_threshold consecutive failures the breaker opens and allow()
+    returns False until reset_timeout has passed; then a single trial call is
+    let through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"Circuit breaker for {self.name} opened")
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+class UpstreamStats:
+    """Thread-safe request, error and latency counters for one upstream"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.last_latency = None
+        self._lock = threading.Lock()
+
+    def record(self, latency, error):
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.last_latency = latency
+            if error:
+                self.errors += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'avg_latency': self.total_latency / self.requests if self.requests else None,
+                'last_latency': self.last_latency
+            }
+
+crypto_breakers = {symbol: CircuitBreaker(f'coinbase:{symbol}') for symbol in CRYPTO_SYMBOLS}
+upstream_stats = defaultdict(UpstreamStats)
+
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """The process's keep-alive connection pool, shared by all upstream calls.
+
+    Created on first use, so requests stays out of worker boot and CLI start,
+    and again in a forked worker rather than sharing the parent's sockets.
+    """
+    global _http_session, _http_session_pid
+    if _http_session_pid != os.getpid():
+        with _http_session_lock:
+            if _http_session_pid != os.getpid():
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=len(CRYPTO_SYMBOLS)))
+                session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=len(CRYPTO_SYMBOLS)))
+                _http_session, _http_session_pid = session, os.getpid()
+    return _http_session
+
+def timed_request(upstream, method, url, **kwargs):
+    """Send a request through the pooled session, recording latency and errors for `upstream`"""
+    import requests
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    started = time.perf_counter()
+    try:
+        response = get_http_session().request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        latency = time.perf_counter() - started
+        upstream_stats[upstream].record(latency, True)
+        record_upstream(upstream, latency, True)
+        raise
+    latency = time.perf_counter() - started
+    upstream_stats[upstream].record(latency, response.status_code >= 400)
+    record_upstream(upstream, latency, response.status_code >= 400)
+    return response
+
+def timed_get(upstream, url, **kwargs):
+    """GET through the pooled session, recording latency and errors for `upstream`"""
+    return timed_request(upstream, 'GET', url, **kwargs)
+
+def get_upstream_status():
+    """Latency/error counters per upstream and the state of each circuit breaker"""
+    return {
+        'upstreams': {name: stats.to_dict() for name, stats in list(upstream_stats.items())},
+        'breakers': {symbol: breaker.state for symbol, breaker in crypto_breakers.items()}
+    }
+
+def get_live_exchange_rates():
+    """Fetch live exchange rates from an API with retry mechanism"""
+    import requests
+    for attempt in range(MAX_RETRIES):
+        try:
+            response = timed_get('exchangerate-api', EXCHANGE_RATE_API_URL)
+            response.raise_for_status()
+            data = response.json()
+            
+            # Every currency the upstream quotes, with the static table filling gaps
+            rates = dict(STATIC_EXCHANGE_RATES)
+            rates.update({
+                currency: float(rate) for currency, rate in data['rates'].items()
+                if isinstance(currency, str) and len(currency) == 3 and isinstance(rate, (int, float)) and rate > 0
+            })
+            rates['USD'] = 1.0
+            
+            logger.info("Successfully fetched live exchange rates")
+            return rates
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Attempt {attempt + 1}/{MAX_RETRIES} failed: {str(e)}")
+            if attempt < MAX_RETRIES - 1:
+                upstream_retries.inc('exchangerate-api')
+                time.sleep(RETRY_DELAY * (2 ** attempt))  # Exponential backoff
+            continue
+        except Exception as e:
+            logger.error(f"Unexpected error fetching exchange rates: {str(e)}")
+            break
+            
+    logger.warning("All attempts to fetch exchange rates failed, using static rates")
+    return None
+
+def fetch_crypto_price(symbol, headers):
+    """Fetch one USD price from Coinbase, guarded by the symbol's circuit breaker"""
+    import requests
+    breaker = crypto_breakers[symbol]
+    for attempt in range(MAX_RETRIES):
+        if not breaker.allow():
+            logger.warning(f"Circuit open for {symbol}, skipping upstream call")
+            return None
+        try:
+            response = timed_get(
+                f'coinbase:{symbol}',
+                f'{COINBASE_API_URL}?currency={symbol}',
+                headers=headers
+            )
+
+            if response.status_code == 502:
+                logger.error(f"Bad Gateway (502) error for {symbol}")
+                breaker.record_failure()
+                if attempt < MAX_RETRIES - 1:
+                    delay = RETRY_DELAY * (2 ** attempt)  # Exponential backoff
+                    logger.info(f"Retrying after {delay} seconds...")
+                    upstream_retries.inc(f'coinbase:{symbol}')
+                    time.sleep(delay)
+                continue
+
+            response.raise_for_status()
+            data = response.json()
+
+            if 'data' in data and 'rates' in data['data'] and 'USD' in data['data']['rates']:
+                breaker.record_success()
+                logger.info(f"Successfully fetched {symbol} price")
+                return float(data['data']['rates']['USD'])
+            raise ValueError(f"Invalid response format for {symbol}")
+
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Attempt {attempt + 1}/{MAX_RETRIES} failed for {symbol}: {str(e)}")
+            breaker.record_failure()
+            if attempt < MAX_RETRIES - 1:
+                delay = RETRY_DELAY * (2 ** attempt)  # Exponential backoff
+                upstream_retries.inc(f'coinbase:{symbol}')
+                time.sleep(delay)
+            continue
+        except ValueError as e:
+            logger.error(f"Invalid response for {symbol}: {str(e)}")
+            breaker.record_failure()
+            return None
+        except Exception as e:
+            logger.error(f"Unexpected error fetching {symbol} price: {str(e)}")
+            breaker.record_failure()
+            return None
+    return None
+
+def get_live_crypto_prices():
+    """Fetch live cryptocurrency prices from Coinbase API, one thread per symbol.
+
+    Only the symbols fetched live are returned; RateRefresher fills the rest
+    from STATIC_CRYPTO_PRICES and reports them as not live. None is returned
+    if no symbol was live.
+    """
+    coinbase_key = os.environ.get('COINBASE_COMMERCE_API_KEY')
+    if not coinbase_key:
+        logger.error("Coinbase API key not found in environment variables")
+        return None
+
+    headers = {
+        'X-CC-Api-Key': coinbase_key,
+        'X-CC-Version': '2018-03-22'
+    }
+
+    with ThreadPoolExecutor(max_workers=len(CRYPTO_SYMBOLS), thread_name_prefix='crypto-fetch') as pool:
+        fetched = dict(zip(CRYPTO_SYMBOLS, pool.map(lambda symbol: fetch_crypto_price(symbol, headers), CRYPTO_SYMBOLS)))
+
+    prices = {}
+    for symbol, price in fetched.items():
+        if price is None:
+            logger.warning(f"Using fallback price for {symbol}")
+        else:
+            prices[symbol] = price
+    return prices or None
+
+@dataclass(frozen=True)
+class RateSnapshot:
+    """Immutable set of rates published by a RateRefresher.
+
+    The static fallback has no fetched_at (and no age): it was never fetched.
+    """
+    values: MappingProxyType
+    fetched_at: float = None
+    # Keys whose value came from the upstream; the rest are static fallbacks
+    live_keys: frozenset = frozenset()
+    # Monotonic publish time, used for age so wall-clock jumps do not matter
+    published_at: float = field(default_factory=time.monotonic, compare=False)
+
+    @property
+    def is_live(self):
+        """True only when every value is live"""
+        return bool(self.values) and self.live_keys >= self.values.keys()
+
+    @property
+    def age(self):
+        """Seconds since the values were fetched, or None for the static fallback"""
+        if self.fetched_at is None:
+            return None
+        return time.monotonic() - self.published_at
+
+    def to_dict(self):
+        return dict(self.values)
+
+    def liveness(self):
+        """{key: whether its value is live}"""
+        return {key: key in self.live_keys for key in self.values}
+
+class RateRefresher:
+    """Owns one upstream rate source and publishes snapshots from a daemon thread.
+
+    Request handlers call current(), which only reads an attribute, so they
+    never block on the upstream. A live snapshot older than stale_after is
+    still served but wakes the refresher early (stale-while-revalidate); once
+    it is older than expire_after the static fallback is served instead.
+    """
+
+    def __init__(self, name, fetch, fallback, interval=RATES_REFRESH_INTERVAL,
+                 stale_after=RATES_STALE_AFTER, expire_after=RATES_EXPIRE_AFTER, on_refresh=None):
+        self.name = name
+        self.fetch = fetch
+        # Called from the refresh thread with every live result (e.g. to record history)
+        self.on_refresh = on_refresh
+        self.fallback = RateSnapshot(MappingProxyType(dict(fallback)))
+        self.interval = interval
+        self.stale_after = stale_after
+        self.expire_after = expire_after
+        self._snapshot = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the refresh thread once per process (safe to call repeatedly)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            # A forked worker inherits the attribute but not the thread
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def refresh(self):
+        """Fetch from the upstream once and publish the result if it succeeded.
+
+        Keys the upstream left out keep their fallback value, marked not live.
+        """
+        try:
+            values = self.fetch()
+        except Exception as e:
+            logger.error(f"Unexpected error refreshing {self.name}: {str(e)}")
+            values = None
+        if values:
+            self._snapshot = RateSnapshot(
+                MappingProxyType({**self.fallback.values, **values}), time.time(), frozenset(values)
+            )
+            if self.on_refresh is not None:
+                try:
+                    self.on_refresh(values)
+                except Exception as e:
+                    logger.error(f"Error handling refreshed {self.name}: {str(e)}")
+        return values is not None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def current(self):
+        """Return the latest snapshot without touching the network"""
+        self.start()
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self.fallback
+        age = snapshot.age
+        if age > self.expire_after:
+            return self.fallback
+        if age > self.stale_after:
+            self._wake.set()
+        return snapshot
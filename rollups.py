@@ -0,0 +1,408 @@
+import logging
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import event, func, select, delete, insert, case, literal, inspect, union_all
+from sqlalchemy.orm import Session
+from models import (
+    db, Bill, Diagnosis, Procedure, InsuranceClaim, BillArchive, ClaimArchive, DailyBillRollup, DailyClaimRollup
+)
+
+logger = logging.getLogger(__name__)
+
+# Rollup settings
+ROLLUP_SNAPSHOT_CHUNK = 500  # ids per IN (...) when reading rows before/after a change
+ROLLUP_REBUILD_CHUNK_DAYS = 7
+TOP_INSURERS = 10
+
+# Dashboard date filters as a number of calendar days, today included
+ROLLUP_DATE_FILTERS = {'today': 1, 'week': 7, 'month': 30}
+
+# Claim statuses folded into the outcomes the dashboard reports. Leasing a
+# claim (queued -> submitting, a Core UPDATE) stays inside 'open'.
+CLAIM_OUTCOMES = {
+    'queued': 'open',
+    'submitting': 'open',
+    'submitted': 'accepted',
+    'rejected': 'rejected',
+    'failed': 'failed',
+}
+
+Rollup = namedtuple('Rollup', 'source target columns key measures')
+
+def _bill_key(row):
+    return (
+        ('day', row.created_at.date() if row.created_at else None),
+        ('payment_status', row.payment_status or 'pending'),
+        ('payment_method', row.payment_method or ''),
+        ('currency', (row.bank_currency if row.payment_method == 'bank' else row.payment_currency) or ''),
+        ('insurer', row.insurance_provider or ''),
+    )
+
+def _claim_key(row):
+    queued = row.queued_at or row.submitted_at
+    return (
+        ('day', queued.date() if queued else None),
+        ('payer_id', row.payer_id),
+        ('payer_name', row.payer_name),
+        ('outcome', CLAIM_OUTCOMES.get(row.status or 'queued', row.status)),
+    )
+
+BILL_ROLLUP = Rollup(
+    Bill, DailyBillRollup,
+    (Bill.id, Bill.created_at, Bill.payment_status, Bill.payment_method, Bill.bank_currency,
+     Bill.payment_currency, Bill.insurance_provider, Bill.total_amount),
+    _bill_key,
+    lambda row: {'bill_count': 1, 'total_amount': Decimal(row.total_amount or 0)}
+)
+CLAIM_ROLLUP = Rollup(
+    InsuranceClaim, DailyClaimRollup,
+    (InsuranceClaim.id, InsuranceClaim.queued_at, InsuranceClaim.submitted_at, InsuranceClaim.payer_id,
+     InsuranceClaim.payer_name, InsuranceClaim.status),
+    _claim_key,
+    lambda row: {'claim_count': 1}
+)
+ROLLUPS = (BILL_ROLLUP, CLAIM_ROLLUP)
+
+# Attributes that move a row between rollup buckets or change its measures
+ROLLUP_FIELDS = {
+    Bill: ('created_at', 'payment_status', 'payment_method', 'bank_currency', 'payment_currency',
+           'insurance_provider', 'total_amount'),
+    InsuranceClaim: ('queued_at', 'submitted_at', 'payer_id', 'payer_name', 'status'),
+}
+LINE_ITEM_FIELDS = ('bill_id', 'amount')
+
+def rollup_snapshot(connection, rollup, ids):
+    """{id: row} of the rollup's source columns for the given ids"""
+    ids = [i for i in set(ids) if i is not None]
+    rows = {}
+    for start in range(0, len(ids), ROLLUP_SNAPSHOT_CHUNK):
+        chunk = ids[start:start + ROLLUP_SNAPSHOT_CHUNK]
+        for row in connection.execute(select(*rollup.columns).where(rollup.columns[0].in_(chunk))):
+            rows[row.id] = row
+    return rows
+
+def _rollup_deltas(rollup, before, after):
+    deltas = defaultdict(lambda: defaultdict(int))
+    for rows, sign in ((before, -1), (after, 1)):
+        for row in rows.values():
+            key = rollup.key(row)
+            if key[0][1] is None:
+                continue
+            for name, value in rollup.measures(row).items():
+                deltas[key][name] += sign * value
+    # In key order, so concurrent writers lock rollup rows in the same order (no deadlocks on PostgreSQL)
+    return [dict(key, **measures) for key, measures in sorted(deltas.items()) if any(measures.values())]
+
+def _upsert(connection, target, rows):
+    """INSERT rows, adding their measures to any existing row with the same key"""
+    # Imported here: the PostgreSQL dialect is slow to load and unused on SQLite
+    from sqlalchemy.dialects import postgresql, sqlite
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}.get(connection.dialect.name)
+    if dialect is None:
+        raise NotImplementedError(f"Rollups need INSERT ... ON CONFLICT; {connection.dialect.name} is not supported")
+    table = target.__table__
+    stmt = dialect.insert(table)
+    measures = [name for name in rows[0] if not table.c[name].primary_key]
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=[column.name for column in table.primary_key],
+        set_={name: table.c[name] + stmt.excluded[name] for name in measures}
+    ), rows)
+
+def apply_rollup_changes(connection, rollup, before, ids=()):
+    """Fold the change from `before` (a rollup_snapshot) to the rows' current state into the rollup.
+
+    For Core statements that bypass the ORM hooks: take a snapshot of the ids
+    about to change, run the statement, then call this in the same
+    transaction. New rows need only their ids with an empty `before`.
+    """
+    after = rollup_snapshot(connection, rollup, set(before) | set(ids))
+    return apply_rollup_delta(connection, rollup, before, after)
+
+def apply_rollup_delta(connection, rollup, before, after):
+    """Fold the change between two {id: row} states of the rollup's source columns into the rollup.
+
+    For writers that already hold both states, e.g. the row a compare-and-set
+    UPDATE matched and what it RETURNed, so no snapshot has to be read.
+    """
+    deltas = _rollup_deltas(rollup, before, after)
+    if deltas:
+        _upsert(connection, rollup.target, deltas)
+    return len(deltas)
+
+def _changed(obj, fields):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in fields)
+
+def _affected(session):
+    """Per rollup: ids whose stored state is about to change, and new objects whose ids exist only after the flush"""
+    ids = {rollup: set() for rollup in ROLLUPS}
+    pending = {rollup: [] for rollup in ROLLUPS}
+    for rollup in ROLLUPS:
+        source = rollup.source
+        pending[rollup].extend(obj for obj in session.new if isinstance(obj, source))
+        ids[rollup].update(obj.id for obj in session.deleted if isinstance(obj, source))
+        ids[rollup].update(
+            obj.id for obj in session.dirty
+            if isinstance(obj, source) and _changed(obj, ROLLUP_FIELDS[source])
+        )
+
+    # Line items move their bill's total through totals.py
+    line_items = [obj for obj in session.new if isinstance(obj, (Diagnosis, Procedure))]
+    line_items += [obj for obj in session.deleted if isinstance(obj, (Diagnosis, Procedure))]
+    line_items += [
+        obj for obj in session.dirty
+        if isinstance(obj, (Diagnosis, Procedure)) and _changed(obj, LINE_ITEM_FIELDS)
+    ]
+    with session.no_autoflush:
+        for obj in line_items:
+            # A bill that is itself new is already pending
+            bill_id = obj.bill_id or (obj.bill.id if obj.bill is not None else None)
+            ids[BILL_ROLLUP].add(bill_id)
+            ids[BILL_ROLLUP].update(inspect(obj).attrs.bill_id.history.deleted)
+    return ids, pending
+
+def _snapshot_orphaned_bill(mapper, connection, target):
+    """Read the bill of a line item the flush deletes as an orphan, before its total moves.
+
+    before_flush only sees session.deleted; rows deleted through delete-orphan
+    cascades (bill.procedures.remove(p)) show up here first.
+    """
+    state = inspect(target)
+    bill_ids = state.attrs.bill_id.history.deleted or [target.bill_id]
+    pending = state.session.info.setdefault('rollup_pending', [])
+    before = next((before for rollup, before, _ in pending if rollup is BILL_ROLLUP), None)
+    if before is None:
+        before = {}
+        pending.append((BILL_ROLLUP, before, []))
+    missing = [bill_id for bill_id in bill_ids if bill_id is not None and bill_id not in before]
+    if missing:
+        before.update(rollup_snapshot(connection, BILL_ROLLUP, missing))
+
+_rollups_registered = False
+
+def register_rollup_maintenance():
+    """Keep the daily rollups in step with ORM changes to bills and claims.
+
+    Before a flush, the stored state of every bill or claim it touches is
+    read; after it (and after totals.py has adjusted bill totals) the new
+    state is read, and only the difference is upserted into the rollup rows.
+    Core statements bypass this: use apply_rollup_changes() next to them, or
+    rebuild_rollups() after bulk repairs. Listeners are attached once per
+    process, however many apps call this.
+    """
+    global _rollups_registered
+    if _rollups_registered:
+        return
+    _rollups_registered = True
+
+    for line_item in (Diagnosis, Procedure):
+        event.listen(line_item, 'before_delete', _snapshot_orphaned_bill)
+
+    @event.listens_for(Session, 'before_flush')
+    def snapshot_rollups(session, flush_context, instances):
+        ids, pending = _affected(session)
+        if not any(ids.values()) and not any(pending.values()):
+            session.info.pop('rollup_pending', None)
+            return
+        connection = session.connection()
+        session.info['rollup_pending'] = [
+            (rollup, rollup_snapshot(connection, rollup, ids[rollup]), pending[rollup])
+            for rollup in ROLLUPS if ids[rollup] or pending[rollup]
+        ]
+
+    @event.listens_for(Session, 'after_flush_postexec')
+    def apply_rollups(session, flush_context):
+        changes = session.info.pop('rollup_pending', None)
+        if not changes:
+            return
+        connection = session.connection()
+        for rollup, before, objects in changes:
+            apply_rollup_changes(connection, rollup, before, [obj.id for obj in objects])
+
+def _bill_rebuild_select(start, end):
+    # Archived bills keep their rollup dimensions in bill_archive (archive.py)
+    currency = case((Bill.payment_method == 'bank', Bill.bank_currency), else_=Bill.payment_currency)
+    rows = union_all(
+        select(Bill.created_at, Bill.payment_status, Bill.payment_method, currency.label('currency'),
+               Bill.insurance_provider, Bill.total_amount)
+        .where(Bill.created_at >= start, Bill.created_at < end),
+        select(BillArchive.created_at, BillArchive.payment_status, BillArchive.payment_method, BillArchive.currency,
+               BillArchive.insurance_provider, BillArchive.total_amount)
+        .where(BillArchive.created_at >= start, BillArchive.created_at < end),
+    ).subquery()
+    day = func.date(rows.c.created_at)
+    dimensions = (
+        func.coalesce(rows.c.payment_status, 'pending'),
+        func.coalesce(rows.c.payment_method, ''),
+        func.coalesce(rows.c.currency, ''),
+        func.coalesce(rows.c.insurance_provider, ''),
+    )
+    return (
+        select(day, *dimensions, func.count(), func.coalesce(func.sum(rows.c.total_amount), 0))
+        .group_by(day, *dimensions)
+    )
+
+def _claim_rebuild_select(start, end):
+    def queued(model):
+        return func.coalesce(model.queued_at, model.submitted_at)
+
+    rows = union_all(*[
+        select(queued(model).label('queued'), model.payer_id, model.payer_name, model.status)
+        .where(queued(model) >= start, queued(model) < end)
+        for model in (InsuranceClaim, ClaimArchive)
+    ]).subquery()
+    day = func.date(rows.c.queued)
+    outcome = case(
+        *[(rows.c.status == status, literal(bucket)) for status, bucket in CLAIM_OUTCOMES.items()],
+        else_=func.coalesce(rows.c.status, 'open')
+    )
+    return (
+        select(day, rows.c.payer_id, rows.c.payer_name, outcome, func.count())
+        .group_by(day, rows.c.payer_id, rows.c.payer_name, outcome)
+    )
+
+REBUILDS = (
+    (DailyBillRollup, ('day', 'payment_status', 'payment_method', 'currency', 'insurer', 'bill_count', 'total_amount'),
+     _bill_rebuild_select, (Bill.created_at, BillArchive.created_at)),
+    (DailyClaimRollup, ('day', 'payer_id', 'payer_name', 'outcome', 'claim_count'),
+     _claim_rebuild_select, (func.coalesce(InsuranceClaim.queued_at, InsuranceClaim.submitted_at),
+                             func.coalesce(ClaimArchive.queued_at, ClaimArchive.submitted_at))),
+)
+
+def rebuild_rollups(start_day=None, end_day=None, chunk_days=ROLLUP_REBUILD_CHUNK_DAYS):
+    """Backfill job: recompute both rollups from the source tables, a few days per transaction.
+
+    Each chunk deletes its rollup rows and re-inserts them with one
+    INSERT ... SELECT ... GROUP BY, then commits, so the job can be resumed
+    from the last reported day. Without bounds it covers the oldest to the
+    newest bill or claim, archived ones included. Yields (chunk_start, chunk_end, rows_written).
+    """
+    if start_day is None or end_day is None:
+        bounds = [
+            db.session.execute(select(func.min(column), func.max(column))).one()
+            for *_, columns in REBUILDS for column in columns
+        ]
+        lows = [_as_date(low) for low, _ in bounds if low is not None]
+        highs = [_as_date(high) for _, high in bounds if high is not None]
+        if not lows:
+            return
+        start_day = start_day or min(lows)
+        end_day = end_day or max(highs)
+
+    day = start_day
+    while day <= end_day:
+        chunk_end = min(day + timedelta(days=chunk_days), end_day + timedelta(days=1))
+        start, end = datetime.combine(day, datetime.min.time()), datetime.combine(chunk_end, datetime.min.time())
+        written = 0
+        for target, columns, rebuild_select, _ in REBUILDS:
+            db.session.execute(delete(target).where(target.day >= day, target.day < chunk_end))
+            result = db.session.execute(insert(target).from_select(columns, rebuild_select(start, end)))
+            written += result.rowcount
+        db.session.commit()
+        yield day, chunk_end - timedelta(days=1), written
+        day = chunk_end
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).date()
+    return value
+
+def rollup_start_day(date_filter, today=None):
+    """First day covered by a dashboard date filter, or None for all time"""
+    days = ROLLUP_DATE_FILTERS.get(date_filter)
+    if days is None:
+        return None
+    return (today or datetime.utcnow().date()) - timedelta(days=days - 1)
+
+def _money(value):
+    return str(Decimal(value or 0).quantize(Decimal('0.01')))
+
+def dashboard_summary(date_filter='all', today=None):
+    """Summary cards, daily series and per-payer claim outcomes, read from the rollups only.
+
+    Cost depends on the number of rollup rows in range (days x dimension
+    combinations), not on the number of bills.
+    """
+    start = rollup_start_day(date_filter, today)
+    bill_filter = [DailyBillRollup.day >= start] if start else []
+    claim_filter = [DailyClaimRollup.day >= start] if start else []
+
+    totals = {'bills': 0, 'billed': Decimal('0')}
+    by_status, by_method, by_currency, by_insurer = (defaultdict(lambda: {'bills': 0, 'amount': Decimal('0')}) for _ in range(4))
+    paid_by_method = defaultdict(Decimal)
+    rows = db.session.execute(
+        select(DailyBillRollup.payment_status, DailyBillRollup.payment_method, DailyBillRollup.currency,
+               DailyBillRollup.insurer, func.sum(DailyBillRollup.bill_count), func.sum(DailyBillRollup.total_amount))
+        .where(*bill_filter)
+        .group_by(DailyBillRollup.payment_status, DailyBillRollup.payment_method,
+                  DailyBillRollup.currency, DailyBillRollup.insurer)
+    )
+    for status, method, currency, insurer, count, amount in rows:
+        amount = Decimal(amount or 0)
+        totals['bills'] += count
+        totals['billed'] += amount
+        for bucket, name in ((by_status, status), (by_method, method or 'none'),
+                             (by_currency, currency or 'USD'), (by_insurer, insurer or 'self-pay')):
+            bucket[name]['bills'] += count
+            bucket[name]['amount'] += amount
+        if status == 'paid':
+            paid_by_method[method or 'none'] += amount
+
+    series = defaultdict(lambda: {'bills': 0, 'billed': Decimal('0'), 'paid': Decimal('0')})
+    for day, status, count, amount in db.session.execute(
+        select(DailyBillRollup.day, DailyBillRollup.payment_status,
+               func.sum(DailyBillRollup.bill_count), func.sum(DailyBillRollup.total_amount))
+        .where(*bill_filter)
+        .group_by(DailyBillRollup.day, DailyBillRollup.payment_status)
+    ):
+        point = series[_as_date(day)]
+        point['bills'] += count
+        point['billed'] += Decimal(amount or 0)
+        if status == 'paid':
+            point['paid'] += Decimal(amount or 0)
+
+    payers = defaultdict(lambda: {'name': None, 'open': 0, 'accepted': 0, 'rejected': 0, 'failed': 0})
+    for payer_id, payer_name, outcome, count in db.session.execute(
+        select(DailyClaimRollup.payer_id, DailyClaimRollup.payer_name, DailyClaimRollup.outcome,
+               func.sum(DailyClaimRollup.claim_count))
+        .where(*claim_filter)
+        .group_by(DailyClaimRollup.payer_id, DailyClaimRollup.payer_name, DailyClaimRollup.outcome)
+    ):
+        payer = payers[payer_id]
+        payer['name'] = payer['name'] or payer_name
+        payer[outcome] = payer.get(outcome, 0) + count
+
+    def amounts(bucket):
+        return {name: {'bills': v['bills'], 'amount': _money(v['amount'])} for name, v in bucket.items()}
+
+    return {
+        'date_filter': date_filter,
+        'since': start.isoformat() if start else None,
+        'bills': totals['bills'],
+        'billed': _money(totals['billed']),
+        'by_status': amounts(by_status),
+        'by_method': {
+            name: {**value, 'paid': _money(paid_by_method[name])}
+            for name, value in amounts(by_method).items()
+        },
+        'by_currency': amounts(by_currency),
+        'top_insurers': dict(sorted(amounts(by_insurer).items(), key=lambda item: -Decimal(item[1]['amount']))[:TOP_INSURERS]),
+        'daily': [
+            {'day': day.isoformat(), 'bills': point['bills'], 'billed': _money(point['billed']), 'paid': _money(point['paid'])}
+            for day, point in sorted(series.items())
+        ],
+        'claims_by_payer': [
+            {
+                'payer_id': payer_id,
+                **payer,
+                # Share of submissions the clearinghouse accepted rather than rejected;
+                # it says nothing about whether the payer approved or denied the claim
+                'acceptance_rate': round(payer['accepted'] / (payer['accepted'] + payer['rejected']), 4)
+                if payer['accepted'] + payer['rejected'] else None
+            }
+            for payer_id, payer in sorted(payers.items())
+        ],
+    }
@@ -0,0 +1,448 @@
+"""Patient and bill search for the front desk.
+
+A query is split into a date of birth, an identifier and name words:
+
+- a token that parses as a date (2024-01-31 or 01/31/2024) restricts the
+  search to that patient_dob
+- a single token containing a digit is an identifier, looked up exactly in
+  Bill.policy_number, Bill.claim_number, Bill.transaction_hash and
+  InsuranceClaim.claim_number
+- anything else is name words, each matching a word of patient_name exactly,
+  as a prefix (while it is still being typed) or with a typo or two
+
+Identifiers and dates of birth use plain B-tree indexes on every database.
+Names use pg_trgm and tsvector GIN indexes on PostgreSQL; elsewhere (SQLite)
+each process keeps a NameIndex in memory, built when the worker boots and
+caught up from Bill.updated_at before searches, so writes from any worker
+show up within SEARCH_SYNC_INTERVAL. Results are newest bill first within each match
+quality: exact words, then prefixes, then approximate matches.
+"""
+import re
+import time
+import bisect
+import heapq
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, inspect, literal, literal_column, select, text, tuple_, union_all
+from sqlalchemy.orm import load_only, raiseload
+from models import db, Bill, InsuranceClaim, BILL_LIST_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Search settings
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MIN_PREFIX_LENGTH = 2     # shorter name words only match whole words
+FUZZY_MIN_LENGTH = 4      # shorter name words are never matched approximately
+SEARCH_SYNC_INTERVAL = 0.25  # seconds between catch-ups of a NameIndex
+# Re-read changes this far behind the cursor: rows committed late by a slower
+# transaction can carry an updated_at older than rows already read
+SEARCH_SYNC_OVERLAP = timedelta(seconds=2)
+SEARCH_SYNC_CHUNK = 10000
+# Newest bills with a date of birth ranked against name words; a date shared by
+# many patients (a placeholder like 1900-01-01) must not load every one of them
+DOB_CANDIDATE_LIMIT = 2000
+
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y')
+
+# Match qualities, best first
+EXACT, PREFIX, FUZZY = 3, 2, 1
+MATCH_LABELS = {EXACT: 'name', PREFIX: 'name_prefix', FUZZY: 'name_fuzzy'}
+
+# Indexes behind name search on PostgreSQL; created by create_search_indexes()
+POSTGRES_SEARCH_EXTENSION = "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+POSTGRES_SEARCH_INDEXES = {
+    'ix_bill_patient_name_trgm': "CREATE INDEX ix_bill_patient_name_trgm ON bill USING gin (lower(patient_name) gin_trgm_ops)",
+    'ix_bill_patient_name_tsv': "CREATE INDEX ix_bill_patient_name_tsv ON bill USING gin (to_tsvector('simple', patient_name))",
+}
+
+# B-tree indexes behind identifier and date-of-birth lookups (declared on the models)
+SEARCH_INDEXES = {
+    Bill: ('ix_bill_policy_number', 'ix_bill_claim_number', 'ix_bill_transaction_hash', 'ix_bill_patient_dob_id'),
+    InsuranceClaim: ('ix_insurance_claim_claim_number',),
+}
+
+# Columns loaded for a search result: the dashboard row plus what identifies the patient
+SEARCH_COLUMNS = BILL_LIST_COLUMNS + (Bill.patient_dob, Bill.policy_number, Bill.transaction_hash)
+
+_NAME_WORD_RE = re.compile(r'[a-z0-9]+')
+
+SearchQuery = namedtuple('SearchQuery', 'words dob identifier')
+SearchResult = namedtuple('SearchResult', 'bill matched')
+
+def name_words(name):
+    """Lower-case words of a name, accents removed"""
+    folded = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode()
+    return _NAME_WORD_RE.findall(folded.lower())
+
+def parse_search_query(query):
+    """Split a search box query into name words, a date of birth and an identifier"""
+    dob, rest = None, []
+    for token in (query or '').split():
+        for date_format in DATE_FORMATS:
+            try:
+                dob = datetime.strptime(token, date_format).date()
+                break
+            except ValueError:
+                continue
+        else:
+            rest.append(token)
+    if len(rest) == 1 and any(ch.isdigit() for ch in rest[0]):
+        return SearchQuery([], dob, rest[0])
+    return SearchQuery(name_words(' '.join(rest)), dob, None)
+
+def max_edits(word):
+    return 0 if len(word) < FUZZY_MIN_LENGTH else 1 if len(word) < 8 else 2
+
+def within_edits(a, b, limit):
+    """True when a and b are at most `limit` insertions, deletions, substitutions or transpositions apart"""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous2, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return False
+        previous2, previous = previous, current
+    return previous[-1] <= limit
+
+def word_quality(word, candidates):
+    """Best match quality of a query word against a name's words, or None"""
+    best = None
+    for candidate in candidates:
+        if candidate == word:
+            return EXACT
+        if candidate.startswith(word):
+            best = PREFIX
+        elif best is None and max_edits(word) and within_edits(word, candidate, max_edits(word)):
+            best = FUZZY
+    return best
+
+def match_quality(words, name):
+    """(worst, total) quality over the query words, each of which must match some word of name; else None"""
+    candidates = name_words(name)
+    worst, total = EXACT, 0
+    for word in words:
+        found = word_quality(word, candidates)
+        if found is None:
+            return None
+        worst, total = min(worst, found), total + found
+    return worst, total
+
+def _ranked(words, bills, limit, default=None):
+    """SearchResults for the bills matching words: worst word match first, then all words, then newest"""
+    ranked = []
+    for bill in bills:
+        quality = match_quality(words, bill.patient_name) or default
+        if quality is not None:
+            ranked.append((-quality[0], -quality[1], -bill.id, bill))
+    ranked.sort(key=lambda item: item[:3])
+    return [SearchResult(item[3], MATCH_LABELS[-item[0]]) for item in ranked[:limit]]
+
+def _trigrams(word):
+    padded = f"${word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class NameIndex:
+    """In-process index of patient name words to bill ids, for databases without trigram indexes.
+
+    Posting lists are sorted arrays of bill ids (4 bytes per word of every
+    name); distinct words are kept sorted for prefix ranges and in a trigram
+    index for approximate matching. Renamed bills keep their old postings
+    until the process restarts; results are re-checked against the current
+    names, so those only cost a wasted candidate.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._words = []
+        self._trigrams = {}
+        self._cursor = None  # (updated_at, id) of the last change applied
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+        self.bill_count = 0
+
+    def __len__(self):
+        return len(self._words)
+
+    def add(self, bill_id, name):
+        for word in set(name_words(name)):
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = array('I')
+                bisect.insort(self._words, word)
+                for gram in _trigrams(word):
+                    self._trigrams.setdefault(gram, set()).add(word)
+            if not postings or postings[-1] < bill_id:
+                postings.append(bill_id)
+            else:
+                position = bisect.bisect_left(postings, bill_id)
+                if position == len(postings) or postings[position] != bill_id:
+                    postings.insert(position, bill_id)
+
+    def sync(self, connection):
+        """Apply bills changed since the last sync; the first call reads every bill"""
+        with self._lock:
+            if self._cursor is None:
+                self._build(connection)
+            since = (self._cursor[0] - SEARCH_SYNC_OVERLAP, 0)
+            while True:
+                rows = connection.execute(
+                    select(Bill.id, Bill.patient_name, Bill.updated_at)
+                    .where(tuple_(Bill.updated_at, Bill.id) > tuple_(*since))
+                    .order_by(Bill.updated_at, Bill.id).limit(SEARCH_SYNC_CHUNK)
+                ).all()
+                for row in rows:
+                    self.add(row.id, row.patient_name)
+                if rows:
+                    since = (rows[-1].updated_at, rows[-1].id)
+                    self._cursor = max(self._cursor, since)
+                if len(rows) < SEARCH_SYNC_CHUNK:
+                    break
+            self._synced_at = time.monotonic()
+
+    def _build(self, connection):
+        started = time.perf_counter()
+        # Changes from here on are picked up by the incremental part of sync()
+        latest = connection.execute(
+            select(Bill.updated_at, Bill.id).order_by(Bill.updated_at.desc(), Bill.id.desc()).limit(1)
+        ).first()
+        last_id = 0
+        while True:
+            rows = connection.execute(
+                select(Bill.id, Bill.patient_name).where(Bill.id > last_id).order_by(Bill.id).limit(SEARCH_SYNC_CHUNK)
+            ).all()
+            for bill_id, name in rows:
+                self.add(bill_id, name)
+            self.bill_count += len(rows)
+            if len(rows) < SEARCH_SYNC_CHUNK:
+                break
+            last_id = rows[-1].id
+            # Under gevent this thread is a greenlet; let the worker serve requests between chunks
+            time.sleep(0)
+        self._cursor = tuple(latest) if latest and latest.updated_at else (datetime(1970, 1, 1), 0)
+        logger.info(f"Built patient name index: {self.bill_count} bills, {len(self._words)} words "
+                    f"in {time.perf_counter() - started:.1f}s")
+
+    def warm(self, app):
+        """Build the index in a background thread, so searches do not wait for it (not needed on PostgreSQL)"""
+        def build():
+            with app.app_context():
+                if db.engine.dialect.name == 'postgresql':
+                    return
+                try:
+                    self.maybe_sync(db.engine)
+                except Exception as e:
+                    logger.error(f"Building the patient name index failed: {str(e)}")
+        thread = threading.Thread(target=build, name='name-index', daemon=True)
+        thread.start()
+        return thread
+
+    def maybe_sync(self, engine):
+        if self._cursor is None or time.monotonic() - self._synced_at >= SEARCH_SYNC_INTERVAL:
+            with engine.connect() as connection:
+                self.sync(connection)
+
+    def _matching_lists(self, word):
+        """[(quality, posting list)] of the indexed words matching one query word"""
+        lists = []
+        postings = self._postings.get(word)
+        if postings:
+            lists.append((EXACT, postings))
+        if len(word) >= MIN_PREFIX_LENGTH:
+            lo = bisect.bisect_left(self._words, word)
+            hi = bisect.bisect_left(self._words, word + '\x7f', lo)
+            lists.extend((PREFIX, self._postings[w]) for w in self._words[lo:hi] if w != word)
+        edits = max_edits(word)
+        if edits:
+            grams = _trigrams(word)
+            shared = {}
+            for gram in grams:
+                for candidate in self._trigrams.get(gram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            # Each edit changes at most four trigrams (a transposition; others change three)
+            for candidate, count in shared.items():
+                if (count >= max(len(word), len(candidate)) - 4 * edits and not candidate.startswith(word)
+                        and within_edits(word, candidate, edits)):
+                    lists.append((FUZZY, self._postings[candidate]))
+        return lists
+
+    def search(self, words, limit):
+        """Up to `limit` (bill id, quality) pairs, best quality then newest first"""
+        # Serialized with sync(), which grows the lists and word sets read here
+        with self._lock:
+            return self._search(words, limit)
+
+    def _search(self, words, limit):
+        lists = [self._matching_lists(word) for word in words]
+        if not words or not all(lists):
+            return []
+        found = {}
+        if len(words) == 1:
+            # Posting lists are sorted, so the newest matches are read off their ends
+            for quality in (EXACT, PREFIX, FUZZY):
+                tier = [postings for q, postings in lists[0] if q == quality]
+                for bill_id in heapq.merge(*(reversed(p) for p in tier), reverse=True):
+                    if bill_id not in found:
+                        found[bill_id] = quality
+                        if len(found) >= limit:
+                            return list(found.items())
+            return list(found.items())
+
+        for quality in (EXACT, PREFIX, FUZZY):
+            if not any(q == quality for word_lists in lists for q, _ in word_lists):
+                continue  # no lists of this quality: same candidates as the tier before
+            tier = [[postings for q, postings in word_lists if q >= quality] for word_lists in lists]
+            if not all(tier):
+                continue
+            for bill_id in _newest_in_all(tier, limit - len(found), found):
+                found[bill_id] = quality
+            if len(found) >= limit:
+                break
+        return list(found.items())
+
+def _newest_in_all(word_lists, wanted, exclude):
+    """Up to `wanted` highest ids found in at least one list of every word, skipping `exclude`.
+
+    Works down the id range in blocks, sized from the words' densities so
+    that common names stop after the first one, and doubled each round. Each
+    block slices the sorted lists by binary search and intersects the slices
+    as sets, so the cost follows the ids read rather than the list sizes.
+    """
+    top = max(postings[-1] for lists in word_lists for postings in lists if postings)
+    density = 1.0
+    for lists in word_lists:
+        density *= min(1.0, sum(map(len, lists)) / (top + 1))
+    block = max(1024, int(2 * wanted / max(density, 1e-9)))
+    found, hi = [], top + 1
+    while hi > 0 and len(found) < wanted:
+        lo = max(0, hi - block)
+        sets = []
+        for lists in word_lists:
+            ids = set()
+            for postings in lists:
+                ids.update(postings[bisect.bisect_left(postings, lo):bisect.bisect_left(postings, hi)])
+            sets.append(ids)
+        sets.sort(key=len)
+        matches = sets[0].intersection(*sets[1:])
+        matches.difference_update(exclude)
+        found.extend(sorted(matches, reverse=True))
+        hi, block = lo, block * 2
+    return found[:wanted]
+
+def _search_query():
+    return Bill.query.options(load_only(*SEARCH_COLUMNS), raiseload('*'))
+
+def find_by_identifier(identifier, dob=None, limit=SEARCH_LIMIT):
+    """Bills whose policy, claim or transaction number is exactly `identifier`"""
+    lookups = [
+        select(Bill.id.label('bill_id'), literal('policy_number').label('field'))
+        .where(Bill.policy_number == identifier),
+        select(Bill.id, literal('claim_number')).where(Bill.claim_number == identifier),
+        select(InsuranceClaim.bill_id, literal('claim_number')).where(InsuranceClaim.claim_number == identifier),
+        # Hashes are hex; accept them in either case
+        select(Bill.id, literal('transaction_hash'))
+        .where(Bill.transaction_hash.in_(sorted({identifier, identifier.lower()}))),
+    ]
+    matched = {}
+    for bill_id, field in db.session.execute(union_all(*lookups)):
+        matched.setdefault(bill_id, field)
+    if not matched:
+        return []
+    query = _search_query().filter(Bill.id.in_(matched))
+    if dob:
+        query = query.filter(Bill.patient_dob == dob)
+    bills = query.order_by(Bill.id.desc()).limit(limit).all()
+    return [SearchResult(bill, matched[bill.id]) for bill in bills]
+
+def find_by_dob(dob, words=(), limit=SEARCH_LIMIT):
+    """Bills of patients born on `dob`, optionally narrowed by name words.
+
+    Name words are matched against the newest DOB_CANDIDATE_LIMIT bills with
+    that date of birth, reading only their names; full rows are loaded for
+    the results alone.
+    """
+    if not words:
+        bills = _search_query().filter(Bill.patient_dob == dob).order_by(Bill.id.desc()).limit(limit).all()
+        return [SearchResult(bill, 'patient_dob') for bill in bills]
+    candidates = db.session.execute(
+        select(Bill.id, Bill.patient_name).where(Bill.patient_dob == dob)
+        .order_by(Bill.id.desc()).limit(DOB_CANDIDATE_LIMIT)
+    ).all()
+    ranked = _ranked(words, candidates, limit)
+    if not ranked:
+        return []
+    bills = {bill.id: bill for bill in _search_query().filter(Bill.id.in_([r.bill.id for r in ranked]))}
+    return [SearchResult(bills[r.bill.id], r.matched) for r in ranked if r.bill.id in bills]
+
+def _postgres_name_search(words, limit):
+    """Ids of word-prefix matches, newest first, then of trigram matches by similarity"""
+    name = func.lower(Bill.patient_name)
+    # Same expressions as the GIN indexes in POSTGRES_SEARCH_INDEXES
+    tsvector = func.to_tsvector(literal_column("'simple'"), Bill.patient_name)
+    prefix_query = func.to_tsquery(literal_column("'simple'"), ' & '.join(f"{word}:*" for word in words))
+    ids = list(db.session.scalars(
+        select(Bill.id).where(tsvector.op('@@', is_comparison=True)(prefix_query))
+        .order_by(Bill.id.desc()).limit(limit)
+    ))
+    if len(ids) < limit:
+        phrase = ' '.join(words)
+        similar = select(Bill.id).where(literal(phrase).op('<%', is_comparison=True)(name))
+        if ids:
+            similar = similar.where(Bill.id.notin_(ids))
+        ids += db.session.scalars(
+            similar.order_by(func.word_similarity(phrase, name).desc(), Bill.id.desc()).limit(limit - len(ids))
+        )
+    return ids
+
+def find_by_name(words, index=None, limit=SEARCH_LIMIT):
+    """Bills whose patient name matches every word (see the module docstring)"""
+    if db.engine.dialect.name == 'postgresql':
+        candidates = _postgres_name_search(words, limit)
+    else:
+        index.maybe_sync(db.engine)
+        # Extra candidates cover renamed bills whose old postings no longer match
+        candidates = [bill_id for bill_id, _ in index.search(words, limit * 2)]
+    if not candidates:
+        return []
+    bills = _search_query().filter(Bill.id.in_(candidates)).all()
+    # Trigram similarity is looser than the edit distance check; keep what PostgreSQL found
+    default = (FUZZY, FUZZY * len(words)) if db.engine.dialect.name == 'postgresql' else None
+    return _ranked(words, bills, limit, default)
+
+def search_bills(query, index=None, limit=SEARCH_LIMIT):
+    """[SearchResult] for a search box query; `index` is the NameIndex used off PostgreSQL"""
+    parsed = parse_search_query(query)
+    if parsed.identifier:
+        return find_by_identifier(parsed.identifier, parsed.dob, limit)
+    if parsed.dob:
+        return find_by_dob(parsed.dob, parsed.words, limit)
+    if parsed.words:
+        return find_by_name(parsed.words, index, limit)
+    return []
+
+def create_search_indexes():
+    """Create the search indexes missing from the database; returns their names"""
+    created = []
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        for model, names in SEARCH_INDEXES.items():
+            for index in model.__table__.indexes:
+                if index.name in names and not inspector.has_index(model.__tablename__, index.name):
+                    index.create(connection)
+                    created.append(index.name)
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text(POSTGRES_SEARCH_EXTENSION))
+            for name, statement in POSTGRES_SEARCH_INDEXES.items():
+                if not inspector.has_index(Bill.__tablename__, name):
+                    connection.execute(text(statement))
+                    created.append(name)
+    return created
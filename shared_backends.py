@@ -0,0 +1,253 @@
+"""Rate-limit and cache storage shared by every gunicorn worker.
+
+Two interchangeable stores implement the same small counter/key-value API:
+
+* SQLiteStore - a WAL-mode SQLite file on local disk, for single-host
+  deployments without extra services.
+* RedisStore - any Redis-protocol server (Redis, KeyDB, or a local stand-in
+  such as fakeredis passed in as ``client``).
+"""
+import os
+import time
+import pickle
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+from flask_caching.backends.base import BaseCache
+from metrics import record_cache
+
+# Fraction of SQLite counter increments that also purge expired rows
+SQLITE_PURGE_PROBABILITY = 0.001
+# Keys deleted per round trip when clearing a prefix on Redis
+REDIS_CLEAR_BATCH = 500
+
+class SQLiteStore:
+    """Counter and key-value store in a WAL-mode SQLite database.
+
+    Each process holds one connection, used under a lock. A thread-local
+    connection would be greenlet-local under gevent, opening one per
+    request; the statements are short, so serialising them costs little.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._reset()
+        # A forked worker (gunicorn --preload) opens its own connection
+        os.register_at_fork(after_in_child=self._reset)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters "
+                "(key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @contextmanager
+    def _connection(self):
+        """The process's connection, held exclusively"""
+        with self._lock:
+            if self._conn is None:
+                conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                self._conn = conn
+            yield self._conn
+
+    def incr_and_get(self, key, ttl, other_key):
+        """Increment `key` (expiring after ttl) and return (its value, value of other_key)"""
+        now = time.time()
+        with self._connection() as conn:
+            value = conn.execute(
+                "INSERT INTO counters (key, value, expires_at) VALUES (?, 1, ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "value = CASE WHEN expires_at < ? THEN 1 ELSE value + 1 END, "
+                "expires_at = CASE WHEN expires_at < ? THEN excluded.expires_at ELSE expires_at END "
+                "RETURNING value",
+                (key, now + ttl, now, now)
+            ).fetchone()[0]
+            row = conn.execute(
+                "SELECT value FROM counters WHERE key = ? AND expires_at >= ?", (other_key, now)
+            ).fetchone()
+            if random.random() < SQLITE_PURGE_PROBABILITY:
+                conn.execute("DELETE FROM counters WHERE expires_at < ?", (now,))
+        return value, row[0] if row else 0
+
+    def get(self, key):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at >= ?)",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE cache.expires_at IS NOT NULL AND cache.expires_at < ?",
+                (key, value, expires_at, now)
+            )
+            return cursor.rowcount > 0
+
+    def delete(self, key):
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def delete_prefix(self, prefix):
+        """Delete the cache keys starting with `prefix`; rate-limit counters are kept"""
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            ).rowcount
+
+class RedisStore:
+    """Counter and key-value store on a Redis-protocol server"""
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def incr_and_get(self, key, ttl, other_key):
+        # One round trip: create the key with its expiry if missing, INCR, read the other key
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(key, 0, ex=int(ttl), nx=True)
+        pipe.incr(key)
+        pipe.get(other_key)
+        _, value, other = pipe.execute()
+        return int(value), int(other) if other is not None else 0
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=int(ttl) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, ex=int(ttl) if ttl else None, nx=True))
+
+    def delete(self, key):
+        return self.client.delete(key) > 0
+
+    def delete_prefix(self, prefix):
+        """Delete the keys starting with `prefix`, leaving the rest of the database alone"""
+        pattern = ''.join('\\' + c if c in '*?[]\\' else c for c in prefix) + '*'
+        deleted = 0
+        batch = []
+        for key in self.client.scan_iter(match=pattern, count=REDIS_CLEAR_BATCH):
+            batch.append(key)
+            if len(batch) >= REDIS_CLEAR_BATCH:
+                deleted += self.client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self.client.unlink(*batch)
+        return deleted
+
+class SlidingWindowLimiter:
+    """O(1) sliding-window rate limiter over a shared store.
+
+    The request rate is estimated from the counts of the current and previous
+    fixed windows, weighting the previous one by how much of it still falls
+    inside the sliding window. Each check is one increment and one read, and
+    counters expire on their own, so no sweep over tracked clients is needed.
+    """
+
+    def __init__(self, store, limit, window, prefix='rl'):
+        self.store = store
+        self.limit = limit
+        self.window = window
+        self.prefix = prefix
+
+    def hit(self, client_id):
+        """Record a request; return (allowed, seconds until the client may retry)"""
+        now = time.time()
+        current_window = int(now // self.window)
+        elapsed = now - current_window * self.window
+        current, previous = self.store.incr_and_get(
+            f"{self.prefix}:{client_id}:{current_window}",
+            self.window * 2,
+            f"{self.prefix}:{client_id}:{current_window - 1}"
+        )
+        estimate = previous * (1 - elapsed / self.window) + current
+        if estimate <= self.limit:
+            return True, 0
+        return False, max(1, int(self.window - elapsed))
+
+class SharedStoreCache(BaseCache):
+    """Flask-Caching backend over a SQLiteStore or RedisStore"""
+
+    def __init__(self, store, default_timeout=300, key_prefix='cache:'):
+        super().__init__(default_timeout)
+        self.store = store
+        self.key_prefix = key_prefix
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        return cls(
+            build_store(config),
+            default_timeout=config.get('CACHE_DEFAULT_TIMEOUT', 300),
+            key_prefix=config.get('CACHE_KEY_PREFIX') or 'cache:'
+        )
+
+    def get(self, key):
+        value = self.store.get(self.key_prefix + key)
+        record_cache('shared', value is not None)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        self.store.set(self.key_prefix + key, pickle.dumps(value), self._normalize_timeout(timeout))
+        return True
+
+    def add(self, key, value, timeout=None):
+        return self.store.add(self.key_prefix + key, pickle.dumps(value), self._normalize_timeout(timeout))
+
+    def delete(self, key):
+        return self.store.delete(self.key_prefix + key)
+
+    def has(self, key):
+        return self.store.get(self.key_prefix + key) is not None
+
+    def clear(self):
+        # Only this cache's keys: the store also holds rate-limit counters (and,
+        # on Redis, whatever else shares the database)
+        self.store.delete_prefix(self.key_prefix)
+        return True
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def build_store(config):
+    """Return the process-wide store selected by SHARED_BACKEND ('sqlite' or 'redis')"""
+    backend = config.get('SHARED_BACKEND', 'sqlite')
+    location = config.get('REDIS_URL') if backend == 'redis' else config.get('SHARED_SQLITE_PATH')
+    with _stores_lock:
+        if (backend, location) not in _stores:
+            if backend == 'redis':
+                _stores[(backend, location)] = RedisStore(location)
+            elif backend == 'sqlite':
+                _stores[(backend, location)] = SQLiteStore(location)
+            else:
+                raise ValueError(f"Unknown SHARED_BACKEND: {backend}")
+        return _stores[(backend, location)]
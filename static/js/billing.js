@@ -21,6 +21,7 @@ document.addEventListener('DOMContentLoaded', function() {
         setupFormHandlers();
         setupTabFunctionality();
         setupServicesHandlers();
+        setupCodeAutocomplete();
     } else {
         console.error('Billing form not found');
     }
@@ -47,12 +48,65 @@ function setupTabFunctionality() {
     // Bootstrap 5 handles tab functionality automatically through data-bs-* attributes
 }
 
-function handleDiagnosisSearch(event) {
-    const searchTerm = event.target.value.trim();
-    if (searchTerm.length < 2) return;
-    
-    // In a real app, this would make an API call to search ICD-10 codes
-    console.log('Searching for diagnosis:', searchTerm);
+// Code autocomplete against the server-side ICD-10 / CPT catalog
+const CODE_SEARCH_DELAY = 150;
+const unavailableCatalogs = new Set();
+
+function setupCodeAutocomplete() {
+    attachCodeAutocomplete(
+        document.getElementById('diagnosisCode'), 'icd10',
+        document.getElementById('diagnosisDescription'), null
+    );
+    document.querySelectorAll('.tab-pane').forEach(pane => {
+        attachCodeAutocomplete(
+            pane.querySelector('.service-code'), 'cpt',
+            pane.querySelector('.service-description'), pane.querySelector('.service-amount')
+        );
+    });
+}
+
+function attachCodeAutocomplete(input, system, descriptionInput, amountInput) {
+    if (!input) return;
+    const datalist = document.createElement('datalist');
+    datalist.id = `${system}-suggestions-${document.querySelectorAll('datalist').length}`;
+    input.after(datalist);
+    input.setAttribute('list', datalist.id);
+
+    let suggestions = {};
+    let timer = null;
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        const query = input.value;
+        if (query.trim().length < 2 || unavailableCatalogs.has(system)) return;
+        timer = setTimeout(async () => {
+            try {
+                const response = await fetch(`/api/codes/${system}?q=${encodeURIComponent(query)}`);
+                if (response.status === 503) {
+                    // No catalog configured on the server; codes stay free text
+                    unavailableCatalogs.add(system);
+                    return;
+                }
+                const data = await response.json();
+                if (!data.success) return;
+                suggestions = {};
+                datalist.replaceChildren(...data.results.map(entry => {
+                    suggestions[entry.code] = entry;
+                    const option = document.createElement('option');
+                    option.value = entry.code;
+                    option.label = entry.description;
+                    return option;
+                }));
+            } catch (error) {
+                console.warn('Code search failed:', error);
+            }
+        }, CODE_SEARCH_DELAY);
+    });
+    input.addEventListener('change', () => {
+        const entry = suggestions[input.value];
+        if (!entry) return;
+        if (descriptionInput && !descriptionInput.value) descriptionInput.value = entry.description;
+        if (amountInput && !amountInput.value && entry.price) amountInput.value = entry.price;
+    });
 }
 
 function addManualDiagnosis() {
@@ -209,7 +263,8 @@ async function handleFormSubmission(e) {
         const data = await response.json();
         if (data.success) {
             window.currentBillId = data.bill_id;
-            showPaymentModal(formData.total);
+            // The server's Decimal total is authoritative
+            showPaymentModal(parseFloat(data.total_amount));
         } else {
             throw new Error(data.error || 'Failed to submit bill');
         }
@@ -1,3 +1,8 @@
+// Sent with every submission of this form, so a resubmitted claim is not queued twice
+const claimSubmissionKey = (window.crypto && crypto.randomUUID)
+    ? crypto.randomUUID()
+    : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+
 document.addEventListener('DOMContentLoaded', function() {
     const claimForm = document.getElementById('claimForm');
     if (claimForm) {
@@ -87,6 +92,10 @@ function populateProcedureCodes(procedures) {
 
 async function handleClaimSubmission(e) {
     e.preventDefault();
+    const submitButton = e.target.querySelector('[type="submit"]');
+    if (submitButton) {
+        submitButton.disabled = true;
+    }
     
     const formData = {
         payerId: document.getElementById('payerId').value,
@@ -104,7 +113,8 @@ async function handleClaimSubmission(e) {
         const response = await fetch('/api/submit_claim', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Idempotency-Key': claimSubmissionKey
             },
             body: JSON.stringify(formData)
         });
@@ -119,5 +129,9 @@ async function handleClaimSubmission(e) {
     } catch (error) {
         console.error('Error submitting claim:', error);
         alert(error.message || 'Failed to submit claim. Please try again.');
+    } finally {
+        if (submitButton) {
+            submitButton.disabled = false;
+        }
     }
 }
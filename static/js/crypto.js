@@ -50,15 +50,7 @@ async function updateCryptoPrices() {
                     if (!data.prices || Object.keys(data.prices).length === 0) {
                         throw new Error('No price data received');
                     }
-                    cryptoPrices = data.prices;
-                    console.log('Successfully updated crypto prices:', cryptoPrices);
-                    
-                    if (statusElement) {
-                        statusElement.textContent = data.is_live ? 
-                            'Live prices' : 
-                            'Using cached prices';
-                        statusElement.className = `text-${data.is_live ? 'success' : 'warning'} small`;
-                    }
+                    applyCryptoPrices(data, false);
                     break;  // Success, exit retry loop
                 } else {
                     throw new Error(data.error || 'Server returned error status');
@@ -92,6 +84,25 @@ async function updateCryptoPrices() {
     }
 }
 
+function applyCryptoPrices(data, refreshModal = true) {
+    cryptoPrices = data.prices;
+    const statusElement = document.getElementById('cryptoStatus');
+    if (statusElement) {
+        const estimated = Object.keys(data.live || {}).filter(symbol => !data.live[symbol]);
+        if (data.is_live) {
+            statusElement.textContent = 'Live prices';
+        } else if (estimated.length && estimated.length < Object.keys(data.live).length) {
+            statusElement.textContent = `Live prices; ${estimated.join(', ')} estimated`;
+        } else {
+            statusElement.textContent = 'Using cached prices';
+        }
+        statusElement.className = `text-${data.is_live ? 'success' : 'warning'} small`;
+    }
+    if (refreshModal) {
+        updatePaymentModal();
+    }
+}
+
 function showPaymentModal(totalUSD) {
     if (!totalUSD || isNaN(totalUSD)) {
         console.error('Invalid payment amount:', totalUSD);
@@ -157,32 +168,9 @@ function changeCryptoCurrency(crypto) {
     updatePaymentModal();
 }
 
-// Price update interval management
-let priceUpdateInterval;
-
-function startPriceUpdates() {
-    updateCryptoPrices(); // Initial update
-    priceUpdateInterval = setInterval(updateCryptoPrices, 30000);
-}
-
-function stopPriceUpdates() {
-    if (priceUpdateInterval) {
-        clearInterval(priceUpdateInterval);
-        priceUpdateInterval = null;
-    }
-}
-
-// Event listeners
-document.addEventListener('DOMContentLoaded', startPriceUpdates);
-window.addEventListener('beforeunload', stopPriceUpdates);
-
-// Modal event listeners for better interval management
+// Prices are pushed over the shared event stream; polled every 30 seconds without it
 document.addEventListener('DOMContentLoaded', function() {
-    const paymentModal = document.getElementById('paymentModal');
-    if (paymentModal) {
-        paymentModal.addEventListener('shown.bs.modal', startPriceUpdates);
-        paymentModal.addEventListener('hidden.bs.modal', stopPriceUpdates);
-    }
+    LiveEvents.on('prices', applyCryptoPrices, { poll: updateCryptoPrices, interval: 30000 });
 });
 
 // Expose necessary functions to window
@@ -1,5 +1,20 @@
+let nextCursor = null;
+let changesCursor = null;
+const CHANGES_POLL_INTERVAL = 15000;
+const SUMMARY_REFRESH_DELAY = 5000;
+const SEARCH_DELAY = 150;
+let summaryTimer = null;
+// Bill id -> last applied version; the event stream re-sends changes it is unsure of
+const appliedVersions = new Map();
+let searchTimer = null;
+let searchRequest = 0;
+
 document.addEventListener('DOMContentLoaded', function() {
     setupFilterListeners();
+    setupSearch();
+    setupLoadMore();
+    setupStatusUpdates();
+    updateSummary();
 });
 
 function setupFilterListeners() {
@@ -12,36 +27,225 @@ function setupFilterListeners() {
     });
 }
 
-async function updateDashboard() {
+function setupSearch() {
+    const input = document.getElementById('billSearch');
+    if (input) {
+        input.addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(searchBills, SEARCH_DELAY);
+        });
+    }
+}
+
+async function searchBills() {
+    const query = document.getElementById('billSearch').value.trim();
+    if (!query) {
+        searchRequest++;
+        updateDashboard();
+        return;
+    }
+    // Drop answers to earlier keystrokes that arrive late
+    const request = ++searchRequest;
     try {
-        const dateFilter = document.getElementById('dateFilter').value;
-        const statusFilter = document.getElementById('statusFilter').value;
-        const methodFilter = document.getElementById('methodFilter').value;
+        const response = await fetch(`/api/search?q=${encodeURIComponent(query)}`);
+        if (!response.ok) throw new Error('Search failed');
+        const data = await response.json();
+        if (request !== searchRequest) return;
+        nextCursor = null;
+        updateLoadMoreButton();
+        updatePaymentTable(data.results, false);
+    } catch (error) {
+        console.warn('Error searching bills:', error);
+    }
+}
 
-        const response = await fetch(`/api/payments?date=${dateFilter}&status=${statusFilter}&method=${methodFilter}`);
-        if (!response.ok) throw new Error('Failed to fetch payments');
-        
+function setupLoadMore() {
+    const button = document.getElementById('loadMoreButton');
+    if (button) {
+        nextCursor = button.dataset.nextCursor || null;
+        button.addEventListener('click', loadMorePayments);
+    }
+}
+
+function setupStatusUpdates() {
+    const tbody = document.querySelector('table tbody');
+    changesCursor = tbody ? tbody.dataset.changesCursor || null : null;
+    if (changesCursor) {
+        // Pushed over the event stream; the change feed is polled without it
+        LiveEvents.on('status', applyStatusChange, { poll: fetchStatusChanges, interval: CHANGES_POLL_INTERVAL });
+    }
+}
+
+async function fetchStatusChanges() {
+    try {
+        const response = await fetch(`/api/payments/changes?since=${encodeURIComponent(changesCursor)}`);
+        if (!response.ok) return;
         const data = await response.json();
-        updatePaymentTable(data.payments);
+        if (!data.success) return;
+        changesCursor = data.cursor;
+        data.changes.forEach(applyStatusChange);
+    } catch (error) {
+        console.warn('Error fetching status changes:', error);
+    }
+}
+
+function applyStatusChange(change) {
+    if ((appliedVersions.get(change.id) || 0) >= change.version) return;
+    appliedVersions.set(change.id, change.version);
+
+    // Status changes move amounts between cards; refresh them at most every few seconds
+    if (!summaryTimer) {
+        summaryTimer = setTimeout(() => {
+            summaryTimer = null;
+            updateSummary();
+        }, SUMMARY_REFRESH_DELAY);
+    }
+
+    const row = document.querySelector(`tr[data-bill-id="${change.id}"]`);
+    if (!row) return;
+
+    const badge = row.querySelector('.payment-status');
+    if (badge) {
+        badge.className = `badge payment-status bg-${getStatusBadge(change.payment_status)}`;
+        badge.textContent = change.payment_status;
+    }
+    const claimCell = row.querySelector('.claim-cell');
+    if (claimCell && change.claim_status === 'submitted') {
+        claimCell.innerHTML = `
+            <span class="badge bg-info">Claim Submitted</span>
+            <br>
+            <small>${change.claim_number || ''}</small>
+        `;
+    }
+}
+
+function buildPaymentsQuery(cursor) {
+    const params = new URLSearchParams({
+        date: document.getElementById('dateFilter').value,
+        status: document.getElementById('statusFilter').value,
+        method: document.getElementById('methodFilter').value
+    });
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    return `/api/payments?${params.toString()}`;
+}
+
+async function fetchPayments(cursor) {
+    const response = await fetch(buildPaymentsQuery(cursor));
+    if (!response.ok) throw new Error('Failed to fetch payments');
+
+    const data = await response.json();
+    nextCursor = data.next_cursor;
+    updateLoadMoreButton();
+    return data.payments;
+}
+
+async function updateSummary() {
+    try {
+        const date = document.getElementById('dateFilter')?.value || 'all';
+        const response = await fetch(`/api/dashboard/summary?date=${encodeURIComponent(date)}`);
+        if (!response.ok) throw new Error('Failed to fetch summary');
+        const data = await response.json();
+        if (data.success) renderSummary(data);
+    } catch (error) {
+        console.warn('Error updating summary:', error);
+    }
+}
+
+function renderSummary(summary) {
+    const setText = (id, text) => {
+        const element = document.getElementById(id);
+        if (element) element.textContent = text;
+    };
+    const status = name => summary.by_status[name] || { bills: 0, amount: '0.00' };
+    const method = name => summary.by_method[name] || { bills: 0, amount: '0.00', paid: '0.00' };
+
+    setText('summaryBilled', formatAmount(summary.billed));
+    setText('summaryBills', `${summary.bills} bills`);
+    setText('summaryPaid', formatAmount(status('paid').amount));
+    setText('summaryPending', `${formatAmount(status('pending').amount)} pending, ${status('failed').bills} failed`);
+    setText('summaryMethods', `${formatAmount(method('crypto').paid)} / ${formatAmount(method('bank').paid)}`);
+    setText('summaryCurrencies', Object.keys(summary.by_currency).join(', '));
+
+    const accepted = summary.claims_by_payer.reduce((sum, payer) => sum + payer.accepted, 0);
+    const rejected = summary.claims_by_payer.reduce((sum, payer) => sum + payer.rejected, 0);
+    setText('summaryAcceptance', accepted + rejected ? `${(100 * accepted / (accepted + rejected)).toFixed(1)}%` : '-');
+    setText('summaryClaims', `${accepted} accepted, ${rejected} rejected`);
+
+    const payers = document.getElementById('payerAcceptance');
+    if (payers) {
+        payers.replaceChildren(...summary.claims_by_payer.map(payer => {
+            const row = document.createElement('tr');
+            const rate = payer.acceptance_rate === null ? '-' : `${(100 * payer.acceptance_rate).toFixed(1)}%`;
+            [payer.name || payer.payer_id, payer.accepted, payer.rejected, rate].forEach(value => {
+                const cell = document.createElement('td');
+                cell.textContent = value;
+                row.appendChild(cell);
+            });
+            return row;
+        }));
+    }
+
+    const chart = document.getElementById('dailyChart');
+    if (chart) {
+        const max = Math.max(...summary.daily.map(point => parseFloat(point.billed)), 1);
+        chart.replaceChildren(...summary.daily.map(point => {
+            const bar = document.createElement('div');
+            bar.className = 'daily-bar';
+            bar.style.height = `${100 * parseFloat(point.billed) / max}%`;
+            bar.title = `${point.day}: ${formatAmount(point.billed)} billed, ${formatAmount(point.paid)} paid`;
+            const paid = document.createElement('div');
+            paid.className = 'daily-bar-paid';
+            paid.style.height = parseFloat(point.billed) > 0 ? `${100 * parseFloat(point.paid) / parseFloat(point.billed)}%` : '0';
+            bar.appendChild(paid);
+            return bar;
+        }));
+    }
+}
+
+async function updateDashboard() {
+    updateSummary();
+    try {
+        const payments = await fetchPayments(null);
+        updatePaymentTable(payments, false);
     } catch (error) {
         console.error('Error updating dashboard:', error);
         alert('Failed to update payment history. Please try again.');
     }
 }
 
-function updatePaymentTable(payments) {
+async function loadMorePayments() {
+    if (!nextCursor) return;
+    try {
+        const payments = await fetchPayments(nextCursor);
+        updatePaymentTable(payments, true);
+    } catch (error) {
+        console.error('Error loading more payments:', error);
+        alert('Failed to load more payments. Please try again.');
+    }
+}
+
+function updateLoadMoreButton() {
+    const button = document.getElementById('loadMoreButton');
+    if (button) {
+        button.style.display = nextCursor ? '' : 'none';
+    }
+}
+
+function updatePaymentTable(payments, append) {
     const tbody = document.querySelector('table tbody');
     if (!tbody) return;
 
-    tbody.innerHTML = payments.map(payment => `
-        <tr>
+    const rows = payments.map(payment => `
+        <tr data-bill-id="${payment.id}">
             <td>${formatDate(payment.created_at)}</td>
             <td>${payment.patient_name}</td>
             <td>${formatAmount(payment.total_amount)}</td>
             <td>${payment.payment_method}</td>
             <td>${getCurrency(payment)}</td>
             <td>
-                <span class="badge bg-${getStatusBadge(payment.payment_status)}">
+                <span class="badge payment-status bg-${getStatusBadge(payment.payment_status)}">
                     ${payment.payment_status}
                 </span>
             </td>
@@ -53,6 +257,12 @@ function updatePaymentTable(payments) {
             </td>
         </tr>
     `).join('');
+
+    if (append) {
+        tbody.insertAdjacentHTML('beforeend', rows);
+    } else {
+        tbody.innerHTML = rows;
+    }
 }
 
 async function viewDetails(paymentId) {
@@ -0,0 +1,67 @@
+// One shared /api/events stream per page. Scripts register a handler per topic
+// plus a polling fallback that runs only while the stream is unavailable.
+const LiveEvents = (function() {
+    const handlers = {};
+    const fallbacks = {};
+    let source = null;
+    let connectScheduled = false;
+
+    function on(topic, handler, fallback) {
+        (handlers[topic] = handlers[topic] || []).push(handler);
+        if (fallback) {
+            fallbacks[topic] = { poll: fallback.poll, interval: fallback.interval, timer: null };
+        }
+        if (!connectScheduled) {
+            connectScheduled = true;
+            setTimeout(connect, 0);
+        }
+    }
+
+    function startFallbacks() {
+        Object.values(fallbacks).forEach(fallback => {
+            if (!fallback.timer) {
+                fallback.poll();
+                fallback.timer = setInterval(fallback.poll, fallback.interval);
+            }
+        });
+    }
+
+    function stopFallbacks() {
+        Object.values(fallbacks).forEach(fallback => {
+            if (fallback.timer) {
+                clearInterval(fallback.timer);
+                fallback.timer = null;
+            }
+        });
+    }
+
+    function connect() {
+        if (!window.EventSource) {
+            startFallbacks();
+            return;
+        }
+        source = new EventSource(`/api/events?topics=${Object.keys(handlers).join(',')}`);
+        source.onopen = stopFallbacks;
+        // Network errors are retried by EventSource itself; a non-200 answer
+        // (503 when the server cannot hold streams) closes it for good.
+        // Either way, poll until the stream is open again.
+        source.onerror = startFallbacks;
+        Object.keys(handlers).forEach(topic => {
+            source.addEventListener(topic, event => {
+                const data = JSON.parse(event.data);
+                handlers[topic].forEach(handler => handler(data));
+            });
+        });
+    }
+
+    function close() {
+        if (source) {
+            source.close();
+            source = null;
+        }
+        stopFallbacks();
+    }
+
+    window.addEventListener('beforeunload', close);
+    return { on, close };
+})();
@@ -24,12 +24,17 @@ let selectedCurrency = 'USD';
 let currentBillAmount = 0;
 let currentBillId = null;
 let exchangeRates = STATIC_EXCHANGE_RATES;
+// One idempotency key per payment attempt: retries and double-clicks of the
+// same attempt are answered from the server's record instead of paying twice
+let paymentAttemptKey = null;
+let paymentInFlight = false;
 
 document.addEventListener('DOMContentLoaded', function() {
     setupPaymentMethodListeners();
     setupCurrencyListeners();
-    updateExchangeRates();
-    setInterval(updateExchangeRates, 30000); // Update rates every 30 seconds
+    // Pushed over the shared event stream (which sends the current rates on
+    // connect); polled every 30 seconds without it
+    LiveEvents.on('rates', applyExchangeRates, { poll: updateExchangeRates, interval: 30000 });
 });
 
 function setupPaymentMethodListeners() {
@@ -87,13 +92,7 @@ async function updateExchangeRates() {
         
         const data = await response.json();
         if (data.success) {
-            exchangeRates = data.rates;
-            Object.keys(SUPPORTED_CURRENCIES).forEach(currency => {
-                if (exchangeRates[currency]) {
-                    SUPPORTED_CURRENCIES[currency].rate = exchangeRates[currency];
-                }
-            });
-            updatePaymentDisplay();
+            applyExchangeRates(data);
         }
     } catch (error) {
         console.warn('Using fallback exchange rates');
@@ -106,6 +105,16 @@ async function updateExchangeRates() {
     }
 }
 
+function applyExchangeRates(data) {
+    exchangeRates = data.rates;
+    Object.keys(SUPPORTED_CURRENCIES).forEach(currency => {
+        if (exchangeRates[currency]) {
+            SUPPORTED_CURRENCIES[currency].rate = exchangeRates[currency];
+        }
+    });
+    updatePaymentDisplay();
+}
+
 function updatePaymentDisplay() {
     const paymentAmountElement = document.getElementById('paymentAmount');
     const exchangeRateInfo = document.getElementById('exchangeRateInfo');
@@ -133,6 +142,7 @@ function showPaymentModal(amount) {
     }
     
     currentBillAmount = amount;
+    paymentAttemptKey = newIdempotencyKey();
     const modal = document.getElementById('paymentModal');
     if (modal) {
         updatePaymentDisplay();
@@ -141,11 +151,30 @@ function showPaymentModal(amount) {
     }
 }
 
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+}
+
+function setPaymentInFlight(inFlight) {
+    paymentInFlight = inFlight;
+    const button = document.getElementById('confirmPaymentButton');
+    if (button) {
+        button.disabled = inFlight;
+    }
+}
+
 async function processPayment() {
     if (!currentBillId) {
         alert('Invalid bill ID. Please try again.');
         return;
     }
+    if (paymentInFlight) {
+        return;
+    }
+    paymentAttemptKey = paymentAttemptKey || newIdempotencyKey();
 
     try {
         const paymentData = {
@@ -163,11 +192,21 @@ async function processPayment() {
                 alert('Please fill in all bank transfer details.');
                 return;
             }
+        } else if (currentPaymentMethod === 'crypto') {
+            paymentData.transactionHash = document.getElementById('transactionHash')?.value.trim();
+            paymentData.currency = selectedCrypto;
+            paymentData.cryptoAmount = calculateCryptoAmount().toFixed(8);
+
+            if (!paymentData.transactionHash) {
+                alert('Please enter the transaction hash of your payment.');
+                return;
+            }
         }
 
+        setPaymentInFlight(true);
         const response = await fetch('/verify_payment', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': paymentAttemptKey },
             body: JSON.stringify(paymentData)
         });
 
@@ -181,6 +220,8 @@ async function processPayment() {
     } catch (error) {
         console.error('Error processing payment:', error);
         alert(error.message || 'Error processing payment. Please try again.');
+    } finally {
+        setPaymentInFlight(false);
     }
 }
 
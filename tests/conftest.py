@@ -0,0 +1,58 @@
+import os
+import sys
+from datetime import date
+
+import pytest
+from flask.testing import FlaskClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def app(tmp_path):
+    """Application on a fresh SQLite file, with the schema created and an app context pushed"""
+    from app import create_app
+    from models import db
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'billing.db'}",
+        'SHARED_SQLITE_PATH': str(tmp_path / 'shared.db'),
+        'PDF_CACHE_DIR': str(tmp_path / 'pdf_cache'),
+        'METRICS_ENABLED': False,
+        'RATE_LIMIT': 10000,
+        'MAIL_DEFAULT_SENDER': 'billing@localhost',
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    """Test client that looks like it came through the TLS-terminating proxy"""
+    class ProxiedClient(FlaskClient):
+        def open(self, *args, **kwargs):
+            kwargs.setdefault('base_url', 'https://localhost')
+            return super().open(*args, **kwargs)
+
+    app.test_client_class = ProxiedClient
+    client = app.test_client()
+    client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+    return client
+
+@pytest.fixture
+def make_bill(app):
+    """Create a bill through the ORM: make_bill(procedures=[...], diagnoses=[...], **columns)"""
+    from models import db, Bill, Diagnosis, Procedure
+
+    def make(diagnoses=(), procedures=(), **columns):
+        bill = Bill(**{'patient_name': 'Ada Lovelace', 'patient_dob': date(1980, 1, 1),
+                       'email': 'ada@example.com', **columns})
+        bill.diagnoses = [Diagnosis(icd10_code=code, description=f"Diagnosis {code}", amount=amount)
+                          for code, amount in diagnoses]
+        bill.procedures = [Procedure(cpt_code=code, description=f"Procedure {code}", amount=amount)
+                           for code, amount in procedures]
+        db.session.add(bill)
+        db.session.commit()
+        return bill
+    return make
@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter, so modules other tests imported do not count
+FACTORY_SCRIPT = """
+import json, sys
+from app import create_app
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1], 'SHARED_SQLITE_PATH': sys.argv[2],
+                  'METRICS_ENABLED': False})
+print(json.dumps({name: name in sys.modules for name in ('reportlab', 'requests', 'pyarrow', 'pypdf')}))
+"""
+
+def test_create_app_leaves_the_database_and_heavy_modules_alone(tmp_path):
+    database = tmp_path / 'billing.db'
+    result = subprocess.run(
+        [sys.executable, '-c', FACTORY_SCRIPT, f"sqlite:///{database}", str(tmp_path / 'shared.db')],
+        cwd=ROOT, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    imported = json.loads(result.stdout.splitlines()[-1])
+    assert imported == {'reportlab': False, 'requests': False, 'pyarrow': False, 'pypdf': False}
+    assert not database.exists()
+
+def test_forked_children_get_fresh_pools(app, make_bill):
+    from models import db
+    make_bill()
+    pool = db.engine.pool
+    pid = os.fork()
+    if pid == 0:
+        # The parent's pooled connection must not be reused by the child
+        code = 1
+        try:
+            if db.engine.pool is not pool and db.session.execute(db.text('SELECT 1')).scalar() == 1:
+                code = 0
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
@@ -0,0 +1,71 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from archive import archive_bills, archive_horizon
+
+OLD = datetime.utcnow() - timedelta(days=400)
+
+def add_claim(bill, status):
+    from models import db, InsuranceClaim
+    db.session.add(InsuranceClaim(
+        bill_id=bill.id, payer_id='60054', payer_name='Aetna', subscriber_id='W1', subscriber_name=bill.patient_name,
+        subscriber_dob=bill.patient_dob, relationship_to_subscriber='self', date_of_service=date(2023, 3, 1),
+        place_of_service='11', status=status, claim_number='CLM1' if status == 'submitted' else None
+    ))
+    db.session.commit()
+
+def add_email(bill, status):
+    from models import db, OutboundEmail
+    db.session.add(OutboundEmail(recipient=bill.email, subject='Payment confirmation', body='Thanks',
+                                 bill_id=bill.id, status=status))
+    db.session.commit()
+
+def archive():
+    return sum(archived for _, _, archived in archive_bills(archive_horizon(), batch_size=2))
+
+def test_only_settled_old_bills_move(app, make_bill):
+    from models import db, Bill
+    settled = [make_bill(payment_status='paid', created_at=OLD + timedelta(minutes=n)) for n in range(3)]
+    add_claim(settled[0], 'submitted')
+    add_email(settled[1], 'sent')
+    kept = [
+        make_bill(payment_status='pending', created_at=OLD),
+        make_bill(payment_status='paid'),
+        make_bill(payment_status='paid', created_at=OLD),
+        make_bill(payment_status='paid', created_at=OLD),
+    ]
+    add_claim(kept[2], 'queued')
+    add_email(kept[3], 'queued')
+    kept_ids = [bill.id for bill in kept]
+    db.session.expunge_all()
+
+    assert archive() == 3
+    assert sorted(db.session.scalars(db.select(Bill.id))) == kept_ids
+    # Nothing left to do: a second run is a no-op
+    assert archive() == 0
+
+def test_archived_bill_reads_like_a_hot_one(client, make_bill):
+    from models import db, OutboundEmail
+    bill = make_bill(diagnoses=[('E11.9', Decimal('40.00'))], procedures=[('99213', Decimal('120.00'))],
+                     payment_status='paid', payment_method='bank', bank_currency='EUR',
+                     bank_exchange_rate=Decimal('0.9'), created_at=OLD)
+    add_claim(bill, 'submitted')
+    add_email(bill, 'sent')
+    before = client.get(f"/api/bills/{bill.id}").get_json()
+    summary = client.get('/api/dashboard/summary').get_json()
+    db.session.expunge_all()
+
+    assert archive() == 1
+    assert client.get(f"/api/bills/{bill.id}").get_json() == before
+    assert client.get(f"/api/payments/{bill.id}").get_json() == before['bill']
+    assert client.get(f"/download_bill_pdf/{bill.id}").status_code == 200
+    # The daily rollups keep counting it; its sent mail stays, unlinked
+    assert client.get('/api/dashboard/summary').get_json() == summary
+    assert db.session.query(OutboundEmail).one().bill_id is None
+    assert client.get('/api/bills/999').status_code == 404
+
+def test_archive_command(app, make_bill):
+    make_bill(payment_status='paid', created_at=OLD)
+    result = app.test_cli_runner().invoke(args=['archive-bills'])
+    assert result.exit_code == 0, result.output
+    assert 'Archived 1 bills created before' in result.output
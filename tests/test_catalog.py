@@ -0,0 +1,81 @@
+import pytest
+
+from catalog import CatalogError, CodeCatalog
+
+ICD10 = """\
+E119    Type 2 diabetes mellitus without complications
+E1165   Type 2 diabetes mellitus with hyperglycemia
+E108    Type 1 diabetes mellitus with unspecified complications
+J209    Acute bronchitis, unspecified
+J45909  Unspecified asthma, uncomplicated
+"""
+
+FEE_SCHEDULE = """\
+code,description,amount
+99213,Office or other outpatient visit,120
+99214,Office or other outpatient visit of moderate complexity,180.5
+80053,Comprehensive metabolic panel,35
+"""
+
+@pytest.fixture
+def catalog(tmp_path):
+    (tmp_path / 'icd10.txt').write_text(ICD10)
+    (tmp_path / 'fees.csv').write_text(FEE_SCHEDULE)
+    return CodeCatalog({'icd10': str(tmp_path / 'icd10.txt'), 'cpt': str(tmp_path / 'fees.csv')},
+                       str(tmp_path / 'catalog'))
+
+def codes(entries):
+    return [entry.code for entry in entries]
+
+def test_code_prefix_with_or_without_the_dot(catalog):
+    icd10 = catalog.index('icd10')
+    assert codes(icd10.prefix('E1')) == ['E10.8', 'E11.65', 'E11.9']
+    assert codes(icd10.prefix('e11.6')) == codes(icd10.prefix('E116')) == ['E11.65']
+    assert codes(icd10.prefix('E1', limit=1)) == ['E10.8']
+    assert icd10.lookup('j20.9').description == 'Acute bronchitis, unspecified'
+    assert catalog.index('cpt').lookup('99214').price == '180.50'
+
+def test_description_words_match_in_any_order(catalog):
+    icd10 = catalog.index('icd10')
+    assert codes(icd10.search('mellitus type 2 ')) == ['E11.65', 'E11.9']
+    # The word still being typed matches as a prefix; the others must match whole
+    assert codes(icd10.search('diabetes with hyper')) == ['E11.65']
+    assert codes(icd10.search('diabetes compl')) == ['E10.8', 'E11.9']
+    assert icd10.search('diabetes asthma ') == []
+    assert icd10.search('the of') == []
+
+def test_autocomplete_puts_code_matches_first(catalog):
+    cpt = catalog.index('cpt')
+    assert codes(cpt.autocomplete('9921')) == ['99213', '99214']
+    assert codes(cpt.autocomplete('office mod')) == ['99214']
+
+def test_unknown_codes_and_status(catalog):
+    assert catalog.unknown_codes('icd10', ['E11.9', 'Z99.9', 'e119', 'Z99.9']) == ['Z99.9']
+    assert catalog.status() == {'icd10': {'loaded': True, 'codes': 5}, 'cpt': {'loaded': True, 'codes': 3}}
+
+def test_index_is_built_once_and_rebuilt_when_the_source_changes(catalog, tmp_path):
+    path = catalog.build('cpt')
+    assert catalog.build('cpt') == path
+    (tmp_path / 'fees.csv').write_text(FEE_SCHEDULE + '99215,Office visit of high complexity,250\n')
+    rebuilt = catalog.build('cpt')
+    assert rebuilt != path
+    assert [f.name for f in (tmp_path / 'catalog').glob('cpt-*.idx')] == [rebuilt.rsplit('/', 1)[1]]
+
+def test_bad_fee_schedule_price(tmp_path):
+    (tmp_path / 'fees.csv').write_text('code,description,amount\n99213,Office visit,lots\n')
+    catalog = CodeCatalog({'cpt': str(tmp_path / 'fees.csv')}, str(tmp_path / 'catalog'))
+    with pytest.raises(CatalogError, match='fees.csv:2'):
+        catalog.build('cpt')
+    # Logged, and the system is left unvalidated rather than failing requests
+    assert catalog.index('cpt') is None
+    assert catalog.unknown_codes('cpt', ['99213']) == []
+
+def test_code_search_route(app, client, catalog):
+    assert client.get('/api/codes/icd10', query_string={'q': 'E1'}).status_code == 503
+    app.extensions['billing']['code_catalog'] = catalog
+    response = client.get('/api/codes/icd10', query_string={'q': 'bronch'})
+    assert response.get_json()['results'] == [
+        {'code': 'J20.9', 'description': 'Acute bronchitis, unspecified', 'price': None}]
+    data = client.get('/api/codes/cpt', query_string={'q': '99', 'limit': 0}).get_json()
+    assert [result['code'] for result in data['results']] == ['99213']
+    assert client.get('/api/codes/loinc', query_string={'q': '1'}).status_code == 404
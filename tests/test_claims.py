@@ -0,0 +1,94 @@
+import pytest
+
+import clearinghouse
+from clearinghouse import FakeClearinghouse, HttpClearinghouse, build_clearinghouse
+
+CLAIM = {'payerId': '60054', 'payerName': 'Aetna', 'subscriberId': 'W123456789', 'subscriberName': 'Ada Lovelace',
+         'subscriberDOB': '1980-01-01', 'dateOfService': '2024-03-01'}
+
+def test_fake_clearinghouse_is_opt_in():
+    with pytest.raises(ValueError, match='CLEARINGHOUSE_URL'):
+        build_clearinghouse({})
+    with pytest.raises(ValueError, match="'http' or 'fake'"):
+        build_clearinghouse({'CLEARINGHOUSE': 'none'})
+    assert isinstance(build_clearinghouse({'CLEARINGHOUSE': 'fake'}), FakeClearinghouse)
+    assert isinstance(build_clearinghouse({'TESTING': True}), FakeClearinghouse)
+    assert isinstance(build_clearinghouse({'CLEARINGHOUSE_URL': 'https://ch.invalid/837'}), HttpClearinghouse)
+
+def test_claims_worker_refuses_to_start_unconfigured(app):
+    app.config.update(TESTING=False, CLEARINGHOUSE_URL=None)
+    result = app.test_cli_runner().invoke(args=['claims-worker', '--once'])
+    assert result.exit_code != 0
+    assert 'CLEARINGHOUSE_URL is not set' in result.output
+
+def test_claim_for_missing_bill_leaves_nothing_pending(app, client):
+    from models import db
+    response = client.post('/api/submit_claim', json={**CLAIM, 'billId': 999})
+    assert response.status_code == 404
+    assert not db.session().in_transaction()
+
+def test_claim_is_queued_and_submitted(app, client, make_bill):
+    from models import db, Bill
+    bill = make_bill(procedures=[('99213', 120)])
+    response = client.post('/api/submit_claim', json={**CLAIM, 'billId': bill.id})
+    assert response.status_code == 202
+    result = app.test_cli_runner().invoke(args=['claims-worker', '--once'])
+    assert result.exit_code == 0, result.output
+    db.session.expire_all()
+    assert db.session.get(Bill, bill.id).claim_status == 'submitted'
+
+def queue_claims(client, make_bill, count):
+    bills = [make_bill(procedures=[('99213', 120)]) for _ in range(count)]
+    for bill in bills:
+        assert client.post('/api/submit_claim', json={**CLAIM, 'billId': bill.id}).status_code == 202
+    return bills
+
+def make_due():
+    from datetime import datetime
+    from sqlalchemy import update
+    from models import db, InsuranceClaim
+    db.session.execute(update(InsuranceClaim).values(available_at=datetime.utcnow()))
+    db.session.commit()
+
+def claim_states():
+    from models import db, InsuranceClaim
+    db.session.expire_all()
+    return sorted((claim.status, claim.batch_id) for claim in db.session.query(InsuranceClaim))
+
+def test_lost_answer_resends_the_same_batch(app, client, make_bill):
+    from claim_queue import process_claims
+    from models import db, ClaimBatch
+    queue_claims(client, make_bill, 2)
+    fake = FakeClearinghouse(lose_next=1)
+    assert process_claims(fake) == 2
+    [batch] = db.session.query(ClaimBatch).all()
+    assert batch.status == 'failed'
+    assert claim_states() == [('queued', batch.id)] * 2
+
+    make_due()
+    assert process_claims(fake) == 2
+    # One interchange reached the clearinghouse; the retry was recognised as a repeat
+    assert [batch_id for batch_id, _, _ in fake.submissions] == [batch.id]
+    assert db.session.query(ClaimBatch).count() == 1
+    assert claim_states() == [('submitted', batch.id)] * 2
+
+def test_worker_dying_mid_call_resends_the_same_batch(app, client, make_bill):
+    from claim_queue import process_claims
+    from models import db, ClaimBatch
+    queue_claims(client, make_bill, 1)
+    fake = FakeClearinghouse()
+
+    class DiesAfterSending:
+        def submit(self, batch_id, payer_id, payload):
+            fake.submit(batch_id, payer_id, payload)
+            raise RuntimeError('worker killed')
+
+    assert process_claims(DiesAfterSending()) == 1
+    [batch] = db.session.query(ClaimBatch).all()
+    assert batch.status == 'sending'
+    assert claim_states() == [('submitting', batch.id)]
+
+    make_due()  # the lease ran out
+    assert process_claims(fake) == 1
+    assert len(fake.submissions) == 1
+    assert claim_states() == [('submitted', batch.id)]
@@ -0,0 +1,53 @@
+from datetime import datetime
+from decimal import ROUND_HALF_EVEN, Decimal
+
+import pyarrow as pa
+import pytest
+
+from currency import convert_column, rates_at, record_rates, revaluation_totals
+
+CENT = Decimal('0.01')
+JAN, FEB, MAR = datetime(2024, 1, 1), datetime(2024, 2, 1), datetime(2024, 3, 1)
+
+def decimals(values, scale):
+    return pa.array([Decimal(v) for v in values], pa.decimal128(18, scale))
+
+def test_conversion_rounds_half_even_like_quantize():
+    amounts = ['10.05', '10.15', '0.01', '1.00', '999999.99']
+    rates = ['0.5', '0.5', '0.5', '1.23456789', '0.00012345']
+    converted = convert_column(decimals(amounts, 2), decimals(rates, 8)).to_pylist()
+    assert converted == [(Decimal(a) * Decimal(r)).quantize(CENT, ROUND_HALF_EVEN) for a, r in zip(amounts, rates)]
+    assert converted[:3] == [Decimal('5.02'), Decimal('5.08'), Decimal('0.00')]
+
+    # Division is carried far enough that the rounding is still the exact one
+    divided = convert_column(decimals(['100.00', '0.25'], 2), decimals(['1', '1'], 8), decimals(['3', '2'], 8))
+    assert divided.to_pylist() == [Decimal('33.33'), Decimal('0.12')]
+
+def test_rate_history_records_changes_only(app):
+    assert record_rates({'EUR': 0.9, 'GBP': 0.8, 'USD': 1.0}, 'test', at=JAN) == 2
+    assert record_rates({'EUR': 0.900000001, 'GBP': 0.75}, 'test', at=FEB) == 1
+    assert rates_at(FEB) == {'EUR': Decimal('0.90000000'), 'GBP': Decimal('0.75000000')}
+    # Before the first recorded rate, the first one applies
+    assert rates_at(datetime(2023, 6, 1))['GBP'] == Decimal('0.80000000')
+
+def test_revaluation_totals(app, make_bill):
+    record_rates({'EUR': 0.9, 'GBP': 0.8}, 'test', at=JAN)
+    record_rates({'EUR': 0.8}, 'test', at=MAR)
+    bank = {'payment_method': 'bank', 'payment_status': 'paid', 'created_at': FEB}
+    make_bill(bank_currency='EUR', total_amount=Decimal('100.00'), bank_exchange_rate=Decimal('0.9'), **bank)
+    # No stored rate: the historical one at created_at is used
+    make_bill(bank_currency='EUR', total_amount=Decimal('10.05'), **bank)
+    make_bill(bank_currency='JPY', total_amount=Decimal('50.00'), **bank)
+
+    totals = revaluation_totals('GBP')
+    # 100.00 * 0.8 + 10.05 * 0.8 = 80.00 + 8.04
+    assert totals['EUR'] == {'payments': 2, 'unconverted': 0, 'local_amount': '99.04', 'target_amount': '88.04'}
+    # No yen rate, so what the patient paid is unknown
+    assert totals['JPY'] == {'payments': 1, 'unconverted': 1, 'local_amount': '0', 'target_amount': '40.00'}
+
+    totals = revaluation_totals('USD', MAR)
+    # 90.00 / 0.8 and 9.04 (10.05 * 0.9 = 9.045, to even) / 0.8 = 11.30
+    assert totals['EUR'] == {'payments': 2, 'unconverted': 0, 'local_amount': '99.04', 'target_amount': '110.05',
+                             'revalued_amount': '123.80', 'fx_difference': '13.75'}
+    with pytest.raises(ValueError, match='No CHF rate'):
+        revaluation_totals('CHF', MAR)
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import select
+
+from db_routing import STICKY_COOKIE, configure_engines, reading_from_replicas, refresh_sqlite_replicas
+
+@pytest.fixture
+def app(tmp_path):
+    """Application on a SQLite primary with one SQLite replica, refreshed by hand"""
+    from app import create_app
+    from models import db
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'billing.db'}",
+        'DATABASE_REPLICA_URLS': [f"sqlite:///{tmp_path / 'replica.db'}"],
+        'SHARED_SQLITE_PATH': str(tmp_path / 'shared.db'),
+        'PDF_CACHE_DIR': str(tmp_path / 'pdf_cache'),
+        'METRICS_ENABLED': False,
+        'RATE_LIMIT': 10000,
+        'MAIL_DEFAULT_SENDER': 'billing@localhost',
+    })
+    try:
+        with app.app_context():
+            db.create_all()
+            refresh_sqlite_replicas(db)
+            yield app
+            db.session.remove()
+    finally:
+        # db is shared by every app in the process; apps without replicas have no such bind
+        db.metadatas.pop('replica_0', None)
+
+def listed(client):
+    """Bill ids on the dashboard, read in a fresh session like a new request's"""
+    from models import db
+    db.session.remove()
+    return [payment['id'] for payment in client.get('/api/payments').get_json()['payments']]
+
+def test_reads_go_to_the_replica_until_the_client_writes(app, client, make_bill):
+    from models import db
+    replicated = make_bill().id
+    refresh_sqlite_replicas(db)
+    unreplicated = make_bill().id
+    assert listed(client) == [replicated]
+
+    payment = {'billId': unreplicated, 'paymentMethod': 'bank', 'currency': 'USD', 'bankName': 'First Bank',
+               'accountNumber': '000123', 'routingNumber': '110000000'}
+    db.session.remove()
+    response = client.post('/verify_payment', json=payment)
+    assert response.status_code == 200
+    assert STICKY_COOKIE in response.headers['Set-Cookie']
+    # Reads its own write from the primary while the cookie lasts
+    assert listed(client) == [unreplicated, replicated]
+    client.delete_cookie(STICKY_COOKIE, domain='localhost')
+    assert listed(client) == [replicated]
+
+def test_batch_reads_fall_back_to_the_primary_after_a_write(app, make_bill):
+    from models import db, Bill
+    bill_id = make_bill().id
+    db.session.remove()
+    with reading_from_replicas():
+        assert db.session.scalars(select(Bill.id)).all() == []
+        # Locking reads and everything after a write stay on the primary
+        assert db.session.scalars(select(Bill.id).with_for_update()).all() == [bill_id]
+        bill = db.session.scalars(select(Bill).where(Bill.id == bill_id).with_for_update()).one()
+        bill.email = 'ada@example.org'
+        db.session.flush()
+        assert db.session.scalars(select(Bill.id)).all() == [bill_id]
+    db.session.rollback()
+    db.session.remove()
+    assert db.session.scalars(select(Bill.id)).all() == [bill_id]
+
+def test_pool_settings_per_role():
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'postgresql://db/billing',
+        'DATABASE_REPLICA_URLS': ['postgresql://replica/billing', 'sqlite://'],
+        'DB_POOL_SIZE': 8, 'DB_MAX_OVERFLOW': 4, 'DB_REPLICA_POOL_SIZE': 3, 'DB_REPLICA_MAX_OVERFLOW': 2,
+        'DB_POOL_TIMEOUT': 7, 'DB_POOL_PRE_PING': False,
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_recycle': 60},
+    }
+    configure_engines(config)
+    options = config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert (options['pool_size'], options['max_overflow'], options['pool_timeout']) == (8, 4, 7)
+    assert options['pool_recycle'] == 60
+    replica, memory = config['SQLALCHEMY_BINDS']['replica_0'], config['SQLALCHEMY_BINDS']['replica_1']
+    assert (replica['pool_size'], replica['max_overflow'], replica['pool_logging_name']) == (3, 2, 'replica_0')
+    assert memory == {'url': 'sqlite://'}
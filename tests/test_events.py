@@ -0,0 +1,74 @@
+import queue
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from events import Subscription
+
+def age(bill_id, seconds):
+    """Give a bill's last change an updated_at `seconds` in the past"""
+    from models import db, Bill
+    db.session.execute(update(Bill).where(Bill.id == bill_id)
+                       .values(updated_at=datetime.utcnow() - timedelta(seconds=seconds)))
+    db.session.commit()
+
+def pay(bill_id, status='paid'):
+    from models import db
+    from payment_state import transition
+    transition(bill_id, 'payment', status, source='test')
+    db.session.commit()
+
+@pytest.fixture
+def status_events(app):
+    """The process's event hub with one status subscriber, polled by hand instead of by its thread"""
+    hub = app.extensions['billing']['event_hub']
+    subscription = Subscription({'status'})
+    hub._subscribers.add(subscription)
+
+    def poll():
+        hub._poll_status()
+        events = []
+        while True:
+            try:
+                event = subscription.queue.get_nowait()
+            except queue.Empty:
+                return events
+            events.append((event.data['id'], event.data['version']))
+    return poll
+
+def test_change_feed_holds_back_recent_changes(client, make_bill):
+    bill = make_bill()
+    age(bill.id, 60)
+    cursor = client.get('/api/payments/changes').get_json()['cursor']
+
+    pay(bill.id)
+    data = client.get('/api/payments/changes', query_string={'since': cursor}).get_json()
+    # Within STATUS_FEED_LAG: an older transaction may still commit behind it
+    assert data['changes'] == []
+    assert data['cursor'] == cursor
+
+    age(bill.id, 5)
+    data = client.get('/api/payments/changes', query_string={'since': cursor}).get_json()
+    assert [(c['id'], c['payment_status'], c['version']) for c in data['changes']] == [(bill.id, 'paid', 2)]
+    assert client.get('/api/payments/changes', query_string={'since': data['cursor']}).get_json()['changes'] == []
+
+def test_event_hub_sees_late_commits_once(app, make_bill, status_events):
+    first, second = make_bill(), make_bill()
+    age(first.id, 60)
+    age(second.id, 60)
+    assert status_events() == []
+
+    pay(second.id, 'failed')
+    age(second.id, 1)
+    assert status_events() == [(second.id, 2)]
+
+    # Committed after the poll above, but stamped before the change it already sent
+    pay(first.id)
+    age(first.id, 3)
+    assert status_events() == [(first.id, 2)]
+    assert status_events() == []
+
+    # A newer version of a bill already sent goes out again
+    pay(second.id, 'pending')
+    assert status_events() == [(second.id, 3)]
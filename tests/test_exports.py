@@ -0,0 +1,70 @@
+import csv
+from datetime import datetime, timedelta
+
+import pyarrow.parquet as pq
+import pytest
+from sqlalchemy import update
+
+import exports
+from exports import run_incremental_export
+
+STAMP = datetime.utcnow() - timedelta(hours=1)
+
+def stamp(bill_ids, at=STAMP):
+    """Give bills one shared updated_at, as rows written in one transaction have"""
+    from models import db, Bill
+    db.session.execute(update(Bill).where(Bill.id.in_(bill_ids)).values(updated_at=at))
+    db.session.commit()
+
+def exported_ids(path):
+    with open(path, newline='') as f:
+        return [int(row['id']) for row in csv.DictReader(f)]
+
+def test_incremental_export_resumes_after_its_watermark(app, make_bill, tmp_path):
+    from models import db, ExportWatermark
+    from payment_state import transition
+    bills = [make_bill() for _ in range(3)]
+    ids = [bill.id for bill in bills]
+    stamp(ids)
+
+    # Ties on updated_at are ordered by id, so no row is lost between batches
+    assert run_incremental_export('bills', tmp_path / 'first.csv', batch_size=1) == 3
+    assert exported_ids(tmp_path / 'first.csv') == ids
+    watermark = db.session.get(ExportWatermark, 'bills')
+    assert (watermark.updated_at, watermark.last_id) == (STAMP, ids[-1])
+    assert run_incremental_export('bills', tmp_path / 'empty.csv') == 0
+    assert exported_ids(tmp_path / 'empty.csv') == []
+
+    # Changed just now: held back until EXPORT_WATERMARK_LAG has passed
+    transition(ids[0], 'payment', 'paid', source='test')
+    db.session.commit()
+    assert run_incremental_export('bills', tmp_path / 'recent.csv') == 0
+    stamp([ids[0]], datetime.utcnow() - exports.EXPORT_WATERMARK_LAG * 2)
+    assert run_incremental_export('bills', tmp_path / 'second.parquet', 'parquet') == 1
+    table = pq.read_table(tmp_path / 'second.parquet')
+    assert table.column('id').to_pylist() == [ids[0]]
+    assert table.column('payment_status').to_pylist() == ['paid']
+
+def test_failed_export_keeps_the_watermark(app, make_bill, tmp_path, monkeypatch):
+    from models import db, ExportWatermark
+    stamp([make_bill().id, make_bill().id])
+
+    def write_then_fail(entity, path, batch_size, on_batch, **filters):
+        on_batch(next(exports.iter_export_batches(exports.build_export_query(entity, **filters), 1)))
+        raise OSError('disk full')
+    monkeypatch.setattr(exports, 'write_csv', write_then_fail)
+    with pytest.raises(OSError):
+        run_incremental_export('bills', tmp_path / 'failed.csv')
+    assert db.session.get(ExportWatermark, 'bills') is None
+    monkeypatch.undo()
+    assert run_incremental_export('bills', tmp_path / 'retry.csv') == 2
+
+def test_export_command(app, make_bill, tmp_path):
+    stamp([make_bill().id])
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['export', 'bills', str(tmp_path / 'bills.csv'), '--incremental'])
+    assert result.exit_code == 0, result.output
+    assert exported_ids(tmp_path / 'bills.csv') == [1]
+    # No bank account numbers in any export
+    with open(tmp_path / 'bills.csv', newline='') as f:
+        assert not {'account_number', 'routing_number'} & set(next(csv.reader(f)))
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from ingest import BillValidationError, parse_bill_payload
+
+BILL = {'patient_name': 'Ada Lovelace', 'patient_dob': '1980-01-01', 'email': 'ada@example.com',
+        'diagnoses': [{'code': 'E11.9', 'amount': '40'}], 'procedures': [{'code': '99213', 'amount': '120.005'}]}
+
+def ndjson(*bills):
+    return '\n'.join(json.dumps(bill) for bill in bills) + '\n'
+
+def test_parses_both_payload_shapes():
+    bill = parse_bill_payload({**BILL, 'procedures': [], 'services': {'labs': [{'code': '80053', 'price': 35}]}})
+    assert [p['cpt_code'] for p in bill['procedures']] == ['80053']
+    assert str(bill['total_amount']) == '75.00'
+
+@pytest.mark.parametrize('change, message', [
+    ({'diagnoses': ['A00']}, 'line items must be objects'),
+    ({'procedures': [None]}, 'line items must be objects'),
+    ({'diagnoses': {'code': 'A00'}}, 'diagnoses must be a list'),
+    ({'services': {'labs': 5}}, 'services.labs must be a list'),
+    ({'services': ['labs']}, 'services must be an object'),
+])
+def test_malformed_line_items_are_validation_errors(change, message):
+    with pytest.raises(BillValidationError, match=message):
+        parse_bill_payload({**BILL, **change})
+
+def test_batch_reports_bad_rows_and_keeps_the_rest(client):
+    from models import db, Bill
+    body = ndjson(BILL, {**BILL, 'diagnoses': ['A00']}, {**BILL, 'services': {'labs': 5}}, 'not a bill',
+                  {**BILL, 'email': 'grace@example.com'}) + '{broken\n'
+    response = client.post('/api/bills/batch', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert (result['received'], result['inserted'], result['failed']) == (6, 2, 4)
+    assert [error['line'] for error in result['errors']] == [2, 3, 4, 6]
+    assert db.session.query(Bill).count() == 2
+
+def test_submit_bill_rejects_malformed_line_items(client):
+    response = client.post('/submit_bill', json={**BILL, 'diagnoses': ['A00']})
+    assert response.status_code == 400
+    assert 'line items must be objects' in response.get_json()['error']
+
+def test_batch_upload_is_rate_limited(app, client):
+    from shared_backends import SlidingWindowLimiter
+    limiter = app.extensions['billing']['rate_limiter']
+    app.extensions['billing']['rate_limiter'] = SlidingWindowLimiter(limiter.store, 1, limiter.window, 'rl-batch')
+    assert client.post('/api/bills/batch', data=ndjson(BILL), content_type='application/x-ndjson').status_code == 200
+    response = client.post('/api/bills/batch', data=ndjson(BILL), content_type='application/x-ndjson')
+    assert response.status_code == 429
+    assert response.get_json()['retry_after'] > 0
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+import mailer
+
+class FakeConnection:
+    """Stands in for the pooled SMTP session; fails for recipients in `failing`"""
+
+    def __init__(self):
+        self.sent = []
+        self.failing = set()
+
+    def send(self, sender, recipients, message_bytes):
+        if set(recipients) & self.failing:
+            raise OSError('connection refused')
+        self.sent.extend(recipients)
+
+    def close(self):
+        pass
+
+    def close_if_idle(self, idle_timeout=mailer.MAIL_IDLE_TIMEOUT):
+        pass
+
+@pytest.fixture
+def sender(app):
+    sender = app.extensions['billing']['mail_sender']
+    sender.connection = FakeConnection()
+    return sender
+
+def queue(count, recipient='patient{}@example.com'):
+    from models import db
+    emails = [mailer.queue_email(recipient.format(n), 'Statement', 'Hello') for n in range(count)]
+    db.session.commit()
+    return [email.id for email in emails]
+
+def make_due(ids):
+    from models import db, OutboundEmail
+    db.session.execute(update(OutboundEmail).where(OutboundEmail.id.in_(ids))
+                       .values(available_at=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+
+def test_send_mail_drains_the_backlog(app, sender):
+    from models import db, OutboundEmail
+    ids = queue(5)
+    result = app.test_cli_runner().invoke(args=['send-mail', '--once', '--batch-size', '2'])
+    assert result.exit_code == 0, result.output
+    assert 'Sent mail: 5 messages leased' in result.output
+    assert sorted(sender.connection.sent) == sorted(f"patient{n}@example.com" for n in range(5))
+    statuses = db.session.scalars(select(OutboundEmail.status).where(OutboundEmail.id.in_(ids))).all()
+    assert statuses == ['sent'] * 5
+
+def test_failed_message_is_retried_with_backoff(app, sender):
+    from models import db, OutboundEmail
+    [email_id] = queue(1, 'bounce@example.com')
+    sender.connection.failing.add('bounce@example.com')
+
+    started = datetime.utcnow()
+    assert sender.send_backlog() == 1
+    email = db.session.get(OutboundEmail, email_id)
+    assert (email.status, email.attempts, email.last_error) == ('queued', 1, 'connection refused')
+    assert email.available_at >= started + timedelta(seconds=mailer.MAIL_RETRY_DELAY)
+    # Not due yet, so the next pass leaves it alone
+    assert sender.send_backlog() == 0
+
+    make_due([email_id])
+    assert sender.send_backlog() == 1
+    email = db.session.get(OutboundEmail, email_id)
+    db.session.refresh(email)
+    assert email.attempts == 2
+    assert email.available_at >= started + timedelta(seconds=2 * mailer.MAIL_RETRY_DELAY)
+
+    sender.connection.failing.clear()
+    make_due([email_id])
+    assert sender.send_backlog() == 1
+    db.session.refresh(email)
+    assert (email.status, email.last_error) == ('sent', None)
+    assert sender.connection.sent == ['bounce@example.com']
+
+def test_gives_up_after_max_attempts(app, sender):
+    from models import db, OutboundEmail
+    [email_id] = queue(1, 'bounce@example.com')
+    sender.connection.failing.add('bounce@example.com')
+    for _ in range(mailer.MAIL_MAX_ATTEMPTS):
+        make_due([email_id])
+        assert sender.send_backlog() == 1
+    email = db.session.get(OutboundEmail, email_id)
+    db.session.refresh(email)
+    assert (email.status, email.attempts) == ('failed', mailer.MAIL_MAX_ATTEMPTS)
+    make_due([email_id])
+    assert sender.send_backlog() == 0
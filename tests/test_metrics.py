@@ -0,0 +1,80 @@
+import json
+import re
+
+import pytest
+
+from metrics import MetricsRegistry, registry
+
+HTTPS = 'https://localhost'
+
+@pytest.fixture
+def metrics_client(tmp_path):
+    """Client of an app with request metrics on; the process-wide registry is reset afterwards"""
+    from app import create_app
+    from models import db
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'billing.db'}",
+        'SHARED_SQLITE_PATH': str(tmp_path / 'shared.db'),
+        'PDF_CACHE_DIR': str(tmp_path / 'pdf_cache'),
+        'METRICS_ENABLED': True,
+        'METRICS_DIR': str(tmp_path / 'metrics'),
+        'RATE_LIMIT': 10000,
+    })
+    try:
+        with app.app_context():
+            db.create_all()
+            client = app.test_client()
+            client.environ_base['HTTP_X_FORWARDED_PROTO'] = 'https'
+            yield client
+            db.session.remove()
+    finally:
+        registry.enabled = False
+        registry.directory = None
+        registry._reset()
+
+def sample(text, name, **labels):
+    """Value of one series in a Prometheus exposition, or None"""
+    wanted = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf'^{re.escape(name)}(?:\{{{re.escape(wanted)}\}})? (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+def test_server_timing_and_request_metrics(metrics_client):
+    response = metrics_client.get('/api/payments', base_url=HTTPS)
+    assert response.status_code == 200
+    timing = response.headers['Server-Timing']
+    match = re.fullmatch(r'db;dur=[\d.]+;desc="(\d+) queries", app;dur=[\d.]+', timing)
+    assert match and int(match.group(1)) >= 1
+    metrics_client.get('/api/bills/999', base_url=HTTPS)
+
+    text = metrics_client.get('/metrics', base_url=HTTPS).get_data(as_text=True)
+    assert sample(text, 'http_requests_total', route='/api/payments', method='GET', status='200') == 1
+    assert sample(text, 'http_requests_total', route='/api/bills/<int:bill_id>', method='GET', status='404') == 1
+    assert sample(text, 'http_request_duration_seconds_count', route='/api/payments', method='GET') == 1
+    assert sample(text, 'http_request_db_queries_count', route='/api/payments') == 1
+    assert sample(text, 'db_queries_total') >= 1
+
+def test_scrape_merges_other_workers(metrics_client, tmp_path):
+    metrics_client.get('/api/payments', base_url=HTTPS)
+    other = {'http_requests_total': [[['/api/payments', 'GET', '200'], 2]],
+             'http_request_db_queries': [[['/api/payments'], [0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0.5]]]}
+    (tmp_path / 'metrics' / 'other-worker.json').write_text(json.dumps(other))
+    text = metrics_client.get('/metrics', base_url=HTTPS).get_data(as_text=True)
+    assert sample(text, 'http_requests_total', route='/api/payments', method='GET', status='200') == 3
+    assert sample(text, 'http_request_db_queries_count', route='/api/payments') == 2
+
+def test_histogram_buckets_are_cumulative():
+    local = MetricsRegistry()
+    local.enabled = True
+    latency = local.histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.observe(value, '/a')
+    text = local.render()
+    assert [sample(text, 'latency_seconds_bucket', route='/a', le=le) for le in ('0.1', '1.0', '+Inf')] == [1, 3, 4]
+    assert sample(text, 'latency_seconds_sum', route='/a') == pytest.approx(4.25)
+    assert sample(text, 'latency_seconds_count', route='/a') == 4
+
+def test_metrics_endpoint_is_off_when_disabled(client):
+    response = client.get('/api/payments')
+    assert 'Server-Timing' not in response.headers
+    assert client.get('/metrics').status_code == 404
@@ -0,0 +1,88 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import inspect, text
+
+# The tables as the first release created them
+LEGACY_SCHEMA = (
+    """CREATE TABLE bill (
+        id INTEGER PRIMARY KEY, patient_name VARCHAR(100) NOT NULL, patient_dob DATE NOT NULL,
+        insurance_provider VARCHAR(100), policy_number VARCHAR(50), total_amount NUMERIC(10, 2) NOT NULL,
+        email VARCHAR(120) NOT NULL, created_at DATETIME, payment_status VARCHAR(20), payment_method VARCHAR(20),
+        transaction_hash VARCHAR(66), payment_currency VARCHAR(10), crypto_amount NUMERIC(20, 8),
+        bank_name VARCHAR(100), account_number VARCHAR(50), routing_number VARCHAR(50), bank_currency VARCHAR(3),
+        bank_exchange_rate NUMERIC(10, 4), claim_status VARCHAR(20), claim_submission_date DATETIME,
+        claim_number VARCHAR(50))""",
+    """CREATE TABLE diagnosis (
+        id INTEGER PRIMARY KEY, bill_id INTEGER NOT NULL REFERENCES bill (id) ON DELETE CASCADE,
+        icd10_code VARCHAR(10) NOT NULL, description VARCHAR(200), amount NUMERIC(10, 2) NOT NULL)""",
+    """CREATE TABLE procedure (
+        id INTEGER PRIMARY KEY, bill_id INTEGER NOT NULL REFERENCES bill (id) ON DELETE CASCADE,
+        cpt_code VARCHAR(10) NOT NULL, description VARCHAR(200), amount NUMERIC(10, 2) NOT NULL)""",
+    """CREATE TABLE insurance_claim (
+        id INTEGER PRIMARY KEY, bill_id INTEGER NOT NULL REFERENCES bill (id), payer_id VARCHAR(50) NOT NULL,
+        payer_name VARCHAR(100) NOT NULL, subscriber_id VARCHAR(50) NOT NULL, subscriber_name VARCHAR(100) NOT NULL,
+        subscriber_dob DATE NOT NULL, relationship_to_subscriber VARCHAR(20) NOT NULL, date_of_service DATE NOT NULL,
+        place_of_service VARCHAR(2) NOT NULL, status VARCHAR(20), submitted_at DATETIME, claim_number VARCHAR(50),
+        response_message TEXT)""",
+)
+
+CREATED = datetime(2023, 3, 1, 9, 30)
+
+def test_init_db_upgrades_a_legacy_database(app):
+    from models import db, Bill, InsuranceClaim
+    db.session.remove()
+    db.drop_all()
+    with db.engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text(
+            "INSERT INTO bill (id, patient_name, patient_dob, total_amount, email, created_at, payment_status, claim_status)"
+            " VALUES (1, 'Ada Lovelace', '1980-01-01', 999.99, 'ada@example.com', :created, 'pending', 'pending')"
+        ), {'created': CREATED})
+        connection.execute(text("INSERT INTO diagnosis (bill_id, icd10_code, amount) VALUES (1, 'J20.9', 10.00)"))
+        connection.execute(text("INSERT INTO procedure (bill_id, cpt_code, amount) VALUES (1, '99213', 120.00)"))
+        connection.execute(text(
+            "INSERT INTO insurance_claim (bill_id, payer_id, payer_name, subscriber_id, subscriber_name, subscriber_dob,"
+            " relationship_to_subscriber, date_of_service, place_of_service, status, submitted_at)"
+            " VALUES (1, '60054', 'Aetna', 'W1', 'Ada Lovelace', '1980-01-01', 'self', '2023-03-01', '11', 'pending', :created)"
+        ), {'created': CREATED})
+
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert 'Added column bill.version' in result.output
+    assert 'Created index uq_bill_transaction_hash_open' in result.output
+    assert 'Recomputed subtotals of 1 bills' in result.output
+
+    bill = db.session.get(Bill, 1)
+    assert (bill.diagnoses_subtotal, bill.procedures_subtotal, bill.total_amount) == (
+        Decimal('10.00'), Decimal('120.00'), Decimal('130.00'))
+    # Recomputing the totals changed the bill, so it is stamped now
+    assert bill.version == 1 and bill.updated_at > CREATED
+    assert [item.updated_at for item in bill.diagnoses + bill.procedures] == [CREATED, CREATED]
+    claim = db.session.get(InsuranceClaim, 1)
+    assert (claim.status, claim.queued_at, claim.submitted_at, claim.attempts) == ('queued', CREATED, None, 0)
+    assert claim.available_at is not None and claim.updated_at is not None
+    assert 'ix_insurance_claim_status_available_at' in {
+        index['name'] for index in inspect(db.engine).get_indexes('insurance_claim')}
+
+    # Already upgraded: nothing left to do
+    db.session.remove()
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ['Database tables created']
+
+def test_legacy_pending_claims_are_queued(app, make_bill):
+    from models import db, InsuranceClaim
+    from migrations import upgrade_schema
+    bill = make_bill()
+    db.session.add(InsuranceClaim(
+        bill_id=bill.id, payer_id='60054', payer_name='Aetna', subscriber_id='W1', subscriber_name='Ada Lovelace',
+        subscriber_dob=date(1980, 1, 1), relationship_to_subscriber='self', date_of_service=date.today(),
+        place_of_service='11', status='pending'
+    ))
+    db.session.commit()
+    assert upgrade_schema() == ['Backfilled insurance_claim.status pending -> queued on 1 rows']
+    db.session.expire_all()
+    assert db.session.query(InsuranceClaim).one().status == 'queued'
+    assert upgrade_schema() == []
@@ -0,0 +1,90 @@
+import pytest
+
+from payment_state import IdempotencyKeyReused, InvalidTransition, VersionConflict, bill_history, transition
+
+PAYMENT = {'paymentMethod': 'bank', 'currency': 'USD', 'bankName': 'First Bank',
+           'accountNumber': '000123', 'routingNumber': '110000000'}
+
+def confirmations():
+    from models import db, OutboundEmail
+    return db.session.query(OutboundEmail).count()
+
+def test_transitions_follow_the_state_machine(app, make_bill):
+    from models import db, Bill
+    bill = make_bill()
+    change = transition(bill.id, 'payment', 'paid', source='test')
+    db.session.commit()
+    assert (change.from_status, change.to_status, change.version, change.replayed) == ('pending', 'paid', 2, False)
+    with pytest.raises(InvalidTransition):
+        transition(bill.id, 'payment', 'pending', source='test')
+    with pytest.raises(InvalidTransition):
+        transition(bill.id, 'claim', 'submitted', source='test')
+    with pytest.raises(LookupError):
+        transition(999, 'payment', 'paid', source='test')
+    assert [(t.from_status, t.to_status, t.version) for t in bill_history(bill.id)] == [('pending', 'paid', 2)]
+
+    # Direct writes would skip the version check and the log
+    bill = db.session.get(Bill, bill.id)
+    bill.payment_status = 'failed'
+    with pytest.raises(InvalidTransition, match='transition()'):
+        db.session.flush()
+    db.session.rollback()
+
+def test_expected_version_conflicts(app, make_bill):
+    from models import db
+    bill = make_bill()
+    transition(bill.id, 'payment', 'failed', expected_version=1, source='test')
+    db.session.commit()
+    with pytest.raises(VersionConflict, match='version 2, not 1'):
+        transition(bill.id, 'payment', 'pending', expected_version=1, source='test')
+    assert transition(bill.id, 'payment', 'pending', expected_version=2, source='test').version == 3
+
+def test_idempotency_key_replays_without_a_second_change(app, make_bill):
+    from models import db
+    bill, other = make_bill(), make_bill()
+    first = transition(bill.id, 'payment', 'failed', idempotency_key='k1', source='test')
+    db.session.commit()
+    # The bill has moved on since; the key still answers with what it did
+    transition(bill.id, 'payment', 'pending', source='test')
+    db.session.commit()
+    replay = transition(bill.id, 'payment', 'failed', idempotency_key='k1', source='test')
+    assert replay == first._replace(replayed=True)
+    assert len(bill_history(bill.id)) == 2
+
+    with pytest.raises(IdempotencyKeyReused):
+        transition(other.id, 'payment', 'failed', idempotency_key='k1', source='test')
+    with pytest.raises(IdempotencyKeyReused):
+        transition(bill.id, 'claim', 'queued', idempotency_key='k1', source='test')
+
+def test_verify_payment_is_idempotent(client, make_bill):
+    bill = make_bill()
+    headers = {'Idempotency-Key': 'pay-1'}
+    response = client.post('/verify_payment', json={**PAYMENT, 'billId': bill.id}, headers=headers)
+    assert response.status_code == 200
+    assert 'Idempotent-Replayed' not in response.headers
+    assert response.get_json()['version'] == 2
+    assert confirmations() == 1
+
+    response = client.post('/verify_payment', json={**PAYMENT, 'billId': bill.id}, headers=headers)
+    assert response.status_code == 200
+    assert response.headers['Idempotent-Replayed'] == 'true'
+    assert response.get_json()['version'] == 2
+    assert confirmations() == 1
+
+    other = make_bill()
+    response = client.post('/verify_payment', json={**PAYMENT, 'billId': other.id}, headers=headers)
+    assert response.status_code == 422
+    response = client.post('/verify_payment', json={**PAYMENT, 'billId': bill.id},
+                           headers={'Idempotency-Key': 'x' * 101})
+    assert response.status_code == 400
+
+def test_verify_payment_if_match(client, make_bill):
+    bill = make_bill()
+    response = client.post('/verify_payment', json={**PAYMENT, 'billId': bill.id}, headers={'If-Match': 'W/"2"'})
+    assert response.status_code == 409
+    assert 'version 1, not 2' in response.get_json()['error']
+    assert confirmations() == 0
+    response = client.post('/verify_payment', json={**PAYMENT, 'billId': bill.id}, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert client.post('/verify_payment', json={**PAYMENT, 'billId': bill.id},
+                       headers={'If-Match': 'latest'}).status_code == 400
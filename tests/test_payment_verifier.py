@@ -0,0 +1,181 @@
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+import payment_verifier
+from payment_verifier import (
+    CHAIN_TOKENS, CONFIRMED, FAILED, PENDING, ExpectedPayment, JsonRpcChainProvider, verify_pending_payments
+)
+
+RECEIVING_ADDRESS = '0x' + '11' * 20
+OTHER_ADDRESS = '0x' + '22' * 20
+HEAD = 1000
+
+def tx_hash(n):
+    return f"0x{n:064x}"
+
+def eth_transfer(to, wei):
+    return {'to': to, 'value': hex(wei), 'input': '0x'}
+
+def token_transfer(currency, to, units):
+    data = payment_verifier.ERC20_TRANSFER_SELECTOR + to[2:].rjust(64, '0') + f"{units:064x}"
+    return {'to': CHAIN_TOKENS[currency].contract, 'value': '0x0', 'input': data}
+
+class FakeNode:
+    """Answers the provider's JSON-RPC batches from {tx_hash: (receipt, transaction)}"""
+
+    def __init__(self, transactions):
+        self.transactions = transactions
+
+    def __call__(self, name, method, url, json, timeout):
+        replies = []
+        for call in json:
+            if call['method'] == 'eth_blockNumber':
+                result = hex(HEAD)
+            else:
+                receipt, tx = self.transactions.get(call['params'][0], (None, None))
+                result = receipt if call['method'] == 'eth_getTransactionReceipt' else tx
+            replies.append({'jsonrpc': '2.0', 'id': call['id'], 'result': result})
+        return FakeResponse(replies)
+
+class FakeResponse:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.replies
+
+def mined(depth=20, status='0x1'):
+    return {'status': status, 'blockNumber': hex(HEAD - depth + 1)}
+
+@pytest.fixture
+def node(monkeypatch):
+    transactions = {}
+    monkeypatch.setattr(payment_verifier, 'timed_request', FakeNode(transactions))
+    return transactions
+
+@pytest.fixture
+def provider():
+    return JsonRpcChainProvider('http://node.invalid', RECEIVING_ADDRESS.upper().replace('0X', '0x'))
+
+def test_confirms_a_deep_enough_payment_to_us(node, provider):
+    node[tx_hash(1)] = (mined(), eth_transfer(RECEIVING_ADDRESS, 5 * 10 ** 17))
+    node[tx_hash(2)] = (mined(), token_transfer('USDC', RECEIVING_ADDRESS, 25_500_000))
+    node[tx_hash(3)] = (mined(depth=3), eth_transfer(RECEIVING_ADDRESS, 10 ** 18))
+    statuses = provider.check([
+        ExpectedPayment(tx_hash(1), 'ETH', Decimal('0.5')),
+        ExpectedPayment(tx_hash(2), 'USDC', Decimal('25.50')),
+        ExpectedPayment(tx_hash(3), 'ETH', Decimal('1')),
+        ExpectedPayment(tx_hash(4), 'ETH', Decimal('1')),
+    ])
+    assert statuses == {tx_hash(1): CONFIRMED, tx_hash(2): CONFIRMED, tx_hash(3): PENDING, tx_hash(4): PENDING}
+
+def test_rejects_payment_to_another_address(node, provider):
+    node[tx_hash(1)] = (mined(), eth_transfer(OTHER_ADDRESS, 10 ** 18))
+    node[tx_hash(2)] = (mined(), token_transfer('USDT', OTHER_ADDRESS, 10 ** 8))
+    statuses = provider.check([
+        ExpectedPayment(tx_hash(1), 'ETH', Decimal('1')),
+        ExpectedPayment(tx_hash(2), 'USDT', Decimal('100')),
+    ])
+    assert statuses == {tx_hash(1): FAILED, tx_hash(2): FAILED}
+
+def test_rejects_short_amount(node, provider):
+    node[tx_hash(1)] = (mined(), eth_transfer(RECEIVING_ADDRESS, 10 ** 18 - 1))
+    node[tx_hash(2)] = (mined(), token_transfer('USDC', RECEIVING_ADDRESS, 25_499_999))
+    statuses = provider.check([
+        ExpectedPayment(tx_hash(1), 'ETH', Decimal('1')),
+        ExpectedPayment(tx_hash(2), 'USDC', Decimal('25.50')),
+    ])
+    assert statuses == {tx_hash(1): FAILED, tx_hash(2): FAILED}
+
+def test_rejects_wrong_token_and_unverifiable_currency(node, provider):
+    # USDT sent for a USDC bill, and a BTC bill an EVM node cannot see
+    node[tx_hash(1)] = (mined(), token_transfer('USDT', RECEIVING_ADDRESS, 10 ** 8))
+    node[tx_hash(2)] = (mined(), eth_transfer(RECEIVING_ADDRESS, 10 ** 18))
+    statuses = provider.check([
+        ExpectedPayment(tx_hash(1), 'USDC', Decimal('100')),
+        ExpectedPayment(tx_hash(2), 'BTC', Decimal('0.01')),
+    ])
+    assert statuses == {tx_hash(1): FAILED, tx_hash(2): FAILED}
+
+def test_unrelated_transaction_does_not_settle_a_bill(app, node, provider, make_bill):
+    from models import db, Bill
+    bill = make_bill(payment_method='crypto', payment_currency='ETH', crypto_amount=Decimal('0.25'),
+                     transaction_hash=tx_hash(7))
+    node[tx_hash(7)] = (mined(), eth_transfer(OTHER_ADDRESS, 10 ** 18))
+    assert verify_pending_payments(provider)['failed'] == 1
+    assert db.session.get(Bill, bill.id).payment_status == 'failed'
+
+def test_transaction_hash_settles_only_one_bill(app, client, make_bill):
+    from models import db, Bill
+    first = make_bill(payment_method='crypto', payment_currency='ETH', transaction_hash=tx_hash(9))
+    second = make_bill()
+    payment = {'billId': second.id, 'paymentMethod': 'crypto', 'currency': 'ETH',
+               'transactionHash': tx_hash(9).upper().replace('0X', '0x'), 'cryptoAmount': '0.1'}
+
+    response = client.post('/verify_payment', json=payment)
+    assert response.status_code == 409
+    assert db.session.get(Bill, second.id).transaction_hash is None
+
+    # The database enforces it too, for writers that skip the check
+    with pytest.raises(IntegrityError):
+        db.session.execute(insert(Bill), {'patient_name': 'Bob', 'patient_dob': first.patient_dob,
+                                          'email': 'bob@example.com', 'transaction_hash': tx_hash(9)})
+    db.session.rollback()
+
+    # Once the first bill failed, its transaction hash may be used again
+    from payment_state import transition_many
+    transition_many([first.id], 'payment', 'pending', 'failed', source='test')
+    db.session.commit()
+    response = client.post('/verify_payment', json=payment)
+    assert response.status_code == 200
+    assert db.session.get(Bill, second.id).transaction_hash == tx_hash(9)
+
+def test_mock_provider_is_opt_in():
+    with pytest.raises(ValueError, match='PAYMENT_RPC_URL'):
+        payment_verifier.build_chain_provider({})
+    with pytest.raises(ValueError, match='PAYMENT_RECEIVING_ADDRESS'):
+        payment_verifier.build_chain_provider({'PAYMENT_RPC_URL': 'http://node.invalid'})
+    assert isinstance(payment_verifier.build_chain_provider({'PAYMENT_PROVIDER': 'mock'}),
+                      payment_verifier.MockChainProvider)
+    assert isinstance(payment_verifier.build_chain_provider({'TESTING': True}), payment_verifier.MockChainProvider)
+    assert isinstance(payment_verifier.build_chain_provider({
+        'PAYMENT_RPC_URL': 'http://node.invalid', 'PAYMENT_RECEIVING_ADDRESS': RECEIVING_ADDRESS
+    }), JsonRpcChainProvider)
+
+def test_verifier_refuses_to_start_unconfigured(app):
+    app.config.update(TESTING=False, PAYMENT_RPC_URL=None)
+    result = app.test_cli_runner().invoke(args=['verify-payments', '--once'])
+    assert result.exit_code != 0
+    assert 'PAYMENT_RPC_URL is not set' in result.output
+
+def test_archived_bill_keeps_its_transaction_spent(app, client, make_bill):
+    from datetime import datetime, timedelta
+    from sqlalchemy import update
+    from archive import archive_bills, backfill_transaction_hashes
+    from models import db, Bill, BillArchive
+    old = make_bill(payment_method='crypto', payment_currency='ETH', transaction_hash=tx_hash(11),
+                    created_at=datetime.utcnow() - timedelta(days=400))
+    from payment_state import transition
+    old_id = old.id
+    transition(old_id, 'payment', 'paid', source='test')
+    db.session.commit()
+    db.session.expunge_all()
+    assert sum(archived for _, _, archived in archive_bills(datetime.utcnow() - timedelta(days=365))) == 1
+    assert db.session.get(Bill, old_id) is None
+
+    new = make_bill()
+    payment = {'billId': new.id, 'paymentMethod': 'crypto', 'currency': 'ETH',
+               'transactionHash': tx_hash(11), 'cryptoAmount': '0.1'}
+    assert client.post('/verify_payment', json=payment).status_code == 409
+
+    # Bills archived before the column existed get their hash back from the payload
+    db.session.execute(update(BillArchive).values(transaction_hash=None))
+    db.session.commit()
+    assert backfill_transaction_hashes() == 1
+    assert client.post('/verify_payment', json=payment).status_code == 409
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+CREATED = datetime.utcnow() - timedelta(days=1)
+
+def pages(client, **params):
+    """Every page of /api/payments as a list of id lists"""
+    result, cursor = [], None
+    while True:
+        query = {**params, **({'cursor': cursor} if cursor else {})}
+        data = client.get('/api/payments', query_string=query).get_json()
+        result.append([payment['id'] for payment in data['payments']])
+        cursor = data['next_cursor']
+        if cursor is None:
+            return result
+
+def test_pages_walk_every_bill_once_newest_first(client, make_bill):
+    # Bills created in the same instant are ordered by id
+    bills = [make_bill(created_at=CREATED + timedelta(hours=n // 2)) for n in range(5)]
+    assert pages(client, limit=2) == [[bills[4].id, bills[3].id], [bills[2].id, bills[1].id], [bills[0].id]]
+    assert pages(client, limit=5) == [[bill.id for bill in reversed(bills)]]
+
+def test_cursor_is_stable_while_bills_are_added(client, make_bill):
+    bills = [make_bill(created_at=CREATED + timedelta(minutes=n)) for n in range(4)]
+    first = client.get('/api/payments', query_string={'limit': 2}).get_json()
+    make_bill()
+    rest = client.get('/api/payments', query_string={'limit': 2, 'cursor': first['next_cursor']}).get_json()
+    assert [p['id'] for p in first['payments'] + rest['payments']] == [bill.id for bill in reversed(bills)]
+    assert rest['next_cursor'] is None
+
+def test_filters_apply_before_paging(client, make_bill):
+    paid = [make_bill(payment_status='paid', payment_method='bank', created_at=CREATED + timedelta(minutes=n))
+            for n in range(3)]
+    make_bill(payment_status='pending', payment_method='bank')
+    make_bill(payment_status='paid', payment_method='crypto')
+    make_bill(payment_status='paid', payment_method='bank', created_at=datetime.utcnow() - timedelta(days=60))
+    assert pages(client, status='paid', method='bank', date='month', limit=2) == [
+        [paid[2].id, paid[1].id], [paid[0].id]]
+
+def test_bad_cursor_is_rejected(client, make_bill):
+    make_bill()
+    response = client.get('/api/payments', query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Invalid cursor')
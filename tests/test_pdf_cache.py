@@ -0,0 +1,73 @@
+import os
+import time
+from decimal import Decimal
+
+import pytest
+
+import app as billing_app
+from pdf_cache import PdfCache
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Bill ids rendered by the download route, in order"""
+    rendered = []
+    render = billing_app.render_bill_pdf
+
+    def counting_render(bill):
+        rendered.append(bill.id)
+        return render(bill)
+    monkeypatch.setattr(billing_app, 'render_bill_pdf', counting_render)
+    return rendered
+
+def download(client, bill_id, etag=None):
+    return client.get(f"/download_bill_pdf/{bill_id}", headers={'If-None-Match': f'"{etag}"'} if etag else {})
+
+def test_statement_is_rendered_once_per_content(client, make_bill, renders):
+    from models import db, Bill
+    from payment_state import transition
+    bill = make_bill(procedures=[('99213', Decimal('120.00'))])
+    first = download(client, bill.id)
+    assert first.status_code == 200 and first.data.startswith(b'%PDF')
+    etag = first.headers['ETag'].strip('"')
+    assert download(client, bill.id).headers['ETag'] == first.headers['ETag']
+    assert download(client, bill.id, etag).status_code == 304
+    assert renders == [bill.id]
+
+    # Not drawn on the statement: the cached file stays
+    transition(bill.id, 'payment', 'paid', source='test')
+    db.session.commit()
+    assert download(client, bill.id, etag).status_code == 304
+
+    # Rolled back: nothing changed
+    bill = db.session.get(Bill, bill.id)
+    bill.procedures[0].amount = Decimal('99.00')
+    db.session.flush()
+    db.session.rollback()
+    assert download(client, bill.id, etag).status_code == 304
+
+    bill = db.session.get(Bill, bill.id)
+    bill.patient_name = 'Ada King'
+    db.session.commit()
+    response = download(client, bill.id, etag)
+    assert response.status_code == 200 and response.headers['ETag'] != f'"{etag}"'
+    assert renders == [bill.id, bill.id]
+    assert len(os.listdir(client.application.config['PDF_CACHE_DIR'])) == 1
+
+def test_missing_bill_is_404(client):
+    assert download(client, 999).status_code == 404
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = PdfCache(str(tmp_path), max_bytes=300)
+    for bill_id in (1, 2, 3):
+        cache.put(bill_id, 'k', b'x' * 100)
+        time.sleep(0.01)
+    assert cache.get(1, 'k') is not None  # now the most recently used
+    time.sleep(0.01)
+    cache.put(4, 'k', b'x' * 100)
+    # Shrunk to 90% of max_bytes, oldest first
+    assert [cache.get(bill_id, 'k') is not None for bill_id in (1, 2, 3, 4)] == [True, False, False, True]
+    assert cache._size == 200
+
+    # A new version of a bill replaces the old one
+    cache.put(4, 'k2', b'y' * 50)
+    assert cache.get(4, 'k') is None and cache._size == 150
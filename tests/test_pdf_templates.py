@@ -0,0 +1,66 @@
+import io
+import json
+from decimal import Decimal
+
+import pytest
+from pypdf import PdfReader
+
+import pdf_templates
+from pdf_cache import bill_content_key
+from pdf_generator import render_bill_pdf
+from pdf_templates import build_template, load_template, use_template
+
+CLINIC = {
+    'page': {'size': 'A4'},
+    'brand': {'name': 'Lakeside Clinic', 'subtitle': 'Patient Statement'},
+    'sections': {'procedures': 'Services'},
+    'patient_fields': [{'label': 'Patient', 'field': 'patient_name'}, {'label': 'Plan', 'field': 'insurance_provider',
+                                                                        'default': 'Uninsured'}],
+    'totals': {'total': 'Balance Due'},
+}
+
+@pytest.fixture
+def clinic_template(tmp_path):
+    """CLINIC loaded from a file and made active; the default is restored afterwards"""
+    path = tmp_path / 'template.json'
+    path.write_text(json.dumps(CLINIC))
+    previous = pdf_templates.active_template()[0]
+    use_template(load_template(path))
+    yield
+    use_template(previous)
+
+def statement_text(bill):
+    reader = PdfReader(io.BytesIO(render_bill_pdf(bill)))
+    return reader, '\n'.join(page.extract_text() for page in reader.pages)
+
+def test_overrides_merge_into_the_default():
+    template = build_template(CLINIC)
+    assert template['brand']['logo_width'] == 72
+    assert template['totals']['diagnoses'] == 'Diagnoses Subtotal'
+    assert template['patient_fields'] == CLINIC['patient_fields']
+
+@pytest.mark.parametrize('overrides, message', [
+    ({'brand': {'colour': 'red'}}, 'brand.colour'),
+    ({'page': {'size': 'legal'}}, 'page.size'),
+    ({'patient_fields': [{'label': 'SSN', 'field': 'ssn'}]}, 'patient_fields'),
+    ({'columns': {'widths': [100, 200]}}, 'three widths'),
+])
+def test_invalid_templates_are_rejected(overrides, message):
+    with pytest.raises(ValueError, match=message):
+        build_template(overrides)
+
+def test_statement_is_drawn_from_the_active_template(app, make_bill, clinic_template):
+    bill = make_bill(procedures=[('99213', Decimal('120.00'))], policy_number='W123456789')
+    reader, text = statement_text(bill)
+    assert round(float(reader.pages[0].mediabox.width)) == 595  # A4
+    for printed in ('Lakeside Clinic', 'Patient Statement', 'Services', 'Patient: Ada Lovelace',
+                    'Plan: Uninsured', 'Balance Due'):
+        assert printed in text
+    assert 'Healthcare Billing Report' not in text
+    assert 'W123456789' not in text
+
+def test_template_is_part_of_the_cache_key(app, make_bill, clinic_template):
+    bill = make_bill(procedures=[('99213', Decimal('120.00'))])
+    clinic_key = bill_content_key(bill)
+    use_template(build_template())
+    assert bill_content_key(bill) != clinic_key
@@ -0,0 +1,52 @@
+"""Each bill view runs a fixed number of queries, however many line items the bills have"""
+from decimal import Decimal
+
+import pytest
+
+from models import assert_max_queries, db
+
+LIST_QUERIES = 1
+DETAIL_QUERIES = 4  # bill, then diagnoses, procedures and claims in one SELECT each
+PDF_QUERIES = 3  # bill, diagnoses, procedures
+
+@pytest.fixture(params=[1, 10, 100])
+def bills(request, make_bill):
+    items = request.param
+    made = [make_bill(diagnoses=[(f"Z{i:02d}.{n % 10}", Decimal('12.50')) for n in range(items)],
+                      procedures=[(f"{99000 + n}", Decimal('80.00')) for n in range(items)])
+            for i in range(5)]
+    ids = [bill.id for bill in made]
+    # Nothing may come from the identity map
+    db.session.expunge_all()
+    return ids, items
+
+def test_dashboard_list_budget(client, bills):
+    ids, _ = bills
+    with assert_max_queries(LIST_QUERIES):
+        response = client.get('/api/payments?limit=50')
+    assert response.status_code == 200
+    assert sorted(payment['id'] for payment in response.get_json()['payments']) == sorted(ids)
+
+def test_bill_detail_budget(client, bills):
+    ids, items = bills
+    with assert_max_queries(DETAIL_QUERIES):
+        response = client.get(f"/api/bills/{ids[0]}")
+    assert response.status_code == 200
+    bill = response.get_json()['bill']
+    assert len(bill['procedures']) == items and len(bill['diagnoses']) == items
+
+def test_pdf_budget(client, bills):
+    ids, _ = bills
+    with assert_max_queries(PDF_QUERIES):
+        response = client.get(f"/download_bill_pdf/{ids[0]}")
+    assert response.status_code == 200
+    assert response.data.startswith(b'%PDF')
+
+def test_pdf_profile_refuses_to_lazy_load_claims(app, make_bill):
+    from sqlalchemy.exc import InvalidRequestError
+    from models import Bill, bill_query
+    bill_id = make_bill().id
+    db.session.expunge_all()
+    bill = bill_query('pdf').filter(Bill.id == bill_id).one()
+    with pytest.raises(InvalidRequestError):
+        bill.claims
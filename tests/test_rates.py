@@ -0,0 +1,63 @@
+import pytest
+
+import rates
+from rates import STATIC_CRYPTO_PRICES, RateRefresher, get_live_crypto_prices
+
+@pytest.fixture
+def coinbase(monkeypatch):
+    """Coinbase answering for the symbols in the returned dict, failing for the rest"""
+    monkeypatch.setenv('COINBASE_COMMERCE_API_KEY', 'test-key')
+    live = {}
+    monkeypatch.setattr(rates, 'fetch_crypto_price', lambda symbol, headers: live.get(symbol))
+    return live
+
+def test_only_live_prices_are_returned(coinbase):
+    assert get_live_crypto_prices() is None
+    coinbase['ETH'] = 2500.0
+    assert get_live_crypto_prices() == {'ETH': 2500.0}
+
+def test_partial_prices_are_not_reported_live(coinbase):
+    refresher = RateRefresher('crypto-prices', get_live_crypto_prices, STATIC_CRYPTO_PRICES)
+    coinbase['ETH'] = 2500.0
+    assert refresher.refresh()
+    snapshot = refresher._snapshot
+    assert snapshot.values == {**STATIC_CRYPTO_PRICES, 'ETH': 2500.0}
+    assert not snapshot.is_live
+    assert snapshot.liveness() == {'BTC': False, 'ETH': True, 'USDT': False, 'USDC': False}
+
+    coinbase.update(BTC=60000.0, USDT=1.0, USDC=1.0)
+    refresher.refresh()
+    assert refresher._snapshot.is_live
+
+def test_price_response_reports_liveness_per_symbol(app, client, coinbase):
+    refresher = app.extensions['billing']['crypto_price_refresher']
+    refresher.fetch = get_live_crypto_prices
+    coinbase.update(BTC=60000.0, ETH=2500.0)
+    refresher.refresh()
+    try:
+        data = client.get('/get_crypto_prices').get_json()
+    finally:
+        refresher.stop()
+    assert data['is_live'] is False
+    assert data['live'] == {'BTC': True, 'ETH': True, 'USDT': False, 'USDC': False}
+    assert data['prices']['USDT'] == STATIC_CRYPTO_PRICES['USDT']
+
+def test_fallback_has_no_fetch_time(app, client):
+    refresher = app.extensions['billing']['exchange_rate_refresher']
+    refresher.fetch = lambda: None
+    try:
+        data = client.get('/get_exchange_rates').get_json()
+    finally:
+        refresher.stop()
+    assert data['is_live'] is False
+    assert data['timestamp'] is None and data['age'] is None
+    assert not any(data['live'].values())
+
+def test_expired_snapshot_falls_back_without_an_age():
+    refresher = RateRefresher('test-rates', lambda: {'EUR': 0.9}, {'EUR': 0.85, 'USD': 1.0}, expire_after=0)
+    refresher.start = lambda: None
+    assert refresher.refresh()
+    assert refresher._snapshot.age is not None
+    snapshot = refresher.current()
+    assert snapshot.values == {'EUR': 0.85, 'USD': 1.0}
+    assert snapshot.fetched_at is None and snapshot.age is None
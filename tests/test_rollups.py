@@ -0,0 +1,42 @@
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import delete
+
+def add_claims(bill, payer_id, payer_name, statuses):
+    from models import db, InsuranceClaim
+    for status in statuses:
+        db.session.add(InsuranceClaim(
+            bill_id=bill.id, payer_id=payer_id, payer_name=payer_name, subscriber_id='W1',
+            subscriber_name=bill.patient_name, subscriber_dob=bill.patient_dob, relationship_to_subscriber='self',
+            date_of_service=date.today(), place_of_service='11', status=status
+        ))
+    db.session.commit()
+
+def test_summary_reports_claim_acceptance_per_payer(client, make_bill):
+    bill = make_bill(procedures=[('99213', Decimal('120.00'))])
+    make_bill(procedures=[('99214', Decimal('80.50'))])
+    add_claims(bill, '60054', 'Aetna', ['submitted', 'submitted', 'submitted', 'rejected', 'queued'])
+    add_claims(bill, '87726', 'UnitedHealthcare', ['queued'])
+
+    summary = client.get('/api/dashboard/summary').get_json()
+    assert summary['bills'] == 2
+    assert summary['billed'] == '200.50'
+    payers = {payer['payer_id']: payer for payer in summary['claims_by_payer']}
+    assert (payers['60054']['accepted'], payers['60054']['rejected'], payers['60054']['open']) == (3, 1, 1)
+    assert payers['60054']['acceptance_rate'] == 0.75
+    # Nothing decided yet: no rate rather than 0%
+    assert payers['87726']['acceptance_rate'] is None
+
+def test_rebuild_matches_maintained_rollups(client, make_bill):
+    from models import db, DailyBillRollup, DailyClaimRollup
+    from rollups import rebuild_rollups
+    bill = make_bill(procedures=[('99213', Decimal('120.00'))])
+    add_claims(bill, '60054', 'Aetna', ['submitted', 'rejected'])
+    maintained = client.get('/api/dashboard/summary').get_json()
+
+    db.session.execute(delete(DailyBillRollup))
+    db.session.execute(delete(DailyClaimRollup))
+    db.session.commit()
+    assert sum(rows for _, _, rows in rebuild_rollups()) > 0
+    assert client.get('/api/dashboard/summary').get_json() == maintained
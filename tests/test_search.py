@@ -0,0 +1,65 @@
+from datetime import date
+
+import search
+from search import NameIndex, parse_search_query, search_bills, within_edits
+
+DOB = date(1980, 1, 1)
+
+def test_parses_query_parts():
+    assert parse_search_query('Lovelace 01/01/1980') == (['lovelace'], DOB, None)
+    assert parse_search_query('W123456789') == ([], None, 'W123456789')
+    assert parse_search_query('José  Núñez') == (['jose', 'nunez'], None, None)
+
+def test_edit_distance_counts_transpositions():
+    assert within_edits('lovelace', 'lovelcae', 1)
+    assert not within_edits('lovelace', 'lovelcea', 1)
+    assert within_edits('ada', 'ada', 0)
+
+def test_names_match_exactly_by_prefix_and_approximately(app, make_bill):
+    ada = make_bill(patient_name='Ada Lovelace')
+    adam = make_bill(patient_name='Adam Smith')
+    grace = make_bill(patient_name='Grace Hopper')
+    index = NameIndex()
+    assert [(r.bill.id, r.matched) for r in search_bills('ada', index)] == [(ada.id, 'name'), (adam.id, 'name_prefix')]
+    assert [(r.bill.id, r.matched) for r in search_bills('hoper', index)] == [(grace.id, 'name_fuzzy')]
+    # Written after the index was built: picked up by the next catch-up
+    later = make_bill(patient_name='Ada Byron')
+    index._synced_at = 0
+    assert [r.bill.id for r in search_bills('ada', index)] == [later.id, ada.id, adam.id]
+
+def test_warm_builds_the_index_off_the_request_path(app, make_bill):
+    make_bill(patient_name='Ada Lovelace')
+    index = NameIndex()
+    index.warm(app).join()
+    assert index.bill_count == 1 and len(index) == 2
+
+def test_identifier_lookup_checks_every_number(app, make_bill):
+    bill = make_bill(policy_number='W123456789', transaction_hash='0x' + 'ab' * 32)
+    [result] = search_bills('W123456789')
+    assert (result.bill.id, result.matched) == (bill.id, 'policy_number')
+    [result] = search_bills('0x' + 'AB' * 32)
+    assert result.matched == 'transaction_hash'
+
+def test_dob_search_is_limited(app, make_bill, monkeypatch):
+    bills = [make_bill(patient_name=f"Patient {n}") for n in range(5)]
+    make_bill(patient_name='Ada Lovelace', patient_dob=date(1990, 5, 12))
+    assert [r.bill.id for r in search_bills('1980-01-01', limit=3)] == [b.id for b in reversed(bills)][:3]
+
+    ada = make_bill(patient_name='Ada Lovelace')
+    [result] = search_bills('ada 1980-01-01', limit=3)
+    assert (result.bill.id, result.matched) == (ada.id, 'name')
+    # Only the newest candidates are ranked against the name
+    monkeypatch.setattr(search, 'DOB_CANDIDATE_LIMIT', 2)
+    assert [r.bill.id for r in search_bills('patient 1980-01-01')] == [bills[-1].id]
+
+def test_search_endpoint(client, make_bill):
+    ada = make_bill(patient_name='Ada Lovelace', policy_number='W123456789')
+    make_bill(patient_name='Grace Hopper')
+    data = client.get('/api/search', query_string={'q': 'lovelace'}).get_json()
+    assert [(r['id'], r['matched'], r['patient_dob']) for r in data['results']] == [(ada.id, 'name', '1980-01-01')]
+    data = client.get('/api/search', query_string={'q': 'W123456789'}).get_json()
+    assert [(r['id'], r['matched'], r['policy_number']) for r in data['results']] == [
+        (ada.id, 'policy_number', 'W123456789')]
+    # The limit is clamped rather than rejected
+    assert len(client.get('/api/search', query_string={'q': '01/01/1980', 'limit': 0}).get_json()['results']) == 1
+    assert client.get('/api/search').get_json() == {'success': True, 'results': []}
@@ -0,0 +1,87 @@
+import threading
+
+import fakeredis
+import pytest
+
+import shared_backends
+from shared_backends import RedisStore, SQLiteStore, SharedStoreCache, SlidingWindowLimiter
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteStore(str(tmp_path / 'shared.db'))
+    return RedisStore(client=fakeredis.FakeRedis())
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(6000.0)
+    monkeypatch.setattr(shared_backends, 'time', clock)
+    return clock
+
+def test_limiter_slides_across_windows(store, clock):
+    limiter = SlidingWindowLimiter(store, limit=3, window=60)
+    assert [limiter.hit('1.2.3.4')[0] for _ in range(3)] == [True] * 3
+    assert limiter.hit('1.2.3.4') == (False, 60)
+    assert limiter.hit('5.6.7.8') == (True, 0)
+
+    # Half-way through the next window the 4 earlier hits still weigh 2
+    clock.now += 90
+    assert limiter.hit('1.2.3.4') == (True, 0)
+    assert limiter.hit('1.2.3.4') == (False, 30)
+
+    # Two windows on, the old counts no longer matter
+    clock.now += 60
+    assert limiter.hit('1.2.3.4') == (True, 0)
+
+def test_cache_clear_only_touches_its_prefix(store, clock):
+    limiter = SlidingWindowLimiter(store, limit=2, window=60)
+    pages = SharedStoreCache(store, key_prefix='pages:')
+    rates = SharedStoreCache(store, key_prefix='rates:')
+    # Glob characters in a prefix match themselves only
+    starred = SharedStoreCache(store, key_prefix='r*:')
+    pages.set('home', b'<html>')
+    rates.set('USD', 1)
+    starred.set('x', 2)
+    limiter.hit('1.2.3.4')
+    limiter.hit('1.2.3.4')
+
+    starred.clear()
+    pages.clear()
+    assert not pages.has('home') and not starred.has('x')
+    assert rates.get('USD') == 1
+    # Clearing a cache does not reset anyone's rate limit
+    assert limiter.hit('1.2.3.4')[0] is False
+
+def test_redis_clear_keeps_other_keys_in_the_database():
+    client = fakeredis.FakeRedis()
+    client.set('sessions:abc', 'keep')
+    cache = SharedStoreCache(RedisStore(client=client), key_prefix='cache:')
+    for i in range(1200):
+        cache.set(f"item{i}", i)
+    assert cache.clear()
+    assert client.keys('cache:*') == []
+    assert client.get('sessions:abc') == b'keep'
+
+def test_sqlite_store_shares_one_connection_across_threads(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'shared.db'))
+    connections = set()
+
+    def work():
+        for _ in range(50):
+            store.incr_and_get('hits', 60, 'other')
+            connections.add(id(store._conn))
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(connections) == 1
+    assert store.incr_and_get('hits', 60, 'other') == (401, 0)
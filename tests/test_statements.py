@@ -0,0 +1,63 @@
+import io
+import zipfile
+from decimal import Decimal
+
+import pytest
+
+from pdf_generator import format_money
+
+def test_money_is_rounded_as_decimal():
+    assert format_money(Decimal('2.675')) == '$2.68'
+    assert format_money(Decimal('1234567.005')) == '$1234567.01'
+    assert format_money(Decimal('1E+2')) == '$100.00'
+    assert format_money(None) == '$0.00'
+
+@pytest.fixture
+def statement_pool(app):
+    pool = app.extensions['billing']['statement_pool']
+    yield pool
+    pool.shutdown()
+
+def test_statements_zip_renders_on_the_shared_pool(client, make_bill, statement_pool):
+    bills = [make_bill(procedures=[('99213', Decimal('120.005'))]) for _ in range(3)]
+    executors = set()
+    for _ in range(2):
+        response = client.get('/api/statements.zip')
+        assert response.status_code == 200
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        assert sorted(archive.namelist()) == sorted(f"bill_{bill.id}.pdf" for bill in bills)
+        response.close()
+        executors.add(id(statement_pool.executor()))
+    # Both downloads ran on one pool, which is free again
+    assert len(executors) == 1
+    assert statement_pool.try_acquire()
+    statement_pool.release()
+
+def test_statements_zip_refuses_when_busy(client, statement_pool):
+    assert statement_pool.try_acquire()
+    try:
+        response = client.get('/api/statements.zip')
+        assert response.status_code == 503
+        assert response.headers['Retry-After']
+    finally:
+        statement_pool.release()
+
+def test_merged_statements_are_capped(app, make_bill, tmp_path):
+    from pypdf import PdfReader
+    from pdf_batch import write_merged_statements
+    bills = [make_bill(procedures=[('99213', Decimal('120.00'))]) for _ in range(2)]
+    path = tmp_path / 'statements.pdf'
+    write_merged_statements([bill.id for bill in bills], str(path), workers=1)
+    assert len(PdfReader(str(path)).pages) >= 2
+
+    with pytest.raises(ValueError, match='use the zip format'):
+        write_merged_statements([bill.id for bill in bills], str(path), workers=1, max_bills=1)
+
+def test_shared_pool_spawns_under_gevent(client, make_bill, statement_pool, monkeypatch):
+    import pdf_batch
+    monkeypatch.setattr(pdf_batch, '_gevent_patched', lambda: True)
+    bill = make_bill(procedures=[('99213', Decimal('120.00'))])
+    response = client.get('/api/statements.zip')
+    assert response.status_code == 200
+    assert zipfile.ZipFile(io.BytesIO(response.data)).namelist() == [f"bill_{bill.id}.pdf"]
+    assert statement_pool.executor()._mp_context.get_start_method() == 'spawn'
@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+from sqlalchemy import select
+
+def stored_totals(bill_id):
+    from models import db, Bill
+    return db.session.execute(
+        select(Bill.diagnoses_subtotal, Bill.procedures_subtotal, Bill.total_amount).where(Bill.id == bill_id)
+    ).one()
+
+def rollup_total(bill):
+    from models import db, DailyBillRollup
+    return db.session.scalar(select(DailyBillRollup.total_amount).where(
+        DailyBillRollup.day == bill.created_at.date(), DailyBillRollup.payment_status == 'pending'))
+
+def test_line_items_maintain_totals(app, make_bill):
+    from models import db, Procedure
+    bill = make_bill(diagnoses=[('E11.9', 40)], procedures=[('99213', 120), ('80053', 35)])
+    assert stored_totals(bill.id) == (Decimal('40.00'), Decimal('155.00'), Decimal('195.00'))
+
+    bill.procedures[0].amount = Decimal('100')
+    bill.procedures.append(Procedure(cpt_code='36415', description='Venipuncture', amount=Decimal('5')))
+    db.session.commit()
+    assert stored_totals(bill.id) == (Decimal('40.00'), Decimal('140.00'), Decimal('180.00'))
+    assert rollup_total(bill) == Decimal('180.00')
+
+    db.session.delete(bill.diagnoses[0])
+    db.session.commit()
+    assert stored_totals(bill.id) == (Decimal('0.00'), Decimal('140.00'), Decimal('140.00'))
+    assert rollup_total(bill) == Decimal('140.00')
+
+def test_orphaned_line_items_leave_totals(app, make_bill):
+    # delete-orphan: removed from the collection, deleted by the flush without session.delete()
+    from models import db
+    bill = make_bill(diagnoses=[('E11.9', 40), ('I10', 25)], procedures=[('99213', 120), ('80053', 35)])
+    assert rollup_total(bill) == Decimal('220.00')
+
+    bill.procedures.remove(bill.procedures[1])
+    del bill.diagnoses[0]
+    db.session.commit()
+    assert stored_totals(bill.id) == (Decimal('25.00'), Decimal('120.00'), Decimal('145.00'))
+    assert bill.total_amount == Decimal('145.00')
+    assert rollup_total(bill) == Decimal('145.00')
+
+    bill.procedures = []
+    db.session.commit()
+    assert stored_totals(bill.id) == (Decimal('25.00'), Decimal('0.00'), Decimal('25.00'))
+    assert rollup_total(bill) == Decimal('25.00')
@@ -0,0 +1,201 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from sqlalchemy import event, func, select, update, inspect
+from sqlalchemy.orm import Session
+from models import db, Bill, Diagnosis, Procedure
+
+logger = logging.getLogger(__name__)
+
+# Bills per transaction in the bulk recompute job
+RECOMPUTE_CHUNK_SIZE = 10000
+
+SUBTOTAL_COLUMNS = {
+    Diagnosis: 'diagnoses_subtotal',
+    Procedure: 'procedures_subtotal',
+}
+TOTAL_ATTRIBUTES = ['diagnoses_subtotal', 'procedures_subtotal', 'total_amount']
+ZERO = Decimal('0.00')
+
+def _amount_delta(state):
+    """Return the change in a line item's amount, or None if it cannot be known"""
+    history = state.attrs.amount.history
+    if not history.has_changes():
+        return ZERO
+    if not history.deleted and state.persistent:
+        return None  # old value was never loaded
+    added = history.added[0] if history.added else ZERO
+    removed = history.deleted[0] if history.deleted else ZERO
+    return Decimal(added or 0) - Decimal(removed or 0)
+
+def _collect_deltas(session):
+    """Per-bill subtotal deltas for the line items being flushed.
+
+    Returns ({(bill_id, column): delta}, {bill_ids needing a full recompute}).
+    """
+    deltas = defaultdict(lambda: ZERO)
+    recompute = set()
+
+    for obj in session.new:
+        column = SUBTOTAL_COLUMNS.get(type(obj))
+        if column:
+            deltas[(obj.bill_id, column)] += Decimal(obj.amount or 0)
+
+    # Deleted rows, orphans included, are recorded by _record_line_item_deletion()
+    for (bill_id, column), amount in session.info.pop('line_items_deleted', {}).items():
+        deltas[(bill_id, column)] -= amount
+
+    for obj in session.dirty:
+        column = SUBTOTAL_COLUMNS.get(type(obj))
+        if not column or not session.is_modified(obj):
+            continue
+        state = inspect(obj)
+        bill_history = state.attrs.bill_id.history
+        if bill_history.has_changes():
+            recompute.update(bill_id for bill_id in bill_history.sum() if bill_id is not None)
+            continue
+        delta = _amount_delta(state)
+        if delta is None:
+            recompute.add(obj.bill_id)
+        elif delta:
+            deltas[(obj.bill_id, column)] += delta
+
+    return deltas, recompute
+
+def _record_line_item_deletion(mapper, connection, target):
+    """Note a deleted line item's amount for the flush's after_flush totals update.
+
+    A mapper event rather than session.deleted, which misses rows the flush
+    deletes as delete-orphans (bill.procedures.remove(p), del bill.diagnoses[i]).
+    """
+    state = inspect(target)
+    bill_history = state.attrs.bill_id.history
+    bill_id = bill_history.deleted[0] if bill_history.deleted else target.bill_id
+    amount_history = state.attrs.amount.history
+    amount = amount_history.deleted[0] if amount_history.deleted else target.amount
+    deleted = state.session.info.setdefault('line_items_deleted', defaultdict(lambda: ZERO))
+    deleted[(bill_id, SUBTOTAL_COLUMNS[type(target)])] += Decimal(amount or 0)
+
+def _apply_deltas(connection, deltas):
+    for (bill_id, column), delta in deltas.items():
+        if bill_id is None or not delta:
+            continue
+        connection.execute(
+            update(Bill.__table__)
+            .where(Bill.__table__.c.id == bill_id)
+            .values({
+                column: Bill.__table__.c[column] + delta,
+                'total_amount': Bill.__table__.c.total_amount + delta,
+            })
+        )
+
+_totals_registered = False
+
+def register_total_maintenance():
+    """Keep Bill subtotals and total_amount in step with ORM changes to line items.
+
+    Inserts, deletes and amount edits of Diagnosis/Procedure rows are turned
+    into ``col = col + delta`` UPDATEs in the same transaction, so no read of
+    the children is needed. Core/bulk statements bypass this; run
+    recompute_bill_totals() for the affected bills afterwards. Listeners are
+    attached once per process, however many apps call this.
+    """
+    global _totals_registered
+    if _totals_registered:
+        return
+    _totals_registered = True
+
+    for line_item in SUBTOTAL_COLUMNS:
+        event.listen(line_item, 'after_delete', _record_line_item_deletion)
+
+    @event.listens_for(Session, 'before_flush')
+    def reset_deletions(session, flush_context, instances):
+        # Left over from a flush that failed before after_flush
+        session.info.pop('line_items_deleted', None)
+
+    @event.listens_for(Session, 'after_flush')
+    def maintain_totals(session, flush_context):
+        deltas, recompute = _collect_deltas(session)
+        if not deltas and not recompute:
+            return
+        connection = session.connection()
+        _apply_deltas(connection, deltas)
+        for bill_id in recompute:
+            recompute_bill_totals_for(connection, [bill_id])
+        session.info.setdefault('totals_changed', set()).update(
+            {bill_id for bill_id, _ in deltas} | recompute
+        )
+
+    @event.listens_for(Session, 'after_flush_postexec')
+    def expire_stale_totals(session, flush_context):
+        changed = session.info.pop('totals_changed', None)
+        if not changed:
+            return
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, Bill) and obj.id in changed:
+                session.expire(obj, TOTAL_ATTRIBUTES)
+
+def _totals_select(id_filter):
+    """SELECT bill_id, diagnoses subtotal, procedures subtotal via SUM ... GROUP BY bill_id"""
+    diagnoses = (
+        select(Diagnosis.bill_id, func.sum(Diagnosis.amount).label('subtotal'))
+        .where(id_filter(Diagnosis.bill_id))
+        .group_by(Diagnosis.bill_id)
+        .subquery()
+    )
+    procedures = (
+        select(Procedure.bill_id, func.sum(Procedure.amount).label('subtotal'))
+        .where(id_filter(Procedure.bill_id))
+        .group_by(Procedure.bill_id)
+        .subquery()
+    )
+    bills = Bill.__table__.alias('totals_bill')
+    return (
+        select(
+            bills.c.id.label('bill_id'),
+            func.coalesce(diagnoses.c.subtotal, 0).label('diagnoses_subtotal'),
+            func.coalesce(procedures.c.subtotal, 0).label('procedures_subtotal'),
+        )
+        .select_from(bills)
+        .outerjoin(diagnoses, diagnoses.c.bill_id == bills.c.id)
+        .outerjoin(procedures, procedures.c.bill_id == bills.c.id)
+        .where(id_filter(bills.c.id))
+        .subquery()
+    )
+
+def _update_from_totals(connection, id_filter):
+    totals = _totals_select(id_filter)
+    table = Bill.__table__
+    result = connection.execute(
+        update(table)
+        .where(table.c.id == totals.c.bill_id)
+        .values(
+            diagnoses_subtotal=totals.c.diagnoses_subtotal,
+            procedures_subtotal=totals.c.procedures_subtotal,
+            total_amount=totals.c.diagnoses_subtotal + totals.c.procedures_subtotal,
+        )
+    )
+    return result.rowcount
+
+def recompute_bill_totals_for(connection, bill_ids):
+    """Recompute stored totals for specific bills with one set-based UPDATE"""
+    bill_ids = list(bill_ids)
+    return _update_from_totals(connection, lambda column: column.in_(bill_ids))
+
+def recompute_bill_totals(chunk_size=RECOMPUTE_CHUNK_SIZE, start_id=None):
+    """Repair job: recompute every bill's stored totals in id-range chunks.
+
+    Each chunk is one ``UPDATE ... FROM (SELECT ... SUM ... GROUP BY bill_id)``
+    committed on its own, so the job can be stopped and resumed from the
+    last reported id. Yields (last_id, rows_updated) after each chunk.
+    """
+    lo = start_id if start_id is not None else db.session.query(func.min(Bill.id)).scalar()
+    max_id = db.session.query(func.max(Bill.id)).scalar()
+    if lo is None or max_id is None:
+        return
+    while lo <= max_id:
+        hi = lo + chunk_size - 1
+        updated = _update_from_totals(db.session.connection(), lambda column: column.between(lo, hi))
+        db.session.commit()
+        yield hi, updated
+        lo = hi + 1
@@ -0,0 +1,135 @@
+import os
+import re
+from datetime import datetime
+
+# Submitter, receiver and billing provider identity used in every interchange
+X12_USAGE = os.environ.get('X12_USAGE', 'T')  # 'T' test or 'P' production
+SUBMITTER_ID = os.environ.get('X12_SUBMITTER_ID', 'BILLINGDOG')
+SUBMITTER_NAME = os.environ.get('X12_SUBMITTER_NAME', 'BILLINGDOG')
+SUBMITTER_PHONE = os.environ.get('X12_SUBMITTER_PHONE', '0000000000')
+RECEIVER_ID = os.environ.get('X12_RECEIVER_ID', 'CLEARINGHOUSE')
+RECEIVER_NAME = os.environ.get('X12_RECEIVER_NAME', 'CLEARINGHOUSE')
+PROVIDER_NAME = os.environ.get('BILLING_PROVIDER_NAME', 'BILLINGDOG MEDICAL')
+PROVIDER_NPI = os.environ.get('BILLING_PROVIDER_NPI', '0000000000')
+PROVIDER_TAX_ID = os.environ.get('BILLING_PROVIDER_TAX_ID', '000000000')
+PROVIDER_ADDRESS = os.environ.get('BILLING_PROVIDER_ADDRESS', '1 MAIN ST')
+PROVIDER_CITY = os.environ.get('BILLING_PROVIDER_CITY', 'ANYTOWN')
+PROVIDER_STATE = os.environ.get('BILLING_PROVIDER_STATE', 'CA')
+PROVIDER_ZIP = os.environ.get('BILLING_PROVIDER_ZIP', '900010000')
+
+IMPLEMENTATION = '005010X222A1'
+SEGMENT_TERMINATOR = '~'
+ELEMENT_SEPARATOR = '*'
+COMPONENT_SEPARATOR = ':'
+# The HI segment carries at most 12 diagnosis codes
+MAX_DIAGNOSES = 12
+RELATIONSHIP_CODES = {'spouse': '01', 'child': '19', 'other': 'G8'}
+
+_DELIMITERS = re.compile(r'[*~:^\r\n]')
+
+def clean(value):
+    """Upper-case a data element and strip anything that would be read as a delimiter"""
+    return _DELIMITERS.sub(' ', str(value or '')).strip().upper()
+
+def split_name(full_name):
+    """Split "First Middle Last" into (last, first) for NM1 segments"""
+    parts = clean(full_name).split()
+    if not parts:
+        return '', ''
+    if len(parts) == 1:
+        return parts[0], ''
+    return parts[-1], ' '.join(parts[:-1])
+
+def _segment(*elements):
+    return ELEMENT_SEPARATOR.join(str(e) for e in elements).rstrip(ELEMENT_SEPARATOR) + SEGMENT_TERMINATOR
+
+def _amount(value):
+    return f"{value:.2f}".rstrip('0').rstrip('.') if value else '0'
+
+def _claim_segments(claim, hl_number):
+    """Subscriber (and patient) loops plus the claim and its service lines"""
+    bill = claim.bill
+    is_self = claim.relationship_to_subscriber == 'self'
+    sub_last, sub_first = split_name(claim.subscriber_name)
+    segments = [
+        _segment('HL', hl_number, 1, 22, 0 if is_self else 1),
+        _segment('SBR', 'P', '18' if is_self else '', '', '', '', '', '', '', 'CI'),
+        _segment('NM1', 'IL', 1, sub_last, sub_first, '', '', '', 'MI', clean(claim.subscriber_id)),
+        _segment('DMG', 'D8', claim.subscriber_dob.strftime('%Y%m%d'), 'U'),
+        _segment('NM1', 'PR', 2, clean(claim.payer_name), '', '', '', '', 'PI', clean(claim.payer_id)),
+    ]
+    next_hl = hl_number + 1
+    if not is_self:
+        pat_last, pat_first = split_name(bill.patient_name)
+        segments += [
+            _segment('HL', next_hl, hl_number, 23, 0),
+            _segment('PAT', RELATIONSHIP_CODES[claim.relationship_to_subscriber]),
+            _segment('NM1', 'QC', 1, pat_last, pat_first),
+            _segment('DMG', 'D8', bill.patient_dob.strftime('%Y%m%d'), 'U'),
+        ]
+        next_hl += 1
+
+    charges = sum(p.amount for p in bill.procedures)
+    segments.append(_segment(
+        'CLM', claim.id, _amount(charges), '', '',
+        COMPONENT_SEPARATOR.join((claim.place_of_service, 'B', '1')), 'Y', 'A', 'Y', 'Y'
+    ))
+    codes = [clean(d.icd10_code).replace('.', '') for d in bill.diagnoses[:MAX_DIAGNOSES]]
+    if codes:
+        qualifiers = ['ABK'] + ['ABF'] * (len(codes) - 1)
+        segments.append(_segment('HI', *(f"{q}{COMPONENT_SEPARATOR}{c}" for q, c in zip(qualifiers, codes))))
+    for line_number, procedure in enumerate(bill.procedures, start=1):
+        segments += [
+            _segment('LX', line_number),
+            _segment('SV1', f"HC{COMPONENT_SEPARATOR}{clean(procedure.cpt_code)}", _amount(procedure.amount), 'UN', 1, '', '', 1),
+            _segment('DTP', 472, 'D8', claim.date_of_service.strftime('%Y%m%d')),
+        ]
+    return segments, next_hl
+
+def build_837p(control_number, claims, now=None):
+    """Render claims for one payer as a single 837P (005010X222A1) interchange.
+
+    All claims share one billing-provider loop inside one transaction set.
+    Service lines come from the bill's procedures; diagnoses become the HI
+    codes. `control_number` is used for the ISA, GS and BHT references.
+    """
+    now = now or datetime.utcnow()
+    body = [
+        _segment('ST', 837, '0001', IMPLEMENTATION),
+        _segment('BHT', '0019', '00', control_number, now.strftime('%Y%m%d'), now.strftime('%H%M'), 'CH'),
+        _segment('NM1', 41, 2, clean(SUBMITTER_NAME), '', '', '', '', 46, clean(SUBMITTER_ID)),
+        _segment('PER', 'IC', clean(SUBMITTER_NAME), 'TE', clean(SUBMITTER_PHONE)),
+        _segment('NM1', 40, 2, clean(RECEIVER_NAME), '', '', '', '', 46, clean(RECEIVER_ID)),
+        _segment('HL', 1, '', 20, 1),
+        _segment('NM1', 85, 2, clean(PROVIDER_NAME), '', '', '', '', 'XX', clean(PROVIDER_NPI)),
+        _segment('N3', clean(PROVIDER_ADDRESS)),
+        _segment('N4', clean(PROVIDER_CITY), clean(PROVIDER_STATE), clean(PROVIDER_ZIP)),
+        _segment('REF', 'EI', clean(PROVIDER_TAX_ID)),
+    ]
+    hl_number = 2
+    for claim in claims:
+        segments, hl_number = _claim_segments(claim, hl_number)
+        body.extend(segments)
+    body.append(_segment('SE', len(body) + 1, '0001'))
+
+    icn = f"{control_number % 1000000000:09d}"
+    header = [
+        _segment(
+            'ISA', '00', ' ' * 10, '00', ' ' * 10, 'ZZ', f"{clean(SUBMITTER_ID)[:15]:<15}",
+            'ZZ', f"{clean(RECEIVER_ID)[:15]:<15}", now.strftime('%y%m%d'), now.strftime('%H%M'),
+            '^', '00501', icn, 0, X12_USAGE, COMPONENT_SEPARATOR
+        ),
+        _segment('GS', 'HC', clean(SUBMITTER_ID), clean(RECEIVER_ID), now.strftime('%Y%m%d'),
+                 now.strftime('%H%M'), control_number, 'X', IMPLEMENTATION),
+    ]
+    trailer = [_segment('GE', 1, control_number), _segment('IEA', 1, icn)]
+    return '\n'.join(header + body + trailer) + '\n'
+
+def claim_ids(payload):
+    """Claim ids (CLM01) in an 837 interchange, in order"""
+    ids = []
+    for segment in payload.split(SEGMENT_TERMINATOR):
+        elements = segment.strip().split(ELEMENT_SEPARATOR)
+        if elements[0] == 'CLM':
+            ids.append(int(elements[1]))
+    return ids